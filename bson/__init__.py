@@ -31,7 +31,10 @@ from bson.binary import (Binary, OLD_UUID_SUBTYPE,
                          JAVA_LEGACY, CSHARP_LEGACY,
                          UUIDLegacy)
 from bson.code import Code
-from bson.codec_options import CodecOptions, DEFAULT_CODEC_OPTIONS
+from bson.codec_options import (
+    CodecOptions, DEFAULT_CODEC_OPTIONS, _raw_document_class,
+    _RAW_BSON_DOCUMENT_MARKER)
+from bson.datetime_ms import DatetimeMS, _millis_to_datetime
 from bson.dbref import DBRef
 from bson.errors import (InvalidBSON,
                          InvalidDocument,
@@ -42,6 +45,8 @@ from bson.min_key import MinKey
 from bson.objectid import ObjectId
 from bson.py3compat import (b,
                             PY3,
+                            bytes_from_buffer,
+                            HAVE_MEMORYVIEW,
                             iteritems,
                             text_type,
                             string_type,
@@ -85,17 +90,35 @@ BSONMIN = b"\xFF" # Min key
 BSONMAX = b"\x7F" # Max key
 
 
-_UNPACK_FLOAT = struct.Struct("<d").unpack
+_UNPACK_FLOAT_FROM = struct.Struct("<d").unpack_from
 _UNPACK_INT = struct.Struct("<i").unpack
-_UNPACK_LENGTH_SUBTYPE = struct.Struct("<iB").unpack
-_UNPACK_LONG = struct.Struct("<q").unpack
-_UNPACK_TIMESTAMP = struct.Struct("<II").unpack
+_UNPACK_INT_FROM = struct.Struct("<i").unpack_from
+_UNPACK_LENGTH_SUBTYPE_FROM = struct.Struct("<iB").unpack_from
+_UNPACK_LONG_FROM = struct.Struct("<q").unpack_from
+_UNPACK_TIMESTAMP_FROM = struct.Struct("<II").unpack_from
+
+
+if PY3:
+    def _byte_key(byte):
+        """The value of data[i] if the byte at i in data is `byte`."""
+        # Indexing bytes returns an int in python 3.
+        return ord(byte)
+else:
+    def _byte_key(byte):
+        """The value of data[i] if the byte at i in data is `byte`."""
+        return byte
+
+
+# The decoders read values from `data` in place with the Struct
+# unpack_from methods and index single bytes, rather than slicing, so
+# that they are fast on PyPy.
+_EOO = _byte_key(b"\x00")
+_TRUE = _byte_key(b"\x01")
 
 
 def _get_int(data, position, dummy0, dummy1):
     """Decode a BSON int32 to python int."""
-    end = position + 4
-    return _UNPACK_INT(data[position:end])[0], end
+    return _UNPACK_INT_FROM(data, position)[0], position + 4
 
 
 def _get_c_string(data, position, opts):
@@ -107,18 +130,17 @@ def _get_c_string(data, position, opts):
 
 def _get_float(data, position, dummy0, dummy1):
     """Decode a BSON double to python float."""
-    end = position + 8
-    return _UNPACK_FLOAT(data[position:end])[0], end
+    return _UNPACK_FLOAT_FROM(data, position)[0], position + 8
 
 
 def _get_string(data, position, obj_end, opts):
     """Decode a BSON string to python unicode string."""
-    length = _UNPACK_INT(data[position:position + 4])[0]
+    length = _UNPACK_INT_FROM(data, position)[0]
     position += 4
     if length < 1 or obj_end - position < length:
         raise InvalidBSON("invalid string length")
     end = position + length - 1
-    if data[end:end + 1] != b"\x00":
+    if data[end] != _EOO:
         raise InvalidBSON("invalid end of string")
     return _utf_8_decode(data[position:end],
                          opts.unicode_decode_error_handler, True)[0], end + 1
@@ -126,12 +148,16 @@ def _get_string(data, position, obj_end, opts):
 
 def _get_object(data, position, obj_end, opts):
     """Decode a BSON subdocument to opts.document_class or bson.dbref.DBRef."""
-    obj_size = _UNPACK_INT(data[position:position + 4])[0]
+    obj_size = _UNPACK_INT_FROM(data, position)[0]
     end = position + obj_size - 1
-    if data[end:position + obj_size] != b"\x00":
-        raise InvalidBSON("bad eoo")
-    if end >= obj_end:
+    if obj_size < 5 or end >= obj_end:
         raise InvalidBSON("invalid object length")
+    if data[end] != _EOO:
+        raise InvalidBSON("bad eoo")
+    if _raw_document_class(opts.document_class):
+        return (opts.document_class(data[position:end + 1], opts),
+                position + obj_size)
+
     obj = _elements_to_dict(data, position + 4, end, opts)
 
     position += obj_size
@@ -143,9 +169,11 @@ def _get_object(data, position, obj_end, opts):
 
 def _get_array(data, position, obj_end, opts):
     """Decode a BSON array to python list."""
-    size = _UNPACK_INT(data[position:position + 4])[0]
+    size = _UNPACK_INT_FROM(data, position)[0]
     end = position + size - 1
-    if data[end:end + 1] != b"\x00":
+    if size < 5 or end >= obj_end:
+        raise InvalidBSON("invalid array length")
+    if data[end] != _EOO:
         raise InvalidBSON("bad eoo")
     position += 4
     end -= 1
@@ -157,7 +185,7 @@ def _get_array(data, position, obj_end, opts):
     getter = _ELEMENT_GETTER
 
     while position < end:
-        element_type = data[position:position + 1]
+        element_type = data[position]
         # Just skip the keys.
         position = index(b'\x00', position) + 1
         value, position = getter[element_type](data, position, obj_end, opts)
@@ -167,10 +195,10 @@ def _get_array(data, position, obj_end, opts):
 
 def _get_binary(data, position, dummy, opts):
     """Decode a BSON binary to bson.binary.Binary or python UUID."""
-    length, subtype = _UNPACK_LENGTH_SUBTYPE(data[position:position + 5])
+    length, subtype = _UNPACK_LENGTH_SUBTYPE_FROM(data, position)
     position += 5
     if subtype == 2:
-        length2 = _UNPACK_INT(data[position:position + 4])[0]
+        length2 = _UNPACK_INT_FROM(data, position)[0]
         position += 4
         if length2 != length - 4:
             raise InvalidBSON("invalid binary (st 2) - lengths don't match!")
@@ -189,6 +217,9 @@ def _get_binary(data, position, dummy, opts):
         else:
             value = uuid.UUID(bytes=data[position:end])
         return value, end
+    if subtype == 0 and opts.binary_memoryview:
+        # A slice of the (immutable) data, which it keeps alive.
+        return memoryview(data)[position:end], end
     # Python3 special case. Decode subtype 0 to 'bytes'.
     if PY3 and subtype == 0:
         value = data[position:end]
@@ -205,26 +236,15 @@ def _get_oid(data, position, dummy0, dummy1):
 
 def _get_boolean(data, position, dummy0, dummy1):
     """Decode a BSON true/false to python True/False."""
-    end = position + 1
-    return data[position:end] == b"\x01", end
+    return data[position] == _TRUE, position + 1
 
 
 def _get_date(data, position, dummy, opts):
     """Decode a BSON datetime to python datetime.datetime."""
-    end = position + 8
-    millis = _UNPACK_LONG(data[position:end])[0]
-    diff = ((millis % 1000) + 1000) % 1000
-    seconds = (millis - diff) / 1000
-    micros = diff * 1000
-    if opts.tz_aware:
-        dt = EPOCH_AWARE + datetime.timedelta(
-            seconds=seconds, microseconds=micros)
-        if opts.tzinfo:
-            dt = dt.astimezone(opts.tzinfo)
-    else:
-        dt = EPOCH_NAIVE + datetime.timedelta(
-            seconds=seconds, microseconds=micros)
-    return dt, end
+    millis = _UNPACK_LONG_FROM(data, position)[0]
+    if opts.datetime_ms:
+        return DatetimeMS(millis), position + 8
+    return _millis_to_datetime(millis, opts), position + 8
 
 
 def _get_code(data, position, obj_end, opts):
@@ -236,6 +256,9 @@ def _get_code(data, position, obj_end, opts):
 def _get_code_w_scope(data, position, obj_end, opts):
     """Decode a BSON code_w_scope to bson.code.Code."""
     code, position = _get_string(data, position + 4, obj_end, opts)
+    if opts.decode_fields is not None:
+        # Always decode the whole scope.
+        opts = opts._replace(decode_fields=None)
     scope, position = _get_object(data, position, obj_end, opts)
     return Code(code, scope), position
 
@@ -257,15 +280,13 @@ def _get_ref(data, position, obj_end, opts):
 
 def _get_timestamp(data, position, dummy0, dummy1):
     """Decode a BSON timestamp to bson.timestamp.Timestamp."""
-    end = position + 8
-    inc, timestamp = _UNPACK_TIMESTAMP(data[position:end])
-    return Timestamp(timestamp, inc), end
+    inc, timestamp = _UNPACK_TIMESTAMP_FROM(data, position)
+    return Timestamp(timestamp, inc), position + 8
 
 
 def _get_int64(data, position, dummy0, dummy1):
     """Decode a BSON int64 to bson.int64.Int64."""
-    end = position + 8
-    return Int64(_UNPACK_LONG(data[position:end])[0]), end
+    return Int64(_UNPACK_LONG_FROM(data, position)[0]), position + 8
 
 
 # Each decoder function's signature is:
@@ -273,7 +294,11 @@ def _get_int64(data, position, dummy0, dummy1):
 #   - position: int, beginning of object in 'data' to decode
 #   - obj_end: int, end of object to decode in 'data' if variable-length type
 #   - opts: a CodecOptions
-_ELEMENT_GETTER = {
+#
+# The keys are _byte_key(element type), the value of data[i] at the
+# element's type byte.
+_ELEMENT_GETTER = dict((_byte_key(element_type), getter)
+                       for element_type, getter in iteritems({
     BSONNUM: _get_float,
     BSONSTR: _get_string,
     BSONOBJ: _get_object,
@@ -293,40 +318,180 @@ _ELEMENT_GETTER = {
     BSONTIM: _get_timestamp,
     BSONLON: _get_int64,
     BSONMIN: lambda w, x, y, z: (MinKey(), x),
-    BSONMAX: lambda w, x, y, z: (MaxKey(), x)}
+    BSONMAX: lambda w, x, y, z: (MaxKey(), x)}))
 
 
 def _element_to_dict(data, position, obj_end, opts):
     """Decode a single key, value pair."""
-    element_type = data[position:position + 1]
-    position += 1
-    element_name, position = _get_c_string(data, position, opts)
+    element_type = data[position]
+    element_name, position = _get_c_string(data, position + 1, opts)
     value, position = _ELEMENT_GETTER[element_type](data,
                                                     position, obj_end, opts)
     return element_name, value, position
+if _USE_C:
+    _element_to_dict = _cbson._element_to_dict
+
+
+# The length of each fixed size BSON value.
+_FIXED_LENGTH = dict((_byte_key(element_type), length)
+                     for element_type, length in iteritems({
+    BSONNUM: 8,
+    BSONUND: 0,
+    BSONOID: 12,
+    BSONBOO: 1,
+    BSONDAT: 8,
+    BSONNUL: 0,
+    BSONINT: 4,
+    BSONTIM: 8,
+    BSONLON: 8,
+    BSONMIN: 0,
+    BSONMAX: 0}))
+
+# The number of bytes in each variable length BSON value besides the bytes
+# counted by the int32 length it begins with.
+_LENGTH_OVERHEAD = dict((_byte_key(element_type), length)
+                        for element_type, length in iteritems({
+    BSONSTR: 4,
+    BSONCOD: 4,
+    BSONSYM: 4,
+    BSONBIN: 5,
+    BSONREF: 16}))
+_RGX = _byte_key(BSONRGX)
+_DOCUMENT_TYPES = frozenset(
+    _byte_key(element_type) for element_type in (BSONOBJ, BSONARR, BSONCWS))
+
+
+def _value_end(data, element_type, position):
+    """Find the end of a BSON value without decoding it.
+
+    `element_type` is _byte_key(the value's type).
+    """
+    length = _FIXED_LENGTH.get(element_type)
+    if length is not None:
+        return position + length
+    if element_type == _RGX:
+        # Skip the pattern and options C strings.
+        return data.index(b"\x00", data.index(b"\x00", position) + 1) + 1
+    length = _UNPACK_INT_FROM(data, position)[0]
+    if element_type in _DOCUMENT_TYPES:
+        if length < 5:
+            raise InvalidBSON("invalid object length")
+        return position + length
+    if length < 1:
+        raise InvalidBSON("invalid string length")
+    overhead = _LENGTH_OVERHEAD.get(element_type)
+    if overhead is None:
+        raise InvalidBSON("invalid type code %r" % (element_type,))
+    return position + overhead + length
+
+
+def _raw_element_index(data, position, obj_end, opts):
+    """Map the keys of a BSON document to the positions of their elements.
+
+    Returns a list of the document's keys in order, and a dict mapping each
+    key to the position of its element in `data`. Values are skipped over,
+    not decoded.
+    """
+    keys = []
+    index = {}
+    try:
+        while position < obj_end:
+            start = position
+            element_type = data[position]
+            key, position = _get_c_string(data, position + 1, opts)
+            position = _value_end(data, element_type, position)
+            if key not in index:
+                keys.append(key)
+            index[key] = start
+    except InvalidBSON:
+        raise
+    except Exception:
+        # Change exception type to InvalidBSON but preserve traceback.
+        _, exc_value, exc_tb = sys.exc_info()
+        reraise(InvalidBSON, exc_value, exc_tb)
+    if position != obj_end:
+        raise InvalidBSON("bad object or element length")
+    return keys, index
+if _USE_C:
+    _raw_element_index = _cbson._raw_element_index
+
+
+def _field_options(opts):
+    """Map each field name selected by opts.decode_fields to the
+    CodecOptions for decoding that field's value.
+    """
+    paths = {}
+    for path in opts.decode_fields:
+        name, _, rest = path.partition(".")
+        if not rest:
+            # Decode the whole field.
+            paths[name] = None
+        elif paths.get(name, ()) is not None:
+            paths.setdefault(name, set()).add(rest)
+    return dict(
+        (name, opts._replace(
+            decode_fields=None if rest is None else frozenset(rest)))
+        for name, rest in iteritems(paths))
+
+
+def _projected_elements_to_dict(data, position, obj_end, opts):
+    """Decode the fields of a BSON document selected by opts.decode_fields,
+    skipping over all others.
+    """
+    field_options = _field_options(opts)
+    result = opts.document_class()
+    end = obj_end - 1
+    while position < end:
+        element_type = data[position]
+        key, position = _get_c_string(data, position + 1, opts)
+        value_opts = field_options.get(key)
+        if value_opts is None:
+            position = _value_end(data, element_type, position)
+            if position > obj_end:
+                raise InvalidBSON("bad object or element length")
+        else:
+            value, position = _ELEMENT_GETTER[element_type](
+                data, position, obj_end, value_opts)
+            result[key] = value
+    return result
 
 
 def _elements_to_dict(data, position, obj_end, opts):
     """Decode a BSON document."""
+    if opts.decode_fields is not None:
+        return _projected_elements_to_dict(data, position, obj_end, opts)
     result = opts.document_class()
     end = obj_end - 1
+
+    # Avoid doing global and attibute lookups in the loop.
+    index = data.index
+    getter = _ELEMENT_GETTER
+    errors = opts.unicode_decode_error_handler
+
     while position < end:
-        (key, value, position) = _element_to_dict(data, position, obj_end, opts)
+        element_type = data[position]
+        name_end = index(b"\x00", position + 1)
+        key = _utf_8_decode(data[position + 1:name_end], errors, True)[0]
+        value, position = getter[element_type](
+            data, name_end + 1, obj_end, opts)
         result[key] = value
     return result
 
 
 def _bson_to_dict(data, opts):
     """Decode a BSON string to document_class."""
+    data = bytes_from_buffer(data)
     try:
-        obj_size = _UNPACK_INT(data[:4])[0]
+        obj_size = _UNPACK_INT_FROM(data, 0)[0]
     except struct.error as exc:
         raise InvalidBSON(str(exc))
     if obj_size != len(data):
         raise InvalidBSON("invalid object size")
-    if data[obj_size - 1:obj_size] != b"\x00":
+    if data[obj_size - 1] != _EOO:
         raise InvalidBSON("bad eoo")
     try:
+        if _raw_document_class(opts.document_class):
+            return opts.document_class(data, opts)
         return _elements_to_dict(data, 4, obj_size - 1, opts)
     except InvalidBSON:
         raise
@@ -338,8 +503,49 @@ if _USE_C:
     _bson_to_dict = _cbson._bson_to_dict
 
 
+def _decode_schema(data, plan, opts):
+    """Decode a document with a plan compiled by bson.schema.Schema, using
+    the plan's keys instead of decoding each element name. Not needed with
+    the C extension, which caches decoded element names.
+
+    Returns None if the document's fields aren't the schema's, in order.
+    """
+    data = bytes_from_buffer(data)
+    try:
+        obj_size = _UNPACK_INT_FROM(data, 0)[0]
+    except struct.error as exc:
+        raise InvalidBSON(str(exc))
+    if obj_size != len(data):
+        raise InvalidBSON("invalid object size")
+    if data[obj_size - 1] != _EOO:
+        raise InvalidBSON("bad eoo")
+    result = opts.document_class()
+    position = 4
+    obj_end = obj_size - 1
+    getter = _ELEMENT_GETTER
+    try:
+        for field in plan:
+            name = field[1]
+            name_end = position + 1 + len(name)
+            if name_end > obj_end or data[position + 1:name_end] != name:
+                return None
+            value, position = getter[data[position]](
+                data, name_end, obj_end, opts)
+            result[field[0]] = value
+    except InvalidBSON:
+        raise
+    except Exception:
+        # Change exception type to InvalidBSON but preserve traceback.
+        _, exc_value, exc_tb = sys.exc_info()
+        reraise(InvalidBSON, exc_value, exc_tb)
+    if position != obj_end:
+        return None
+    return result
+
+
 _PACK_FLOAT = struct.Struct("<d").pack
 _PACK_INT = struct.Struct("<i").pack
+_PACK_INT_INTO = struct.Struct("<i").pack_into
 _PACK_LENGTH_SUBTYPE = struct.Struct("<iB").pack
 _PACK_LONG = struct.Struct("<q").pack
 _PACK_TIMESTAMP = struct.Struct("<II").pack
@@ -406,130 +612,175 @@ else:
     _make_name = _make_c_string_check
 
 
-def _encode_float(name, value, dummy0, dummy1):
+def _encode_float(buf, name, value, dummy0, dummy1):
     """Encode a float."""
-    return b"\x01" + name + _PACK_FLOAT(value)
+    buf += b"\x01" + name + _PACK_FLOAT(value)
 
 
 if PY3:
-    def _encode_bytes(name, value, dummy0, dummy1):
+    def _encode_bytes(buf, name, value, dummy0, dummy1):
         """Encode a python bytes."""
         # Python3 special case. Store 'bytes' as BSON binary subtype 0.
-        return b"\x05" + name + _PACK_INT(len(value)) + b"\x00" + value
+        buf += b"\x05" + name + _PACK_INT(len(value)) + b"\x00"
+        buf += value
 else:
-    def _encode_bytes(name, value, dummy0, dummy1):
+    def _encode_bytes(buf, name, value, dummy0, dummy1):
         """Encode a python str (python 2.x)."""
         try:
             _utf_8_decode(value, None, True)
         except UnicodeError:
             raise InvalidStringData("strings in documents must be valid "
                                     "UTF-8: %r" % (value,))
-        return b"\x02" + name + _PACK_INT(len(value) + 1) + value + b"\x00"
+        buf += b"\x02" + name + _PACK_INT(len(value) + 1)
+        buf += value
+        buf += b"\x00"
+
+
+def _encode_memoryview(buf, name, value, dummy0, dummy1):
+    """Encode a memoryview as BSON binary subtype 0."""
+    data = value.tobytes()
+    buf += b"\x05" + name + _PACK_INT(len(data)) + b"\x00"
+    buf += data
 
 
-def _encode_mapping(name, value, check_keys, opts):
+def _encode_mapping(buf, name, value, check_keys, opts):
     """Encode a mapping type."""
-    data = b"".join([_element_to_bson(key, val, check_keys, opts)
-                     for key, val in iteritems(value)])
-    return b"\x03" + name + _PACK_INT(len(data) + 5) + data + b"\x00"
+    buf += b"\x03" + name
+    _write_document(buf, value, check_keys, opts, False)
 
 
-def _encode_dbref(name, value, check_keys, opts):
+def _check_document_bytes(data):
+    """Check the size and terminating NUL byte of an encoded document."""
+    if (len(data) < 5 or _UNPACK_INT_FROM(data, 0)[0] != len(data) or
+            data[-1] != _EOO):
+        raise InvalidDocument("cannot embed invalid BSON document bytes")
+    return data
+
+
+def _encode_bson(buf, name, value, dummy0, dummy1):
+    """Encode bson.BSON by copying its bytes."""
+    buf += b"\x03" + name
+    buf += _check_document_bytes(value)
+
+
+def _encode_raw_document(buf, name, value, dummy0, dummy1):
+    """Encode bson.raw_bson.RawBSONDocument by copying its bytes."""
+    buf += b"\x03" + name
+    buf += _check_document_bytes(value.raw)
+
+
+def _encode_dbref(buf, name, value, check_keys, opts):
     """Encode bson.dbref.DBRef."""
-    buf = bytearray(b"\x03" + name + b"\x00\x00\x00\x00")
-    begin = len(buf) - 4
+    buf += b"\x03" + name
+    begin = len(buf)
+    buf += b"\x00\x00\x00\x00"
 
-    buf += _name_value_to_bson(b"$ref\x00",
-                               value.collection, check_keys, opts)
-    buf += _name_value_to_bson(b"$id\x00",
-                               value.id, check_keys, opts)
+    _name_value_to_bson(buf, b"$ref\x00", value.collection, check_keys, opts)
+    _name_value_to_bson(buf, b"$id\x00", value.id, check_keys, opts)
     if value.database is not None:
-        buf += _name_value_to_bson(
-            b"$db\x00", value.database, check_keys, opts)
+        _name_value_to_bson(
+            buf, b"$db\x00", value.database, check_keys, opts)
     for key, val in iteritems(value._DBRef__kwargs):
-        buf += _element_to_bson(key, val, check_keys, opts)
+        _element_to_bson(buf, key, val, check_keys, opts)
 
     buf += b"\x00"
-    buf[begin:begin + 4] = _PACK_INT(len(buf) - begin)
-    return bytes(buf)
+    _PACK_INT_INTO(buf, begin, len(buf) - begin)
 
 
-def _encode_list(name, value, check_keys, opts):
+def _encode_list(buf, name, value, check_keys, opts):
     """Encode a list/tuple."""
+    buf += b"\x04" + name
+    begin = len(buf)
+    buf += b"\x00\x00\x00\x00"
+
     lname = gen_list_name()
-    data = b"".join([_name_value_to_bson(next(lname), item,
-                                         check_keys, opts)
-                     for item in value])
-    return b"\x04" + name + _PACK_INT(len(data) + 5) + data + b"\x00"
+    for item in value:
+        _name_value_to_bson(buf, next(lname), item, check_keys, opts)
+
+    buf += b"\x00"
+    _PACK_INT_INTO(buf, begin, len(buf) - begin)
 
 
-def _encode_text(name, value, dummy0, dummy1):
+def _encode_text(buf, name, value, dummy0, dummy1):
     """Encode a python unicode (python 2.x) / str (python 3.x)."""
     value = _utf_8_encode(value)[0]
-    return b"\x02" + name + _PACK_INT(len(value) + 1) + value + b"\x00"
+    buf += b"\x02" + name + _PACK_INT(len(value) + 1)
+    buf += value
+    buf += b"\x00"
 
 
-def _encode_binary(name, value, dummy0, dummy1):
+def _encode_binary(buf, name, value, dummy0, dummy1):
     """Encode bson.binary.Binary."""
     subtype = value.subtype
     if subtype == 2:
-        value = _PACK_INT(len(value)) + value
-    return b"\x05" + name + _PACK_LENGTH_SUBTYPE(len(value), subtype) + value
+        buf += (b"\x05" + name + _PACK_LENGTH_SUBTYPE(len(value) + 4, 2) +
+                _PACK_INT(len(value)))
+    else:
+        buf += b"\x05" + name + _PACK_LENGTH_SUBTYPE(len(value), subtype)
+    buf += value
 
 
-def _encode_uuid(name, value, dummy, opts):
+def _encode_uuid(buf, name, value, dummy, opts):
     """Encode uuid.UUID."""
     uuid_representation = opts.uuid_representation
     # Python Legacy Common Case
     if uuid_representation == OLD_UUID_SUBTYPE:
-        return b"\x05" + name + b'\x10\x00\x00\x00\x03' + value.bytes
+        buf += b"\x05" + name + b'\x10\x00\x00\x00\x03' + value.bytes
     # Java Legacy
     elif uuid_representation == JAVA_LEGACY:
         from_uuid = value.bytes
         data = from_uuid[0:8][::-1] + from_uuid[8:16][::-1]
-        return b"\x05" + name + b'\x10\x00\x00\x00\x03' + data
+        buf += b"\x05" + name + b'\x10\x00\x00\x00\x03' + data
     # C# legacy
     elif uuid_representation == CSHARP_LEGACY:
         # Microsoft GUID representation.
-        return b"\x05" + name + b'\x10\x00\x00\x00\x03' + value.bytes_le
+        buf += b"\x05" + name + b'\x10\x00\x00\x00\x03' + value.bytes_le
     # New
     else:
-        return b"\x05" + name + b'\x10\x00\x00\x00\x04' + value.bytes
+        buf += b"\x05" + name + b'\x10\x00\x00\x00\x04' + value.bytes
 
 
-def _encode_objectid(name, value, dummy0, dummy1):
+def _encode_objectid(buf, name, value, dummy0, dummy1):
     """Encode bson.objectid.ObjectId."""
-    return b"\x07" + name + value.binary
+    buf += b"\x07" + name + value.binary
 
 
-def _encode_bool(name, value, dummy0, dummy1):
+def _encode_bool(buf, name, value, dummy0, dummy1):
     """Encode a python boolean (True/False)."""
-    return b"\x08" + name + (value and b"\x01" or b"\x00")
+    buf += b"\x08" + name + (value and b"\x01" or b"\x00")
 
 
-def _encode_datetime(name, value, dummy0, dummy1):
+def _encode_datetime(buf, name, value, dummy0, dummy1):
     """Encode datetime.datetime."""
     if value.utcoffset() is not None:
         value = value - value.utcoffset()
     millis = int(calendar.timegm(value.timetuple()) * 1000 +
                  value.microsecond / 1000)
-    return b"\x09" + name + _PACK_LONG(millis)
+    buf += b"\x09" + name + _PACK_LONG(millis)
 
 
-def _encode_none(name, dummy0, dummy1, dummy2):
+def _encode_datetime_ms(buf, name, value, dummy0, dummy1):
+    """Encode bson.datetime_ms.DatetimeMS."""
+    try:
+        buf += b"\x09" + name + _PACK_LONG(value)
+    except struct.error:
+        raise OverflowError("BSON can only handle up to 8-byte ints")
+
+
+def _encode_none(buf, name, dummy0, dummy1, dummy2):
     """Encode python None."""
-    return b"\x0A" + name
+    buf += b"\x0A" + name
 
 
-def _encode_regex(name, value, dummy0, dummy1):
+def _encode_regex(buf, name, value, dummy0, dummy1):
     """Encode a python regex or bson.regex.Regex."""
     flags = value.flags
     # Python 2 common case
     if flags == 0:
-        return b"\x0B" + name + _make_c_string_check(value.pattern) + b"\x00"
+        buf += b"\x0B" + name + _make_c_string_check(value.pattern) + b"\x00"
     # Python 3 common case
     elif flags == re.UNICODE:
-        return b"\x0B" + name + _make_c_string_check(value.pattern) + b"u\x00"
+        buf += b"\x0B" + name + _make_c_string_check(value.pattern) + b"u\x00"
     else:
         sflags = b""
         if flags & re.IGNORECASE:
@@ -545,55 +796,61 @@ def _encode_regex(name, value, dummy0, dummy1):
         if flags & re.VERBOSE:
             sflags += b"x"
         sflags += b"\x00"
-        return b"\x0B" + name + _make_c_string_check(value.pattern) + sflags
+        buf += b"\x0B" + name + _make_c_string_check(value.pattern) + sflags
 
 
-def _encode_code(name, value, dummy, opts):
+def _encode_code(buf, name, value, dummy, opts):
     """Encode bson.code.Code."""
     cstring = _make_c_string(value)
     cstrlen = len(cstring)
     if not value.scope:
-        return b"\x0D" + name + _PACK_INT(cstrlen) + cstring
-    scope = _dict_to_bson(value.scope, False, opts, False)
-    full_length = _PACK_INT(8 + cstrlen + len(scope))
-    return b"\x0F" + name + full_length + _PACK_INT(cstrlen) + cstring + scope
-
-
-def _encode_int(name, value, dummy0, dummy1):
+        buf += b"\x0D" + name + _PACK_INT(cstrlen)
+        buf += cstring
+        return
+    buf += b"\x0F" + name
+    begin = len(buf)
+    buf += b"\x00\x00\x00\x00" + _PACK_INT(cstrlen)
+    buf += cstring
+    _write_document(buf, value.scope, False, opts, False)
+    _PACK_INT_INTO(buf, begin, len(buf) - begin)
+
+
+def _encode_int(buf, name, value, dummy0, dummy1):
     """Encode a python int."""
     if -2147483648 <= value <= 2147483647:
-        return b"\x10" + name + _PACK_INT(value)
+        buf += b"\x10" + name + _PACK_INT(value)
     else:
         try:
-            return b"\x12" + name + _PACK_LONG(value)
+            buf += b"\x12" + name + _PACK_LONG(value)
         except struct.error:
             raise OverflowError("BSON can only handle up to 8-byte ints")
 
 
-def _encode_timestamp(name, value, dummy0, dummy1):
+def _encode_timestamp(buf, name, value, dummy0, dummy1):
     """Encode bson.timestamp.Timestamp."""
-    return b"\x11" + name + _PACK_TIMESTAMP(value.inc, value.time)
+    buf += b"\x11" + name + _PACK_TIMESTAMP(value.inc, value.time)
 
 
-def _encode_long(name, value, dummy0, dummy1):
+def _encode_long(buf, name, value, dummy0, dummy1):
     """Encode a python long (python 2.x)"""
     try:
-        return b"\x12" + name + _PACK_LONG(value)
+        buf += b"\x12" + name + _PACK_LONG(value)
     except struct.error:
         raise OverflowError("BSON can only handle up to 8-byte ints")
 
 
-def _encode_minkey(name, dummy0, dummy1, dummy2):
+def _encode_minkey(buf, name, dummy0, dummy1, dummy2):
     """Encode bson.min_key.MinKey."""
-    return b"\xFF" + name
+    buf += b"\xFF" + name
 
 
-def _encode_maxkey(name, dummy0, dummy1, dummy2):
+def _encode_maxkey(buf, name, dummy0, dummy1, dummy2):
     """Encode bson.max_key.MaxKey."""
-    return b"\x7F" + name
+    buf += b"\x7F" + name
 
 
-# Each encoder function's signature is:
+# Each encoder function appends an element to a bytearray. Its signature is:
+#   - buf: the bytearray
 #   - name: utf-8 bytes
 #   - value: a Python data type, e.g. a Python int for _encode_int
 #   - check_keys: bool, whether to check for invalid names
@@ -613,6 +870,7 @@ _ENCODERS = {
     uuid.UUID: _encode_uuid,
     Binary: _encode_binary,
     Int64: _encode_long,
+    DatetimeMS: _encode_datetime_ms,
     Code: _encode_code,
     DBRef: _encode_dbref,
     MaxKey: _encode_maxkey,
@@ -631,11 +889,14 @@ _ENCODERS = {
 _MARKERS = {
     5: _encode_binary,
     7: _encode_objectid,
+    9: _encode_datetime_ms,
     11: _encode_regex,
     13: _encode_code,
     17: _encode_timestamp,
     18: _encode_long,
+    3: _encode_bson,
     100: _encode_dbref,
+    _RAW_BSON_DOCUMENT_MARKER: _encode_raw_document,
     127: _encode_maxkey,
     255: _encode_minkey,
 }
@@ -643,14 +904,17 @@ _MARKERS = {
 if not PY3:
     _ENCODERS[long] = _encode_long
 
+if HAVE_MEMORYVIEW:
+    _ENCODERS[memoryview] = _encode_memoryview
+
 
-def _name_value_to_bson(name, value, check_keys, opts):
+def _name_value_to_bson(buf, name, value, check_keys, opts):
     """Encode a single name, value pair."""
 
     # First see if the type is already cached. KeyError will only ever
     # happen once per subtype.
     try:
-        return _ENCODERS[type(value)](name, value, check_keys, opts)
+        return _ENCODERS[type(value)](buf, name, value, check_keys, opts)
     except KeyError:
         pass
 
@@ -662,7 +926,7 @@ def _name_value_to_bson(name, value, check_keys, opts):
         func = _MARKERS[marker]
         # Cache this type for faster subsequent lookup.
         _ENCODERS[type(value)] = func
-        return func(name, value, check_keys, opts)
+        return func(buf, name, value, check_keys, opts)
 
     # If all else fails test each base type. This will only happen once for
     # a subtype of a supported base type.
@@ -671,14 +935,14 @@ def _name_value_to_bson(name, value, check_keys, opts):
             func = _ENCODERS[base]
             # Cache this type for faster subsequent lookup.
             _ENCODERS[type(value)] = func
-            return func(name, value, check_keys, opts)
+            return func(buf, name, value, check_keys, opts)
 
     raise InvalidDocument("cannot convert value of type %s to bson" %
                           type(value))
 
 
-def _element_to_bson(key, value, check_keys, opts):
-    """Encode a single key, value pair."""
+def _key_to_name(key, check_keys):
+    """Make the BSON element name for a document key."""
     if not isinstance(key, string_type):
         raise InvalidDocument("documents must have only string keys, "
                               "key was %r" % (key,))
@@ -688,45 +952,437 @@ def _element_to_bson(key, value, check_keys, opts):
         if "." in key:
             raise InvalidDocument("key %r must not contain '.'" % (key,))
 
-    name = _make_name(key)
-    return _name_value_to_bson(name, value, check_keys, opts)
+    return _make_name(key)
+
+
+def _element_to_bson(buf, key, value, check_keys, opts):
+    """Encode a single key, value pair."""
+    name = _key_to_name(key, check_keys)
+    return _name_value_to_bson(buf, name, value, check_keys, opts)
+
+
+def _write_document(buf, doc, check_keys, opts, top_level):
+    """Append a document to a bytearray."""
+    if _raw_document_class(doc):
+        buf += doc.raw
+        return
+    begin = len(buf)
+    buf += b"\x00\x00\x00\x00"
+    if top_level and "_id" in doc:
+        _name_value_to_bson(buf, b"_id\x00", doc["_id"], check_keys, opts)
+    for (key, value) in iteritems(doc):
+        if not top_level or key != "_id":
+            _element_to_bson(buf, key, value, check_keys, opts)
+    buf += b"\x00"
+    _PACK_INT_INTO(buf, begin, len(buf) - begin)
 
 
 def _dict_to_bson(doc, check_keys, opts, top_level=True):
     """Encode a document to BSON."""
+    if _raw_document_class(doc):
+        return doc.raw
+    # Every element, including those of embedded documents and arrays,
+    # is written to the same buffer.
+    buf = bytearray()
     try:
-        elements = []
-        if top_level and "_id" in doc:
-            elements.append(_name_value_to_bson(b"_id\x00", doc["_id"],
-                                                check_keys, opts))
-        for (key, value) in iteritems(doc):
-            if not top_level or key != "_id":
-                elements.append(_element_to_bson(key, value,
-                                                 check_keys, opts))
+        _write_document(buf, doc, check_keys, opts, top_level)
     except AttributeError:
         raise TypeError("encoder expected a mapping type but got: %r" % (doc,))
-
-    encoded = b"".join(elements)
-    return _PACK_INT(len(encoded) + 5) + encoded + b"\x00"
+    return bytes(buf)
 if _USE_C:
     _dict_to_bson = _cbson._dict_to_bson
 
 
+def _encode_many(docs, check_keys, opts):
+    """Encode documents to one string of BSON.
+
+    Returns the string and a list of the (offset, length) of each document.
+    """
+    buf = bytearray()
+    offsets = []
+    for doc in docs:
+        begin = len(buf)
+        try:
+            _write_document(buf, doc, check_keys, opts, True)
+        except AttributeError:
+            raise TypeError(
+                "encoder expected a mapping type but got: %r" % (doc,))
+        offsets.append((begin, len(buf) - begin))
+    return bytes(buf), offsets
+if _USE_C:
+    _encode_many = _cbson._encode_many
+
+
+def _encoded_size(doc, check_keys, opts, top_level=True):
+    """Compute the length of a document encoded to BSON."""
+    return len(_dict_to_bson(doc, check_keys, opts, top_level))
+if _USE_C:
+    _encoded_size = _cbson._encoded_size
+
+
+def _encode_schema(plan, doc, check_keys, opts):
+    """Encode a document with a plan compiled by bson.schema.Schema.
+
+    The plan has a (key, name, type code, declared type, encoder) tuple for
+    each field. Values of their declared type are passed straight to its
+    encoder, skipping the lookup in _name_value_to_bson.
+    """
+    if len(doc) != len(plan):
+        raise InvalidDocument("document has %d fields, the schema has %d" %
+                              (len(doc), len(plan)))
+    buf = bytearray(b"\x00\x00\x00\x00")
+    for key, name, _, declared, encoder in plan:
+        try:
+            value = doc[key]
+        except KeyError:
+            raise InvalidDocument("document is missing the field %r" % (key,))
+        if type(value) is declared:
+            encoder(buf, name, value, check_keys, opts)
+        else:
+            _name_value_to_bson(buf, name, value, check_keys, opts)
+    buf += b"\x00"
+    _PACK_INT_INTO(buf, 0, len(buf))
+    return bytes(buf)
+if _USE_C:
+    _encode_schema = _cbson._encode_schema
+
+
 _CODEC_OPTIONS_TYPE_ERROR = TypeError(
     "codec_options must be an instance of CodecOptions")
 
 
+def encode_many(docs, check_keys=False, codec_options=DEFAULT_CODEC_OPTIONS):
+    """Encode multiple documents to concatenated BSON data.
+
+    Returns a tuple ``(data, offsets)``, where `data` is a string
+    (:class:`bytes` in python 3) of the concatenated BSON documents and
+    `offsets` is a list with an ``(offset, length)`` tuple for each document
+    in `data`. `data` can be decoded with :func:`decode_all`.
+
+    With the C extension, every document is encoded into the same buffer,
+    which is faster than encoding each one with :meth:`BSON.encode` and
+    joining the results.
+
+    :Parameters:
+      - `docs`: an iterable of documents, see :meth:`BSON.encode`
+      - `check_keys` (optional): check if keys start with '$' or
+        contain '.', raising :class:`~bson.errors.InvalidDocument` in
+        either case
+      - `codec_options` (optional): An instance of
+        :class:`~bson.codec_options.CodecOptions`.
+
+    .. versionadded:: 3.1
+    """
+    if not isinstance(codec_options, CodecOptions):
+        raise _CODEC_OPTIONS_TYPE_ERROR
+
+    return _encode_many(docs, check_keys, codec_options)
+
+
+def encoded_size(document, check_keys=False,
+                 codec_options=DEFAULT_CODEC_OPTIONS):
+    """Compute the length in bytes of `document` encoded to BSON.
+
+    The result is always ``len(BSON.encode(document, check_keys,
+    codec_options))``, and the same exceptions are raised for documents
+    that can't be encoded. With the C extension, the size is computed
+    without producing the encoded bytes, so it can be used to check
+    whether a large document fits in a batch before encoding it.
+
+    :Parameters:
+      - `document`: mapping type representing a document
+      - `check_keys` (optional): check if keys start with '$' or
+        contain '.', raising :class:`~bson.errors.InvalidDocument` in
+        either case
+      - `codec_options` (optional): An instance of
+        :class:`~bson.codec_options.CodecOptions`.
+
+    .. versionadded:: 3.1
+    """
+    if not isinstance(codec_options, CodecOptions):
+        raise _CODEC_OPTIONS_TYPE_ERROR
+
+    return _encoded_size(document, check_keys, codec_options)
+
+
+def _append_element(buf, key, value, check_keys, opts):
+    """Append a single encoded key, value pair to a bytearray."""
+    _element_to_bson(buf, key, value, check_keys, opts)
+if _USE_C:
+    def _append_element(buf, key, value, check_keys, opts):
+        """Append a single encoded key, value pair to a bytearray."""
+        buf += _cbson._element_to_bson(key, value, check_keys, opts)
+
+
+# BSONWriter writes encoded elements to its stream in chunks of about this
+# many bytes. Values of bytes, Binary, BSON or RawBSONDocument at least
+# this large are written to the stream as they are, without being copied.
+_WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def _large_bytes_value(value):
+    """Split a large value that is stored as its own bytes into its BSON
+    type byte, the header that precedes the bytes, and the bytes.
+
+    Returns None for any other value.
+    """
+    if isinstance(value, bytes):
+        if len(value) < _WRITE_CHUNK_SIZE:
+            return None
+        marker = getattr(value, "_type_marker", None)
+        if marker == 5:
+            # Binary. Subtype 2 is rare enough to encode the usual way.
+            if value.subtype == 2:
+                return None
+            return (b"\x05", _PACK_LENGTH_SUBTYPE(len(value), value.subtype),
+                    value)
+        if marker == 3:
+            # BSON.
+            return b"\x03", b"", _check_document_bytes(value)
+        if PY3 and marker is None:
+            return b"\x05", _PACK_LENGTH_SUBTYPE(len(value), 0), value
+    elif _raw_document_class(value) and len(value.raw) >= _WRITE_CHUNK_SIZE:
+        return b"\x03", b"", _check_document_bytes(value.raw)
+    return None
+
+
+def _seekable(stream):
+    """Return True if `stream` supports tell() and seek().
+
+    Streams opened in append mode write at the end whatever the position,
+    so they are treated as not seekable.
+    """
+    mode = getattr(stream, "mode", None)
+    if isinstance(mode, string_type) and "a" in mode:
+        return False
+    try:
+        return stream.seekable()
+    except AttributeError:
+        pass
+    try:
+        stream.tell()
+    except (AttributeError, IOError, OSError):
+        return False
+    return True
+
+
+class BSONWriter(object):
+    """Encode documents to BSON directly into a writable stream.
+
+    Documents are encoded and written a few elements at a time, so a large
+    document is never held in memory as a whole. Each document is written
+    exactly as :meth:`BSON.encode` would encode it, and the output can be
+    read back with :func:`decode_file_iter`.
+
+    If `stream` is a :class:`bytearray`, or is seekable and positioned at
+    its end, each document's length is filled in after its elements have
+    been written. Otherwise, as for a stream opened in append mode, the
+    length is computed with :func:`encoded_size` before writing. If a
+    document can't be encoded nothing is written, or the stream is
+    truncated back to where the document began.
+
+    :Parameters:
+      - `stream`: a :class:`bytearray`, a file-like object opened for
+        writing in binary mode, or a connected socket
+      - `check_keys` (optional): check if keys start with '$' or
+        contain '.', raising :class:`~bson.errors.InvalidDocument` in
+        either case
+      - `codec_options` (optional): An instance of
+        :class:`~bson.codec_options.CodecOptions`.
+
+    .. versionadded:: 3.1
+    """
+
+    def __init__(self, stream, check_keys=False,
+                 codec_options=DEFAULT_CODEC_OPTIONS):
+        if not isinstance(codec_options, CodecOptions):
+            raise _CODEC_OPTIONS_TYPE_ERROR
+
+        self.__stream = stream
+        self.__check_keys = check_keys
+        self.__codec_options = codec_options
+        self.__is_bytearray = isinstance(stream, bytearray)
+        if self.__is_bytearray:
+            self.__write = stream.extend
+            self.__seekable = True
+        else:
+            self.__write = getattr(stream, "write", None) or stream.sendall
+            self.__seekable = _seekable(stream)
+        self.__buf = bytearray()
+
+    @property
+    def stream(self):
+        """The stream documents are written to."""
+        return self.__stream
+
+    def __tell(self):
+        if self.__is_bytearray:
+            return len(self.__stream)
+        return self.__stream.tell()
+
+    def __at_end(self, position):
+        """Is `position` the end of the stream?"""
+        if self.__is_bytearray:
+            return True
+        stream = self.__stream
+        stream.seek(0, 2)
+        end = stream.tell()
+        if end == position:
+            return True
+        stream.seek(position)
+        return False
+
+    def __truncate(self, position):
+        """Remove everything written since `position`."""
+        del self.__buf[:]
+        if self.__is_bytearray:
+            del self.__stream[position:]
+        else:
+            self.__stream.seek(position)
+            self.__stream.truncate()
+
+    def __set_length(self, position, length):
+        """Fill in the length of the document starting at `position`."""
+        if self.__is_bytearray:
+            _PACK_INT_INTO(self.__stream, position, length)
+        else:
+            stream = self.__stream
+            end = stream.tell()
+            stream.seek(position)
+            stream.write(_PACK_INT(length))
+            stream.seek(end)
+
+    def __flush(self):
+        """Write the buffered elements. Returns the number of bytes."""
+        buf = self.__buf
+        length = len(buf)
+        self.__write(buf)
+        del buf[:]
+        return length
+
+    def __write_elements(self, document):
+        """Write the elements of `document`, returning their length."""
+        check_keys = self.__check_keys
+        opts = self.__codec_options
+        buf = self.__buf
+        items = iteritems(document)
+        if "_id" in document:
+            items = itertools.chain(
+                [("_id", document["_id"])],
+                (item for item in items if item[0] != "_id"))
+
+        length = 0
+        for key, value in items:
+            large = _large_bytes_value(value)
+            if large is None:
+                _append_element(buf, key, value, check_keys, opts)
+                if len(buf) >= _WRITE_CHUNK_SIZE:
+                    length += self.__flush()
+            else:
+                element_type, header, data = large
+                buf += element_type + _key_to_name(key, check_keys) + header
+                length += self.__flush()
+                self.__write(data)
+                length += len(data)
+        return length
+
+    def write(self, document):
+        """Encode `document` and write it to the stream.
+
+        Returns the length of the encoded document.
+
+        :Parameters:
+          - `document`: mapping type representing a document
+        """
+        if _raw_document_class(document):
+            self.__write(document.raw)
+            return len(document.raw)
+        if not isinstance(document, collections.Mapping):
+            raise TypeError("encoder expected a mapping type but got: %r" %
+                            (document,))
+
+        if self.__seekable:
+            begin = self.__tell()
+        # Don't truncate data that follows the document if it fails.
+        if not self.__seekable or not self.__at_end(begin):
+            # Compute the length first, which also checks that the whole
+            # document can be encoded.
+            length = _encoded_size(
+                document, self.__check_keys, self.__codec_options)
+            try:
+                self.__buf += _PACK_INT(length)
+                self.__write_elements(document)
+                self.__buf += b"\x00"
+                self.__flush()
+            except Exception:
+                # Don't write the rest of the document before the next one.
+                del self.__buf[:]
+                raise
+            return length
+
+        self.__buf += b"\x00\x00\x00\x00"
+        try:
+            length = self.__write_elements(document)
+            self.__buf += b"\x00"
+            length += self.__flush()
+        except Exception:
+            self.__truncate(begin)
+            raise
+        self.__set_length(begin, length)
+        return length
+
+    def write_many(self, documents):
+        """Encode each document in `documents` and write it to the stream.
+
+        Returns the total length of the encoded documents.
+
+        :Parameters:
+          - `documents`: an iterable of documents
+        """
+        return sum(self.write(document) for document in documents)
+
+
+def encode_to(stream, document, check_keys=False,
+              codec_options=DEFAULT_CODEC_OPTIONS):
+    """Encode `document` to BSON directly into a writable stream.
+
+    Returns the length of the encoded document. Unlike writing the result
+    of :meth:`BSON.encode`, this never holds the whole encoded document
+    in memory. See :class:`BSONWriter` for details, and to write several
+    documents with the same options.
+
+    :Parameters:
+      - `stream`: a :class:`bytearray`, a file-like object opened for
+        writing in binary mode, or a connected socket
+      - `document`: mapping type representing a document
+      - `check_keys` (optional): check if keys start with '$' or
+        contain '.', raising :class:`~bson.errors.InvalidDocument` in
+        either case
+      - `codec_options` (optional): An instance of
+        :class:`~bson.codec_options.CodecOptions`.
+
+    .. versionadded:: 3.1
+    """
+    return BSONWriter(stream, check_keys, codec_options).write(document)
+
+
 def decode_all(data, codec_options=DEFAULT_CODEC_OPTIONS):
     """Decode BSON data to multiple documents.
 
     `data` must be a string of concatenated, valid, BSON-encoded
-    documents.
+    documents, or any other object supporting the buffer protocol
+    containing them, such as a :class:`bytearray` or :class:`memoryview`.
+    With the C extension, documents are decoded directly from the buffer
+    without first copying it.
 
     :Parameters:
       - `data`: BSON data
       - `codec_options` (optional): An instance of
         :class:`~bson.codec_options.CodecOptions`.
 
+    .. versionchanged:: 3.1
+       `data` may be any object supporting the buffer protocol.
+
     .. versionchanged:: 3.0
        Removed `compile_re` option: PyMongo now always represents BSON regular
        expressions as :class:`~bson.regex.Regex` objects. Use
@@ -748,21 +1404,28 @@ def decode_all(data, codec_options=DEFAULT_CODEC_OPTIONS):
     if not isinstance(codec_options, CodecOptions):
         raise _CODEC_OPTIONS_TYPE_ERROR
 
+    data = bytes_from_buffer(data)
     docs = []
     position = 0
     end = len(data) - 1
+    use_raw = _raw_document_class(codec_options.document_class)
     try:
         while position < end:
-            obj_size = _UNPACK_INT(data[position:position + 4])[0]
-            if len(data) - position < obj_size:
+            obj_size = _UNPACK_INT_FROM(data, position)[0]
+            if obj_size < 5 or len(data) - position < obj_size:
                 raise InvalidBSON("invalid object size")
             obj_end = position + obj_size - 1
-            if data[obj_end:position + obj_size] != b"\x00":
+            if data[obj_end] != _EOO:
                 raise InvalidBSON("bad eoo")
-            docs.append(_elements_to_dict(data,
-                                          position + 4,
-                                          obj_end,
-                                          codec_options))
+            if use_raw:
+                docs.append(
+                    codec_options.document_class(
+                        data[position:obj_end + 1], codec_options))
+            else:
+                docs.append(_elements_to_dict(data,
+                                              position + 4,
+                                              obj_end,
+                                              codec_options))
             position += obj_size
         return docs
     except InvalidBSON:
@@ -777,6 +1440,118 @@ if _USE_C:
     decode_all = _cbson.decode_all
 
 
+_COLUMN_NUMBERS = frozenset(
+    _byte_key(element_type) for element_type in (BSONNUM, BSONDAT, BSONLON))
+_COLUMN_NULLS = frozenset(
+    _byte_key(element_type) for element_type in (BSONUND, BSONNUL))
+_INT = _byte_key(BSONINT)
+_BOOLEAN = _byte_key(BSONBOO)
+
+
+def _decode_columns(data, names, opts):
+    """Decode concatenated BSON documents into a column per field.
+
+    `names` is a list of the field names to decode, or None to decode all
+    top-level fields. Returns the list of field names and a list with a
+    (types, values, objects) tuple per field, where:
+
+      - `types` is a bytearray of the BSON type of each row's value, or 0
+        if the field is missing from that row's document.
+      - `values` is a bytearray of each row's value as an 8 byte, little
+        endian number if it's a number, boolean, or datetime.
+      - `objects` is a list of each row's decoded value if it's any other
+        type, otherwise None.
+    """
+    data = bytes_from_buffer(data)
+    if opts.decode_fields is not None:
+        # Values in object columns are decoded whole.
+        opts = opts._replace(decode_fields=None)
+    find_names = names is None
+    names = [] if find_names else list(names)
+    index = {}
+    columns = []
+    for name in names:
+        index[name] = len(columns)
+        columns.append((bytearray(), bytearray(), []))
+
+    zero = _PACK_LONG(0)
+    position = 0
+    row = 0
+    end = len(data)
+    try:
+        while position < end:
+            obj_size = _UNPACK_INT_FROM(data, position)[0]
+            if obj_size < 5 or end - position < obj_size:
+                raise InvalidBSON("invalid object size")
+            obj_end = position + obj_size - 1
+            if data[obj_end] != _EOO:
+                raise InvalidBSON("bad eoo")
+            position += 4
+            while position < obj_end:
+                # The type's code in python 3, or its byte in python 2.
+                # bytearray accepts either.
+                element_type = data[position]
+                name, position = _get_c_string(data, position + 1, opts)
+                value_end = _value_end(data, element_type, position)
+                if value_end > obj_end:
+                    raise InvalidBSON("bad object or element length")
+                column = index.get(name)
+                if column is None and find_names:
+                    column = index[name] = len(columns)
+                    names.append(name)
+                    columns.append((bytearray(), bytearray(), []))
+                if column is not None:
+                    types, values, objects = columns[column]
+                    missing = row - len(types)
+                    if missing > 0:
+                        types.extend(b"\x00" * missing)
+                        values.extend(zero * missing)
+                        objects.extend([None] * missing)
+
+                    obj = None
+                    if element_type in _COLUMN_NUMBERS:
+                        value = data[position:value_end]
+                    elif element_type == _INT:
+                        value = _PACK_LONG(
+                            _UNPACK_INT_FROM(data, position)[0])
+                    elif element_type == _BOOLEAN:
+                        value = _PACK_LONG(data[position] != _EOO)
+                    else:
+                        value = zero
+                        if element_type not in _COLUMN_NULLS:
+                            obj = _ELEMENT_GETTER[element_type](
+                                data, position, obj_end, opts)[0]
+
+                    if len(types) == row:
+                        types.append(element_type)
+                        values.extend(value)
+                        objects.append(obj)
+                    else:
+                        # A duplicate key: the last value wins, like a
+                        # decoded document.
+                        types[row] = element_type
+                        values[row * 8:row * 8 + 8] = value
+                        objects[row] = obj
+                position = value_end
+            position += 1
+            row += 1
+    except InvalidBSON:
+        raise
+    except Exception:
+        # Change exception type to InvalidBSON but preserve traceback.
+        _, exc_value, exc_tb = sys.exc_info()
+        reraise(InvalidBSON, exc_value, exc_tb)
+
+    for types, values, objects in columns:
+        missing = row - len(types)
+        types.extend(b"\x00" * missing)
+        values.extend(zero * missing)
+        objects.extend([None] * missing)
+    return names, columns
+if _USE_C:
+    _decode_columns = _cbson._decode_columns
+
+
 def decode_iter(data, codec_options=DEFAULT_CODEC_OPTIONS):
     """Decode BSON data to multiple documents as a generator.
 
@@ -784,13 +1559,19 @@ def decode_iter(data, codec_options=DEFAULT_CODEC_OPTIONS):
     time.
 
     `data` must be a string of concatenated, valid, BSON-encoded
-    documents.
+    documents, or any other object supporting the buffer protocol
+    containing them, such as a :class:`bytearray` or :class:`memoryview`.
+    With the C extension, documents are decoded directly from the buffer
+    without first copying it.
 
     :Parameters:
       - `data`: BSON data
       - `codec_options` (optional): An instance of
         :class:`~bson.codec_options.CodecOptions`.
 
+    .. versionchanged:: 3.1
+       `data` may be any object supporting the buffer protocol.
+
     .. versionchanged:: 3.0
        Replaced `as_class`, `tz_aware`, and `uuid_subtype` options with
        `codec_options`.
@@ -800,10 +1581,20 @@ def decode_iter(data, codec_options=DEFAULT_CODEC_OPTIONS):
     if not isinstance(codec_options, CodecOptions):
         raise _CODEC_OPTIONS_TYPE_ERROR
 
+    if not isinstance(data, bytes):
+        if _USE_C and HAVE_MEMORYVIEW:
+            # Slicing a memoryview doesn't copy. The C extension decodes
+            # each slice in place.
+            try:
+                data = memoryview(data)
+            except TypeError:
+                data = bytes_from_buffer(data)
+        else:
+            data = bytes_from_buffer(data)
     position = 0
     end = len(data) - 1
     while position < end:
-        obj_size = _UNPACK_INT(data[position:position + 4])[0]
+        obj_size = _UNPACK_INT_FROM(data, position)[0]
         elements = data[position:position + obj_size]
         position += obj_size
 
@@ -839,6 +1630,155 @@ def decode_file_iter(file_obj, codec_options=DEFAULT_CODEC_OPTIONS):
         yield _bson_to_dict(elements, codec_options)
 
 
+_STRING_TYPES = frozenset(
+    _byte_key(element_type) for element_type in (BSONSTR, BSONCOD, BSONSYM))
+_BIN = _byte_key(BSONBIN)
+_REF = _byte_key(BSONREF)
+_CWS = _byte_key(BSONCWS)
+
+
+def _check_string(data, position, obj_end):
+    """Check a BSON string that must end before `obj_end`.
+
+    Returns the position after the string.
+    """
+    length = _UNPACK_INT_FROM(data, position)[0]
+    end = position + 4 + length
+    if length < 1 or end > obj_end or data[end - 1] != _EOO:
+        raise InvalidBSON("invalid string")
+    _utf_8_decode(data[position + 4:end - 1], None, True)
+    return end
+
+
+def _validate_document(data, position, obj_size, max_depth):
+    """Check the structure of the BSON document of `obj_size` bytes at
+    `position` in `data`, without decoding it.
+
+    The caller has checked the size and terminating NUL. Embedded documents
+    and arrays may be nested at most `max_depth` levels deep, or to any
+    depth if `max_depth` is negative. Raises an exception if the document
+    isn't valid.
+    """
+    # The end of each enclosing document, for when its child is done.
+    ends = []
+    end = position + obj_size - 1
+    position += 4
+    index = data.index
+    while True:
+        if position == end:
+            if not ends:
+                return
+            position = end + 1
+            end = ends.pop()
+            continue
+        element_type = data[position]
+        name_end = index(b"\x00", position + 1, end)
+        _utf_8_decode(data[position + 1:name_end], None, True)
+        position = name_end + 1
+
+        if element_type in _DOCUMENT_TYPES:
+            obj_size = _UNPACK_INT_FROM(data, position)[0]
+            obj_end = position + obj_size
+            if obj_size < 5 or obj_end > end or data[obj_end - 1] != _EOO:
+                raise InvalidBSON("invalid object length")
+            child = position
+            if element_type == _CWS:
+                child = _check_string(data, position + 4, obj_end - 5)
+                if _UNPACK_INT_FROM(data, child)[0] != obj_end - child:
+                    raise InvalidBSON("invalid code with scope length")
+            if 0 <= max_depth <= len(ends):
+                raise InvalidBSON("documents nested too deeply")
+            # Check the child document's elements next.
+            ends.append(end)
+            end = obj_end - 1
+            position = child + 4
+            continue
+
+        if element_type in _STRING_TYPES:
+            position = _check_string(data, position, end)
+        elif element_type == _REF:
+            position = _check_string(data, position, end - 12) + 12
+        elif element_type == _BIN:
+            length, subtype = _UNPACK_LENGTH_SUBTYPE_FROM(data, position)
+            if length < 0:
+                raise InvalidBSON("invalid binary length")
+            if subtype == 2:
+                # The old binary subtype repeats the length.
+                if (length < 4 or
+                        _UNPACK_INT_FROM(data, position + 5)[0] != length - 4):
+                    raise InvalidBSON("invalid binary (st 2) length")
+            elif subtype in (3, 4) and length != 16:
+                raise InvalidBSON("invalid UUID length")
+            position += 5 + length
+        elif element_type == _RGX:
+            pattern_end = index(b"\x00", position, end)
+            flags_end = index(b"\x00", pattern_end + 1, end)
+            _utf_8_decode(data[position:pattern_end], None, True)
+            _utf_8_decode(data[pattern_end + 1:flags_end], None, True)
+            position = flags_end + 1
+        else:
+            position += _FIXED_LENGTH[element_type]
+        if position > end:
+            raise InvalidBSON("invalid element length")
+
+
+def _validate(data, max_depth):
+    """Return the offsets of the invalid documents in BSON data."""
+    data = bytes_from_buffer(data)
+    invalid = []
+    position = 0
+    end = len(data)
+    while position < end:
+        obj_size = -1
+        try:
+            obj_size = _UNPACK_INT_FROM(data, position)[0]
+            if (obj_size < 5 or position + obj_size > end or
+                    data[position + obj_size - 1] != _EOO):
+                obj_size = -1
+                raise InvalidBSON("invalid object size")
+            _validate_document(data, position, obj_size, max_depth)
+        except Exception:
+            invalid.append(position)
+        if obj_size < 0:
+            # The following documents can't be found.
+            break
+        position += obj_size
+    return invalid
+if _USE_C:
+    _validate = _cbson._validate
+
+
+def validate(data, max_depth=None):
+    """Check the structure of BSON data without decoding it.
+
+    `data` must be a string of concatenated BSON-encoded documents, or any
+    other object supporting the buffer protocol containing them. Returns a
+    list of the offsets in `data` of the documents that are not valid
+    BSON, which is empty if every document is valid. If a document's size
+    is invalid the documents after it can't be found, so its offset is the
+    last in the list.
+
+    Each document's sizes, terminating NUL bytes, element types and UTF-8
+    strings are checked, but no values are decoded. With the C extension
+    no Python objects are created, and large documents are checked without
+    holding the GIL. This is much faster than decoding untrusted data just
+    to find out whether it is valid.
+
+    :Parameters:
+      - `data`: BSON data
+      - `max_depth` (optional): the maximum number of levels of embedded
+        documents and arrays in a valid document. By default the depth
+        isn't limited.
+
+    .. versionadded:: 3.1
+    """
+    if max_depth is None:
+        max_depth = -1
+    elif max_depth < 0:
+        raise ValueError("max_depth must be None or at least 0")
+    return _validate(data, max_depth)
+
+
 def is_valid(bson):
     """Check that the given string represents valid :class:`BSON` data.
 
@@ -848,27 +1788,43 @@ def is_valid(bson):
 
     :Parameters:
       - `bson`: the data to be validated
+
+    .. versionchanged:: 3.1
+       Checks the structure of `bson` like :func:`validate` instead of
+       decoding it. Values that are valid BSON but can't be decoded to a
+       Python object, such as a datetime outside the range of
+       :class:`datetime.datetime`, are no longer considered invalid.
     """
     if not isinstance(bson, bytes):
         raise TypeError("BSON data must be an instance of a subclass of bytes")
 
-    try:
-        _bson_to_dict(bson, DEFAULT_CODEC_OPTIONS)
-        return True
-    except Exception:
+    if len(bson) < 5 or _UNPACK_INT_FROM(bson, 0)[0] != len(bson):
         return False
+    return not _validate(bson, -1)
 
 
 class BSON(bytes):
     """BSON (Binary JSON) data.
+
+    A :class:`BSON` instance used as a value in a document is encoded as an
+    embedded document by copying its bytes, without decoding it.
+
+    .. versionchanged:: 3.1
+       Instances are encoded as embedded documents. Previously they were
+       encoded as strings (Python 2) or binary data (Python 3).
     """
 
+    # Encoded as an embedded document, BSON type 3.
+    _type_marker = 3
+
     @classmethod
     def encode(cls, document, check_keys=False,
                codec_options=DEFAULT_CODEC_OPTIONS):
         """Encode a document to a new :class:`BSON` instance.
 
-        A document can be any mapping type (like :class:`dict`).
+        A document can be any mapping type (like :class:`dict`). A
+        :class:`~bson.raw_bson.RawBSONDocument` is encoded by copying its
+        bytes, without checking its keys.
 
         Raises :class:`TypeError` if `document` is not a mapping type,
         or contains keys that are not instances of
@@ -884,6 +1840,10 @@ class BSON(bytes):
           - `codec_options` (optional): An instance of
             :class:`~bson.codec_options.CodecOptions`.
 
+        .. versionchanged:: 3.1
+           :class:`BSON` and :class:`~bson.raw_bson.RawBSONDocument` values
+           are encoded by copying their bytes.
+
         .. versionchanged:: 3.0
            Replaced `uuid_subtype` option with `codec_options`.
         """
@@ -30,6 +30,19 @@
 #define _CBSON_MODULE
 #include "_cbsonmodule.h"
 
+/* The number of element names cached by _decode_element_name. Must be a
+ * power of two. */
+#define KEY_CACHE_SIZE 1024
+/* The longest element name, in bytes, that is cached. */
+#define KEY_CACHE_MAX_LENGTH 32
+
+/* A cached element name. */
+struct key_cache_entry {
+    PyObject* key;
+    size_t length;
+    char bytes[KEY_CACHE_MAX_LENGTH];
+};
+
 /* New module state and initialization code.
  * See the module-initialization-and-state
  * section in the following doc:
@@ -50,7 +63,9 @@ struct module_state {
     PyObject* UTC;
     PyTypeObject* REType;
     PyObject* BSONInt64;
+    PyObject* DatetimeMS;
     PyObject* Mapping;
+    struct key_cache_entry key_cache[KEY_CACHE_SIZE];
 };
 
 /* The Py_TYPE macro was introduced in CPython 2.6 */
@@ -79,6 +94,8 @@ static struct module_state _state;
 #define BSON_MAX_SIZE 2147483647
 /* The smallest possible BSON document, i.e. "{}" */
 #define BSON_MIN_SIZE 5
+/* Release the GIL while scanning or copying at least this many bytes. */
+#define NOGIL_MIN_SIZE (1024 * 1024)
 
 /* Get an error class from the bson.errors module.
  *
@@ -110,26 +127,163 @@ _downcast_and_check(Py_ssize_t size, int extra) {
     return (int)size + extra;
 }
 
+/* Get the _type_marker from an Object.
+ *
+ * Return the type marker, 0 if there is no marker, or -1 on failure.
+ */
+static long _type_marker(PyObject* object) {
+    PyObject* type_marker = NULL;
+    long type = 0;
+
+    if (PyObject_HasAttrString(object, "_type_marker")) {
+        type_marker = PyObject_GetAttrString(object, "_type_marker");
+        if (type_marker == NULL) {
+            return -1;
+        }
+    }
+    /*
+     * Python objects with broken __getattr__ implementations could return
+     * arbitrary types for a call to PyObject_GetAttrString. For example
+     * pymongo.database.Database returns a new Collection instance for
+     * __getattr__ calls with names that don't match an existing attribute
+     * or method. In some cases "value" could be a subtype of something
+     * we know how to serialize. Make a best effort to encode these types.
+     */
+#if PY_MAJOR_VERSION >= 3
+    if (type_marker && PyLong_CheckExact(type_marker)) {
+        type = PyLong_AsLong(type_marker);
+#else
+    if (type_marker && PyInt_CheckExact(type_marker)) {
+        type = PyInt_AsLong(type_marker);
+#endif
+        Py_DECREF(type_marker);
+        /*
+         * Py(Long|Int)_AsLong returns -1 for error but -1 is a valid value
+         * so we call PyErr_Occurred to differentiate.
+         */
+        if (type == -1 && PyErr_Occurred()) {
+            return -1;
+        }
+    } else {
+        Py_XDECREF(type_marker);
+    }
+
+    return type;
+}
+
+/* Build the tree of fields to decode from the decode_fields option, an
+ * iterable of dotted field names. Each node is a dict mapping a field name
+ * to Py_None, to decode the whole field, or to another node selecting the
+ * fields of the documents embedded in it.
+ *
+ * Returns a new reference or NULL on failure. */
+static PyObject* _field_tree(PyObject* decode_fields) {
+    PyObject* tree;
+    PyObject* iter;
+    PyObject* path;
+
+    if (!(tree = PyDict_New())) {
+        return NULL;
+    }
+    if (!(iter = PyObject_GetIter(decode_fields))) {
+        Py_DECREF(tree);
+        return NULL;
+    }
+    while ((path = PyIter_Next(iter))) {
+        PyObject* node = tree;
+        Py_ssize_t i, count;
+        PyObject* parts = PyObject_CallMethod(path, "split", "s", ".");
+        Py_DECREF(path);
+        if (!parts) {
+            break;
+        }
+        count = PyList_GET_SIZE(parts);
+        for (i = 0; i < count; i++) {
+            PyObject* part = PyList_GET_ITEM(parts, i);
+            PyObject* child;
+            if (i == count - 1) {
+                /* Decode the whole field, even if only some of its fields
+                 * were selected by another path. */
+                if (PyDict_SetItem(node, part, Py_None) < 0) {
+                    node = NULL;
+                }
+                break;
+            }
+            child = PyDict_GetItem(node, part);
+            if (child == Py_None) {
+                /* The whole field is already selected. */
+                break;
+            }
+            if (!child) {
+                if (!(child = PyDict_New())) {
+                    node = NULL;
+                    break;
+                }
+                if (PyDict_SetItem(node, part, child) < 0) {
+                    Py_DECREF(child);
+                    node = NULL;
+                    break;
+                }
+                Py_DECREF(child);
+            }
+            node = child;
+        }
+        Py_DECREF(parts);
+        if (!node) {
+            break;
+        }
+    }
+    Py_DECREF(iter);
+    if (PyErr_Occurred()) {
+        Py_DECREF(tree);
+        return NULL;
+    }
+    return tree;
+}
+
 /* Fill out a codec_options_t* from a CodecOptions object. Use with the "O&"
  * format spec in PyArg_ParseTuple.
  *
- * Return 1 on success. options->document_class is a new reference.
+ * Return 1 on success. options->document_class and options->options_obj
+ * are new references.
  * Return 0 on failure.
  */
 int convert_codec_options(PyObject* options_obj, void* p) {
     codec_options_t* options = (codec_options_t*)p;
+    long type_marker;
+    PyObject* decode_fields;
     options->unicode_decode_error_handler = NULL;
-    if (!PyArg_ParseTuple(options_obj, "ObbzO",
+    options->source_view = NULL;
+    options->source_start = NULL;
+    if (!PyArg_ParseTuple(options_obj, "ObbzOObb",
                           &options->document_class,
                           &options->tz_aware,
                           &options->uuid_rep,
                           &options->unicode_decode_error_handler,
-                          &options->tzinfo)) {
+                          &options->tzinfo,
+                          &decode_fields,
+                          &options->datetime_ms,
+                          &options->binary_memoryview)) {
+        return 0;
+    }
+
+    type_marker = _type_marker(options->document_class);
+    if (type_marker < 0) {
+        return 0;
+    }
+
+    options->fields = NULL;
+    if (decode_fields != Py_None &&
+            !(options->fields = _field_tree(decode_fields))) {
         return 0;
     }
 
     Py_INCREF(options->document_class);
     Py_INCREF(options->tzinfo);
+    options->options_obj = options_obj;
+    Py_INCREF(options->options_obj);
+    /* RawBSONDocument */
+    options->is_raw_bson = (101 == type_marker);
     return 1;
 }
 
@@ -144,11 +298,61 @@ void default_codec_options(codec_options_t* options) {
     options->unicode_decode_error_handler = NULL;
     options->tzinfo = Py_None;
     Py_INCREF(options->tzinfo);
+    options->options_obj = NULL;
+    options->is_raw_bson = 0;
+    options->datetime_ms = 0;
+    options->binary_memoryview = 0;
+    options->source_view = NULL;
+    options->source_start = NULL;
+    options->fields = NULL;
 }
 
 void destroy_codec_options(codec_options_t* options) {
     Py_CLEAR(options->document_class);
     Py_CLEAR(options->tzinfo);
+    Py_CLEAR(options->options_obj);
+    Py_CLEAR(options->fields);
+    Py_CLEAR(options->source_view);
+}
+
+/* With the binary_memoryview option, make a read-only memoryview of
+ * `bson`, the object about to be decoded, whose data starts at `start`.
+ * Binary values are then decoded to slices of it, which keep `bson`
+ * alive. destroy_codec_options releases the view.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int set_decode_source(codec_options_t* options, PyObject* bson,
+                             const char* start) {
+#if PY_VERSION_HEX >= 0x02070000
+    PyObject* view;
+    if (!options->binary_memoryview) {
+        return 1;
+    }
+    if (!(view = PyMemoryView_FromObject(bson))) {
+        return 0;
+    }
+    if (PyMemoryView_GET_BUFFER(view)->buf != start) {
+        /* Not the memory being decoded, binary values will be copied. */
+        Py_DECREF(view);
+        return 1;
+    }
+#if PY_MAJOR_VERSION >= 3
+    /* Like memoryview.toreadonly(). Slices inherit this flag, so values
+     * can't be used to modify a mutable buffer such as a bytearray. */
+    PyMemoryView_GET_BUFFER(view)->readonly = 1;
+#else
+    /* Python 2 slices export the buffer again, so only share read-only
+     * buffers such as str. */
+    if (!PyMemoryView_GET_BUFFER(view)->readonly) {
+        Py_DECREF(view);
+        return 1;
+    }
+#endif
+    options->source_view = view;
+    options->source_start = start;
+#endif
+    /* Python 2.6 has no memoryview: CodecOptions rejects the option. */
+    return 1;
 }
 
 static PyObject* elements_to_dict(PyObject* self, const char* string,
@@ -160,7 +364,7 @@ static int _write_element_to_buffer(PyObject* self, buffer_t buffer,
                                     const codec_options_t* options);
 
 /* Date stuff */
-static PyObject* datetime_from_millis(long long millis) {
+static PyObject* datetime_from_millis(long long millis, PyObject* tzinfo) {
     /* To encode a datetime instance like datetime(9999, 12, 31, 23, 59, 59, 999999)
      * we follow these steps:
      * 1. Calculate a timestamp in seconds:       253402300799
@@ -195,13 +399,17 @@ static PyObject* datetime_from_millis(long long millis) {
     struct TM timeinfo;
     gmtime64_r(&seconds, &timeinfo);
 
-    return PyDateTime_FromDateAndTime(timeinfo.tm_year + 1900,
-                                      timeinfo.tm_mon + 1,
-                                      timeinfo.tm_mday,
-                                      timeinfo.tm_hour,
-                                      timeinfo.tm_min,
-                                      timeinfo.tm_sec,
-                                      microseconds);
+    /* Pass tzinfo straight to the constructor, rather than creating a
+     * naive datetime and calling replace(tzinfo=...) on it. */
+    return PyDateTimeAPI->DateTime_FromDateAndTime(timeinfo.tm_year + 1900,
+                                                   timeinfo.tm_mon + 1,
+                                                   timeinfo.tm_mday,
+                                                   timeinfo.tm_hour,
+                                                   timeinfo.tm_min,
+                                                   timeinfo.tm_sec,
+                                                   microseconds,
+                                                   tzinfo,
+                                                   PyDateTimeAPI->DateTimeType);
 }
 
 static long long millis_from_datetime(PyObject* datetime) {
@@ -376,6 +584,7 @@ static int _load_python_objects(PyObject* module) {
         _load_object(&state->UTC, "bson.tz_util", "utc") ||
         _load_object(&state->Regex, "bson.regex", "Regex") ||
         _load_object(&state->BSONInt64, "bson.int64", "Int64") ||
+        _load_object(&state->DatetimeMS, "bson.datetime_ms", "DatetimeMS") ||
         _load_object(&state->UUID, "uuid", "UUID") ||
         _load_object(&state->Mapping, "collections", "Mapping")) {
         return 1;
@@ -594,6 +803,70 @@ static int _write_regex_to_buffer(
     return 1;
 }
 
+/* Check the size and terminating NUL byte of `raw`, the bytes of an
+ * already encoded document, and set `data` and `size` to its contents.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int check_raw_document(PyObject* raw, const char** data,
+                              Py_ssize_t* size) {
+    int length;
+#if PY_MAJOR_VERSION >= 3
+    if (!PyBytes_Check(raw)) {
+#else
+    if (!PyString_Check(raw)) {
+#endif
+        PyErr_SetString(PyExc_TypeError,
+                        "raw BSON document must be an instance of bytes");
+        return 0;
+    }
+#if PY_MAJOR_VERSION >= 3
+    *data = PyBytes_AS_STRING(raw);
+    *size = PyBytes_GET_SIZE(raw);
+#else
+    *data = PyString_AS_STRING(raw);
+    *size = PyString_GET_SIZE(raw);
+#endif
+    if (*size >= BSON_MIN_SIZE) {
+        memcpy(&length, *data, 4);
+    }
+    if (*size < BSON_MIN_SIZE || *size > BSON_MAX_SIZE ||
+            length != *size || (*data)[*size - 1]) {
+        PyObject* InvalidDocument = _error("InvalidDocument");
+        if (InvalidDocument) {
+            PyErr_SetString(InvalidDocument,
+                            "cannot embed invalid BSON document bytes");
+            Py_DECREF(InvalidDocument);
+        }
+        return 0;
+    }
+    return 1;
+}
+
+/* Copy the already encoded document `raw`, a bytes object, to `buffer`
+ * after checking its size and terminating NUL byte.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int write_raw_document(buffer_t buffer, PyObject* raw) {
+    const char* data;
+    Py_ssize_t size;
+    if (!check_raw_document(raw, &data, &size)) {
+        return 0;
+    }
+    if (size >= NOGIL_MIN_SIZE) {
+        /* bytes are immutable, copy without the GIL. */
+        int failed;
+        Py_BEGIN_ALLOW_THREADS
+        failed = buffer_write(buffer, data, (int)size);
+        Py_END_ALLOW_THREADS
+        if (failed) {
+            PyErr_NoMemory();
+            return 0;
+        }
+        return 1;
+    }
+    return buffer_write_bytes(buffer, data, (int)size);
+}
+
 /* TODO our platform better be little-endian w/ 4-byte ints! */
 /* Write a single value to the buffer (also write its type_byte, for which
  * space has already been reserved.
@@ -604,44 +877,19 @@ static int _write_element_to_buffer(PyObject* self, buffer_t buffer,
                                     unsigned char check_keys,
                                     const codec_options_t* options) {
     struct module_state *state = GETSTATE(self);
-    PyObject* type_marker = NULL;
     PyObject* mapping_type;
     PyObject* uuid_type;
-
     /*
      * Don't use PyObject_IsInstance for our custom types. It causes
      * problems with python sub interpreters. Our custom types should
      * have a _type_marker attribute, which we can switch on instead.
      */
-    if (PyObject_HasAttrString(value, "_type_marker")) {
-        type_marker = PyObject_GetAttrString(value, "_type_marker");
-        if (type_marker == NULL) {
-            return 0;
-        }
+    long type = _type_marker(value);
+    if (type < 0) {
+        return 0;
     }
-    /*
-     * Python objects with broken __getattr__ implementations could return
-     * arbitrary types for a call to PyObject_GetAttrString. For example
-     * pymongo.database.Database returns a new Collection instance for
-     * __getattr__ calls with names that don't match an existing attribute
-     * or method. In some cases "value" could be a subtype of something
-     * we know how to serialize. Make a best effort to encode these types.
-     */
-#if PY_MAJOR_VERSION >= 3
-    if (type_marker && PyLong_CheckExact(type_marker)) {
-        long type = PyLong_AsLong(type_marker);
-#else
-    if (type_marker && PyInt_CheckExact(type_marker)) {
-        long type = PyInt_AsLong(type_marker);
-#endif
-        Py_DECREF(type_marker);
-        /* 
-         * Py(Long|Int)_AsLong returns -1 for error but -1 is a valid value
-         * so we call PyErr_Occurred to differentiate.
-         */
-        if (type == -1 && PyErr_Occurred()) {
-            return 0;
-        }
+
+    if (type) {
         switch (type) {
         case 5:
             {
@@ -838,6 +1086,40 @@ static int _write_element_to_buffer(PyObject* self, buffer_t buffer,
                 *(buffer_get_buffer(buffer) + type_byte) = 0x12;
                 return 1;
             }
+        case 9:
+            {
+                /* DatetimeMS */
+                const long long millis = PyLong_AsLongLong(value);
+                if (PyErr_Occurred()) { /* Overflow */
+                    PyErr_SetString(PyExc_OverflowError,
+                                    "MongoDB can only handle up to 8-byte ints");
+                    return 0;
+                }
+                if (!buffer_write_bytes(buffer, (const char*)&millis, 8)) {
+                    return 0;
+                }
+                *(buffer_get_buffer(buffer) + type_byte) = 0x09;
+                return 1;
+            }
+        case 3:
+            {
+                /* BSON */
+                *(buffer_get_buffer(buffer) + type_byte) = 0x03;
+                return write_raw_document(buffer, value);
+            }
+        case 101:
+            {
+                /* RawBSONDocument */
+                int result;
+                PyObject* raw = PyObject_GetAttrString(value, "raw");
+                if (!raw) {
+                    return 0;
+                }
+                result = write_raw_document(buffer, raw);
+                Py_DECREF(raw);
+                *(buffer_get_buffer(buffer) + type_byte) = 0x03;
+                return result;
+            }
         case 100:
             {
                 /* DBRef */
@@ -866,8 +1148,6 @@ static int _write_element_to_buffer(PyObject* self, buffer_t buffer,
                 return 1;
             }
         }
-    } else {
-        Py_XDECREF(type_marker);
     }
 
     /* No _type_marker attibute or not one of our types. */
@@ -1073,6 +1353,30 @@ static int _write_element_to_buffer(PyObject* self, buffer_t buffer,
         return buffer_write_bytes(buffer, (const char*)&millis, 8);
     } else if (PyObject_TypeCheck(value, state->REType)) {
         return _write_regex_to_buffer(buffer, type_byte, value);
+#if PY_VERSION_HEX >= 0x02070000
+    } else if (PyMemoryView_Check(value)) {
+        /* Stored as BSON binary subtype 0, like the binary_memoryview
+         * option decodes it. */
+        Py_buffer view;
+        int subtype = 0;
+        int size;
+        if (PyObject_GetBuffer(value, &view, PyBUF_C_CONTIGUOUS) == -1) {
+            return 0;
+        }
+        if ((size = _downcast_and_check(view.len, 0)) == -1) {
+            PyBuffer_Release(&view);
+            return 0;
+        }
+        *(buffer_get_buffer(buffer) + type_byte) = 0x05;
+        if (!buffer_write_bytes(buffer, (const char*)&size, 4) ||
+                !buffer_write_bytes(buffer, (const char*)&subtype, 1) ||
+                !buffer_write_bytes(buffer, (const char*)view.buf, size)) {
+            PyBuffer_Release(&view);
+            return 0;
+        }
+        PyBuffer_Release(&view);
+        return 1;
+#endif
     }
     
     /* 
@@ -1241,63 +1545,64 @@ int write_pair(PyObject* self, buffer_t buffer, const char* name, int name_lengt
     return 1;
 }
 
-int decode_and_write_pair(PyObject* self, buffer_t buffer,
-                          PyObject* key, PyObject* value,
-                          unsigned char check_keys,
-                          const codec_options_t* options,
-                          unsigned char top_level) {
-    PyObject* encoded;
-    const char* data;
-    int size;
+/* Encode `key` to a BSON element name, checking that it is a string with
+ * no NUL bytes. Sets `encoded` to a new reference to an object that owns
+ * `data`, the NUL terminated name, and `size` to its length including the
+ * NUL byte.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int encode_key(PyObject* key, PyObject** encoded,
+                      const char** data, int* size) {
     if (PyUnicode_Check(key)) {
-        encoded = PyUnicode_AsUTF8String(key);
-        if (!encoded) {
+        *encoded = PyUnicode_AsUTF8String(key);
+        if (!*encoded) {
             return 0;
         }
 #if PY_MAJOR_VERSION >= 3
-        if (!(data = PyBytes_AS_STRING(encoded))) {
-            Py_DECREF(encoded);
+        if (!(*data = PyBytes_AS_STRING(*encoded))) {
+            Py_DECREF(*encoded);
             return 0;
         }
-        if ((size = _downcast_and_check(PyBytes_GET_SIZE(encoded), 1)) == -1) {
-            Py_DECREF(encoded);
+        if ((*size = _downcast_and_check(PyBytes_GET_SIZE(*encoded), 1)) == -1) {
+            Py_DECREF(*encoded);
             return 0;
         }
 #else
-        if (!(data = PyString_AS_STRING(encoded))) {
-            Py_DECREF(encoded);
+        if (!(*data = PyString_AS_STRING(*encoded))) {
+            Py_DECREF(*encoded);
             return 0;
         }
-        if ((size = _downcast_and_check(PyString_GET_SIZE(encoded), 1)) == -1) {
-            Py_DECREF(encoded);
+        if ((*size = _downcast_and_check(PyString_GET_SIZE(*encoded), 1)) == -1) {
+            Py_DECREF(*encoded);
             return 0;
         }
 #endif
-        if (strlen(data) != (size_t)(size - 1)) {
+        if (strlen(*data) != (size_t)(*size - 1)) {
             PyObject* InvalidDocument = _error("InvalidDocument");
             if (InvalidDocument) {
                 PyErr_SetString(InvalidDocument,
                                 "Key names must not contain the NULL byte");
                 Py_DECREF(InvalidDocument);
             }
-            Py_DECREF(encoded);
+            Py_DECREF(*encoded);
             return 0;
         }
+        return 1;
 #if PY_MAJOR_VERSION < 3
     } else if (PyString_Check(key)) {
         result_t status;
-        encoded = key;
-        Py_INCREF(encoded);
+        *encoded = key;
+        Py_INCREF(*encoded);
 
-        if (!(data = PyString_AS_STRING(encoded))) {
-            Py_DECREF(encoded);
+        if (!(*data = PyString_AS_STRING(*encoded))) {
+            Py_DECREF(*encoded);
             return 0;
         }
-        if ((size = _downcast_and_check(PyString_GET_SIZE(encoded), 1)) == -1) {
-            Py_DECREF(encoded);
+        if ((*size = _downcast_and_check(PyString_GET_SIZE(*encoded), 1)) == -1) {
+            Py_DECREF(*encoded);
             return 0;
         }
-        status = check_string((const unsigned char*)data, size - 1, 1, 1);
+        status = check_string((const unsigned char*)*data, *size - 1, 1, 1);
 
         if (status == NOT_UTF_8) {
             PyObject* InvalidStringData = _error("InvalidStringData");
@@ -1306,7 +1611,7 @@ int decode_and_write_pair(PyObject* self, buffer_t buffer,
                                 "strings in documents must be valid UTF-8");
                 Py_DECREF(InvalidStringData);
             }
-            Py_DECREF(encoded);
+            Py_DECREF(*encoded);
             return 0;
         } else if (status == HAS_NULL) {
             PyObject* InvalidDocument = _error("InvalidDocument");
@@ -1315,9 +1620,10 @@ int decode_and_write_pair(PyObject* self, buffer_t buffer,
                                 "Key names must not contain the NULL byte");
                 Py_DECREF(InvalidDocument);
             }
-            Py_DECREF(encoded);
+            Py_DECREF(*encoded);
             return 0;
         }
+        return 1;
 #endif
     } else {
         PyObject* InvalidDocument = _error("InvalidDocument");
@@ -1355,6 +1661,19 @@ int decode_and_write_pair(PyObject* self, buffer_t buffer,
         }
         return 0;
     }
+}
+
+int decode_and_write_pair(PyObject* self, buffer_t buffer,
+                          PyObject* key, PyObject* value,
+                          unsigned char check_keys,
+                          const codec_options_t* options,
+                          unsigned char top_level) {
+    PyObject* encoded;
+    const char* data;
+    int size;
+    if (!encode_key(key, &encoded, &data, &size)) {
+        return 0;
+    }
 
     /* If top_level is True, don't allow writing _id here - it was already written. */
     if (!write_pair(self, buffer, data,
@@ -1367,19 +1686,14 @@ int decode_and_write_pair(PyObject* self, buffer_t buffer,
     return 1;
 }
 
-/* returns 0 on failure */
-int write_dict(PyObject* self, buffer_t buffer,
-               PyObject* dict, unsigned char check_keys,
-               const codec_options_t* options, unsigned char top_level) {
-    PyObject* key;
-    PyObject* iter;
-    char zero = 0;
-    int length;
-    int length_location;
+/* Check that `dict` is a Mapping, raising TypeError if it isn't.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int check_mapping(PyObject* self, PyObject* dict) {
     struct module_state *state = GETSTATE(self);
-    PyObject* mapping_type = _get_object(state->Mapping,
-                                         "collections", "Mapping");
+    PyObject* mapping_type;
 
+    mapping_type = _get_object(state->Mapping, "collections", "Mapping");
     if (mapping_type) {
         if (!PyObject_IsInstance(dict, mapping_type)) {
             PyObject* repr;
@@ -1425,6 +1739,40 @@ int write_dict(PyObject* self, buffer_t buffer,
         }
     }
 
+    return 1;
+}
+
+/* returns 0 on failure */
+int write_dict(PyObject* self, buffer_t buffer,
+               PyObject* dict, unsigned char check_keys,
+               const codec_options_t* options, unsigned char top_level) {
+    PyObject* key;
+    PyObject* iter;
+    char zero = 0;
+    int length;
+    int length_location;
+    long type_marker;
+
+    /* Copy a RawBSONDocument's bytes without re-encoding them. */
+    type_marker = _type_marker(dict);
+    if (type_marker < 0) {
+        return 0;
+    }
+    if (type_marker == 101) {
+        int result;
+        PyObject* raw = PyObject_GetAttrString(dict, "raw");
+        if (!raw) {
+            return 0;
+        }
+        result = write_raw_document(buffer, raw);
+        Py_DECREF(raw);
+        return result;
+    }
+
+    if (!check_mapping(self, dict)) {
+        return 0;
+    }
+
     length_location = buffer_save_space(buffer, 4);
     if (length_location == -1) {
         PyErr_NoMemory();
@@ -1495,1051 +1843,3481 @@ int write_dict(PyObject* self, buffer_t buffer,
     return 1;
 }
 
-static PyObject* _cbson_dict_to_bson(PyObject* self, PyObject* args) {
-    PyObject* dict;
-    PyObject* result;
-    unsigned char check_keys;
-    unsigned char top_level = 1;
-    codec_options_t options;
-    buffer_t buffer;
+/* Size calculation.
+ *
+ * These functions compute the length of the BSON that write_dict would
+ * produce, following the same type dispatch, without writing it. Rarely
+ * used types are measured by encoding just that value. */
 
-    if (!PyArg_ParseTuple(args, "ObO&|b", &dict, &check_keys,
-                          convert_codec_options, &options, &top_level)) {
-        return NULL;
-    }
-    buffer = buffer_new();
+static int dict_size(PyObject* self, PyObject* dict,
+                     unsigned char check_keys,
+                     const codec_options_t* options,
+                     unsigned char top_level, long long* size);
+
+static int element_size(PyObject* self, PyObject* value,
+                        unsigned char check_keys,
+                        const codec_options_t* options, long long* size);
+
+/* Measure a value by encoding it to a temporary buffer.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int encoded_element_size(PyObject* self, PyObject* value,
+                                unsigned char check_keys,
+                                const codec_options_t* options,
+                                long long* size) {
+    int type_byte;
+    buffer_t buffer = buffer_new();
     if (!buffer) {
-        destroy_codec_options(&options);
         PyErr_NoMemory();
-        return NULL;
+        return 0;
     }
-
-    if (!write_dict(self, buffer, dict, check_keys, &options, top_level)) {
-        destroy_codec_options(&options);
-        buffer_free(buffer);
+    type_byte = buffer_save_space(buffer, 1);
+    if (type_byte == -1) {
+        PyErr_NoMemory();
+        buffer_free(buffer);
+        return 0;
+    }
+    if (!write_element_to_buffer(self, buffer, type_byte,
+                                 value, check_keys, options)) {
+        buffer_free(buffer);
+        return 0;
+    }
+    *size = buffer_get_position(buffer) - 1;
+    buffer_free(buffer);
+    return 1;
+}
+
+/* Compute the size of an already encoded document, `raw`.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int raw_document_size(PyObject* raw, long long* size) {
+    const char* data;
+    Py_ssize_t raw_size;
+    if (!check_raw_document(raw, &data, &raw_size)) {
+        return 0;
+    }
+    *size = raw_size;
+    return 1;
+}
+
+/* Compute the size of an encoded 64-bit integer, raising OverflowError if
+ * `value` doesn't fit in one.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int int64_size(PyObject* value, long long* size) {
+    PyLong_AsLongLong(value);
+    if (PyErr_Occurred()) { /* Overflow */
+        PyErr_SetString(PyExc_OverflowError,
+                        "MongoDB can only handle up to 8-byte ints");
+        return 0;
+    }
+    *size = 8;
+    return 1;
+}
+
+/* Compute the size of a (key, value) pair: its type byte, name and value.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int pair_size(PyObject* self, const char* name, int name_length,
+                     PyObject* value, unsigned char check_keys,
+                     const codec_options_t* options, long long* size) {
+    long long value_size;
+    if (check_keys && !check_key_name(name, name_length)) {
+        return 0;
+    }
+    if (!element_size(self, value, check_keys, options, &value_size)) {
+        return 0;
+    }
+    *size = 1 + name_length + 1 + value_size;
+    return 1;
+}
+
+/* Compute the size of a value, not including its type byte and name.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int _element_size(PyObject* self, PyObject* value,
+                         unsigned char check_keys,
+                         const codec_options_t* options, long long* size) {
+    struct module_state *state = GETSTATE(self);
+    PyObject* mapping_type;
+    PyObject* uuid_type;
+    long type = _type_marker(value);
+    if (type < 0) {
+        return 0;
+    }
+
+    if (type) {
+        switch (type) {
+        case 5:
+            {
+                /* Binary */
+                PyObject* subtype_object;
+                long subtype;
+                Py_ssize_t length;
+
+                subtype_object = PyObject_GetAttrString(value, "subtype");
+                if (!subtype_object) {
+                    return 0;
+                }
+#if PY_MAJOR_VERSION >= 3
+                subtype = PyLong_AsLong(subtype_object);
+                length = PyBytes_Size(value);
+#else
+                subtype = PyInt_AsLong(subtype_object);
+                length = PyString_Size(value);
+#endif
+                Py_DECREF(subtype_object);
+                if (subtype == -1 || length == -1 ||
+                        _downcast_and_check(length, subtype == 2 ? 4 : 0) == -1) {
+                    return 0;
+                }
+                /* Subtype 2 repeats the length inside the value. */
+                *size = 4 + 1 + (subtype == 2 ? 4 : 0) + length;
+                return 1;
+            }
+        case 7:
+            /* ObjectId */
+            *size = 12;
+            return 1;
+        case 17:
+            /* Timestamp */
+            *size = 8;
+            return 1;
+        case 18:
+            /* Int64 */
+        case 9:
+            /* DatetimeMS */
+            return int64_size(value, size);
+        case 3:
+            /* BSON */
+            return raw_document_size(value, size);
+        case 101:
+            {
+                /* RawBSONDocument */
+                int result;
+                PyObject* raw = PyObject_GetAttrString(value, "raw");
+                if (!raw) {
+                    return 0;
+                }
+                result = raw_document_size(raw, size);
+                Py_DECREF(raw);
+                return result;
+            }
+        case 100:
+            {
+                /* DBRef */
+                int result;
+                PyObject* as_doc = PyObject_CallMethod(value, "as_doc", NULL);
+                if (!as_doc) {
+                    return 0;
+                }
+                result = dict_size(self, as_doc, 0, options, 0, size);
+                Py_DECREF(as_doc);
+                return result;
+            }
+        case 255:
+            /* MinKey */
+        case 127:
+            /* MaxKey */
+            *size = 0;
+            return 1;
+        case 11:
+            /* Regex */
+        case 13:
+            /* Code */
+            return encoded_element_size(self, value, check_keys,
+                                        options, size);
+        }
+    }
+
+    /* No _type_marker attibute or not one of our types. */
+
+    if (PyBool_Check(value)) {
+        *size = 1;
+        return 1;
+    }
+#if PY_MAJOR_VERSION >= 3
+    else if (PyLong_Check(value)) {
+        const long long_value = PyLong_AsLong(value);
+#else
+    else if (PyInt_Check(value)) {
+        const long long_value = PyInt_AsLong(value);
+#endif
+        const int int_value = (int)long_value;
+        if (PyErr_Occurred() || long_value != int_value) { /* Overflow */
+            PyErr_Clear();
+            return int64_size(value, size);
+        }
+        *size = 4;
+        return 1;
+#if PY_MAJOR_VERSION < 3
+    } else if (PyLong_Check(value)) {
+        return int64_size(value, size);
+#endif
+    } else if (PyFloat_Check(value)) {
+        *size = 8;
+        return 1;
+    } else if (value == Py_None) {
+        *size = 0;
+        return 1;
+    } else if (PyDict_Check(value)) {
+        return dict_size(self, value, check_keys, options, 0, size);
+    } else if (PyList_Check(value) || PyTuple_Check(value)) {
+        Py_ssize_t items, i;
+
+        if ((items = PySequence_Size(value)) > BSON_MAX_SIZE) {
+            PyObject* BSONError = _error("BSONError");
+            if (BSONError) {
+                PyErr_SetString(BSONError,
+                                "Too many items to serialize.");
+                Py_DECREF(BSONError);
+            }
+            return 0;
+        }
+        /* Length and terminating NUL byte. */
+        *size = 5;
+        for(i = 0; i < items; i++) {
+            char name[16];
+            long long item_size;
+            PyObject* item_value;
+
+            INT2STRING(name, (int)i);
+            if (!(item_value = PySequence_GetItem(value, i)))
+                return 0;
+            if (!pair_size(self, name, (int)strlen(name), item_value,
+                           check_keys, options, &item_size)) {
+                Py_DECREF(item_value);
+                return 0;
+            }
+            Py_DECREF(item_value);
+            *size += item_size;
+        }
+        return 1;
+#if PY_MAJOR_VERSION >= 3
+    } else if (PyBytes_Check(value)) {
+        /* Stored as BSON binary subtype 0. */
+        if (_downcast_and_check(PyBytes_GET_SIZE(value), 0) == -1)
+            return 0;
+        *size = 4 + 1 + PyBytes_GET_SIZE(value);
+        return 1;
+    } else if (PyUnicode_Check(value)) {
+#if PY_VERSION_HEX >= 0x03030000
+        if (PyUnicode_READY(value) == -1)
+            return 0;
+        /* Only ASCII strings have a UTF-8 length we can read directly. */
+        if (PyUnicode_IS_ASCII(value)) {
+            if (_downcast_and_check(PyUnicode_GET_LENGTH(value), 1) == -1)
+                return 0;
+            *size = 4 + PyUnicode_GET_LENGTH(value) + 1;
+            return 1;
+        }
+#endif
+        return encoded_element_size(self, value, check_keys, options, size);
+#endif
+    } else if (PyDateTime_Check(value)) {
+        *size = 8;
+        return 1;
+    }
+
+    mapping_type = _get_object(state->Mapping, "collections", "Mapping");
+    if (mapping_type && PyObject_IsInstance(value, mapping_type)) {
+        Py_DECREF(mapping_type);
+        /* PyObject_IsInstance returns -1 on error */
+        if (PyErr_Occurred()) {
+            return 0;
+        }
+        return dict_size(self, value, check_keys, options, 0, size);
+    }
+
+    uuid_type = _get_object(state->UUID, "uuid", "UUID");
+    if (uuid_type && PyObject_IsInstance(value, uuid_type)) {
+        Py_DECREF(uuid_type);
+        Py_XDECREF(mapping_type);
+        /* PyObject_IsInstance returns -1 on error */
+        if (PyErr_Occurred()) {
+            return 0;
+        }
+        *size = 4 + 1 + 16;
+        return 1;
+    }
+    Py_XDECREF(mapping_type);
+    Py_XDECREF(uuid_type);
+    /* Python 2 str, regular expressions, or a type we can't encode. */
+    return encoded_element_size(self, value, check_keys, options, size);
+}
+
+static int element_size(PyObject* self, PyObject* value,
+                        unsigned char check_keys,
+                        const codec_options_t* options, long long* size) {
+    int result;
+    if(Py_EnterRecursiveCall(" while encoding an object to BSON "))
+        return 0;
+    result = _element_size(self, value, check_keys, options, size);
+    Py_LeaveRecursiveCall();
+    return result;
+}
+
+/* Compute the size of `dict` encoded as a BSON document.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int dict_size(PyObject* self, PyObject* dict,
+                     unsigned char check_keys,
+                     const codec_options_t* options,
+                     unsigned char top_level, long long* size) {
+    PyObject* key;
+    PyObject* iter;
+    long long item_size;
+    long type_marker;
+
+    type_marker = _type_marker(dict);
+    if (type_marker < 0) {
+        return 0;
+    }
+    if (type_marker == 101) {
+        int result;
+        PyObject* raw = PyObject_GetAttrString(dict, "raw");
+        if (!raw) {
+            return 0;
+        }
+        result = raw_document_size(raw, size);
+        Py_DECREF(raw);
+        return result;
+    }
+
+    if (!check_mapping(self, dict)) {
+        return 0;
+    }
+
+    /* Length and terminating NUL byte. */
+    *size = 5;
+
+    /* _id is written first in a top level doc, see write_dict. */
+    if (top_level) {
+        if (PyDict_Check(dict)) {
+            PyObject* _id = PyDict_GetItemString(dict, "_id");
+            if (_id) {
+                if (!pair_size(self, "_id", 3, _id,
+                               check_keys, options, &item_size)) {
+                    return 0;
+                }
+                *size += item_size;
+            }
+        } else if (PyMapping_HasKeyString(dict, "_id")) {
+            PyObject* _id = PyMapping_GetItemString(dict, "_id");
+            if (!_id) {
+                return 0;
+            }
+            if (!pair_size(self, "_id", 3, _id,
+                           check_keys, options, &item_size)) {
+                Py_DECREF(_id);
+                return 0;
+            }
+            Py_DECREF(_id);
+            *size += item_size;
+        }
+    }
+
+    iter = PyObject_GetIter(dict);
+    if (iter == NULL) {
+        return 0;
+    }
+    while ((key = PyIter_Next(iter)) != NULL) {
+        PyObject* encoded;
+        const char* data;
+        int name_size;
+        PyObject* value = PyObject_GetItem(dict, key);
+        if (!value) {
+            PyErr_SetObject(PyExc_KeyError, key);
+            Py_DECREF(key);
+            Py_DECREF(iter);
+            return 0;
+        }
+        if (!encode_key(key, &encoded, &data, &name_size)) {
+            Py_DECREF(key);
+            Py_DECREF(value);
+            Py_DECREF(iter);
+            return 0;
+        }
+        Py_DECREF(key);
+        /* Skip _id in a top level doc, it was counted above. */
+        if (!top_level || strcmp(data, "_id") != 0) {
+            if (!pair_size(self, data, name_size - 1, value,
+                           check_keys, options, &item_size)) {
+                Py_DECREF(encoded);
+                Py_DECREF(value);
+                Py_DECREF(iter);
+                return 0;
+            }
+            *size += item_size;
+        }
+        Py_DECREF(encoded);
+        Py_DECREF(value);
+    }
+    Py_DECREF(iter);
+    if (PyErr_Occurred()) {
+        return 0;
+    }
+    return 1;
+}
+
+static PyObject* _cbson_encoded_size(PyObject* self, PyObject* args) {
+    PyObject* dict;
+    unsigned char check_keys;
+    unsigned char top_level = 1;
+    codec_options_t options;
+    long long size;
+    int result;
+
+    if (!PyArg_ParseTuple(args, "ObO&|b", &dict, &check_keys,
+                          convert_codec_options, &options, &top_level)) {
+        return NULL;
+    }
+    result = dict_size(self, dict, check_keys, &options, top_level, &size);
+    destroy_codec_options(&options);
+    if (!result) {
+        return NULL;
+    }
+    return PyLong_FromLongLong(size);
+}
+
+static PyObject* _cbson_dict_to_bson(PyObject* self, PyObject* args) {
+    PyObject* dict;
+    PyObject* result;
+    unsigned char check_keys;
+    unsigned char top_level = 1;
+    codec_options_t options;
+    buffer_t buffer;
+
+    if (!PyArg_ParseTuple(args, "ObO&|b", &dict, &check_keys,
+                          convert_codec_options, &options, &top_level)) {
+        return NULL;
+    }
+    buffer = buffer_new();
+    if (!buffer) {
+        destroy_codec_options(&options);
+        PyErr_NoMemory();
+        return NULL;
+    }
+
+    if (!write_dict(self, buffer, dict, check_keys, &options, top_level)) {
+        destroy_codec_options(&options);
+        buffer_free(buffer);
+        return NULL;
+    }
+
+    /* objectify buffer */
+#if PY_MAJOR_VERSION >= 3
+    result = Py_BuildValue("y#", buffer_get_buffer(buffer),
+                           buffer_get_position(buffer));
+#else
+    result = Py_BuildValue("s#", buffer_get_buffer(buffer),
+                           buffer_get_position(buffer));
+#endif
+    destroy_codec_options(&options);
+    buffer_free(buffer);
+    return result;
+}
+
+static PyObject* _cbson_element_to_bson(PyObject* self, PyObject* args) {
+    PyObject* key;
+    PyObject* value;
+    PyObject* result;
+    unsigned char check_keys;
+    codec_options_t options;
+    buffer_t buffer;
+
+    if (!PyArg_ParseTuple(args, "OObO&", &key, &value, &check_keys,
+                          convert_codec_options, &options)) {
+        return NULL;
+    }
+    buffer = buffer_new();
+    if (!buffer) {
+        destroy_codec_options(&options);
+        PyErr_NoMemory();
+        return NULL;
+    }
+
+    if (!decode_and_write_pair(self, buffer, key, value,
+                               check_keys, &options, 0)) {
+        destroy_codec_options(&options);
+        buffer_free(buffer);
+        return NULL;
+    }
+
+#if PY_MAJOR_VERSION >= 3
+    result = Py_BuildValue("y#", buffer_get_buffer(buffer),
+                           buffer_get_position(buffer));
+#else
+    result = Py_BuildValue("s#", buffer_get_buffer(buffer),
+                           buffer_get_position(buffer));
+#endif
+    destroy_codec_options(&options);
+    buffer_free(buffer);
+    return result;
+}
+
+/* Write a value of the type declared for it in a schema, whose type code
+ * is `tag`, without looking for a _type_marker or checking other types.
+ *
+ * Returns 1 on success, 0 with an exception set on failure, or -1 if the
+ * value must be written by write_element_to_buffer instead. */
+static int write_schema_value(buffer_t buffer, int type_byte,
+                              long tag, PyObject* value) {
+    switch (tag) {
+    case 0x01:
+        {
+            const double d = PyFloat_AsDouble(value);
+            *(buffer_get_buffer(buffer) + type_byte) = 0x01;
+            return buffer_write_bytes(buffer, (const char*)&d, 8);
+        }
+    case 0x02:
+        *(buffer_get_buffer(buffer) + type_byte) = 0x02;
+        return write_unicode(buffer, value);
+    case 0x08:
+        {
+            const char c = (value == Py_True) ? 0x01 : 0x00;
+            *(buffer_get_buffer(buffer) + type_byte) = 0x08;
+            return buffer_write_bytes(buffer, &c, 1);
+        }
+    case 0x10:
+        {
+#if PY_MAJOR_VERSION >= 3
+            const long long_value = PyLong_AsLong(value);
+#else
+            const long long_value = PyInt_AsLong(value);
+#endif
+            const int int_value = (int)long_value;
+            if (PyErr_Occurred() || long_value != int_value) {
+                /* Too big for an int32. */
+                PyErr_Clear();
+                return -1;
+            }
+            *(buffer_get_buffer(buffer) + type_byte) = 0x10;
+            return buffer_write_bytes(buffer, (const char*)&int_value, 4);
+        }
+    case 0x12:
+        {
+            const long long ll = PyLong_AsLongLong(value);
+            if (PyErr_Occurred()) { /* Overflow */
+                PyErr_SetString(PyExc_OverflowError,
+                                "MongoDB can only handle up to 8-byte ints");
+                return 0;
+            }
+            *(buffer_get_buffer(buffer) + type_byte) = 0x12;
+            return buffer_write_bytes(buffer, (const char*)&ll, 8);
+        }
+    }
+    return -1;
+}
+
+static void _set_missing_field(PyObject* key) {
+    PyObject* InvalidDocument = _error("InvalidDocument");
+    if (InvalidDocument) {
+#if PY_MAJOR_VERSION >= 3
+        PyErr_Format(InvalidDocument,
+                     "document is missing the field %R", key);
+#else
+        PyObject* repr = PyObject_Repr(key);
+        if (repr) {
+            PyErr_Format(InvalidDocument, "document is missing the field %s",
+                         PyString_AS_STRING(repr));
+            Py_DECREF(repr);
+        }
+#endif
+        Py_DECREF(InvalidDocument);
+    }
+}
+
+/* Encode a document with a plan compiled by bson.schema.Schema: a tuple
+ * with a (key, name, tag, declared_type, encoder) tuple for each field,
+ * where `name` is the encoded element name including its NUL byte. */
+static PyObject* _cbson_encode_schema(PyObject* self, PyObject* args) {
+    PyObject* plan;
+    PyObject* document;
+    PyObject* result;
+    unsigned char check_keys;
+    codec_options_t options;
+    buffer_t buffer;
+    Py_ssize_t count;
+    Py_ssize_t i;
+    Py_ssize_t document_size;
+    int length_location;
+    int length;
+    char zero = 0;
+
+    if (!PyArg_ParseTuple(args, "O!ObO&", &PyTuple_Type, &plan, &document,
+                          &check_keys, convert_codec_options, &options)) {
+        return NULL;
+    }
+    count = PyTuple_GET_SIZE(plan);
+    if ((document_size = PyObject_Size(document)) == -1) {
+        destroy_codec_options(&options);
+        return NULL;
+    }
+    if (document_size != count) {
+        PyObject* InvalidDocument = _error("InvalidDocument");
+        if (InvalidDocument) {
+            PyErr_Format(InvalidDocument,
+                         "document has %zd fields, the schema has %zd",
+                         document_size, count);
+            Py_DECREF(InvalidDocument);
+        }
+        destroy_codec_options(&options);
+        return NULL;
+    }
+    buffer = buffer_new();
+    if (!buffer) {
+        destroy_codec_options(&options);
+        PyErr_NoMemory();
+        return NULL;
+    }
+    length_location = buffer_save_space(buffer, 4);
+    if (length_location == -1) {
+        PyErr_NoMemory();
+        goto fail;
+    }
+
+    for (i = 0; i < count; i++) {
+        PyObject* field = PyTuple_GET_ITEM(plan, i);
+        PyObject* key = PyTuple_GET_ITEM(field, 0);
+        PyObject* name = PyTuple_GET_ITEM(field, 1);
+        PyObject* declared = PyTuple_GET_ITEM(field, 3);
+        PyObject* value;
+        int type_byte;
+        int status = -1;
+
+        if (PyDict_CheckExact(document)) {
+            value = PyDict_GetItem(document, key);
+            Py_XINCREF(value);
+        } else {
+            value = PyObject_GetItem(document, key);
+            if (!value && PyErr_ExceptionMatches(PyExc_KeyError)) {
+                PyErr_Clear();
+            }
+        }
+        if (!value) {
+            if (!PyErr_Occurred()) {
+                _set_missing_field(key);
+            }
+            goto fail;
+        }
+
+        type_byte = buffer_save_space(buffer, 1);
+        if (type_byte == -1) {
+            PyErr_NoMemory();
+            Py_DECREF(value);
+            goto fail;
+        }
+#if PY_MAJOR_VERSION >= 3
+        if (!buffer_write_bytes(buffer, PyBytes_AS_STRING(name),
+                                (int)PyBytes_GET_SIZE(name))) {
+#else
+        if (!buffer_write_bytes(buffer, PyString_AS_STRING(name),
+                                (int)PyString_GET_SIZE(name))) {
+#endif
+            Py_DECREF(value);
+            goto fail;
+        }
+        if ((PyObject*)Py_TYPE(value) == declared) {
+#if PY_MAJOR_VERSION >= 3
+            long tag = PyLong_AsLong(PyTuple_GET_ITEM(field, 2));
+#else
+            long tag = PyInt_AsLong(PyTuple_GET_ITEM(field, 2));
+#endif
+            status = write_schema_value(buffer, type_byte, tag, value);
+        }
+        if (status == -1) {
+            status = write_element_to_buffer(self, buffer, type_byte,
+                                             value, check_keys, &options);
+        }
+        Py_DECREF(value);
+        if (!status) {
+            goto fail;
+        }
+    }
+
+    if (!buffer_write_bytes(buffer, &zero, 1)) {
+        goto fail;
+    }
+    length = buffer_get_position(buffer);
+    memcpy(buffer_get_buffer(buffer) + length_location, &length, 4);
+
+#if PY_MAJOR_VERSION >= 3
+    result = Py_BuildValue("y#", buffer_get_buffer(buffer),
+                           buffer_get_position(buffer));
+#else
+    result = Py_BuildValue("s#", buffer_get_buffer(buffer),
+                           buffer_get_position(buffer));
+#endif
+    destroy_codec_options(&options);
+    buffer_free(buffer);
+    return result;
+
+fail:
+    destroy_codec_options(&options);
+    buffer_free(buffer);
+    return NULL;
+}
+
+static PyObject* _cbson_encode_many(PyObject* self, PyObject* args) {
+    PyObject* docs;
+    PyObject* iterator;
+    PyObject* doc;
+    PyObject* offsets;
+    PyObject* data;
+    unsigned char check_keys;
+    codec_options_t options;
+    buffer_t buffer;
+
+    if (!PyArg_ParseTuple(args, "ObO&", &docs, &check_keys,
+                          convert_codec_options, &options)) {
+        return NULL;
+    }
+    iterator = PyObject_GetIter(docs);
+    if (!iterator) {
+        destroy_codec_options(&options);
+        return NULL;
+    }
+    offsets = PyList_New(0);
+    if (!offsets) {
+        destroy_codec_options(&options);
+        Py_DECREF(iterator);
+        return NULL;
+    }
+    /* Every document is written to the same buffer. */
+    buffer = buffer_new();
+    if (!buffer) {
+        destroy_codec_options(&options);
+        Py_DECREF(iterator);
+        Py_DECREF(offsets);
+        PyErr_NoMemory();
+        return NULL;
+    }
+
+    while ((doc = PyIter_Next(iterator)) != NULL) {
+        PyObject* offset;
+        int start = buffer_get_position(buffer);
+
+        if (!write_dict(self, buffer, doc, check_keys, &options, 1)) {
+            Py_DECREF(doc);
+            goto fail;
+        }
+        Py_DECREF(doc);
+        offset = Py_BuildValue("ii", start,
+                               buffer_get_position(buffer) - start);
+        if (!offset) {
+            goto fail;
+        }
+        if (PyList_Append(offsets, offset) < 0) {
+            Py_DECREF(offset);
+            goto fail;
+        }
+        Py_DECREF(offset);
+    }
+    if (PyErr_Occurred()) {
+        goto fail;
+    }
+
+#if PY_MAJOR_VERSION >= 3
+    data = PyBytes_FromStringAndSize(buffer_get_buffer(buffer),
+                                     buffer_get_position(buffer));
+#else
+    data = PyString_FromStringAndSize(buffer_get_buffer(buffer),
+                                      buffer_get_position(buffer));
+#endif
+    destroy_codec_options(&options);
+    Py_DECREF(iterator);
+    buffer_free(buffer);
+    if (!data) {
+        Py_DECREF(offsets);
+        return NULL;
+    }
+    return Py_BuildValue("NN", data, offsets);
+
+fail:
+    destroy_codec_options(&options);
+    Py_DECREF(iterator);
+    Py_DECREF(offsets);
+    buffer_free(buffer);
+    return NULL;
+}
+
+/* Create an instance of options->document_class, a RawBSONDocument type,
+ * from the `size` bytes of a BSON document starting at `buffer`.
+ *
+ * Returns a new reference or NULL on failure. */
+static PyObject* _raw_document(const char* buffer, unsigned size,
+                               const codec_options_t* options) {
+#if PY_MAJOR_VERSION >= 3
+    return PyObject_CallFunction(options->document_class, "y#O",
+                                 buffer, size, options->options_obj);
+#else
+    return PyObject_CallFunction(options->document_class, "s#O",
+                                 buffer, size, options->options_obj);
+#endif
+}
+
+/* Compute the length of the BSON value of type `type` that begins at
+ * `buffer + position`, without decoding it. `max` is the number of bytes
+ * available for the value.
+ *
+ * Returns the length, or -1 if the type is unknown or the value does not
+ * fit in `max` bytes. Does not set an exception. */
+static int _value_length(const char* buffer, unsigned position,
+                         unsigned char type, unsigned max) {
+    unsigned length;
+    switch (type) {
+    case 1:
+    case 9:
+    case 17:
+    case 18:
+        length = 8;
+        break;
+    case 2:
+    case 13:
+    case 14:
+        if (max < 4) {
+            return -1;
+        }
+        memcpy(&length, buffer + position, 4);
+        /* Encoded string length + string */
+        if (!length || length > BSON_MAX_SIZE - 4) {
+            return -1;
+        }
+        length += 4;
+        break;
+    case 3:
+    case 4:
+    case 15:
+        if (max < 4) {
+            return -1;
+        }
+        memcpy(&length, buffer + position, 4);
+        if (length < BSON_MIN_SIZE || length > BSON_MAX_SIZE) {
+            return -1;
+        }
+        break;
+    case 5:
+        if (max < 5) {
+            return -1;
+        }
+        memcpy(&length, buffer + position, 4);
+        /* Binary length + subtype + data */
+        if (length > BSON_MAX_SIZE - 5) {
+            return -1;
+        }
+        length += 5;
+        break;
+    case 6:
+    case 10:
+    case 127:
+    case 255:
+        length = 0;
+        break;
+    case 7:
+        length = 12;
+        break;
+    case 8:
+        length = 1;
+        break;
+    case 11:
+        {
+            /* Pattern and flags are both C strings. */
+            const char* pattern_end;
+            const char* flags_end;
+            pattern_end = memchr(buffer + position, 0, max);
+            if (!pattern_end) {
+                return -1;
+            }
+            flags_end = memchr(pattern_end + 1, 0,
+                               max - (pattern_end + 1 - (buffer + position)));
+            if (!flags_end) {
+                return -1;
+            }
+            length = (unsigned)(flags_end + 1 - (buffer + position));
+            break;
+        }
+    case 12:
+        if (max < 4) {
+            return -1;
+        }
+        memcpy(&length, buffer + position, 4);
+        /* Encoded string length + string + 12 byte ObjectId */
+        if (!length || length > BSON_MAX_SIZE - 16) {
+            return -1;
+        }
+        length += 16;
+        break;
+    case 16:
+        length = 4;
+        break;
+    default:
+        return -1;
+    }
+    if (length > max) {
+        return -1;
+    }
+    return (int)length;
+}
+
+static PyObject* get_value(PyObject* self, const char* buffer,
+                           unsigned* position, unsigned char type,
+                           unsigned max, const codec_options_t* options) {
+    struct module_state *state = GETSTATE(self);
+
+    PyObject* value = NULL;
+    switch (type) {
+    case 1:
+        {
+            double d;
+            if (max < 8) {
+                goto invalid;
+            }
+            memcpy(&d, buffer + *position, 8);
+            value = PyFloat_FromDouble(d);
+            *position += 8;
+            break;
+        }
+    case 2:
+    case 14:
+        {
+            unsigned value_length;
+            if (max < 4) {
+                goto invalid;
+            }
+            memcpy(&value_length, buffer + *position, 4);
+            /* Encoded string length + string */
+            if (!value_length || max < value_length || max < 4 + value_length) {
+                goto invalid;
+            }
+            *position += 4;
+            /* Strings must end in \0 */
+            if (buffer[*position + value_length - 1]) {
+                goto invalid;
+            }
+            value = PyUnicode_DecodeUTF8(
+                buffer + *position, value_length - 1,
+                options->unicode_decode_error_handler);
+            if (!value) {
+                goto invalid;
+            }
+            *position += value_length;
+            break;
+        }
+    case 3:
+        {
+            PyObject* collection;
+            unsigned size;
+            if (max < 4) {
+                goto invalid;
+            }
+            memcpy(&size, buffer + *position, 4);
+            if (size < BSON_MIN_SIZE || max < size) {
+                goto invalid;
+            }
+            /* Check for bad eoo */
+            if (buffer[*position + size - 1]) {
+                goto invalid;
+            }
+
+            if (options->is_raw_bson) {
+                value = _raw_document(buffer + *position, size, options);
+                if (!value) {
+                    goto invalid;
+                }
+                *position += size;
+                break;
+            }
+
+            value = elements_to_dict(self, buffer + *position + 4,
+                                     size - 5, options);
+            if (!value) {
+                goto invalid;
+            }
+
+            /* Decoding for DBRefs */
+            if (PyMapping_HasKeyString(value, "$ref")) { /* DBRef */
+                PyObject* dbref = NULL;
+                PyObject* dbref_type;
+                PyObject* id;
+                PyObject* database;
+
+                collection = PyMapping_GetItemString(value, "$ref");
+                /* PyMapping_GetItemString returns NULL to indicate error. */
+                if (!collection) {
+                    goto invalid;
+                }
+                PyMapping_DelItemString(value, "$ref");
+
+                if (PyMapping_HasKeyString(value, "$id")) {
+                    id = PyMapping_GetItemString(value, "$id");
+                    if (!id) {
+                        Py_DECREF(collection);
+                        goto invalid;
+                    }
+                    PyMapping_DelItemString(value, "$id");
+                } else {
+                    id = Py_None;
+                    Py_INCREF(id);
+                }
+
+                if (PyMapping_HasKeyString(value, "$db")) {
+                    database = PyMapping_GetItemString(value, "$db");
+                    if (!database) {
+                        Py_DECREF(collection);
+                        Py_DECREF(id);
+                        goto invalid;
+                    }
+                    PyMapping_DelItemString(value, "$db");
+                } else {
+                    database = Py_None;
+                    Py_INCREF(database);
+                }
+
+                if ((dbref_type = _get_object(state->DBRef, "bson.dbref", "DBRef"))) {
+                    dbref = PyObject_CallFunctionObjArgs(dbref_type, collection, id, database, value, NULL);
+                    Py_DECREF(dbref_type);
+                }
+                Py_DECREF(value);
+                value = dbref;
+
+                Py_DECREF(id);
+                Py_DECREF(collection);
+                Py_DECREF(database);
+            }
+
+            *position += size;
+            break;
+        }
+    case 4:
+        {
+            unsigned size, end;
+
+            if (max < 4) {
+                goto invalid;
+            }
+            memcpy(&size, buffer + *position, 4);
+            if (size < BSON_MIN_SIZE || max < size) {
+                goto invalid;
+            }
+            end = *position + size - 1;
+            /* Check for bad eoo */
+            if (buffer[end]) {
+                goto invalid;
+            }
+            *position += 4;
+
+            value = PyList_New(0);
+            if (!value) {
+                goto invalid;
+            }
+            while (*position < end) {
+                PyObject* to_append;
+
+                unsigned char bson_type = (unsigned char)buffer[(*position)++];
+
+                size_t key_size = strlen(buffer + *position);
+                if (max < key_size) {
+                    Py_DECREF(value);
+                    goto invalid;
+                }
+                /* just skip the key, they're in order. */
+                *position += (unsigned)key_size + 1;
+                if (Py_EnterRecursiveCall(" while decoding a list value")) {
+                    Py_DECREF(value);
+                    goto invalid;
+                }
+                to_append = get_value(self, buffer, position, bson_type,
+                                      max - (unsigned)key_size, options);
+                Py_LeaveRecursiveCall();
+                if (!to_append) {
+                    Py_DECREF(value);
+                    goto invalid;
+                }
+                PyList_Append(value, to_append);
+                Py_DECREF(to_append);
+            }
+            (*position)++;
+            break;
+        }
+    case 5:
+        {
+            PyObject* data;
+            PyObject* st;
+            PyObject* type_to_create;
+            unsigned length;
+            unsigned char subtype;
+
+            if (max < 5) {
+                goto invalid;
+            }
+            memcpy(&length, buffer + *position, 4);
+            if (max < length) {
+                goto invalid;
+            }
+
+            subtype = (unsigned char)buffer[*position + 4];
+            *position += 5;
+            if (subtype == 2 && length < 4) {
+                goto invalid;
+            }
+            if (subtype == 0 && options->source_view) {
+                /* A slice of the data being decoded, without copying. */
+                Py_ssize_t start = buffer + *position - options->source_start;
+                value = PySequence_GetSlice(options->source_view,
+                                            start, start + length);
+                *position += length;
+                break;
+            }
+#if PY_MAJOR_VERSION >= 3
+            /* Python3 special case. Decode BSON binary subtype 0 to bytes. */
+            if (subtype == 0) {
+                value = PyBytes_FromStringAndSize(buffer + *position, length);
+                *position += length;
+                break;
+            }
+            if (subtype == 2) {
+                data = PyBytes_FromStringAndSize(buffer + *position + 4, length - 4);
+            } else {
+                data = PyBytes_FromStringAndSize(buffer + *position, length);
+            }
+#else
+            if (subtype == 2) {
+                data = PyString_FromStringAndSize(buffer + *position + 4, length - 4);
+            } else {
+                data = PyString_FromStringAndSize(buffer + *position, length);
+            }
+#endif
+            if (!data) {
+                goto invalid;
+            }
+            /* Encode as UUID, not Binary */
+            if (subtype == 3 || subtype == 4) {
+                PyObject* kwargs;
+                PyObject* args = PyTuple_New(0);
+                /* UUID should always be 16 bytes */
+                if (!args || length != 16) {
+                    Py_DECREF(data);
+                    goto invalid;
+                }
+                kwargs = PyDict_New();
+                if (!kwargs) {
+                    Py_DECREF(data);
+                    Py_DECREF(args);
+                    goto invalid;
+                }
+
+                /*
+                 * From this point, we hold refs to args, kwargs, and data.
+                 * If anything fails, goto uuiderror to clean them up.
+                 */
+                if (options->uuid_rep == CSHARP_LEGACY) {
+                    /* Legacy C# byte order */
+                    if ((PyDict_SetItemString(kwargs, "bytes_le", data)) == -1)
+                        goto uuiderror;
+                }
+                else {
+                    if (options->uuid_rep == JAVA_LEGACY) {
+                        /* Convert from legacy java byte order */
+                        char big_endian[16];
+                        _fix_java(buffer + *position, big_endian);
+                        /* Free the previously created PyString object */
+                        Py_DECREF(data);
+#if PY_MAJOR_VERSION >= 3
+                        data = PyBytes_FromStringAndSize(big_endian, length);
+#else
+                        data = PyString_FromStringAndSize(big_endian, length);
+#endif
+                        if (data == NULL)
+                            goto uuiderror;
+                    }
+                    if ((PyDict_SetItemString(kwargs, "bytes", data)) == -1)
+                        goto uuiderror;
+                
+                }
+                if ((type_to_create = _get_object(state->UUID, "uuid", "UUID"))) {
+                    value = PyObject_Call(type_to_create, args, kwargs);
+                    Py_DECREF(type_to_create);
+                }
+
+                Py_DECREF(args);
+                Py_DECREF(kwargs);
+                Py_DECREF(data);
+                if (!value) {
+                    goto invalid;
+                }
+
+                *position += length;
+                break;
+
+            uuiderror:
+                Py_DECREF(args);
+                Py_DECREF(kwargs);
+                Py_XDECREF(data);
+                goto invalid;
+            }
+
+#if PY_MAJOR_VERSION >= 3
+            st = PyLong_FromLong(subtype);
+#else
+            st = PyInt_FromLong(subtype);
+#endif
+            if (!st) {
+                Py_DECREF(data);
+                goto invalid;
+            }
+            if ((type_to_create = _get_object(state->Binary, "bson.binary", "Binary"))) {
+                value = PyObject_CallFunctionObjArgs(type_to_create, data, st, NULL);
+                Py_DECREF(type_to_create);
+            }
+            Py_DECREF(st);
+            Py_DECREF(data);
+            if (!value) {
+                goto invalid;
+            }
+            *position += length;
+            break;
+        }
+    case 6:
+    case 10:
+        {
+            value = Py_None;
+            Py_INCREF(value);
+            break;
+        }
+    case 7:
+        {
+            PyObject* objectid_type;
+            if (max < 12) {
+                goto invalid;
+            }
+            if ((objectid_type = _get_object(state->ObjectId, "bson.objectid", "ObjectId"))) {
+#if PY_MAJOR_VERSION >= 3
+                value = PyObject_CallFunction(objectid_type, "y#", buffer + *position, 12);
+#else
+                value = PyObject_CallFunction(objectid_type, "s#", buffer + *position, 12);
+#endif
+                Py_DECREF(objectid_type);
+            }
+            *position += 12;
+            break;
+        }
+    case 8:
+        {
+            value = buffer[(*position)++] ? Py_True : Py_False;
+            Py_INCREF(value);
+            break;
+        }
+    case 9:
+        {
+            PyObject* tzinfo;
+            long long millis;
+            if (max < 8) {
+                goto invalid;
+            }
+            memcpy(&millis, buffer + *position, 8);
+            *position += 8;
+            if (options->datetime_ms) {
+                PyObject* datetime_ms_type = _get_object(
+                    state->DatetimeMS, "bson.datetime_ms", "DatetimeMS");
+                if (!datetime_ms_type) {
+                    goto invalid;
+                }
+                value = PyObject_CallFunction(datetime_ms_type, "L", millis);
+                Py_DECREF(datetime_ms_type);
+                break;
+            }
+            if (!options->tz_aware) { /* In the naive case, we're done here. */
+                value = datetime_from_millis(millis, Py_None);
+                break;
+            }
+
+            tzinfo = _get_object(state->UTC, "bson.tz_util", "utc");
+            if (!tzinfo) {
+                goto invalid;
+            }
+            /* Create the datetime in its final timezone and let
+             * tzinfo.fromutc shift it, which is all astimezone does once
+             * the datetime is in UTC. */
+            if (options->tzinfo != Py_None && options->tzinfo != tzinfo) {
+                Py_DECREF(tzinfo);
+                value = datetime_from_millis(millis, options->tzinfo);
+                if (value) {
+                    PyObject* local = PyObject_CallMethod(
+                        options->tzinfo, "fromutc", "O", value);
+                    Py_DECREF(value);
+                    value = local;
+                }
+                break;
+            }
+            value = datetime_from_millis(millis, tzinfo);
+            Py_DECREF(tzinfo);
+            break;
+        }
+    case 11:
+        {
+            PyObject* regex_class;
+            PyObject* pattern;
+            int flags;
+            size_t flags_length, i;
+            size_t pattern_length = strlen(buffer + *position);
+            if (pattern_length > BSON_MAX_SIZE || max < pattern_length) {
+                goto invalid;
+            }
+            pattern = PyUnicode_DecodeUTF8(
+                buffer + *position, pattern_length,
+                options->unicode_decode_error_handler);
+            if (!pattern) {
+                goto invalid;
+            }
+            *position += (unsigned)pattern_length + 1;
+            flags_length = strlen(buffer + *position);
+            if (flags_length > BSON_MAX_SIZE ||
+                    (BSON_MAX_SIZE - pattern_length) < flags_length) {
+                Py_DECREF(pattern);
+                goto invalid;
+            }
+            if (max < pattern_length + flags_length) {
+                Py_DECREF(pattern);
+                goto invalid;
+            }
+            flags = 0;
+            for (i = 0; i < flags_length; i++) {
+                if (buffer[*position + i] == 'i') {
+                    flags |= 2;
+                } else if (buffer[*position + i] == 'l') {
+                    flags |= 4;
+                } else if (buffer[*position + i] == 'm') {
+                    flags |= 8;
+                } else if (buffer[*position + i] == 's') {
+                    flags |= 16;
+                } else if (buffer[*position + i] == 'u') {
+                    flags |= 32;
+                } else if (buffer[*position + i] == 'x') {
+                    flags |= 64;
+                }
+            }
+            *position += (unsigned)flags_length + 1;
+
+            regex_class = _get_object(state->Regex, "bson.regex", "Regex");
+            if (regex_class) {
+                value = PyObject_CallFunction(regex_class,
+                                              "Oi", pattern, flags);
+                Py_DECREF(regex_class);
+            }
+            Py_DECREF(pattern);
+            break;
+        }
+    case 12:
+        {
+            unsigned coll_length;
+            PyObject* collection;
+            PyObject* id = NULL;
+            PyObject* objectid_type;
+            PyObject* dbref_type;
+
+            if (max < 4) {
+                goto invalid;
+            }
+            memcpy(&coll_length, buffer + *position, 4);
+            /* Encoded string length + string + 12 byte ObjectId */
+            if (!coll_length || max < coll_length || max < 4 + coll_length + 12) {
+                goto invalid;
+            }
+            *position += 4;
+            /* Strings must end in \0 */
+            if (buffer[*position + coll_length - 1]) {
+                goto invalid;
+            }
+
+            collection = PyUnicode_DecodeUTF8(
+                buffer + *position, coll_length - 1,
+                options->unicode_decode_error_handler);
+            if (!collection) {
+                goto invalid;
+            }
+            *position += coll_length;
+
+            if ((objectid_type = _get_object(state->ObjectId, "bson.objectid", "ObjectId"))) {
+#if PY_MAJOR_VERSION >= 3
+                id = PyObject_CallFunction(objectid_type, "y#", buffer + *position, 12);
+#else
+                id = PyObject_CallFunction(objectid_type, "s#", buffer + *position, 12);
+#endif
+                Py_DECREF(objectid_type);
+            }
+            if (!id) {
+                Py_DECREF(collection);
+                goto invalid;
+            }
+            *position += 12;
+            if ((dbref_type = _get_object(state->DBRef, "bson.dbref", "DBRef"))) {
+                value = PyObject_CallFunctionObjArgs(dbref_type, collection, id, NULL);
+                Py_DECREF(dbref_type);
+            }
+            Py_DECREF(collection);
+            Py_DECREF(id);
+            break;
+        }
+    case 13:
+        {
+            PyObject* code;
+            PyObject* code_type;
+            unsigned value_length;
+            if (max < 4) {
+                goto invalid;
+            }
+            memcpy(&value_length, buffer + *position, 4);
+            /* Encoded string length + string */
+            if (!value_length || max < value_length || max < 4 + value_length) {
+                goto invalid;
+            }
+            *position += 4;
+            /* Strings must end in \0 */
+            if (buffer[*position + value_length - 1]) {
+                goto invalid;
+            }
+            code = PyUnicode_DecodeUTF8(
+                buffer + *position, value_length - 1,
+                options->unicode_decode_error_handler);
+            if (!code) {
+                goto invalid;
+            }
+            *position += value_length;
+            if ((code_type = _get_object(state->Code, "bson.code", "Code"))) {
+                value = PyObject_CallFunctionObjArgs(code_type, code, NULL, NULL);
+                Py_DECREF(code_type);
+            }
+            Py_DECREF(code);
+            break;
+        }
+    case 15:
+        {
+            unsigned c_w_s_size;
+            unsigned code_size;
+            unsigned scope_size;
+            PyObject* code;
+            PyObject* scope;
+            PyObject* code_type;
+
+            if (max < 8) {
+                goto invalid;
+            }
+
+            memcpy(&c_w_s_size, buffer + *position, 4);
+            *position += 4;
+
+            if (max < c_w_s_size) {
+                goto invalid;
+            }
+
+            memcpy(&code_size, buffer + *position, 4);
+            /* code_w_scope length + code length + code + scope length */
+            if (!code_size || max < code_size || max < 4 + 4 + code_size + 4) {
+                goto invalid;
+            }
+            *position += 4;
+            /* Strings must end in \0 */
+            if (buffer[*position + code_size - 1]) {
+                goto invalid;
+            }
+            code = PyUnicode_DecodeUTF8(
+                buffer + *position, code_size - 1,
+                options->unicode_decode_error_handler);
+            if (!code) {
+                goto invalid;
+            }
+            *position += code_size;
+
+            memcpy(&scope_size, buffer + *position, 4);
+            if (scope_size < BSON_MIN_SIZE) {
+                Py_DECREF(code);
+                goto invalid;
+            }
+            /* code length + code + scope length + scope */
+            if ((4 + code_size + 4 + scope_size) != c_w_s_size) {
+                Py_DECREF(code);
+                goto invalid;
+            }
+
+            /* Check for bad eoo */
+            if (buffer[*position + scope_size - 1]) {
+                goto invalid;
+            }
+            if (options->is_raw_bson) {
+                scope = _raw_document(buffer + *position, scope_size, options);
+            } else {
+                /* Always decode the whole scope. */
+                codec_options_t scope_options = *options;
+                scope_options.fields = NULL;
+                scope = elements_to_dict(self, buffer + *position + 4,
+                                         scope_size - 5, &scope_options);
+            }
+            if (!scope) {
+                Py_DECREF(code);
+                goto invalid;
+            }
+            *position += scope_size;
+
+            if ((code_type = _get_object(state->Code, "bson.code", "Code"))) {
+                value = PyObject_CallFunctionObjArgs(code_type, code, scope, NULL);
+                Py_DECREF(code_type);
+            }
+            Py_DECREF(code);
+            Py_DECREF(scope);
+            break;
+        }
+    case 16:
+        {
+            int i;
+            if (max < 4) {
+                goto invalid;
+            }
+            memcpy(&i, buffer + *position, 4);
+#if PY_MAJOR_VERSION >= 3
+            value = PyLong_FromLong(i);
+#else
+            value = PyInt_FromLong(i);
+#endif
+            if (!value) {
+                goto invalid;
+            }
+            *position += 4;
+            break;
+        }
+    case 17:
+        {
+            unsigned int time, inc;
+            PyObject* timestamp_type;
+            if (max < 8) {
+                goto invalid;
+            }
+            memcpy(&inc, buffer + *position, 4);
+            memcpy(&time, buffer + *position + 4, 4);
+            if ((timestamp_type = _get_object(state->Timestamp, "bson.timestamp", "Timestamp"))) {
+                value = PyObject_CallFunction(timestamp_type, "II", time, inc);
+                Py_DECREF(timestamp_type);
+            }
+            *position += 8;
+            break;
+        }
+    case 18:
+        {
+            long long ll;
+            PyObject* bson_int64_type = _get_object(state->BSONInt64,
+                                                    "bson.int64", "Int64");
+            if (!bson_int64_type)
+                goto invalid;
+            if (max < 8) {
+                Py_DECREF(bson_int64_type);
+                goto invalid;
+            }
+            memcpy(&ll, buffer + *position, 8);
+            value = PyObject_CallFunction(bson_int64_type, "L", ll);
+            *position += 8;
+            Py_DECREF(bson_int64_type);
+            break;
+        }
+    case 255:
+        {
+            PyObject* minkey_type = _get_object(state->MinKey, "bson.min_key", "MinKey");
+            if (!minkey_type)
+                goto invalid;
+            value = PyObject_CallFunctionObjArgs(minkey_type, NULL);
+            Py_DECREF(minkey_type);
+            break;
+        }
+    case 127:
+        {
+            PyObject* maxkey_type = _get_object(state->MaxKey, "bson.max_key", "MaxKey");
+            if (!maxkey_type)
+                goto invalid;
+            value = PyObject_CallFunctionObjArgs(maxkey_type, NULL);
+            Py_DECREF(maxkey_type);
+            break;
+        }
+    default:
+        {
+            PyObject* InvalidDocument = _error("InvalidDocument");
+            if (InvalidDocument) {
+                PyErr_SetString(InvalidDocument,
+                                "no c decoder for this type yet");
+                Py_DECREF(InvalidDocument);
+            }
+            goto invalid;
+        }
+    }
+
+    if (value) {
+        return value;
+    }
+
+    invalid:
+
+    /*
+     * Wrap any non-InvalidBSON errors in InvalidBSON.
+     */
+    if (PyErr_Occurred()) {
+        PyObject *etype, *evalue, *etrace;
+        PyObject *InvalidBSON;
+
+        /*
+         * Calling _error clears the error state, so fetch it first.
+         */
+        PyErr_Fetch(&etype, &evalue, &etrace);
+        InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            if (!PyErr_GivenExceptionMatches(etype, InvalidBSON)) {
+                /*
+                 * Raise InvalidBSON(str(e)).
+                 */
+                Py_DECREF(etype);
+                etype = InvalidBSON;
+
+                if (evalue) {
+                    PyObject *msg = PyObject_Str(evalue);
+                    Py_DECREF(evalue);
+                    evalue = msg;
+                }
+                PyErr_NormalizeException(&etype, &evalue, &etrace);
+            } else {
+                /*
+                 * The current exception matches InvalidBSON, so we don't need
+                 * this reference after all.
+                 */
+                Py_DECREF(InvalidBSON);
+            }
+        }
+        /* Steals references to args. */
+        PyErr_Restore(etype, evalue, etrace);
+    } else {
+        PyObject *InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetString(InvalidBSON, "invalid length or type code");
+            Py_DECREF(InvalidBSON);
+        }
+    }
+    return NULL;
+}
+
+/* Decode the BSON element name of `name_length` bytes at `string`.
+ *
+ * The same few names usually appear in every document of a batch, and in
+ * every batch of a query, so short ASCII names are cached in a fixed size
+ * table in the module state, indexed by a hash of their bytes. A name
+ * replaces whichever name was cached in its slot before, so the cache is
+ * bounded and keeps the names that were decoded most recently. Decoding an
+ * ASCII name doesn't depend on the unicode_decode_error_handler option.
+ *
+ * Returns a new reference, or NULL with InvalidBSON set on failure. */
+static PyObject* _decode_element_name(PyObject* self, const char* string,
+                                      size_t name_length,
+                                      const codec_options_t* options) {
+    struct key_cache_entry* entry = NULL;
+    PyObject* name;
+
+    if (name_length <= KEY_CACHE_MAX_LENGTH) {
+        /* FNV-1a */
+        unsigned long hash = 2166136261UL;
+        unsigned char non_ascii = 0;
+        size_t i;
+        for (i = 0; i < name_length; i++) {
+            unsigned char c = (unsigned char)string[i];
+            non_ascii |= c;
+            hash = ((hash ^ c) * 16777619UL) & 0xffffffffUL;
+        }
+        if (!(non_ascii & 0x80)) {
+            entry = &GETSTATE(self)->key_cache[hash & (KEY_CACHE_SIZE - 1)];
+            if (entry->key && entry->length == name_length &&
+                    !memcmp(entry->bytes, string, name_length)) {
+                Py_INCREF(entry->key);
+                return entry->key;
+            }
+        }
+    }
+
+    name = PyUnicode_DecodeUTF8(
+        string, name_length, options->unicode_decode_error_handler);
+    if (name && entry) {
+        Py_XDECREF(entry->key);
+        Py_INCREF(name);
+        entry->key = name;
+        entry->length = name_length;
+        memcpy(entry->bytes, string, name_length);
+    }
+    if (!name) {
+        /* If NULL is returned then wrap the UnicodeDecodeError
+           in an InvalidBSON error */
+        PyObject *etype, *evalue, *etrace;
+        PyObject *InvalidBSON;
+
+        PyErr_Fetch(&etype, &evalue, &etrace);
+        InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            Py_DECREF(etype);
+            etype = InvalidBSON;
+
+            if (evalue) {
+                PyObject *msg = PyObject_Str(evalue);
+                Py_DECREF(evalue);
+                evalue = msg;
+            }
+            PyErr_NormalizeException(&etype, &evalue, &etrace);
+        }
+        PyErr_Restore(etype, evalue, etrace);
+    }
+    return name;
+}
+
+/* Read the name of the element at `string + position`, which must end
+ * before `max`.
+ *
+ * Returns the length of the name, or -1 with InvalidBSON set on failure. */
+static int _element_name_length(const char* string, unsigned position,
+                                unsigned max) {
+    size_t name_length = strlen(string + position);
+    if (name_length > BSON_MAX_SIZE || position + name_length >= max) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetNone(InvalidBSON);
+            Py_DECREF(InvalidBSON);
+        }
+        return -1;
+    }
+    return (int)name_length;
+}
+
+/* Decode the element at `string + position`. The enclosing document's
+ * terminating NUL byte is at `string + max`.
+ *
+ * On success stores new references in `name` and `value` and returns the
+ * position after the element. Returns -1 on failure. */
+static int _element_to_dict(PyObject* self, const char* string,
+                            unsigned position, unsigned max,
+                            const codec_options_t* options,
+                            PyObject** name, PyObject** value) {
+    unsigned char type = (unsigned char)string[position++];
+    int name_length = _element_name_length(string, position, max);
+    if (name_length < 0) {
+        return -1;
+    }
+    *name = _decode_element_name(self, string + position, name_length,
+                                 options);
+    if (!*name) {
+        return -1;
+    }
+    position += (unsigned)name_length + 1;
+    *value = get_value(self, string, &position, type,
+                       max - position, options);
+    if (!*value) {
+        Py_DECREF(*name);
+        return -1;
+    }
+    return (int)position;
+}
+
+/* Like _element_to_dict, but only decode the element if its name is in
+ * options->fields. Other elements are skipped over by their length, and
+ * their `name` and `value` are set to NULL. */
+static int _projected_element_to_dict(PyObject* self, const char* string,
+                                      unsigned position, unsigned max,
+                                      const codec_options_t* options,
+                                      PyObject** name, PyObject** value) {
+    codec_options_t field_options;
+    PyObject* field;
+    unsigned char type = (unsigned char)string[position++];
+    int name_length = _element_name_length(string, position, max);
+    if (name_length < 0) {
+        return -1;
+    }
+    *name = _decode_element_name(self, string + position, name_length,
+                                 options);
+    if (!*name) {
+        return -1;
+    }
+    position += (unsigned)name_length + 1;
+
+    field = PyDict_GetItem(options->fields, *name);
+    if (!field) {
+        int value_length = _value_length(string, position, type,
+                                         max - position);
+        Py_CLEAR(*name);
+        *value = NULL;
+        if (value_length < 0) {
+            PyObject* InvalidBSON = _error("InvalidBSON");
+            if (InvalidBSON) {
+                PyErr_SetString(InvalidBSON, "invalid length or type code");
+                Py_DECREF(InvalidBSON);
+            }
+            return -1;
+        }
+        return (int)(position + (unsigned)value_length);
+    }
+
+    /* Decode embedded documents with the subtree of fields selected
+     * beneath this one. The subtree is borrowed from options->fields. */
+    field_options = *options;
+    field_options.fields = (field == Py_None) ? NULL : field;
+    *value = get_value(self, string, &position, type,
+                       max - position, &field_options);
+    if (!*value) {
+        Py_CLEAR(*name);
+        return -1;
+    }
+    return (int)position;
+}
+
+static PyObject* _elements_to_dict(PyObject* self, const char* string,
+                                   unsigned max,
+                                   const codec_options_t* options) {
+    unsigned position = 0;
+    PyObject* dict = PyObject_CallObject(options->document_class, NULL);
+    if (!dict) {
+        return NULL;
+    }
+    while (position < max) {
+        PyObject* name;
+        PyObject* value;
+        int new_position;
+        if (options->fields) {
+            new_position = _projected_element_to_dict(
+                self, string, position, max, options, &name, &value);
+        } else {
+            new_position = _element_to_dict(self, string, position, max,
+                                            options, &name, &value);
+        }
+        if (new_position < 0) {
+            Py_DECREF(dict);
+            return NULL;
+        }
+        position = (unsigned)new_position;
+        if (!name) {
+            /* Not selected by options->fields. */
+            continue;
+        }
+
+        PyObject_SetItem(dict, name, value);
+        Py_DECREF(name);
+        Py_DECREF(value);
+    }
+    return dict;
+}
+
+static PyObject* elements_to_dict(PyObject* self, const char* string,
+                                  unsigned max,
+                                  const codec_options_t* options) {
+    PyObject* result;
+    if (Py_EnterRecursiveCall(" while decoding a BSON document"))
+        return NULL;
+    result = _elements_to_dict(self, string, max, options);
+    Py_LeaveRecursiveCall();
+    return result;
+}
+
+/* Get a read-only view of `bson`, which may be any object supporting the
+ * buffer protocol: bytes, bytearray, memoryview, mmap, etc.
+ *
+ * Returns 1 on success; the caller must release the view with
+ * PyBuffer_Release. Returns 0 with TypeError set on failure. */
+static int _get_buffer(PyObject* bson, Py_buffer* view,
+                       const char* function_name) {
+    if (PyObject_GetBuffer(bson, view, PyBUF_SIMPLE) == -1) {
+        PyErr_Clear();
+        PyErr_Format(PyExc_TypeError,
+                     "argument to %s must be bytes or another object "
+                     "supporting the buffer protocol", function_name);
+        return 0;
+    }
+    return 1;
+}
+
+static PyObject* _cbson_bson_to_dict(PyObject* self, PyObject* args) {
+    int size;
+    Py_ssize_t total_size;
+    const char* string;
+    PyObject* bson;
+    Py_buffer view;
+    codec_options_t options;
+    PyObject* result;
+
+    if (!PyArg_ParseTuple(
+            args, "OO&", &bson, convert_codec_options, &options)) {
+        return NULL;
+    }
+
+    if (!_get_buffer(bson, &view, "_bson_to_dict")) {
+        destroy_codec_options(&options);
         return NULL;
     }
+    total_size = view.len;
+    string = (const char*)view.buf;
+    if (!set_decode_source(&options, bson, string)) {
+        goto done;
+    }
+
+    if (total_size < BSON_MIN_SIZE) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetString(InvalidBSON,
+                            "not enough data for a BSON document");
+            Py_DECREF(InvalidBSON);
+        }
+        goto done;
+    }
+
+    memcpy(&size, string, 4);
+    if (size < BSON_MIN_SIZE) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetString(InvalidBSON, "invalid message size");
+            Py_DECREF(InvalidBSON);
+        }
+        goto done;
+    }
+
+    if (total_size < size || total_size > BSON_MAX_SIZE) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetString(InvalidBSON, "objsize too large");
+            Py_DECREF(InvalidBSON);
+        }
+        goto done;
+    }
+
+    if (size != total_size || string[size - 1]) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetString(InvalidBSON, "bad eoo");
+            Py_DECREF(InvalidBSON);
+        }
+        goto done;
+    }
 
-    /* objectify buffer */
+    /* No need to decode fields if using RawBSONDocument */
+    if (options.is_raw_bson) {
 #if PY_MAJOR_VERSION >= 3
-    result = Py_BuildValue("y#", buffer_get_buffer(buffer),
-                           buffer_get_position(buffer));
+        if (PyBytes_Check(bson)) {
 #else
-    result = Py_BuildValue("s#", buffer_get_buffer(buffer),
-                           buffer_get_position(buffer));
+        if (PyString_Check(bson)) {
 #endif
+            result = PyObject_CallFunctionObjArgs(
+                options.document_class, bson, options.options_obj, NULL);
+        } else {
+            result = _raw_document(string, (unsigned)size, &options);
+        }
+    } else {
+        result = elements_to_dict(self, string + 4, (unsigned)size - 5,
+                                  &options);
+    }
+    PyBuffer_Release(&view);
     destroy_codec_options(&options);
-    buffer_free(buffer);
     return result;
+
+done:
+    PyBuffer_Release(&view);
+    destroy_codec_options(&options);
+    return NULL;
 }
 
-static PyObject* get_value(PyObject* self, const char* buffer,
-                           unsigned* position, unsigned char type,
-                           unsigned max, const codec_options_t* options) {
-    struct module_state *state = GETSTATE(self);
+/* Check the size and terminating NUL byte of the next BSON document in
+ * a buffer of concatenated documents, where `total_size` bytes remain.
+ *
+ * Returns the document's size, or -1 and stores an error message in
+ * `message` on failure. Doesn't touch Python objects, so it can be called
+ * without the GIL. */
+static int _check_document_size(const char* string, Py_ssize_t total_size,
+                                const char** message) {
+    int size;
+    if (total_size < BSON_MIN_SIZE) {
+        *message = "not enough data for a BSON document";
+        return -1;
+    }
+    memcpy(&size, string, 4);
+    if (size < BSON_MIN_SIZE) {
+        *message = "invalid message size";
+        return -1;
+    }
+    if (total_size < size) {
+        *message = "objsize too large";
+        return -1;
+    }
+    if (string[size - 1]) {
+        *message = "bad eoo";
+        return -1;
+    }
+    return size;
+}
 
-    PyObject* value = NULL;
-    switch (type) {
-    case 1:
-        {
-            double d;
-            if (max < 8) {
-                goto invalid;
+static void _set_invalid_bson(const char* message) {
+    PyObject* InvalidBSON = _error("InvalidBSON");
+    if (InvalidBSON) {
+        PyErr_SetString(InvalidBSON, message);
+        Py_DECREF(InvalidBSON);
+    }
+}
+
+/* Check the size and terminating NUL byte of the next BSON document in
+ * a buffer of concatenated documents, where `total_size` bytes remain.
+ *
+ * Returns the document's size, or -1 with InvalidBSON set on failure. */
+static int _next_document_size(const char* string, Py_ssize_t total_size) {
+    const char* message = NULL;
+    int size = _check_document_size(string, total_size, &message);
+    if (size < 0) {
+        _set_invalid_bson(message);
+    }
+    return size;
+}
+
+/* Check the size and terminating NUL byte of every document in a buffer
+ * of concatenated documents. Large buffers are scanned without the GIL.
+ *
+ * Returns the number of documents, or -1 with InvalidBSON set on
+ * failure. */
+static Py_ssize_t _count_documents(const char* string, Py_ssize_t total_size) {
+    Py_ssize_t count = 0;
+    const char* message = NULL;
+    int size;
+
+    if (total_size >= NOGIL_MIN_SIZE) {
+        Py_BEGIN_ALLOW_THREADS
+        while (total_size > 0) {
+            if ((size = _check_document_size(string, total_size,
+                                             &message)) < 0) {
+                break;
             }
-            memcpy(&d, buffer + *position, 8);
-            value = PyFloat_FromDouble(d);
-            *position += 8;
-            break;
+            string += size;
+            total_size -= size;
+            count++;
         }
-    case 2:
-    case 14:
-        {
-            unsigned value_length;
-            if (max < 4) {
-                goto invalid;
-            }
-            memcpy(&value_length, buffer + *position, 4);
-            /* Encoded string length + string */
-            if (!value_length || max < value_length || max < 4 + value_length) {
-                goto invalid;
-            }
-            *position += 4;
-            /* Strings must end in \0 */
-            if (buffer[*position + value_length - 1]) {
-                goto invalid;
-            }
-            value = PyUnicode_DecodeUTF8(
-                buffer + *position, value_length - 1,
-                options->unicode_decode_error_handler);
-            if (!value) {
-                goto invalid;
+        Py_END_ALLOW_THREADS
+    } else {
+        while (total_size > 0) {
+            if ((size = _check_document_size(string, total_size,
+                                             &message)) < 0) {
+                break;
             }
-            *position += value_length;
-            break;
+            string += size;
+            total_size -= size;
+            count++;
         }
-    case 3:
-        {
-            PyObject* collection;
-            unsigned size;
-            if (max < 4) {
-                goto invalid;
-            }
-            memcpy(&size, buffer + *position, 4);
-            if (size < BSON_MIN_SIZE || max < size) {
-                goto invalid;
-            }
-            /* Check for bad eoo */
-            if (buffer[*position + size - 1]) {
-                goto invalid;
-            }
-            value = elements_to_dict(self, buffer + *position + 4,
-                                     size - 5, options);
-            if (!value) {
-                goto invalid;
-            }
-
-            /* Decoding for DBRefs */
-            if (PyMapping_HasKeyString(value, "$ref")) { /* DBRef */
-                PyObject* dbref = NULL;
-                PyObject* dbref_type;
-                PyObject* id;
-                PyObject* database;
+    }
+    if (message) {
+        _set_invalid_bson(message);
+        return -1;
+    }
+    return count;
+}
 
-                collection = PyMapping_GetItemString(value, "$ref");
-                /* PyMapping_GetItemString returns NULL to indicate error. */
-                if (!collection) {
-                    goto invalid;
-                }
-                PyMapping_DelItemString(value, "$ref");
+static PyObject* _cbson_decode_all(PyObject* self, PyObject* args) {
+    int size;
+    Py_ssize_t count;
+    Py_ssize_t remaining;
+    Py_ssize_t i;
+    const char* string;
+    PyObject* bson;
+    PyObject* dict;
+    PyObject* result = NULL;
+    Py_buffer view;
+    codec_options_t options;
 
-                if (PyMapping_HasKeyString(value, "$id")) {
-                    id = PyMapping_GetItemString(value, "$id");
-                    if (!id) {
-                        Py_DECREF(collection);
-                        goto invalid;
-                    }
-                    PyMapping_DelItemString(value, "$id");
-                } else {
-                    id = Py_None;
-                    Py_INCREF(id);
-                }
+    if (!PyArg_ParseTuple(
+            args, "O|O&",
+            &bson, convert_codec_options, &options)) {
+        return NULL;
+    }
 
-                if (PyMapping_HasKeyString(value, "$db")) {
-                    database = PyMapping_GetItemString(value, "$db");
-                    if (!database) {
-                        Py_DECREF(collection);
-                        Py_DECREF(id);
-                        goto invalid;
-                    }
-                    PyMapping_DelItemString(value, "$db");
-                } else {
-                    database = Py_None;
-                    Py_INCREF(database);
-                }
+    if (PyTuple_GET_SIZE(args) < 2) {
+        default_codec_options(&options);
+    }
 
-                if ((dbref_type = _get_object(state->DBRef, "bson.dbref", "DBRef"))) {
-                    dbref = PyObject_CallFunctionObjArgs(dbref_type, collection, id, database, value, NULL);
-                    Py_DECREF(dbref_type);
-                }
-                Py_DECREF(value);
-                value = dbref;
+    if (!_get_buffer(bson, &view, "decode_all")) {
+        destroy_codec_options(&options);
+        return NULL;
+    }
+    string = (const char*)view.buf;
+    if (!set_decode_source(&options, bson, string)) {
+        goto fail;
+    }
 
-                Py_DECREF(id);
-                Py_DECREF(collection);
-                Py_DECREF(database);
-            }
+    /* Validate every document's size before decoding any of them, so the
+     * result list is allocated once. The buffer is exported until
+     * PyBuffer_Release, so it can't be resized while the GIL is released. */
+    if ((count = _count_documents(string, view.len)) < 0) {
+        goto fail;
+    }
+    if (!(result = PyList_New(count))) {
+        goto fail;
+    }
 
-            *position += size;
-            break;
+    remaining = view.len;
+    for (i = 0; i < count; i++) {
+        /* The buffer's contents may have changed since it was counted, by
+         * another thread or a document_class or tzinfo callback: check
+         * each size again against the bytes that are left. */
+        if ((size = _next_document_size(string, remaining)) < 0) {
+            goto fail;
         }
-    case 4:
-        {
-            unsigned size, end;
-
-            if (max < 4) {
-                goto invalid;
-            }
-            memcpy(&size, buffer + *position, 4);
-            if (size < BSON_MIN_SIZE || max < size) {
-                goto invalid;
-            }
-            end = *position + size - 1;
-            /* Check for bad eoo */
-            if (buffer[end]) {
-                goto invalid;
-            }
-            *position += 4;
 
-            value = PyList_New(0);
-            if (!value) {
-                goto invalid;
-            }
-            while (*position < end) {
-                PyObject* to_append;
+        /* No need to decode fields if using RawBSONDocument. */
+        if (options.is_raw_bson) {
+            dict = _raw_document(string, (unsigned)size, &options);
+        } else {
+            dict = elements_to_dict(self, string + 4, (unsigned)size - 5,
+                                    &options);
+        }
+        if (!dict) {
+            goto fail;
+        }
+        PyList_SET_ITEM(result, i, dict);
+        string += size;
+        remaining -= size;
+    }
 
-                unsigned char bson_type = (unsigned char)buffer[(*position)++];
+    PyBuffer_Release(&view);
+    destroy_codec_options(&options);
+    return result;
 
-                size_t key_size = strlen(buffer + *position);
-                if (max < key_size) {
-                    Py_DECREF(value);
-                    goto invalid;
-                }
-                /* just skip the key, they're in order. */
-                *position += (unsigned)key_size + 1;
-                if (Py_EnterRecursiveCall(" while decoding a list value")) {
-                    Py_DECREF(value);
-                    goto invalid;
-                }
-                to_append = get_value(self, buffer, position, bson_type,
-                                      max - (unsigned)key_size, options);
-                Py_LeaveRecursiveCall();
-                if (!to_append) {
-                    Py_DECREF(value);
-                    goto invalid;
-                }
-                PyList_Append(value, to_append);
-                Py_DECREF(to_append);
-            }
-            (*position)++;
-            break;
-        }
-    case 5:
-        {
-            PyObject* data;
-            PyObject* st;
-            PyObject* type_to_create;
-            unsigned length;
-            unsigned char subtype;
+fail:
+    Py_XDECREF(result);
+    PyBuffer_Release(&view);
+    destroy_codec_options(&options);
+    return NULL;
+}
 
-            if (max < 5) {
-                goto invalid;
-            }
-            memcpy(&length, buffer + *position, 4);
-            if (max < length) {
-                goto invalid;
-            }
+/* Check that `length` bytes at `string` are valid UTF-8. */
+static int _valid_utf8(const char* string, unsigned length) {
+    return check_string((const unsigned char*)string, (int)length,
+                        1, 0) == VALID;
+}
 
-            subtype = (unsigned char)buffer[*position + 4];
-            *position += 5;
-            if (subtype == 2 && length < 4) {
-                goto invalid;
-            }
-#if PY_MAJOR_VERSION >= 3
-            /* Python3 special case. Decode BSON binary subtype 0 to bytes. */
-            if (subtype == 0) {
-                value = PyBytes_FromStringAndSize(buffer + *position, length);
-                *position += length;
+/* Check the structure of the BSON document of `size` bytes at `string`
+ * without decoding it. The caller has checked the size and terminating
+ * NUL. Embedded documents and arrays may be nested at most `max_depth`
+ * levels deep, or to any depth if `max_depth` is negative.
+ *
+ * Embedded documents are checked without recursion, so any depth is safe.
+ * Doesn't touch Python objects, so it can be called without the GIL.
+ *
+ * Returns 1 if the document is valid, 0 if it isn't, or -1 if memory
+ * couldn't be allocated. */
+static int _validate_document(const char* string, unsigned size,
+                              long max_depth) {
+    /* The end of each enclosing document, for when its child is done. */
+    unsigned* ends = NULL;
+    unsigned depth = 0;
+    unsigned capacity = 0;
+    unsigned position = 4;
+    unsigned end = size - 1;
+    int result = 0;
+
+    while (1) {
+        unsigned char type;
+        const char* name_end;
+        const char* value;
+        int length;
+        /* The offset of the size of a child document within the value. */
+        unsigned child = 0;
+
+        if (position == end) {
+            if (!depth) {
+                result = 1;
                 break;
             }
-            if (subtype == 2) {
-                data = PyBytes_FromStringAndSize(buffer + *position + 4, length - 4);
-            } else {
-                data = PyBytes_FromStringAndSize(buffer + *position, length);
-            }
-#else
-            if (subtype == 2) {
-                data = PyString_FromStringAndSize(buffer + *position + 4, length - 4);
-            } else {
-                data = PyString_FromStringAndSize(buffer + *position, length);
+            position = end + 1;
+            end = ends[--depth];
+            continue;
+        }
+        type = (unsigned char)string[position++];
+        name_end = memchr(string + position, 0, end - position);
+        if (!name_end ||
+                !_valid_utf8(string + position,
+                             (unsigned)(name_end - (string + position)))) {
+            break;
+        }
+        position = (unsigned)(name_end + 1 - string);
+        length = _value_length(string, position, type, end - position);
+        if (length < 0) {
+            break;
+        }
+        value = string + position;
+
+        switch (type) {
+        case 2:
+        case 13:
+        case 14:
+            if (value[length - 1] ||
+                    !_valid_utf8(value + 4, (unsigned)length - 5)) {
+                goto done;
             }
-#endif
-            if (!data) {
-                goto invalid;
+            break;
+        case 3:
+        case 4:
+            if (value[length - 1]) {
+                goto done;
             }
-            /* Encode as UUID, not Binary */
-            if (subtype == 3 || subtype == 4) {
-                PyObject* kwargs;
-                PyObject* args = PyTuple_New(0);
-                /* UUID should always be 16 bytes */
-                if (!args || length != 16) {
-                    Py_DECREF(data);
-                    goto invalid;
+            break;
+        case 5:
+            {
+                unsigned data_length = (unsigned)length - 5;
+                unsigned char subtype = (unsigned char)value[4];
+                if (subtype == 2) {
+                    /* The old binary subtype repeats the length. */
+                    unsigned inner_length;
+                    if (data_length < 4) {
+                        goto done;
+                    }
+                    memcpy(&inner_length, value + 5, 4);
+                    if (inner_length != data_length - 4) {
+                        goto done;
+                    }
+                } else if ((subtype == 3 || subtype == 4) &&
+                           data_length != 16) {
+                    goto done;
                 }
-                kwargs = PyDict_New();
-                if (!kwargs) {
-                    Py_DECREF(data);
-                    Py_DECREF(args);
-                    goto invalid;
+                break;
+            }
+        case 11:
+            {
+                unsigned pattern_length = (unsigned)strlen(value);
+                if (!_valid_utf8(value, pattern_length) ||
+                        !_valid_utf8(value + pattern_length + 1,
+                                     (unsigned)length - pattern_length - 2)) {
+                    goto done;
                 }
-
-                /*
-                 * From this point, we hold refs to args, kwargs, and data.
-                 * If anything fails, goto uuiderror to clean them up.
-                 */
-                if (options->uuid_rep == CSHARP_LEGACY) {
-                    /* Legacy C# byte order */
-                    if ((PyDict_SetItemString(kwargs, "bytes_le", data)) == -1)
-                        goto uuiderror;
+                break;
+            }
+        case 12:
+            if (value[length - 13] ||
+                    !_valid_utf8(value + 4, (unsigned)length - 17)) {
+                goto done;
+            }
+            break;
+        case 15:
+            {
+                /* Total size, code string, then the scope document. */
+                unsigned code_length;
+                unsigned scope_size;
+                if (length < 14) {
+                    goto done;
                 }
-                else {
-                    if (options->uuid_rep == JAVA_LEGACY) {
-                        /* Convert from legacy java byte order */
-                        char big_endian[16];
-                        _fix_java(buffer + *position, big_endian);
-                        /* Free the previously created PyString object */
-                        Py_DECREF(data);
-#if PY_MAJOR_VERSION >= 3
-                        data = PyBytes_FromStringAndSize(big_endian, length);
-#else
-                        data = PyString_FromStringAndSize(big_endian, length);
-#endif
-                        if (data == NULL)
-                            goto uuiderror;
-                    }
-                    if ((PyDict_SetItemString(kwargs, "bytes", data)) == -1)
-                        goto uuiderror;
-                
+                memcpy(&code_length, value + 4, 4);
+                if (!code_length || code_length > (unsigned)length - 13 ||
+                        value[8 + code_length - 1] ||
+                        !_valid_utf8(value + 8, code_length - 1)) {
+                    goto done;
                 }
-                if ((type_to_create = _get_object(state->UUID, "uuid", "UUID"))) {
-                    value = PyObject_Call(type_to_create, args, kwargs);
-                    Py_DECREF(type_to_create);
+                child = 8 + code_length;
+                memcpy(&scope_size, value + child, 4);
+                if (scope_size != (unsigned)length - child ||
+                        value[length - 1]) {
+                    goto done;
                 }
+                break;
+            }
+        }
 
-                Py_DECREF(args);
-                Py_DECREF(kwargs);
-                Py_DECREF(data);
-                if (!value) {
-                    goto invalid;
+        if (type == 3 || type == 4 || type == 15) {
+            /* Check the child document's elements next. */
+            if (max_depth >= 0 && depth >= (unsigned long)max_depth) {
+                break;
+            }
+            if (depth == capacity) {
+                unsigned* new_ends;
+                capacity = capacity ? capacity * 2 : 16;
+                new_ends = (unsigned*)realloc(ends,
+                                              capacity * sizeof(unsigned));
+                if (!new_ends) {
+                    result = -1;
+                    break;
                 }
+                ends = new_ends;
+            }
+            ends[depth++] = end;
+            end = position + (unsigned)length - 1;
+            position += child + 4;
+        } else {
+            position += (unsigned)length;
+        }
+    }
 
-                *position += length;
-                break;
+done:
+    free(ends);
+    return result;
+}
 
-            uuiderror:
-                Py_DECREF(args);
-                Py_DECREF(kwargs);
-                Py_XDECREF(data);
-                goto invalid;
-            }
+static PyObject* _cbson_validate(PyObject* self, PyObject* args) {
+    long max_depth;
+    int size;
+    int valid;
+    Py_ssize_t offset = 0;
+    const char* string;
+    const char* message = NULL;
+    PyObject* bson;
+    PyObject* result;
+    Py_buffer view;
 
+    if (!PyArg_ParseTuple(args, "Ol", &bson, &max_depth)) {
+        return NULL;
+    }
+    if (!_get_buffer(bson, &view, "validate")) {
+        return NULL;
+    }
+    if (!(result = PyList_New(0))) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    string = (const char*)view.buf;
+
+    while (offset < view.len) {
+        size = _check_document_size(string + offset, view.len - offset,
+                                    &message);
+        if (size < 0) {
+            valid = 0;
+        } else if (size >= NOGIL_MIN_SIZE) {
+            /* The buffer is exported until PyBuffer_Release, so it can't
+             * be resized while the GIL is released. */
+            Py_BEGIN_ALLOW_THREADS
+            valid = _validate_document(string + offset, (unsigned)size,
+                                       max_depth);
+            Py_END_ALLOW_THREADS
+        } else {
+            valid = _validate_document(string + offset, (unsigned)size,
+                                       max_depth);
+        }
+        if (valid < 0) {
+            PyErr_NoMemory();
+            goto fail;
+        }
+        if (!valid) {
 #if PY_MAJOR_VERSION >= 3
-            st = PyLong_FromLong(subtype);
+            PyObject* bad_offset = PyLong_FromSsize_t(offset);
 #else
-            st = PyInt_FromLong(subtype);
+            PyObject* bad_offset = PyInt_FromSsize_t(offset);
 #endif
-            if (!st) {
-                Py_DECREF(data);
-                goto invalid;
-            }
-            if ((type_to_create = _get_object(state->Binary, "bson.binary", "Binary"))) {
-                value = PyObject_CallFunctionObjArgs(type_to_create, data, st, NULL);
-                Py_DECREF(type_to_create);
+            if (!bad_offset) {
+                goto fail;
             }
-            Py_DECREF(st);
-            Py_DECREF(data);
-            if (!value) {
-                goto invalid;
+            if (PyList_Append(result, bad_offset) < 0) {
+                Py_DECREF(bad_offset);
+                goto fail;
             }
-            *position += length;
-            break;
+            Py_DECREF(bad_offset);
         }
-    case 6:
-    case 10:
-        {
-            value = Py_None;
-            Py_INCREF(value);
+        if (size < 0) {
+            /* The following documents can't be found. */
             break;
         }
-    case 7:
-        {
-            PyObject* objectid_type;
-            if (max < 12) {
-                goto invalid;
-            }
-            if ((objectid_type = _get_object(state->ObjectId, "bson.objectid", "ObjectId"))) {
+        offset += size;
+    }
+
+    PyBuffer_Release(&view);
+    return result;
+
+fail:
+    Py_DECREF(result);
+    PyBuffer_Release(&view);
+    return NULL;
+}
+
+/* A column of values decoded by _cbson_decode_columns. */
+typedef struct column_t {
+    /* The BSON type of the value in each row, or 0 if it's missing. */
+    PyObject* types;
+    /* Each row's value as an 8 byte number, if it's a number, boolean or
+     * datetime. */
+    PyObject* values;
+    /* Each row's decoded value if it's any other type, otherwise None. */
+    PyObject* objects;
+    Py_ssize_t rows;
+} column_t;
+
+static int _column_init(column_t* column) {
+    column->types = PyByteArray_FromStringAndSize(NULL, 0);
+    column->values = PyByteArray_FromStringAndSize(NULL, 0);
+    column->objects = PyList_New(0);
+    column->rows = 0;
+    return column->types && column->values && column->objects;
+}
+
+static void _column_destroy(column_t* column) {
+    Py_CLEAR(column->types);
+    Py_CLEAR(column->values);
+    Py_CLEAR(column->objects);
+}
+
+/* Append a row to `column`. `value` is 8 bytes, or NULL for zero, and
+ * `object` is a borrowed reference, or NULL for None.
+ *
+ * Returns 1 on success or 0 on failure. */
+static int _column_append(column_t* column, unsigned char type,
+                          const char* value, PyObject* object) {
+    Py_ssize_t row = column->rows;
+    /* bytearray over-allocates, so appending is amortized O(1). */
+    if (PyByteArray_Resize(column->types, row + 1) < 0 ||
+            PyByteArray_Resize(column->values, (row + 1) * 8) < 0) {
+        return 0;
+    }
+    if (PyList_Append(column->objects, object ? object : Py_None) < 0) {
+        return 0;
+    }
+    PyByteArray_AS_STRING(column->types)[row] = (char)type;
+    if (value) {
+        memcpy(PyByteArray_AS_STRING(column->values) + row * 8, value, 8);
+    } else {
+        memset(PyByteArray_AS_STRING(column->values) + row * 8, 0, 8);
+    }
+    column->rows++;
+    return 1;
+}
+
+/* Set the value of `column` in `row`, marking any rows before it that
+ * have no value as missing.
+ *
+ * Returns 1 on success or 0 on failure. */
+static int _column_set(column_t* column, Py_ssize_t row, unsigned char type,
+                       const char* value, PyObject* object) {
+    while (column->rows < row) {
+        if (!_column_append(column, 0, NULL, NULL)) {
+            return 0;
+        }
+    }
+    if (column->rows == row) {
+        return _column_append(column, type, value, object);
+    }
+    /* A duplicate key: the last value wins, like a decoded document. */
+    object = object ? object : Py_None;
+    Py_INCREF(object);
+    if (PyList_SetItem(column->objects, row, object) < 0) {
+        return 0;
+    }
+    PyByteArray_AS_STRING(column->types)[row] = (char)type;
+    if (value) {
+        memcpy(PyByteArray_AS_STRING(column->values) + row * 8, value, 8);
+    } else {
+        memset(PyByteArray_AS_STRING(column->values) + row * 8, 0, 8);
+    }
+    return 1;
+}
+
+/* Add an empty column for the field `name`.
+ *
+ * Returns 1 on success or 0 on failure. */
+static int _add_column(column_t** columns, Py_ssize_t* count,
+                       Py_ssize_t* capacity, PyObject* index,
+                       PyObject* name) {
+    PyObject* position;
+    int result;
+    if (*count == *capacity) {
+        Py_ssize_t new_capacity = *capacity ? *capacity * 2 : 16;
+        column_t* new_columns = (column_t*)realloc(
+            *columns, sizeof(column_t) * new_capacity);
+        if (!new_columns) {
+            PyErr_NoMemory();
+            return 0;
+        }
+        *columns = new_columns;
+        *capacity = new_capacity;
+    }
+    if (!_column_init(*columns + *count)) {
+        _column_destroy(*columns + *count);
+        return 0;
+    }
+    (*count)++;
 #if PY_MAJOR_VERSION >= 3
-                value = PyObject_CallFunction(objectid_type, "y#", buffer + *position, 12);
+    position = PyLong_FromSsize_t(*count - 1);
 #else
-                value = PyObject_CallFunction(objectid_type, "s#", buffer + *position, 12);
+    position = PyInt_FromSsize_t(*count - 1);
 #endif
-                Py_DECREF(objectid_type);
-            }
-            *position += 12;
-            break;
-        }
-    case 8:
-        {
-            value = buffer[(*position)++] ? Py_True : Py_False;
-            Py_INCREF(value);
-            break;
-        }
-    case 9:
-        {
-            PyObject* utc_type;
-            PyObject* naive;
-            PyObject* replace;
-            PyObject* args;
-            PyObject* kwargs;
-            PyObject* astimezone;
-            long long millis;
-            if (max < 8) {
-                goto invalid;
-            }
-            memcpy(&millis, buffer + *position, 8);
-            naive = datetime_from_millis(millis);
-            *position += 8;
-            if (!options->tz_aware) { /* In the naive case, we're done here. */
-                value = naive;
-                break;
-            }
+    if (!position) {
+        return 0;
+    }
+    result = PyDict_SetItem(index, name, position) == 0;
+    Py_DECREF(position);
+    return result;
+}
 
-            if (!naive) {
-                goto invalid;
-            }
-            replace = PyObject_GetAttrString(naive, "replace");
-            Py_DECREF(naive);
-            if (!replace) {
-                goto invalid;
-            }
-            args = PyTuple_New(0);
-            if (!args) {
-                Py_DECREF(replace);
-                goto invalid;
-            }
-            kwargs = PyDict_New();
-            if (!kwargs) {
-                Py_DECREF(replace);
-                Py_DECREF(args);
-                goto invalid;
-            }
-            utc_type = _get_object(state->UTC, "bson.tz_util", "utc");
-            if (!utc_type || PyDict_SetItemString(kwargs, "tzinfo", utc_type) == -1) {
-                Py_DECREF(replace);
-                Py_DECREF(args);
-                Py_DECREF(kwargs);
-                Py_XDECREF(utc_type);
-                goto invalid;
-            }
-            Py_XDECREF(utc_type);
-            value = PyObject_Call(replace, args, kwargs);
-            if (!value) {
-                Py_DECREF(replace);
-                Py_DECREF(args);
-                Py_DECREF(kwargs);
-                goto invalid;
-            }
+/* Decode concatenated BSON documents into a column per field.
+ *
+ * Takes the BSON data, a list of field names or None to find the names of
+ * all top-level fields, and a CodecOptions. Returns a tuple of the list of
+ * field names and a list with a (types, values, objects) tuple per field:
+ * see column_t. Numbers, booleans and datetimes are copied to `values`
+ * without creating Python objects for them. */
+static PyObject* _cbson_decode_columns(PyObject* self, PyObject* args) {
+    int size;
+    Py_ssize_t total_size;
+    Py_ssize_t row = 0;
+    Py_ssize_t i;
+    const char* string;
+    PyObject* bson;
+    PyObject* names;
+    PyObject* index = NULL;
+    PyObject* columns_list = NULL;
+    PyObject* result = NULL;
+    column_t* columns = NULL;
+    Py_ssize_t count = 0;
+    Py_ssize_t capacity = 0;
+    int find_names;
+    Py_buffer view;
+    codec_options_t options;
 
-            /* convert to local time */
-            if (options->tzinfo != Py_None) {
-                astimezone = PyObject_GetAttrString(value, "astimezone");
-                if (!astimezone) {
-                    Py_DECREF(replace);
-                    Py_DECREF(args);
-                    Py_DECREF(kwargs);
-                    goto invalid;
-                }
-                value = PyObject_CallFunctionObjArgs(astimezone, options->tzinfo, NULL);
-                Py_DECREF(astimezone);
+    if (!PyArg_ParseTuple(args, "OOO&", &bson, &names,
+                          convert_codec_options, &options)) {
+        return NULL;
+    }
+    /* Values in object columns are decoded whole. */
+    Py_CLEAR(options.fields);
+
+    if (!_get_buffer(bson, &view, "_decode_columns")) {
+        destroy_codec_options(&options);
+        return NULL;
+    }
+    total_size = view.len;
+    string = (const char*)view.buf;
+    if (!set_decode_source(&options, bson, string)) {
+        PyBuffer_Release(&view);
+        destroy_codec_options(&options);
+        return NULL;
+    }
+
+    find_names = (names == Py_None);
+    if (find_names) {
+        names = PyList_New(0);
+    } else {
+        names = PySequence_List(names);
+    }
+    if (!names || !(index = PyDict_New())) {
+        goto done;
+    }
+    if (!find_names) {
+        for (i = 0; i < PyList_GET_SIZE(names); i++) {
+            if (!_add_column(&columns, &count, &capacity, index,
+                             PyList_GET_ITEM(names, i))) {
+                goto done;
             }
+        }
+    }
 
-            Py_DECREF(replace);
-            Py_DECREF(args);
-            Py_DECREF(kwargs);
-            break;
+    while (total_size > 0) {
+        unsigned position = 4;
+        unsigned max;
+        if ((size = _next_document_size(string, total_size)) < 0) {
+            goto done;
         }
-    case 11:
-        {
-            PyObject* regex_class;
-            PyObject* pattern;
-            int flags;
-            size_t flags_length, i;
-            size_t pattern_length = strlen(buffer + *position);
-            if (pattern_length > BSON_MAX_SIZE || max < pattern_length) {
-                goto invalid;
-            }
-            pattern = PyUnicode_DecodeUTF8(
-                buffer + *position, pattern_length,
-                options->unicode_decode_error_handler);
-            if (!pattern) {
-                goto invalid;
-            }
-            *position += (unsigned)pattern_length + 1;
-            flags_length = strlen(buffer + *position);
-            if (flags_length > BSON_MAX_SIZE ||
-                    (BSON_MAX_SIZE - pattern_length) < flags_length) {
-                Py_DECREF(pattern);
-                goto invalid;
+        max = (unsigned)size - 1;
+        while (position < max) {
+            PyObject* name;
+            PyObject* column_index;
+            column_t* column;
+            PyObject* object = NULL;
+            const char* value = NULL;
+            char number[8];
+            int ok;
+            int value_length;
+            unsigned char type = (unsigned char)string[position++];
+            int name_length = _element_name_length(string, position, max);
+            if (name_length < 0) {
+                goto done;
             }
-            if (max < pattern_length + flags_length) {
-                Py_DECREF(pattern);
-                goto invalid;
+            name = _decode_element_name(self, string + position, name_length,
+                                        &options);
+            if (!name) {
+                goto done;
             }
-            flags = 0;
-            for (i = 0; i < flags_length; i++) {
-                if (buffer[*position + i] == 'i') {
-                    flags |= 2;
-                } else if (buffer[*position + i] == 'l') {
-                    flags |= 4;
-                } else if (buffer[*position + i] == 'm') {
-                    flags |= 8;
-                } else if (buffer[*position + i] == 's') {
-                    flags |= 16;
-                } else if (buffer[*position + i] == 'u') {
-                    flags |= 32;
-                } else if (buffer[*position + i] == 'x') {
-                    flags |= 64;
+            position += (unsigned)name_length + 1;
+            value_length = _value_length(string, position, type,
+                                         max - position);
+            if (value_length < 0) {
+                PyObject* InvalidBSON = _error("InvalidBSON");
+                if (InvalidBSON) {
+                    PyErr_SetString(InvalidBSON,
+                                    "invalid length or type code");
+                    Py_DECREF(InvalidBSON);
                 }
+                Py_DECREF(name);
+                goto done;
             }
-            *position += (unsigned)flags_length + 1;
 
-            regex_class = _get_object(state->Regex, "bson.regex", "Regex");
-            if (regex_class) {
-                value = PyObject_CallFunction(regex_class,
-                                              "Oi", pattern, flags);
-                Py_DECREF(regex_class);
+            column_index = PyDict_GetItem(index, name);
+            if (!column_index && find_names) {
+                if (!_add_column(&columns, &count, &capacity, index, name) ||
+                        PyList_Append(names, name) < 0) {
+                    Py_DECREF(name);
+                    goto done;
+                }
+                column_index = PyDict_GetItem(index, name);
             }
-            Py_DECREF(pattern);
-            break;
-        }
-    case 12:
-        {
-            unsigned coll_length;
-            PyObject* collection;
-            PyObject* id = NULL;
-            PyObject* objectid_type;
-            PyObject* dbref_type;
-
-            if (max < 4) {
-                goto invalid;
+            Py_DECREF(name);
+            if (!column_index) {
+                /* Not a selected field. */
+                position += (unsigned)value_length;
+                continue;
             }
-            memcpy(&coll_length, buffer + *position, 4);
-            /* Encoded string length + string + 12 byte ObjectId */
-            if (!coll_length || max < coll_length || max < 4 + coll_length + 12) {
-                goto invalid;
+#if PY_MAJOR_VERSION >= 3
+            column = columns + PyLong_AsSsize_t(column_index);
+#else
+            column = columns + PyInt_AsSsize_t(column_index);
+#endif
+
+            switch (type) {
+            case 1:
+            case 9:
+            case 18:
+                value = string + position;
+                break;
+            case 16:
+                {
+                    int i32;
+                    long long i64;
+                    memcpy(&i32, string + position, 4);
+                    i64 = i32;
+                    memcpy(number, &i64, 8);
+                    value = number;
+                    break;
+                }
+            case 8:
+                {
+                    long long i64 = string[position] ? 1 : 0;
+                    memcpy(number, &i64, 8);
+                    value = number;
+                    break;
+                }
+            case 6:
+            case 10:
+                break;
+            default:
+                {
+                    unsigned object_position = position;
+                    object = get_value(self, string, &object_position, type,
+                                       max - position, &options);
+                    if (!object) {
+                        goto done;
+                    }
+                }
             }
-            *position += 4;
-            /* Strings must end in \0 */
-            if (buffer[*position + coll_length - 1]) {
-                goto invalid;
+            ok = _column_set(column, row, type, value, object);
+            Py_XDECREF(object);
+            if (!ok) {
+                goto done;
             }
+            position += (unsigned)value_length;
+        }
+        string += size;
+        total_size -= size;
+        row++;
+    }
 
-            collection = PyUnicode_DecodeUTF8(
-                buffer + *position, coll_length - 1,
-                options->unicode_decode_error_handler);
-            if (!collection) {
-                goto invalid;
+    if (!(columns_list = PyList_New(count))) {
+        goto done;
+    }
+    for (i = 0; i < count; i++) {
+        PyObject* column;
+        /* Mark the missing rows at the end. */
+        while (columns[i].rows < row) {
+            if (!_column_append(columns + i, 0, NULL, NULL)) {
+                goto done;
             }
-            *position += coll_length;
+        }
+        column = PyTuple_Pack(3, columns[i].types, columns[i].values,
+                              columns[i].objects);
+        if (!column) {
+            goto done;
+        }
+        PyList_SET_ITEM(columns_list, i, column);
+    }
+    result = PyTuple_Pack(2, names, columns_list);
 
-            if ((objectid_type = _get_object(state->ObjectId, "bson.objectid", "ObjectId"))) {
+done:
+    for (i = 0; i < count; i++) {
+        _column_destroy(columns + i);
+    }
+    free(columns);
+    Py_XDECREF(columns_list);
+    Py_XDECREF(index);
+    Py_XDECREF(names);
+    PyBuffer_Release(&view);
+    destroy_codec_options(&options);
+    return result;
+}
+
+/* Get the bytes and size of the `bson` argument to one of the functions
+ * that operate on part of a document, checking that the enclosing
+ * document's terminating NUL byte at `max` is inside it.
+ *
+ * Returns NULL with an exception set on failure. */
+static const char* _get_element_buffer(PyObject* bson, unsigned max,
+                                       const char* function_name) {
+    Py_ssize_t total_size;
+    const char* string;
 #if PY_MAJOR_VERSION >= 3
-                id = PyObject_CallFunction(objectid_type, "y#", buffer + *position, 12);
+    if (!PyBytes_Check(bson)) {
+        PyErr_Format(PyExc_TypeError,
+                     "argument to %s must be a bytes object", function_name);
+        return NULL;
+    }
+    total_size = PyBytes_Size(bson);
+    string = PyBytes_AsString(bson);
 #else
-                id = PyObject_CallFunction(objectid_type, "s#", buffer + *position, 12);
+    if (!PyString_Check(bson)) {
+        PyErr_Format(PyExc_TypeError,
+                     "argument to %s must be a string", function_name);
+        return NULL;
+    }
+    total_size = PyString_Size(bson);
+    string = PyString_AsString(bson);
 #endif
-                Py_DECREF(objectid_type);
-            }
-            if (!id) {
-                Py_DECREF(collection);
-                goto invalid;
-            }
-            *position += 12;
-            if ((dbref_type = _get_object(state->DBRef, "bson.dbref", "DBRef"))) {
-                value = PyObject_CallFunctionObjArgs(dbref_type, collection, id, NULL);
-                Py_DECREF(dbref_type);
+    if (string && (Py_ssize_t)max >= total_size) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetString(InvalidBSON, "invalid object length");
+            Py_DECREF(InvalidBSON);
+        }
+        return NULL;
+    }
+    return string;
+}
+
+static PyObject* _cbson_element_to_dict(PyObject* self, PyObject* args) {
+    const char* string;
+    PyObject* bson;
+    codec_options_t options;
+    unsigned position;
+    unsigned max;
+    int new_position;
+    PyObject* name;
+    PyObject* value;
+
+    if (!PyArg_ParseTuple(args, "OIIO&", &bson, &position, &max,
+                          convert_codec_options, &options)) {
+        return NULL;
+    }
+
+    string = _get_element_buffer(bson, max, "_element_to_dict");
+    if (!string || !set_decode_source(&options, bson, string)) {
+        destroy_codec_options(&options);
+        return NULL;
+    }
+    if (position >= max) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetString(InvalidBSON, "invalid element position");
+            Py_DECREF(InvalidBSON);
+        }
+        destroy_codec_options(&options);
+        return NULL;
+    }
+
+    new_position = _element_to_dict(self, string, position, max, &options,
+                                    &name, &value);
+    destroy_codec_options(&options);
+    if (new_position < 0) {
+        return NULL;
+    }
+    return Py_BuildValue("NNi", name, value, new_position);
+}
+
+static PyObject* _cbson_raw_element_index(PyObject* self, PyObject* args) {
+    const char* string;
+    PyObject* bson;
+    PyObject* keys;
+    PyObject* index;
+    codec_options_t options;
+    unsigned position;
+    unsigned max;
+
+    if (!PyArg_ParseTuple(args, "OIIO&", &bson, &position, &max,
+                          convert_codec_options, &options)) {
+        return NULL;
+    }
+
+    string = _get_element_buffer(bson, max, "_raw_element_index");
+    if (!string) {
+        destroy_codec_options(&options);
+        return NULL;
+    }
+
+    keys = PyList_New(0);
+    if (!keys) {
+        destroy_codec_options(&options);
+        return NULL;
+    }
+    index = PyDict_New();
+    if (!index) {
+        Py_DECREF(keys);
+        destroy_codec_options(&options);
+        return NULL;
+    }
+
+    while (position < max) {
+        PyObject* name;
+        PyObject* offset;
+        unsigned start = position;
+        unsigned char type = (unsigned char)string[position++];
+        int value_length;
+        int name_length = _element_name_length(string, position, max);
+        if (name_length < 0) {
+            goto fail;
+        }
+        name = _decode_element_name(self, string + position, name_length,
+                                    &options);
+        if (!name) {
+            goto fail;
+        }
+        position += (unsigned)name_length + 1;
+
+        /* Skip over the value by its length, without decoding it. */
+        value_length = _value_length(string, position, type, max - position);
+        if (value_length < 0) {
+            PyObject* InvalidBSON = _error("InvalidBSON");
+            if (InvalidBSON) {
+                PyErr_SetString(InvalidBSON, "invalid length or type code");
+                Py_DECREF(InvalidBSON);
             }
-            Py_DECREF(collection);
-            Py_DECREF(id);
+            Py_DECREF(name);
+            goto fail;
+        }
+        position += (unsigned)value_length;
+
+        /* Duplicate keys keep their first position in the key order but
+         * map to their last element, like a decoded document. */
+        if (!PyDict_GetItem(index, name) && PyList_Append(keys, name) < 0) {
+            Py_DECREF(name);
+            goto fail;
+        }
+#if PY_MAJOR_VERSION >= 3
+        offset = PyLong_FromUnsignedLong(start);
+#else
+        offset = PyInt_FromLong((long)start);
+#endif
+        if (!offset || PyDict_SetItem(index, name, offset) < 0) {
+            Py_XDECREF(offset);
+            Py_DECREF(name);
+            goto fail;
+        }
+        Py_DECREF(offset);
+        Py_DECREF(name);
+    }
+
+    if (position != max) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        if (InvalidBSON) {
+            PyErr_SetString(InvalidBSON, "bad object or element length");
+            Py_DECREF(InvalidBSON);
+        }
+        goto fail;
+    }
+
+    destroy_codec_options(&options);
+    return Py_BuildValue("NN", keys, index);
+
+fail:
+    Py_DECREF(keys);
+    Py_DECREF(index);
+    destroy_codec_options(&options);
+    return NULL;
+}
+
+/* Write an ASCII string to `buffer`.
+ *
+ * Returns 1 on success or 0 with MemoryError set on failure. */
+static int _json_write(buffer_t buffer, const char* data) {
+    return buffer_write_bytes(buffer, data, (int)strlen(data));
+}
+
+/* Write a code point of a JSON string, escaped like json.dumps does with
+ * ensure_ascii=True. Code points over 0xFFFF must already be split into
+ * surrogate pairs. */
+static int _json_write_char(buffer_t buffer, unsigned long c) {
+    char escaped[7];
+    const char* simple = NULL;
+    switch (c) {
+    case '"':
+        simple = "\\\"";
+        break;
+    case '\\':
+        simple = "\\\\";
+        break;
+    case '\n':
+        simple = "\\n";
+        break;
+    case '\r':
+        simple = "\\r";
+        break;
+    case '\t':
+        simple = "\\t";
+        break;
+    case '\b':
+        simple = "\\b";
+        break;
+    case '\f':
+        simple = "\\f";
+        break;
+    }
+    if (simple) {
+        return buffer_write_bytes(buffer, simple, 2);
+    }
+    if (c >= ' ' && c <= '~') {
+        char ascii = (char)c;
+        return buffer_write_bytes(buffer, &ascii, 1);
+    }
+    PyOS_snprintf(escaped, sizeof(escaped), "\\u%04lx", c);
+    return buffer_write_bytes(buffer, escaped, 6);
+}
+
+/* Write `length` bytes of UTF-8 as a JSON string.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int _json_write_string(buffer_t buffer, const char* string,
+                              unsigned length,
+                              const codec_options_t* options) {
+    unsigned i;
+    int ascii = 1;
+    for (i = 0; i < length; i++) {
+        if ((unsigned char)string[i] >= 0x80) {
+            ascii = 0;
             break;
         }
-    case 13:
-        {
-            PyObject* code;
-            PyObject* code_type;
-            unsigned value_length;
-            if (max < 4) {
-                goto invalid;
-            }
-            memcpy(&value_length, buffer + *position, 4);
-            /* Encoded string length + string */
-            if (!value_length || max < value_length || max < 4 + value_length) {
-                goto invalid;
-            }
-            *position += 4;
-            /* Strings must end in \0 */
-            if (buffer[*position + value_length - 1]) {
-                goto invalid;
+    }
+    if (!buffer_write_bytes(buffer, "\"", 1)) {
+        return 0;
+    }
+    if (ascii) {
+        for (i = 0; i < length; i++) {
+            if (!_json_write_char(buffer, (unsigned char)string[i])) {
+                return 0;
             }
-            code = PyUnicode_DecodeUTF8(
-                buffer + *position, value_length - 1,
-                options->unicode_decode_error_handler);
-            if (!code) {
-                goto invalid;
+        }
+    } else {
+        /* Decode like the decoder does, so invalid UTF-8 is handled the
+         * same way. */
+        Py_ssize_t j;
+        Py_ssize_t size;
+        PyObject* text = PyUnicode_DecodeUTF8(
+            string, length, options->unicode_decode_error_handler);
+        if (!text) {
+            return 0;
+        }
+#if PY_VERSION_HEX >= 0x03030000
+        if (PyUnicode_READY(text) == -1) {
+            Py_DECREF(text);
+            return 0;
+        }
+        size = PyUnicode_GET_LENGTH(text);
+        for (j = 0; j < size; j++) {
+            unsigned long c = PyUnicode_READ_CHAR(text, j);
+#else
+        size = PyUnicode_GET_SIZE(text);
+        for (j = 0; j < size; j++) {
+            /* Narrow builds store surrogate pairs already. */
+            unsigned long c = (unsigned long)PyUnicode_AS_UNICODE(text)[j];
+#endif
+            int ok;
+            if (c > 0xFFFF) {
+                c -= 0x10000;
+                ok = (_json_write_char(buffer, 0xD800 | (c >> 10)) &&
+                      _json_write_char(buffer, 0xDC00 | (c & 0x3FF)));
+            } else {
+                ok = _json_write_char(buffer, c);
             }
-            *position += value_length;
-            if ((code_type = _get_object(state->Code, "bson.code", "Code"))) {
-                value = PyObject_CallFunctionObjArgs(code_type, code, NULL, NULL);
-                Py_DECREF(code_type);
+            if (!ok) {
+                Py_DECREF(text);
+                return 0;
             }
-            Py_DECREF(code);
-            break;
         }
-    case 15:
-        {
-            unsigned c_w_s_size;
-            unsigned code_size;
-            unsigned scope_size;
-            PyObject* code;
-            PyObject* scope;
-            PyObject* code_type;
+        Py_DECREF(text);
+    }
+    return buffer_write_bytes(buffer, "\"", 1);
+}
 
-            if (max < 8) {
-                goto invalid;
-            }
+static int _json_write_int64(buffer_t buffer, long long value) {
+    /* Enough for -9223372036854775808. */
+    char digits[21];
+    int i = (int)sizeof(digits);
+    unsigned long long magnitude = value < 0 ?
+        0ULL - (unsigned long long)value : (unsigned long long)value;
+    do {
+        digits[--i] = (char)('0' + magnitude % 10);
+        magnitude /= 10;
+    } while (magnitude);
+    if (value < 0) {
+        digits[--i] = '-';
+    }
+    return buffer_write_bytes(buffer, digits + i, (int)sizeof(digits) - i);
+}
 
-            memcpy(&c_w_s_size, buffer + *position, 4);
-            *position += 4;
+static int _json_write_double(buffer_t buffer, double value) {
+    int result;
+#if PY_VERSION_HEX >= 0x02070000
+    char* repr;
+#else
+    PyObject* number;
+    PyObject* repr;
+#endif
+    /* Like json.dumps with allow_nan=True. */
+    if (Py_IS_NAN(value)) {
+        return _json_write(buffer, "NaN");
+    }
+    if (Py_IS_INFINITY(value)) {
+        return _json_write(buffer, value > 0 ? "Infinity" : "-Infinity");
+    }
+#if PY_VERSION_HEX >= 0x02070000
+    repr = PyOS_double_to_string(value, 'r', 0, Py_DTSF_ADD_DOT_0, NULL);
+    if (!repr) {
+        return 0;
+    }
+    result = _json_write(buffer, repr);
+    PyMem_Free(repr);
+#else
+    /* Python 2.6 has no PyOS_double_to_string: use repr(float). */
+    number = PyFloat_FromDouble(value);
+    if (!number) {
+        return 0;
+    }
+    repr = PyObject_Repr(number);
+    Py_DECREF(number);
+    if (!repr) {
+        return 0;
+    }
+    result = _json_write(buffer, PyString_AS_STRING(repr));
+    Py_DECREF(repr);
+#endif
+    return result;
+}
 
-            if (max < c_w_s_size) {
-                goto invalid;
-            }
+/* Write `length` bytes as lowercase hex digits in a JSON string. */
+static int _json_write_hex(buffer_t buffer, const char* data, int length) {
+    static const char hex[] = "0123456789abcdef";
+    int i;
+    if (!buffer_write_bytes(buffer, "\"", 1)) {
+        return 0;
+    }
+    for (i = 0; i < length; i++) {
+        char pair[2];
+        pair[0] = hex[((unsigned char)data[i]) >> 4];
+        pair[1] = hex[((unsigned char)data[i]) & 0xF];
+        if (!buffer_write_bytes(buffer, pair, 2)) {
+            return 0;
+        }
+    }
+    return buffer_write_bytes(buffer, "\"", 1);
+}
 
-            memcpy(&code_size, buffer + *position, 4);
-            /* code_w_scope length + code length + code + scope length */
-            if (!code_size || max < code_size || max < 4 + 4 + code_size + 4) {
-                goto invalid;
-            }
-            *position += 4;
-            /* Strings must end in \0 */
-            if (buffer[*position + code_size - 1]) {
-                goto invalid;
-            }
-            code = PyUnicode_DecodeUTF8(
-                buffer + *position, code_size - 1,
-                options->unicode_decode_error_handler);
-            if (!code) {
-                goto invalid;
-            }
-            *position += code_size;
+/* Write `length` bytes as base64 in a JSON string. */
+static int _json_write_base64(buffer_t buffer, const unsigned char* data,
+                              unsigned length) {
+    static const char alphabet[] =
+        "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+    unsigned i;
+    if (!buffer_write_bytes(buffer, "\"", 1)) {
+        return 0;
+    }
+    for (i = 0; i < length; i += 3) {
+        char quad[4];
+        unsigned long triple = (unsigned long)data[i] << 16;
+        if (i + 1 < length) {
+            triple |= (unsigned long)data[i + 1] << 8;
+        }
+        if (i + 2 < length) {
+            triple |= data[i + 2];
+        }
+        quad[0] = alphabet[(triple >> 18) & 0x3F];
+        quad[1] = alphabet[(triple >> 12) & 0x3F];
+        quad[2] = i + 1 < length ? alphabet[(triple >> 6) & 0x3F] : '=';
+        quad[3] = i + 2 < length ? alphabet[triple & 0x3F] : '=';
+        if (!buffer_write_bytes(buffer, quad, 4)) {
+            return 0;
+        }
+    }
+    return buffer_write_bytes(buffer, "\"", 1);
+}
 
-            memcpy(&scope_size, buffer + *position, 4);
-            if (scope_size < BSON_MIN_SIZE) {
-                Py_DECREF(code);
-                goto invalid;
-            }
-            /* code length + code + scope length + scope */
-            if ((4 + code_size + 4 + scope_size) != c_w_s_size) {
-                Py_DECREF(code);
-                goto invalid;
-            }
+/* Write a UUID stored in `options->uuid_rep` byte order as {"$uuid": hex},
+ * like json_util.dumps does for a uuid.UUID. */
+static int _json_write_uuid(buffer_t buffer, const char* data,
+                            const codec_options_t* options) {
+    char big_endian[16];
+    if (options->uuid_rep == JAVA_LEGACY) {
+        _fix_java(data, big_endian);
+    } else if (options->uuid_rep == CSHARP_LEGACY) {
+        /* uuid.UUID(bytes_le=...) */
+        int i;
+        for (i = 0; i < 4; i++) {
+            big_endian[i] = data[3 - i];
+        }
+        big_endian[4] = data[5];
+        big_endian[5] = data[4];
+        big_endian[6] = data[7];
+        big_endian[7] = data[6];
+        memcpy(big_endian + 8, data + 8, 8);
+    } else {
+        memcpy(big_endian, data, 16);
+    }
+    return (_json_write(buffer, "{\"$uuid\": ") &&
+            _json_write_hex(buffer, big_endian, 16) &&
+            _json_write(buffer, "}"));
+}
 
-            /* Check for bad eoo */
-            if (buffer[*position + scope_size - 1]) {
-                goto invalid;
-            }
-            scope = elements_to_dict(self, buffer + *position + 4,
-                                     scope_size - 5, options);
-            if (!scope) {
-                Py_DECREF(code);
-                goto invalid;
-            }
-            *position += scope_size;
+static int _json_write_document(buffer_t buffer, const char* string,
+                                unsigned position, unsigned max,
+                                int is_array,
+                                const codec_options_t* options);
 
-            if ((code_type = _get_object(state->Code, "bson.code", "Code"))) {
-                value = PyObject_CallFunctionObjArgs(code_type, code, scope, NULL);
-                Py_DECREF(code_type);
-            }
-            Py_DECREF(code);
-            Py_DECREF(scope);
-            break;
-        }
-    case 16:
+/* Write the BSON string (int32 length, bytes, NUL) at `string + position`
+ * as a JSON string. `max` is the number of bytes available.
+ *
+ * Returns the string's length including its length prefix, or -1 on
+ * failure. */
+static int _json_write_bson_string(buffer_t buffer, const char* string,
+                                   unsigned position, unsigned max,
+                                   const codec_options_t* options) {
+    int length = _value_length(string, position, 2, max);
+    if (length < 0 || string[position + length - 1]) {
+        return -1;
+    }
+    if (!_json_write_string(buffer, string + position + 4,
+                            (unsigned)length - 5, options)) {
+        return -1;
+    }
+    return length;
+}
+
+/* Write the value of type `type` at `string + position` as JSON. `max` is
+ * the position of the enclosing document's terminating NUL.
+ *
+ * Returns the position after the value, or -1 on failure. */
+static int _json_write_value(buffer_t buffer, const char* string,
+                             unsigned position, unsigned char type,
+                             unsigned max, const codec_options_t* options) {
+    const char* value = string + position;
+    int length = _value_length(string, position, type, max - position);
+    if (length < 0) {
+        goto invalid;
+    }
+    switch (type) {
+    case 1:
         {
-            int i;
-            if (max < 4) {
-                goto invalid;
-            }
-            memcpy(&i, buffer + *position, 4);
-#if PY_MAJOR_VERSION >= 3
-            value = PyLong_FromLong(i);
-#else
-            value = PyInt_FromLong(i);
-#endif
-            if (!value) {
-                goto invalid;
+            double d;
+            memcpy(&d, value, 8);
+            if (!_json_write_double(buffer, d)) {
+                return -1;
             }
-            *position += 4;
             break;
         }
-    case 17:
+    case 2:
+    case 14:
+        if (_json_write_bson_string(buffer, string, position,
+                                    max - position, options) < 0) {
+            goto error;
+        }
+        break;
+    case 3:
+    case 4:
+        if (!_json_write_document(buffer, string, position,
+                                  position + (unsigned)length - 1,
+                                  type == 4, options)) {
+            return -1;
+        }
+        break;
+    case 5:
         {
-            unsigned int time, inc;
-            PyObject* timestamp_type;
-            if (max < 8) {
-                goto invalid;
+            unsigned data_length;
+            unsigned char subtype = (unsigned char)value[4];
+            char type_code[32];
+            memcpy(&data_length, value, 4);
+            if (subtype == 3 || subtype == 4) {
+                if (data_length != 16) {
+                    goto invalid;
+                }
+                if (!_json_write_uuid(buffer, value + 5, options)) {
+                    return -1;
+                }
+                break;
             }
-            memcpy(&inc, buffer + *position, 4);
-            memcpy(&time, buffer + *position + 4, 4);
-            if ((timestamp_type = _get_object(state->Timestamp, "bson.timestamp", "Timestamp"))) {
-                value = PyObject_CallFunction(timestamp_type, "II", time, inc);
-                Py_DECREF(timestamp_type);
+            value += 5;
+            if (subtype == 2) {
+                /* The old binary subtype repeats the length. */
+                if (data_length < 4) {
+                    goto invalid;
+                }
+                value += 4;
+                data_length -= 4;
             }
-            *position += 8;
-            break;
-        }
-    case 18:
-        {
-            long long ll;
-            PyObject* bson_int64_type = _get_object(state->BSONInt64,
-                                                    "bson.int64", "Int64");
-            if (!bson_int64_type)
-                goto invalid;
-            if (max < 8) {
-                Py_DECREF(bson_int64_type);
-                goto invalid;
+            PyOS_snprintf(type_code, sizeof(type_code),
+                          ", \"$type\": \"%02x\"}", subtype);
+            if (!(_json_write(buffer, "{\"$binary\": ") &&
+                  _json_write_base64(
+                      buffer, (const unsigned char*)value, data_length) &&
+                  _json_write(buffer, type_code))) {
+                return -1;
             }
-            memcpy(&ll, buffer + *position, 8);
-            value = PyObject_CallFunction(bson_int64_type, "L", ll);
-            *position += 8;
-            Py_DECREF(bson_int64_type);
             break;
         }
-    case 255:
+    case 6:
+    case 10:
+        if (!_json_write(buffer, "null")) {
+            return -1;
+        }
+        break;
+    case 7:
+        if (!(_json_write(buffer, "{\"$oid\": ") &&
+              _json_write_hex(buffer, value, 12) &&
+              _json_write(buffer, "}"))) {
+            return -1;
+        }
+        break;
+    case 8:
+        if (!_json_write(buffer, *value ? "true" : "false")) {
+            return -1;
+        }
+        break;
+    case 9:
         {
-            PyObject* minkey_type = _get_object(state->MinKey, "bson.min_key", "MinKey");
-            if (!minkey_type)
-                goto invalid;
-            value = PyObject_CallFunctionObjArgs(minkey_type, NULL);
-            Py_DECREF(minkey_type);
+            long long millis;
+            memcpy(&millis, value, 8);
+            if (!(_json_write(buffer, "{\"$date\": ") &&
+                  _json_write_int64(buffer, millis) &&
+                  _json_write(buffer, "}"))) {
+                return -1;
+            }
             break;
         }
-    case 127:
+    case 11:
         {
-            PyObject* maxkey_type = _get_object(state->MaxKey, "bson.max_key", "MaxKey");
-            if (!maxkey_type)
-                goto invalid;
-            value = PyObject_CallFunctionObjArgs(maxkey_type, NULL);
-            Py_DECREF(maxkey_type);
+            /* Write the flags json_util.dumps would write for a Regex
+             * decoded from this value, in the same order. */
+            const char* flags = value + strlen(value) + 1;
+            const char* flag;
+            if (!(_json_write(buffer, "{\"$regex\": ") &&
+                  _json_write_string(buffer, value, (unsigned)strlen(value),
+                                     options) &&
+                  _json_write(buffer, ", \"$options\": \""))) {
+                goto error;
+            }
+            for (flag = "ilmsux"; *flag; flag++) {
+                if (strchr(flags, *flag) &&
+                        !buffer_write_bytes(buffer, flag, 1)) {
+                    return -1;
+                }
+            }
+            if (!_json_write(buffer, "\"}")) {
+                return -1;
+            }
             break;
         }
-    default:
+    case 12:
         {
-            PyObject* InvalidDocument = _error("InvalidDocument");
-            if (InvalidDocument) {
-                PyErr_SetString(InvalidDocument,
-                                "no c decoder for this type yet");
-                Py_DECREF(InvalidDocument);
+            int collection_length;
+            if (!_json_write(buffer, "{\"$ref\": ")) {
+                return -1;
             }
-            goto invalid;
+            collection_length = _json_write_bson_string(
+                buffer, string, position, max - position, options);
+            if (collection_length < 0) {
+                goto error;
+            }
+            if (!(_json_write(buffer, ", \"$id\": {\"$oid\": ") &&
+                  _json_write_hex(buffer, value + collection_length, 12) &&
+                  _json_write(buffer, "}}"))) {
+                return -1;
+            }
+            break;
         }
-    }
-
-    if (value) {
-        return value;
-    }
-
-    invalid:
-
-    /*
-     * Wrap any non-InvalidBSON errors in InvalidBSON.
-     */
-    if (PyErr_Occurred()) {
-        PyObject *etype, *evalue, *etrace;
-        PyObject *InvalidBSON;
-
-        /*
-         * Calling _error clears the error state, so fetch it first.
-         */
-        PyErr_Fetch(&etype, &evalue, &etrace);
-        InvalidBSON = _error("InvalidBSON");
-        if (InvalidBSON) {
-            if (!PyErr_GivenExceptionMatches(etype, InvalidBSON)) {
-                /*
-                 * Raise InvalidBSON(str(e)).
-                 */
-                Py_DECREF(etype);
-                etype = InvalidBSON;
-
-                if (evalue) {
-                    PyObject *msg = PyObject_Str(evalue);
-                    Py_DECREF(evalue);
-                    evalue = msg;
-                }
-                PyErr_NormalizeException(&etype, &evalue, &etrace);
-            } else {
-                /*
-                 * The current exception matches InvalidBSON, so we don't need
-                 * this reference after all.
-                 */
-                Py_DECREF(InvalidBSON);
+    case 13:
+        if (!_json_write(buffer, "{\"$code\": ") ||
+                _json_write_bson_string(buffer, string, position,
+                                        max - position, options) < 0) {
+            goto error;
+        }
+        if (!_json_write(buffer, ", \"$scope\": {}}")) {
+            return -1;
+        }
+        break;
+    case 15:
+        {
+            int code_length;
+            unsigned scope_position;
+            int scope_size;
+            if (!_json_write(buffer, "{\"$code\": ")) {
+                return -1;
+            }
+            code_length = _json_write_bson_string(
+                buffer, string, position + 4, (unsigned)length - 4, options);
+            if (code_length < 0) {
+                goto error;
+            }
+            scope_position = position + 4 + (unsigned)code_length;
+            scope_size = _value_length(string, scope_position, 3,
+                                       position + (unsigned)length -
+                                       scope_position);
+            if (scope_size < 0 ||
+                    scope_position + scope_size != position + length) {
+                goto invalid;
+            }
+            /* Code in the scope is written as $code too, not as a string
+             * like json_util.dumps writes it. */
+            if (!_json_write(buffer, ", \"$scope\": ") ||
+                    !_json_write_document(buffer, string, scope_position,
+                                          position + (unsigned)length - 1,
+                                          0, options) ||
+                    !_json_write(buffer, "}")) {
+                return -1;
             }
+            break;
         }
-        /* Steals references to args. */
-        PyErr_Restore(etype, evalue, etrace);
-    } else {
-        PyObject *InvalidBSON = _error("InvalidBSON");
-        if (InvalidBSON) {
-            PyErr_SetString(InvalidBSON, "invalid length or type code");
-            Py_DECREF(InvalidBSON);
+    case 16:
+        {
+            int i;
+            memcpy(&i, value, 4);
+            if (!_json_write_int64(buffer, i)) {
+                return -1;
+            }
+            break;
+        }
+    case 17:
+        {
+            unsigned int inc;
+            unsigned int time;
+            memcpy(&inc, value, 4);
+            memcpy(&time, value + 4, 4);
+            if (!(_json_write(buffer, "{\"$timestamp\": {\"t\": ") &&
+                  _json_write_int64(buffer, time) &&
+                  _json_write(buffer, ", \"i\": ") &&
+                  _json_write_int64(buffer, inc) &&
+                  _json_write(buffer, "}}"))) {
+                return -1;
+            }
+            break;
+        }
+    case 18:
+        {
+            long long ll;
+            memcpy(&ll, value, 8);
+            if (!_json_write_int64(buffer, ll)) {
+                return -1;
+            }
+            break;
         }
+    case 127:
+        if (!_json_write(buffer, "{\"$maxKey\": 1}")) {
+            return -1;
+        }
+        break;
+    case 255:
+        if (!_json_write(buffer, "{\"$minKey\": 1}")) {
+            return -1;
+        }
+        break;
+    default:
+        goto invalid;
     }
-    return NULL;
+    return (int)position + length;
+
+error:
+    /* Keep a decoding error, otherwise the value is invalid. */
+    if (PyErr_Occurred()) {
+        return -1;
+    }
+invalid:
+    _set_invalid_bson("invalid length or type code");
+    return -1;
 }
 
-static PyObject* _elements_to_dict(PyObject* self, const char* string,
-                                   unsigned max,
-                                   const codec_options_t* options) {
-    unsigned position = 0;
-    PyObject* dict = PyObject_CallObject(options->document_class, NULL);
-    if (!dict) {
-        return NULL;
+/* Write the document or array at `string + position` as JSON. Its
+ * terminating NUL must be at `string + max`.
+ *
+ * Returns 1 on success or 0 with an exception set on failure. */
+static int _json_write_document(buffer_t buffer, const char* string,
+                                unsigned position, unsigned max,
+                                int is_array,
+                                const codec_options_t* options) {
+    int first = 1;
+    if (string[max]) {
+        _set_invalid_bson("bad eoo");
+        return 0;
+    }
+    if (!buffer_write_bytes(buffer, is_array ? "[" : "{", 1)) {
+        return 0;
     }
+    position += 4;
     while (position < max) {
-        PyObject* name;
-        PyObject* value;
-
         unsigned char type = (unsigned char)string[position++];
-        size_t name_length = strlen(string + position);
-        if (name_length > BSON_MAX_SIZE || position + name_length >= max) {
-            PyObject* InvalidBSON = _error("InvalidBSON");
-            if (InvalidBSON) {
-                PyErr_SetNone(InvalidBSON);
-                Py_DECREF(InvalidBSON);
-            }
-            Py_DECREF(dict);
-            return NULL;
+        int name_length = _element_name_length(string, position, max);
+        int new_position;
+        if (name_length < 0) {
+            return 0;
         }
-        name = PyUnicode_DecodeUTF8(
-            string + position, name_length,
-            options->unicode_decode_error_handler);
-        if (!name) {
-            /* If NULL is returned then wrap the UnicodeDecodeError
-               in an InvalidBSON error */
-            PyObject *etype, *evalue, *etrace;
-            PyObject *InvalidBSON;
-
-            PyErr_Fetch(&etype, &evalue, &etrace);
-            InvalidBSON = _error("InvalidBSON");
-            if (InvalidBSON) {
-                Py_DECREF(etype);
-                etype = InvalidBSON;
-
-                if (evalue) {
-                    PyObject *msg = PyObject_Str(evalue);
-                    Py_DECREF(evalue);
-                    evalue = msg;
-                }
-                PyErr_NormalizeException(&etype, &evalue, &etrace);
+        if (!first && !buffer_write_bytes(buffer, ", ", 2)) {
+            return 0;
+        }
+        first = 0;
+        if (!is_array) {
+            if (!_json_write_string(buffer, string + position,
+                                    (unsigned)name_length, options) ||
+                    !buffer_write_bytes(buffer, ": ", 2)) {
+                return 0;
             }
-            PyErr_Restore(etype, evalue, etrace);
-            Py_DECREF(dict);
-            return NULL;
         }
         position += (unsigned)name_length + 1;
-        value = get_value(self, string, &position, type,
-                          max - position, options);
-        if (!value) {
-            Py_DECREF(name);
-            Py_DECREF(dict);
-            return NULL;
+        new_position = _json_write_value(buffer, string, position, type,
+                                         max, options);
+        if (new_position < 0) {
+            return 0;
         }
-
-        PyObject_SetItem(dict, name, value);
-        Py_DECREF(name);
-        Py_DECREF(value);
+        position = (unsigned)new_position;
     }
-    return dict;
-}
-
-static PyObject* elements_to_dict(PyObject* self, const char* string,
-                                  unsigned max,
-                                  const codec_options_t* options) {
-    PyObject* result;
-    if (Py_EnterRecursiveCall(" while decoding a BSON document"))
-        return NULL;
-    result = _elements_to_dict(self, string, max, options);
-    Py_LeaveRecursiveCall();
-    return result;
+    if (position != max) {
+        _set_invalid_bson("bad object or element length");
+        return 0;
+    }
+    return buffer_write_bytes(buffer, is_array ? "]" : "}", 1);
 }
 
-static PyObject* _cbson_bson_to_dict(PyObject* self, PyObject* args) {
+static PyObject* _cbson_bson_to_json(PyObject* self, PyObject* args) {
     int size;
-    Py_ssize_t total_size;
     const char* string;
     PyObject* bson;
+    PyObject* result = NULL;
+    Py_buffer view;
     codec_options_t options;
-    PyObject* result;
+    buffer_t buffer;
 
     if (!PyArg_ParseTuple(
             args, "OO&", &bson, convert_codec_options, &options)) {
         return NULL;
     }
-
-#if PY_MAJOR_VERSION >= 3
-    if (!PyBytes_Check(bson)) {
-        PyErr_SetString(PyExc_TypeError, "argument to _bson_to_dict must be a bytes object");
-#else
-    if (!PyString_Check(bson)) {
-        PyErr_SetString(PyExc_TypeError, "argument to _bson_to_dict must be a string");
-#endif
-        destroy_codec_options(&options);
-        return NULL;
-    }
-#if PY_MAJOR_VERSION >= 3
-    total_size = PyBytes_Size(bson);
-#else
-    total_size = PyString_Size(bson);
-#endif
-    if (total_size < BSON_MIN_SIZE) {
-        PyObject* InvalidBSON = _error("InvalidBSON");
-        if (InvalidBSON) {
-            PyErr_SetString(InvalidBSON,
-                            "not enough data for a BSON document");
-            Py_DECREF(InvalidBSON);
-        }
-        destroy_codec_options(&options);
-        return NULL;
-    }
-
-#if PY_MAJOR_VERSION >= 3
-    string = PyBytes_AsString(bson);
-#else
-    string = PyString_AsString(bson);
-#endif
-    if (!string) {
-        destroy_codec_options(&options);
-        return NULL;
-    }
-
-    memcpy(&size, string, 4);
-    if (size < BSON_MIN_SIZE) {
-        PyObject* InvalidBSON = _error("InvalidBSON");
-        if (InvalidBSON) {
-            PyErr_SetString(InvalidBSON, "invalid message size");
-            Py_DECREF(InvalidBSON);
-        }
-        destroy_codec_options(&options);
-        return NULL;
-    }
-
-    if (total_size < size || total_size > BSON_MAX_SIZE) {
-        PyObject* InvalidBSON = _error("InvalidBSON");
-        if (InvalidBSON) {
-            PyErr_SetString(InvalidBSON, "objsize too large");
-            Py_DECREF(InvalidBSON);
-        }
-        destroy_codec_options(&options);
-        return NULL;
-    }
-
-    if (size != total_size || string[size - 1]) {
-        PyObject* InvalidBSON = _error("InvalidBSON");
-        if (InvalidBSON) {
-            PyErr_SetString(InvalidBSON, "bad eoo");
-            Py_DECREF(InvalidBSON);
-        }
+    if (!_get_buffer(bson, &view, "_bson_to_json")) {
         destroy_codec_options(&options);
         return NULL;
     }
-
-    result = elements_to_dict(self, string + 4, (unsigned)size - 5, &options);
-    destroy_codec_options(&options);
-    return result;
-}
-
-static PyObject* _cbson_decode_all(PyObject* self, PyObject* args) {
-    int size;
-    Py_ssize_t total_size;
-    const char* string;
-    PyObject* bson;
-    PyObject* dict;
-    PyObject* result;
-    codec_options_t options;
-
-    if (!PyArg_ParseTuple(
-            args, "O|O&",
-            &bson, convert_codec_options, &options)) {
-        return NULL;
+    string = (const char*)view.buf;
+    if ((size = _next_document_size(string, view.len)) < 0) {
+        goto done;
     }
-
-    if (PyTuple_GET_SIZE(args) < 2) {
-        default_codec_options(&options);
+    if (size != view.len) {
+        _set_invalid_bson("invalid object size");
+        goto done;
     }
-
-#if PY_MAJOR_VERSION >= 3
-    if (!PyBytes_Check(bson)) {
-        PyErr_SetString(PyExc_TypeError, "argument to decode_all must be a bytes object");
-#else
-    if (!PyString_Check(bson)) {
-        PyErr_SetString(PyExc_TypeError, "argument to decode_all must be a string");
-#endif
-        return NULL;
+    buffer = buffer_new();
+    if (!buffer) {
+        PyErr_NoMemory();
+        goto done;
     }
+    if (_json_write_document(buffer, string, 0, (unsigned)size - 1, 0,
+                             &options)) {
+        /* The JSON text is ASCII. */
 #if PY_MAJOR_VERSION >= 3
-    total_size = PyBytes_Size(bson);
-    string = PyBytes_AsString(bson);
+        result = PyUnicode_DecodeASCII(buffer_get_buffer(buffer),
+                                       buffer_get_position(buffer), "strict");
 #else
-    total_size = PyString_Size(bson);
-    string = PyString_AsString(bson);
+        result = PyString_FromStringAndSize(buffer_get_buffer(buffer),
+                                            buffer_get_position(buffer));
 #endif
-    if (!string) {
-        return NULL;
-    }
-
-    if (!(result = PyList_New(0))) {
-        destroy_codec_options(&options);
-        return NULL;
-    }
-
-    while (total_size > 0) {
-        if (total_size < BSON_MIN_SIZE) {
-            PyObject* InvalidBSON = _error("InvalidBSON");
-            if (InvalidBSON) {
-                PyErr_SetString(InvalidBSON,
-                                "not enough data for a BSON document");
-                Py_DECREF(InvalidBSON);
-            }
-            destroy_codec_options(&options);
-            Py_DECREF(result);
-            return NULL;
-        }
-
-        memcpy(&size, string, 4);
-        if (size < BSON_MIN_SIZE) {
-            PyObject* InvalidBSON = _error("InvalidBSON");
-            if (InvalidBSON) {
-                PyErr_SetString(InvalidBSON, "invalid message size");
-                Py_DECREF(InvalidBSON);
-            }
-            destroy_codec_options(&options);
-            Py_DECREF(result);
-            return NULL;
-        }
-
-        if (total_size < size) {
-            PyObject* InvalidBSON = _error("InvalidBSON");
-            if (InvalidBSON) {
-                PyErr_SetString(InvalidBSON, "objsize too large");
-                Py_DECREF(InvalidBSON);
-            }
-            destroy_codec_options(&options);
-            Py_DECREF(result);
-            return NULL;
-        }
-
-        if (string[size - 1]) {
-            PyObject* InvalidBSON = _error("InvalidBSON");
-            if (InvalidBSON) {
-                PyErr_SetString(InvalidBSON, "bad eoo");
-                Py_DECREF(InvalidBSON);
-            }
-            destroy_codec_options(&options);
-            Py_DECREF(result);
-            return NULL;
-        }
-
-        dict = elements_to_dict(self, string + 4, (unsigned)size - 5, &options);
-        if (!dict) {
-            Py_DECREF(result);
-            destroy_codec_options(&options);
-            return NULL;
-        }
-        PyList_Append(result, dict);
-        Py_DECREF(dict);
-        string += size;
-        total_size -= size;
     }
+    buffer_free(buffer);
 
+done:
+    PyBuffer_Release(&view);
     destroy_codec_options(&options);
     return result;
 }
@@ -2547,10 +5325,28 @@ static PyObject* _cbson_decode_all(PyObject* self, PyObject* args) {
 static PyMethodDef _CBSONMethods[] = {
     {"_dict_to_bson", _cbson_dict_to_bson, METH_VARARGS,
      "convert a dictionary to a string containing its BSON representation."},
+    {"_element_to_bson", _cbson_element_to_bson, METH_VARARGS,
+     "convert a key and value to a string containing a BSON element."},
+    {"_encode_many", _cbson_encode_many, METH_VARARGS,
+     "encode a sequence of documents into one string."},
+    {"_encoded_size", _cbson_encoded_size, METH_VARARGS,
+     "compute the size of a dictionary's BSON representation."},
+    {"_encode_schema", _cbson_encode_schema, METH_VARARGS,
+     "encode a document with a compiled schema."},
     {"_bson_to_dict", _cbson_bson_to_dict, METH_VARARGS,
      "convert a BSON string to a SON object."},
     {"decode_all", _cbson_decode_all, METH_VARARGS,
      "convert binary data to a sequence of documents."},
+    {"_element_to_dict", _cbson_element_to_dict, METH_VARARGS,
+     "Decode a single key, value pair."},
+    {"_raw_element_index", _cbson_raw_element_index, METH_VARARGS,
+     "Map the keys of a BSON document to the positions of their elements."},
+    {"_decode_columns", _cbson_decode_columns, METH_VARARGS,
+     "Decode concatenated BSON documents into a column per field."},
+    {"_validate", _cbson_validate, METH_VARARGS,
+     "Return the offsets of invalid documents in concatenated BSON."},
+    {"_bson_to_json", _cbson_bson_to_json, METH_VARARGS,
+     "Convert a BSON document to MongoDB Extended JSON text."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -2571,6 +5367,13 @@ static int _cbson_traverse(PyObject *m, visitproc visit, void *arg) {
     return 0;
 }
 
+static void _clear_key_cache(struct module_state* state) {
+    int i;
+    for (i = 0; i < KEY_CACHE_SIZE; i++) {
+        Py_CLEAR(state->key_cache[i].key);
+    }
+}
+
 static int _cbson_clear(PyObject *m) {
     Py_CLEAR(GETSTATE(m)->Binary);
     Py_CLEAR(GETSTATE(m)->Code);
@@ -2583,6 +5386,7 @@ static int _cbson_clear(PyObject *m) {
     Py_CLEAR(GETSTATE(m)->MaxKey);
     Py_CLEAR(GETSTATE(m)->UTC);
     Py_CLEAR(GETSTATE(m)->REType);
+    _clear_key_cache(GETSTATE(m));
     return 0;
 }
 
@@ -58,6 +58,18 @@ typedef struct codec_options_t {
     unsigned char uuid_rep;
     char* unicode_decode_error_handler;
     PyObject* tzinfo;
+    PyObject* options_obj;
+    unsigned char is_raw_bson;
+    /* Decode datetimes to bson.datetime_ms.DatetimeMS. */
+    unsigned char datetime_ms;
+    /* Decode binary subtype 0 to memoryviews of the data being decoded. */
+    unsigned char binary_memoryview;
+    /* While decoding with binary_memoryview, a read-only memoryview of the
+     * data being decoded and the address of its first byte, or NULL. */
+    PyObject* source_view;
+    const char* source_start;
+    /* Fields to decode (see _field_tree), or NULL to decode all fields. */
+    PyObject* fields;
 } codec_options_t;
 
 /* C API functions */
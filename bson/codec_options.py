@@ -18,16 +18,51 @@ import datetime
 
 from collections import MutableMapping, namedtuple
 
-from bson.py3compat import string_type
+from bson.py3compat import string_type, text_type, PY3, HAVE_MEMORYVIEW
 from bson.binary import (ALL_UUID_REPRESENTATIONS,
                          PYTHON_LEGACY,
                          UUID_REPRESENTATION_NAMES)
 
 
+_RAW_BSON_DOCUMENT_MARKER = 101
+
+
+def _raw_document_class(document_class):
+    """Determine if a document_class is a RawBSONDocument class."""
+    marker = getattr(document_class, '_type_marker', None)
+    return marker == _RAW_BSON_DOCUMENT_MARKER
+
+
+def _validate_decode_fields(decode_fields):
+    """Validate the decode_fields option, returning a frozenset of unicode
+    field names.
+    """
+    if isinstance(decode_fields, (string_type, bytes)):
+        raise TypeError("decode_fields must be an iterable of field names, "
+                        "not a single string")
+    try:
+        names = list(decode_fields)
+    except TypeError:
+        raise TypeError("decode_fields must be an iterable of field names")
+    fields = set()
+    for name in names:
+        if not PY3 and isinstance(name, str):
+            name = name.decode('utf-8')
+        if not isinstance(name, text_type):
+            raise TypeError("each field name in decode_fields must be a "
+                            "string, not %r" % (name,))
+        if not all(name.split(".")):
+            raise ValueError("invalid field name in decode_fields: %r" %
+                             (name,))
+        fields.add(name)
+    return frozenset(fields)
+
+
 _options_base = namedtuple(
     'CodecOptions',
     ('document_class', 'tz_aware', 'uuid_representation',
-     'unicode_decode_error_handler', 'tzinfo'))
+     'unicode_decode_error_handler', 'tzinfo', 'decode_fields',
+     'datetime_ms', 'binary_memoryview'))
 
 
 class CodecOptions(_options_base):
@@ -36,7 +71,8 @@ class CodecOptions(_options_base):
     :Parameters:
       - `document_class`: BSON documents returned in queries will be decoded
         to an instance of this class. Must be a subclass of
-        :class:`~collections.MutableMapping`. Defaults to :class:`dict`.
+        :class:`~collections.MutableMapping`, or
+        :class:`~bson.raw_bson.RawBSONDocument`. Defaults to :class:`dict`.
       - `tz_aware`: If ``True``, BSON datetimes will be decoded to timezone
         aware instances of :class:`~datetime.datetime`. Otherwise they will be
         naive. Defaults to ``False``.
@@ -56,16 +92,43 @@ class CodecOptions(_options_base):
       - `tzinfo`: A :class:`~datetime.tzinfo` subclass that specifies the
         timezone to/from which :class:`~datetime.datetime` objects should be
         encoded/decoded.
-
+      - `decode_fields`: An iterable of field names to decode, using dot
+        notation to select fields of embedded documents (e.g.
+        ``['_id', 'address.city']``). All other fields are skipped over
+        without being decoded, which is much faster than decoding the whole
+        document when only a few fields of large documents are needed.
+        Dotted names also apply to documents embedded in arrays. Defaults
+        to ``None``, meaning decode all fields. Cannot be used with
+        :class:`~bson.raw_bson.RawBSONDocument`, which already decodes
+        fields only when they are accessed.
+      - `datetime_ms`: If ``True``, BSON datetimes will be decoded to
+        :class:`~bson.datetime_ms.DatetimeMS`, an integer number of
+        milliseconds since the epoch, instead of
+        :class:`~datetime.datetime`. `tz_aware` and `tzinfo` are then only
+        used by :meth:`~bson.datetime_ms.DatetimeMS.as_datetime`. Defaults
+        to ``False``.
+      - `binary_memoryview`: If ``True``, BSON binary subtype 0 will be
+        decoded to a read-only :class:`memoryview` of the data being
+        decoded, instead of being copied to :class:`bytes` (python 3) or
+        :class:`~bson.binary.Binary` (python 2). Each view keeps the whole
+        buffer it was decoded from alive. Requires python 2.7 or later.
+        Defaults to ``False``.
+
+    .. versionchanged:: 3.1
+       Added the `decode_fields`, `datetime_ms` and `binary_memoryview`
+       options.
     """
 
     def __new__(cls, document_class=dict,
                 tz_aware=False, uuid_representation=PYTHON_LEGACY,
                 unicode_decode_error_handler="strict",
-                tzinfo=None):
-        if not issubclass(document_class, MutableMapping):
-            raise TypeError("document_class must be dict, bson.son.SON, or "
-                            "another subclass of collections.MutableMapping")
+                tzinfo=None, decode_fields=None, datetime_ms=False,
+                binary_memoryview=False):
+        if not (issubclass(document_class, MutableMapping) or
+                _raw_document_class(document_class)):
+            raise TypeError("document_class must be dict, bson.son.SON, "
+                            "bson.raw_bson.RawBSONDocument, or a "
+                            "subclass of collections.MutableMapping")
         if not isinstance(tz_aware, bool):
             raise TypeError("tz_aware must be True or False")
         if uuid_representation not in ALL_UUID_REPRESENTATIONS:
@@ -81,10 +144,23 @@ class CodecOptions(_options_base):
             if not tz_aware:
                 raise ValueError(
                     "cannot specify tzinfo without also setting tz_aware=True")
+        if not isinstance(datetime_ms, bool):
+            raise TypeError("datetime_ms must be True or False")
+        if not isinstance(binary_memoryview, bool):
+            raise TypeError("binary_memoryview must be True or False")
+        if binary_memoryview and not HAVE_MEMORYVIEW:
+            raise ValueError("binary_memoryview requires python 2.7 or later")
+        if decode_fields is not None:
+            decode_fields = _validate_decode_fields(decode_fields)
+            if _raw_document_class(document_class):
+                raise ValueError(
+                    "cannot specify decode_fields with a RawBSONDocument "
+                    "document_class")
 
         return tuple.__new__(
             cls, (document_class, tz_aware, uuid_representation,
-                  unicode_decode_error_handler, tzinfo))
+                  unicode_decode_error_handler, tzinfo, decode_fields,
+                  datetime_ms, binary_memoryview))
 
     def __repr__(self):
         document_class_repr = (
@@ -96,10 +172,14 @@ class CodecOptions(_options_base):
 
         return (
             'CodecOptions(document_class=%s, tz_aware=%r, uuid_representation='
-            '%s, unicode_decode_error_handler=%r, tzinfo=%r)' %
+            '%s, unicode_decode_error_handler=%r, tzinfo=%r, '
+            'decode_fields=%r, datetime_ms=%r, binary_memoryview=%r)' %
             (document_class_repr, self.tz_aware, uuid_rep_repr,
              self.unicode_decode_error_handler,
-             self.tzinfo))
+             self.tzinfo,
+             None if self.decode_fields is None
+             else sorted(self.decode_fields),
+             self.datetime_ms, self.binary_memoryview))
 
 
 DEFAULT_CODEC_OPTIONS = CodecOptions()
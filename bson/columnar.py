@@ -0,0 +1,164 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tools for decoding BSON documents into columns of NumPy arrays.
+
+This module requires `NumPy <http://www.numpy.org/>`_.
+
+.. versionadded:: 3.1
+"""
+
+from collections import namedtuple
+
+import numpy
+
+from bson import (_decode_columns,
+                  _get_date,
+                  _get_float,
+                  _get_int64)
+from bson.codec_options import CodecOptions, DEFAULT_CODEC_OPTIONS
+from bson.py3compat import PY3
+from bson.son import SON
+
+
+_DOUBLE = 1
+_BOOLEAN = 8
+_DATETIME = 9
+_NULL = 10
+_UNDEFINED = 6
+_INT32 = 16
+_INT64 = 18
+
+# How to decode a value stored in a column's values array, when the column
+# is an object array.
+_NUMBER_GETTER = {
+    _DOUBLE: _get_float,
+    _DATETIME: _get_date,
+    _INT64: _get_int64,
+}
+
+
+class Column(namedtuple('Column', ('values', 'mask'))):
+    """The values of one field of a sequence of documents.
+
+    `values` is a :class:`numpy.ndarray` with the field's value in each
+    document, and `mask` is a boolean :class:`numpy.ndarray` that is ``True``
+    where the field has a value, and ``False`` where it is missing, null, or
+    undefined. The masked elements of `values` are zero, or ``None`` in an
+    object array.
+    """
+    __slots__ = ()
+
+
+def _object_column(types, values, objects, codec_options):
+    """Make an object array from a column, decoding any numbers, booleans
+    and datetimes to the same types as :func:`bson.decode_all`.
+    """
+    result = numpy.empty(len(objects), dtype=object)
+    for i, obj in enumerate(objects):
+        result[i] = obj
+    numbers = numpy.in1d(
+        types, (_DOUBLE, _BOOLEAN, _DATETIME, _INT32, _INT64))
+    for i in numpy.flatnonzero(numbers).tolist():
+        code = int(types[i])
+        position = i * 8
+        if code in _NUMBER_GETTER:
+            result[i] = _NUMBER_GETTER[code](
+                values, position, None, codec_options)[0]
+        elif code == _INT32:
+            result[i] = int(_get_int64(values, position, None, None)[0])
+        else:
+            result[i] = bool(values[position])
+    return result
+
+
+def _column(types, values, objects, codec_options):
+    """Convert a column decoded by :func:`bson._decode_columns`."""
+    type_array = numpy.frombuffer(types, dtype=numpy.uint8)
+    value_array = numpy.frombuffer(values, dtype=numpy.uint8)
+    mask = ((type_array != 0) &
+            (type_array != _NULL) &
+            (type_array != _UNDEFINED))
+    codes = set(numpy.unique(type_array[mask]).tolist())
+    numbers = value_array.view('<i8')
+
+    if not codes:
+        array = _object_column(type_array, values, objects, codec_options)
+    elif codes == set([_INT32]):
+        array = numbers.astype('<i4')
+    elif codes <= set([_INT32, _INT64]):
+        array = numbers
+    elif codes == set([_DOUBLE]):
+        array = value_array.view('<f8')
+    elif codes <= set([_DOUBLE, _INT32, _INT64]):
+        array = value_array.view('<f8').copy()
+        integers = (type_array == _INT32) | (type_array == _INT64)
+        array[integers] = numbers[integers]
+    elif codes == set([_BOOLEAN]):
+        array = numbers.astype(bool)
+    elif codes == set([_DATETIME]):
+        array = numbers.view('datetime64[ms]')
+    else:
+        array = _object_column(type_array, values, objects, codec_options)
+    return Column(array, mask)
+
+
+def decode_columns(data, fields=None, codec_options=DEFAULT_CODEC_OPTIONS):
+    """Decode BSON data to an array per field.
+
+    `data` must be a string of concatenated, valid, BSON-encoded
+    documents, or any other object supporting the buffer protocol containing
+    them. Returns a :class:`~bson.son.SON` mapping each field name to a
+    :class:`Column` with one element per document.
+
+    Numbers, booleans and datetimes are copied straight into arrays without
+    creating a Python object for each value, which is much faster than
+    decoding each document with :func:`~bson.decode_all`. A field whose
+    values are all of one of these types becomes an array of that type:
+
+      - 32-bit integers: ``int32``
+      - 64-bit integers, or a mix of 32 and 64-bit integers: ``int64``
+      - doubles, or a mix of doubles and integers: ``float64``
+      - booleans: ``bool``
+      - datetimes: ``datetime64[ms]``, in UTC
+
+    Any other field becomes an object array of the same values that
+    :func:`~bson.decode_all` would decode.
+
+    :Parameters:
+      - `data`: BSON data
+      - `fields` (optional): An iterable of the top-level field names to
+        decode. By default every field found in `data` is decoded, in the
+        order each field first appears.
+      - `codec_options` (optional): An instance of
+        :class:`~bson.codec_options.CodecOptions`, used to decode the values
+        in object arrays.
+
+    .. versionadded:: 3.1
+    """
+    if not isinstance(codec_options, CodecOptions):
+        raise TypeError("codec_options must be an instance of CodecOptions")
+    if fields is not None:
+        names = []
+        for name in fields:
+            if not PY3 and isinstance(name, str):
+                name = name.decode('utf-8')
+            if name not in names:
+                names.append(name)
+        fields = names
+    names, columns = _decode_columns(data, fields, codec_options)
+    result = SON()
+    for name, (types, values, objects) in zip(names, columns):
+        result[name] = _column(types, values, objects, codec_options)
+    return result
@@ -0,0 +1,76 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Representation of a BSON datetime as milliseconds since the epoch.
+
+.. versionadded:: 3.1
+"""
+
+import datetime
+
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from bson.py3compat import PY3
+from bson.tz_util import utc
+
+if PY3:
+    long = int
+
+_EPOCH_NAIVE = datetime.datetime(1970, 1, 1)
+_EPOCH_AWARE = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+
+def _millis_to_datetime(millis, opts):
+    """Convert milliseconds since the epoch to a datetime.datetime, as
+    configured by the CodecOptions `opts`.
+    """
+    delta = datetime.timedelta(milliseconds=millis)
+    if not opts.tz_aware:
+        return _EPOCH_NAIVE + delta
+    tzinfo = opts.tzinfo
+    if tzinfo is None or tzinfo is utc:
+        return _EPOCH_AWARE + delta
+    # Equivalent to (_EPOCH_AWARE + delta).astimezone(tzinfo), without
+    # creating the intermediate UTC datetime.
+    return tzinfo.fromutc(_EPOCH_NAIVE.replace(tzinfo=tzinfo) + delta)
+
+
+class DatetimeMS(long):
+    """Representation of a BSON datetime as an integer number of
+    milliseconds since the Unix epoch, in UTC.
+
+    Datetimes are decoded to DatetimeMS when the ``datetime_ms`` option of
+    :class:`~bson.codec_options.CodecOptions` is ``True``. Creating a
+    DatetimeMS is much cheaper than creating a :class:`~datetime.datetime`,
+    and arithmetic on it returns plain integers. Call :meth:`as_datetime`
+    to convert it when a :class:`~datetime.datetime` is needed. DatetimeMS
+    is always encoded as a BSON datetime, and can hold dates outside the
+    range of :class:`~datetime.datetime`.
+
+    :Parameters:
+      - `value`: milliseconds since the Unix epoch
+    """
+
+    __slots__ = ()
+
+    _type_marker = 9
+
+    def as_datetime(self, codec_options=DEFAULT_CODEC_OPTIONS):
+        """Convert to a :class:`~datetime.datetime`, naive or timezone
+        aware according to the `tz_aware` and `tzinfo` options of
+        `codec_options`.
+        """
+        return _millis_to_datetime(long(self), codec_options)
+
+    def __repr__(self):
+        return "DatetimeMS(%d)" % (self,)
@@ -0,0 +1,297 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tools for random access to the documents in a BSON file.
+
+.. versionadded:: 3.1
+"""
+
+import array
+import bisect
+import itertools
+import mmap
+import multiprocessing
+import os
+
+from bson import (_CODEC_OPTIONS_TYPE_ERROR,
+                  _EOO,
+                  _UNPACK_INT_FROM,
+                  _bson_to_dict,
+                  decode_all,
+                  decode_iter)
+from bson.codec_options import CodecOptions, DEFAULT_CODEC_OPTIONS
+from bson.errors import InvalidBSON
+from bson.py3compat import PY3, string_type
+
+try:
+    array.array('Q')
+    _OFFSET_TYPECODE = 'Q'
+except ValueError:
+    # Python 2 has no 'Q'. 'L' is 64 bits on 64-bit Unix platforms.
+    _OFFSET_TYPECODE = 'L'
+
+
+def _map_file(file_obj):
+    """Memory-map a file read-only, returning the mmap (None for an empty
+    file) and an object to slice its contents from.
+
+    Slicing the result doesn't copy in python 3.
+    """
+    size = os.fstat(file_obj.fileno()).st_size
+    if not size:
+        # Empty files can't be mapped.
+        return None, b""
+    mapped = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+    if PY3:
+        return mapped, memoryview(mapped)
+    return mapped, mapped
+
+
+def _unmap(mapped, data):
+    """Close the mmap and the data returned by _map_file.
+
+    While slices of the data are still in use, for example by an iterator
+    from decode_iter, they keep the mmap open. It is then closed when the
+    last of them is freed.
+    """
+    if mapped is not None:
+        try:
+            if PY3:
+                data.release()
+            mapped.close()
+        except BufferError:
+            pass
+
+
+def _build_index(data):
+    """Scan the concatenated BSON documents in `data` and return an array
+    of the offset of each document, followed by the end of the last one.
+    """
+    offsets = array.array(_OFFSET_TYPECODE)
+    append = offsets.append
+    position = 0
+    end = len(data)
+    while position < end:
+        if end - position < 4:
+            raise InvalidBSON("cut off in middle of objsize")
+        obj_size = _UNPACK_INT_FROM(data, position)[0]
+        if obj_size < 5 or end - position < obj_size:
+            raise InvalidBSON("invalid object size")
+        if data[position + obj_size - 1] != _EOO:
+            raise InvalidBSON("bad eoo")
+        append(position)
+        position += obj_size
+    append(position)
+    return offsets
+
+
+def _decode_file_range(path, begin, end, codec_options):
+    """Decode the documents between two offsets of a BSON file.
+
+    BSONFileReader.decode_parallel runs this in the executor's workers,
+    each of which maps the file itself.
+    """
+    with open(path, "rb") as file_obj:
+        mapped, data = _map_file(file_obj)
+        try:
+            return decode_all(data[begin:end], codec_options)
+        finally:
+            _unmap(mapped, data)
+
+
+class BSONFileReader(object):
+    """Random access to the documents in a file of concatenated BSON
+    documents, such as a ``.bson`` file written by ``mongodump``.
+
+    The file is memory-mapped, and the offset of every document is found
+    in a single pass when the reader is created. The reader then supports
+    ``len()``, iteration, indexing and slicing, which decode only the
+    requested documents::
+
+      >>> with BSONFileReader("dump/db/coll.bson") as reader:
+      ...     first, last = reader[0], reader[-1]
+      ...     batch = reader[1000:2000]
+
+    :Parameters:
+      - `file`: a file name, or a file object opened for reading in binary
+        mode that has a :meth:`fileno`
+      - `codec_options` (optional): An instance of
+        :class:`~bson.codec_options.CodecOptions`.
+
+    Raises :class:`~bson.errors.InvalidBSON` if the file doesn't consist
+    of complete BSON documents. The documents themselves are only checked
+    as they are decoded.
+    """
+
+    def __init__(self, file, codec_options=DEFAULT_CODEC_OPTIONS):
+        if not isinstance(codec_options, CodecOptions):
+            raise _CODEC_OPTIONS_TYPE_ERROR
+
+        if isinstance(file, string_type):
+            self.__name = file
+            with open(file, "rb") as file_obj:
+                self.__mmap, self.__data = _map_file(file_obj)
+        else:
+            name = getattr(file, "name", None)
+            self.__name = name if isinstance(name, string_type) else None
+            self.__mmap, self.__data = _map_file(file)
+        self.__codec_options = codec_options
+        self.__closed = False
+        try:
+            self.__offsets = _build_index(self.__data)
+        except InvalidBSON:
+            self.close()
+            raise
+
+    @property
+    def name(self):
+        """The name of the file, or ``None`` if it isn't known."""
+        return self.__name
+
+    @property
+    def codec_options(self):
+        """The :class:`~bson.codec_options.CodecOptions` documents are
+        decoded with."""
+        return self.__codec_options
+
+    @property
+    def offsets(self):
+        """An :class:`array.array` of the offset of each document in the
+        file, followed by the offset of the end of the last document.
+
+        Must not be modified.
+        """
+        return self.__offsets
+
+    @property
+    def closed(self):
+        """True if :meth:`close` has been called."""
+        return self.__closed
+
+    def close(self):
+        """Unmap the file. The reader can't be used afterwards.
+
+        Iterators over the reader that are still in use keep the file
+        mapped until they are freed.
+        """
+        self.__closed = True
+        if self.__mmap is not None:
+            _unmap(self.__mmap, self.__data)
+            self.__mmap = None
+            self.__data = b""
+
+    def __check_open(self):
+        if self.__closed:
+            raise ValueError("operation on a closed BSONFileReader")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        self.__check_open()
+        return len(self.__offsets) - 1
+
+    def __iter__(self):
+        self.__check_open()
+        return decode_iter(self.__data, self.__codec_options)
+
+    def __getitem__(self, index):
+        self.__check_open()
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return self.decode_range(start, stop)
+            return [self[i] for i in range(start, stop, step)]
+
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("document index out of range")
+        offsets = self.__offsets
+        return _bson_to_dict(self.__data[offsets[index]:offsets[index + 1]],
+                             self.__codec_options)
+
+    def decode_range(self, start, stop):
+        """Decode the documents from index `start` up to, but not including,
+        index `stop`. They are contiguous in the file, and are decoded
+        together with :func:`~bson.decode_all`.
+        """
+        self.__check_open()
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return []
+        offsets = self.__offsets
+        return decode_all(self.__data[offsets[start]:offsets[stop]],
+                          self.__codec_options)
+
+    def split(self, parts):
+        """Split the documents into at most `parts` contiguous ranges of
+        about the same size in bytes.
+
+        Returns a list of ``(start, stop)`` index ranges that together cover
+        every document, for use with :meth:`decode_range`.
+        """
+        self.__check_open()
+        if parts < 1:
+            raise ValueError("parts must be at least 1")
+        offsets = self.__offsets
+        count = len(self)
+        ranges = []
+        start = 0
+        for part in range(1, parts + 1):
+            if start >= count:
+                break
+            # Stop at the first document that starts at or past this
+            # part's share of the file.
+            target = offsets[count] * part // parts
+            stop = bisect.bisect_left(offsets, target, start + 1, count)
+            ranges.append((start, stop))
+            start = stop
+        return ranges
+
+    def decode_parallel(self, executor, parts=None):
+        """Decode every document, splitting the work between the workers of
+        a :class:`concurrent.futures.Executor`.
+
+        Returns an iterator over the documents, in order. The documents are
+        split into `parts` ranges with :meth:`split`, by default four per
+        CPU. With a process pool each worker maps the file by name, so
+        the reader must have been created from a file name or a named file
+        object. Otherwise use a thread pool.
+
+        :Parameters:
+          - `executor`: a :class:`concurrent.futures.Executor`
+          - `parts` (optional): the number of ranges to decode separately
+        """
+        self.__check_open()
+        if parts is None:
+            parts = 4 * multiprocessing.cpu_count()
+        ranges = self.split(parts)
+        if self.__name is not None:
+            offsets = self.__offsets
+            results = executor.map(
+                _decode_file_range,
+                itertools.repeat(self.__name),
+                [offsets[start] for start, _ in ranges],
+                [offsets[stop] for _, stop in ranges],
+                itertools.repeat(self.__codec_options))
+        else:
+            results = executor.map(self.decode_range,
+                                   [start for start, _ in ranges],
+                                   [stop for _, stop in ranges])
+        return itertools.chain.from_iterable(results)
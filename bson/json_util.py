@@ -73,12 +73,25 @@ import collections
 import datetime
 import json
 import re
+import struct
+import sys
 import uuid
 
-from bson import EPOCH_AWARE, RE_TYPE, SON
+from codecs import utf_8_decode as _utf_8_decode
+
+from bson import (EPOCH_AWARE, RE_TYPE, SON,
+                  _ELEMENT_GETTER,
+                  _UNPACK_INT_FROM,
+                  _UNPACK_LONG_FROM,
+                  _byte_key,
+                  _get_float,
+                  _get_string)
 from bson.binary import Binary
 from bson.code import Code
+from bson.codec_options import CodecOptions, DEFAULT_CODEC_OPTIONS
+from bson.datetime_ms import DatetimeMS
 from bson.dbref import DBRef
+from bson.errors import InvalidBSON
 from bson.int64 import Int64
 from bson.max_key import MaxKey
 from bson.min_key import MinKey
@@ -87,7 +100,14 @@ from bson.regex import Regex
 from bson.timestamp import Timestamp
 from bson.tz_util import utc
 
-from bson.py3compat import PY3, iteritems, string_type, text_type
+from bson.py3compat import (PY3, bytes_from_buffer, HAVE_MEMORYVIEW,
+                            iteritems, reraise, string_type, text_type)
+
+try:
+    from bson import _cbson
+    _USE_C = True
+except ImportError:
+    _USE_C = False
 
 
 _RE_OPT_TABLE = {
@@ -118,10 +138,228 @@ def loads(s, *args, **kwargs):
 
     Automatically passes the object_hook for BSON type conversion.
     """
-    kwargs['object_hook'] = lambda dct: object_hook(dct)
+    if not args and not kwargs and isinstance(s, string_type):
+        return _DECODER.decode(s)
+    kwargs['object_hook'] = object_hook
     return json.loads(s, *args, **kwargs)
 
 
+def iter_loads(file_obj, batch_size=None, **kwargs):
+    """Decode newline-delimited JSON from a file as a generator.
+
+    Reads `file_obj` one line at a time and decodes each line that isn't
+    blank to a document, like :func:`loads`, so the whole file is never
+    held in memory. This is the format :func:`dump_bson` and
+    ``mongoexport`` write.
+
+    With `batch_size`, yields lists of up to `batch_size` documents
+    instead of one document at a time, ready to pass to
+    :meth:`~pymongo.collection.Collection.insert_many`::
+
+      with open("dump.json") as file_obj:
+          for batch in iter_loads(file_obj, batch_size=1000):
+              collection.insert_many(batch)
+
+    :Parameters:
+      - `file_obj`: an iterable of lines of JSON text, such as a file
+        object
+      - `batch_size` (optional): the number of documents in each list
+      - `**kwargs` (optional): other keyword arguments are passed to
+        :class:`json.JSONDecoder`
+
+    .. versionadded:: 3.1
+    """
+    if batch_size is not None and batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    kwargs['object_hook'] = object_hook
+    # Unlike json.loads, don't create a decoder for each document.
+    decode = json.JSONDecoder(**kwargs).decode
+    batch = []
+    for line in file_obj:
+        if PY3 and isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        doc = decode(line)
+        if batch_size is None:
+            yield doc
+            continue
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_EOO = _byte_key(b"\x00")
+_DOUBLE = _byte_key(b"\x01")
+_STRING = _byte_key(b"\x02")
+_DOCUMENT = _byte_key(b"\x03")
+_ARRAY = _byte_key(b"\x04")
+_BOOLEAN = _byte_key(b"\x08")
+_DATETIME = _byte_key(b"\x09")
+_NULL = _byte_key(b"\x0A")
+_CODE_W_SCOPE = _byte_key(b"\x0F")
+_INT32 = _byte_key(b"\x10")
+_INT64 = _byte_key(b"\x12")
+_FALSE = _byte_key(b"\x00")
+
+
+def _elements_to_json(data, position, obj_end, opts, is_array, out):
+    """Append the JSON text of a BSON document or array to the list `out`.
+
+    `position` is the offset of the document's size and `obj_end` is the
+    offset of the end of the enclosing document.
+    """
+    obj_size = _UNPACK_INT_FROM(data, position)[0]
+    end = position + obj_size - 1
+    if obj_size < 5 or end >= obj_end:
+        raise InvalidBSON("invalid object length")
+    if data[end] != _EOO:
+        raise InvalidBSON("bad eoo")
+    out.append(is_array and "[" or "{")
+    position += 4
+    errors = opts.unicode_decode_error_handler
+    separator = ""
+    while position < end:
+        element_type = data[position]
+        name_end = data.index(b"\x00", position + 1)
+        out.append(separator)
+        separator = ", "
+        if not is_array:
+            out.append(json.dumps(
+                _utf_8_decode(data[position + 1:name_end], errors, True)[0]))
+            out.append(": ")
+        position = name_end + 1
+        # Write the types whose JSON text doesn't depend on decoding them
+        # to Python objects directly, and everything else like dumps.
+        if element_type == _STRING:
+            value, position = _get_string(data, position, end, opts)
+            out.append(json.dumps(value))
+        elif element_type == _INT32:
+            out.append(str(_UNPACK_INT_FROM(data, position)[0]))
+            position += 4
+        elif element_type in (_INT64, _DATETIME):
+            millis = _UNPACK_LONG_FROM(data, position)[0]
+            if element_type == _DATETIME:
+                out.append('{"$date": %d}' % (millis,))
+            else:
+                out.append(str(millis))
+            position += 8
+        elif element_type == _DOUBLE:
+            value, position = _get_float(data, position, end, opts)
+            out.append(json.dumps(value))
+        elif element_type == _BOOLEAN:
+            out.append(data[position] == _FALSE and "false" or "true")
+            position += 1
+        elif element_type == _NULL:
+            out.append("null")
+        elif element_type in (_DOCUMENT, _ARRAY):
+            position = _elements_to_json(data, position, end, opts,
+                                         element_type == _ARRAY, out)
+        elif element_type == _CODE_W_SCOPE:
+            code_end = position + _UNPACK_INT_FROM(data, position)[0]
+            code, position = _get_string(data, position + 4, end, opts)
+            # Code in the scope is written as $code too, not as a string
+            # like dumps writes it.
+            out.append('{"$code": %s, "$scope": ' % (json.dumps(code),))
+            position = _elements_to_json(data, position, end, opts,
+                                         False, out)
+            if position != code_end:
+                raise InvalidBSON("invalid code with scope length")
+            out.append("}")
+        else:
+            value, position = _ELEMENT_GETTER[element_type](
+                data, position, end, opts)
+            out.append(json.dumps(_json_convert(value)))
+    if position != end:
+        raise InvalidBSON("bad object or element length")
+    out.append(is_array and "]" or "}")
+    return end + 1
+
+
+def _bson_to_json(data, opts):
+    """Convert a BSON document to MongoDB Extended JSON text."""
+    data = bytes_from_buffer(data)
+    try:
+        obj_size = _UNPACK_INT_FROM(data, 0)[0]
+    except struct.error as exc:
+        raise InvalidBSON(str(exc))
+    if obj_size != len(data):
+        raise InvalidBSON("invalid object size")
+    out = []
+    try:
+        _elements_to_json(data, 0, obj_size, opts, False, out)
+    except InvalidBSON:
+        raise
+    except Exception:
+        # Change exception type to InvalidBSON but preserve traceback.
+        _, exc_value, exc_tb = sys.exc_info()
+        reraise(InvalidBSON, exc_value, exc_tb)
+    return "".join(out)
+if _USE_C:
+    _bson_to_json = _cbson._bson_to_json
+
+
+def dump_bson(data, fp, codec_options=DEFAULT_CODEC_OPTIONS):
+    """Write BSON data to a file as MongoDB Extended JSON.
+
+    `data` must be a string of concatenated, valid, BSON-encoded
+    documents, or any other object supporting the buffer protocol
+    containing them. Each document is written to the file-like object `fp`
+    as one line of JSON text as soon as it is converted.
+
+    The JSON is the same as :func:`dumps` produces for a document decoded
+    from `data` with a :class:`~bson.son.SON` `document_class`, but it is
+    written directly from the BSON without decoding the documents to
+    Python objects first. This is much faster, especially with the C
+    extension. Keys are written in the order they appear in `data`, so,
+    unlike with :func:`dumps`, the keys of an embedded DBRef document are
+    not reordered. And a :class:`~bson.code.Code` in the scope of another
+    is written as ``{"$code": ..., "$scope": ...}`` like any other, where
+    :func:`dumps` writes it as a plain string and loses its scope.
+
+    :Parameters:
+      - `data`: BSON data
+      - `fp`: a file-like object with a ``write`` method that accepts
+        :class:`str`
+      - `codec_options` (optional): An instance of
+        :class:`~bson.codec_options.CodecOptions`, which sets the
+        `unicode_decode_error_handler` and the `uuid_representation` of
+        the UUIDs in `data`.
+
+    .. versionadded:: 3.1
+    """
+    if not isinstance(codec_options, CodecOptions):
+        raise TypeError("codec_options must be an instance of CodecOptions")
+
+    if not isinstance(data, bytes):
+        if _USE_C and HAVE_MEMORYVIEW:
+            # Slicing a memoryview doesn't copy. The C extension converts
+            # each slice in place.
+            try:
+                data = memoryview(data)
+            except TypeError:
+                data = bytes_from_buffer(data)
+        else:
+            data = bytes_from_buffer(data)
+    write = fp.write
+    position = 0
+    end = len(data)
+    while position < end:
+        try:
+            obj_size = _UNPACK_INT_FROM(data, position)[0]
+        except struct.error as exc:
+            raise InvalidBSON(str(exc))
+        if obj_size < 5:
+            raise InvalidBSON("invalid object size")
+        write(_bson_to_json(data[position:position + obj_size],
+                            codec_options))
+        write("\n")
+        position += obj_size
+
+
 def _json_convert(obj):
     """Recursive helper method that converts BSON types so they can be
     converted into json.
@@ -136,71 +374,107 @@ def _json_convert(obj):
         return obj
 
 
-def object_hook(dct):
-    if "$oid" in dct:
-        return ObjectId(str(dct["$oid"]))
-    if "$ref" in dct:
-        return DBRef(dct["$ref"], dct["$id"], dct.get("$db", None))
-    if "$date" in dct:
-        dtm = dct["$date"]
-        # mongoexport 2.6 and newer
-        if isinstance(dtm, string_type):
-            aware = datetime.datetime.strptime(
-                dtm[:23], "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=utc)
-            offset = dtm[23:]
-            if not offset or offset == 'Z':
-                # UTC
-                return aware
-            else:
-                if len(offset) == 5:
-                    # Offset from mongoexport is in format (+|-)HHMM
-                    secs = (int(offset[1:3]) * 3600 + int(offset[3:]) * 60)
-                elif ':' in offset and len(offset) == 6:
-                    # RFC-3339 format (+|-)HH:MM
-                    hours, minutes = offset[1:].split(':')
-                    secs = (int(hours) * 3600 + int(minutes) * 60)
-                else:
-                    # Not RFC-3339 compliant or mongoexport output.
-                    raise ValueError("invalid format for offset")
-                if offset[0] == "-":
-                    secs *= -1
-                return aware - datetime.timedelta(seconds=secs)
-        # mongoexport 2.6 and newer, time before the epoch (SERVER-15275)
-        elif isinstance(dtm, collections.Mapping):
-            secs = float(dtm["$numberLong"]) / 1000.0
-        # mongoexport before 2.6
+def _parse_oid(dct):
+    return ObjectId(str(dct["$oid"]))
+
+
+def _parse_dbref(dct):
+    return DBRef(dct["$ref"], dct["$id"], dct.get("$db", None))
+
+
+def _parse_date(dct):
+    dtm = dct["$date"]
+    # mongoexport 2.6 and newer
+    if isinstance(dtm, string_type):
+        aware = datetime.datetime.strptime(
+            dtm[:23], "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=utc)
+        offset = dtm[23:]
+        if not offset or offset == 'Z':
+            # UTC
+            return aware
         else:
-            secs = float(dtm) / 1000.0
-        return EPOCH_AWARE + datetime.timedelta(seconds=secs)
-    if "$regex" in dct:
-        flags = 0
-        # PyMongo always adds $options but some other tools may not.
-        for opt in dct.get("$options", ""):
-            flags |= _RE_OPT_TABLE.get(opt, 0)
-        return Regex(dct["$regex"], flags)
-    if "$minKey" in dct:
-        return MinKey()
-    if "$maxKey" in dct:
-        return MaxKey()
-    if "$binary" in dct:
-        if isinstance(dct["$type"], int):
-            dct["$type"] = "%02x" % dct["$type"]
-        subtype = int(dct["$type"], 16)
-        if subtype >= 0xffffff80:  # Handle mongoexport values
-            subtype = int(dct["$type"][6:], 16)
-        return Binary(base64.b64decode(dct["$binary"].encode()), subtype)
-    if "$code" in dct:
-        return Code(dct["$code"], dct.get("$scope"))
-    if "$uuid" in dct:
-        return uuid.UUID(dct["$uuid"])
-    if "$undefined" in dct:
-        return None
-    if "$numberLong" in dct:
-        return Int64(dct["$numberLong"])
-    if "$timestamp" in dct:
-        tsp = dct["$timestamp"]
-        return Timestamp(tsp["t"], tsp["i"])
-    return dct
+            if len(offset) == 5:
+                # Offset from mongoexport is in format (+|-)HHMM
+                secs = (int(offset[1:3]) * 3600 + int(offset[3:]) * 60)
+            elif ':' in offset and len(offset) == 6:
+                # RFC-3339 format (+|-)HH:MM
+                hours, minutes = offset[1:].split(':')
+                secs = (int(hours) * 3600 + int(minutes) * 60)
+            else:
+                # Not RFC-3339 compliant or mongoexport output.
+                raise ValueError("invalid format for offset")
+            if offset[0] == "-":
+                secs *= -1
+            return aware - datetime.timedelta(seconds=secs)
+    # mongoexport 2.6 and newer, time before the epoch (SERVER-15275)
+    elif isinstance(dtm, collections.Mapping):
+        secs = float(dtm["$numberLong"]) / 1000.0
+    # mongoexport before 2.6
+    else:
+        secs = float(dtm) / 1000.0
+    return EPOCH_AWARE + datetime.timedelta(seconds=secs)
+
+
+def _parse_regex(dct):
+    flags = 0
+    # PyMongo always adds $options but some other tools may not.
+    for opt in dct.get("$options", ""):
+        flags |= _RE_OPT_TABLE.get(opt, 0)
+    return Regex(dct["$regex"], flags)
+
+
+def _parse_binary(dct):
+    if isinstance(dct["$type"], int):
+        dct["$type"] = "%02x" % dct["$type"]
+    subtype = int(dct["$type"], 16)
+    if subtype >= 0xffffff80:  # Handle mongoexport values
+        subtype = int(dct["$type"][6:], 16)
+    return Binary(base64.b64decode(dct["$binary"].encode()), subtype)
+
+
+def _parse_timestamp(dct):
+    tsp = dct["$timestamp"]
+    return Timestamp(tsp["t"], tsp["i"])
+
+
+# The key that marks each Extended JSON type, and the function that
+# converts a dict with that key, in the order the keys are checked.
+_PARSER_ORDER = (
+    ("$oid", _parse_oid),
+    ("$ref", _parse_dbref),
+    ("$date", _parse_date),
+    ("$regex", _parse_regex),
+    ("$minKey", lambda dummy: MinKey()),
+    ("$maxKey", lambda dummy: MaxKey()),
+    ("$binary", _parse_binary),
+    ("$code", lambda dct: Code(dct["$code"], dct.get("$scope"))),
+    ("$uuid", lambda dct: uuid.UUID(dct["$uuid"])),
+    ("$undefined", lambda dummy: None),
+    ("$numberLong", lambda dct: Int64(dct["$numberLong"])),
+    ("$timestamp", _parse_timestamp),
+)
+_PARSERS = dict(_PARSER_ORDER)
+_PARSER_KEYS = frozenset(_PARSERS)
+
+
+def object_hook(dct):
+    """The `object_hook` that :func:`loads` passes to :func:`json.loads`.
+
+    Converts a dict in Extended JSON format to the BSON type it represents.
+    """
+    # Most dicts are plain documents, and most that aren't have one key.
+    if _PARSER_KEYS.isdisjoint(dct):
+        return dct
+    if len(dct) == 1:
+        for key in dct:
+            return _PARSERS[key](dct)
+    for key, parser in _PARSER_ORDER:
+        if key in dct:
+            return parser(dct)
+
+
+# json.loads makes a new decoder for each call with an object_hook.
+_DECODER = json.JSONDecoder(object_hook=object_hook)
 
 
 def default(obj):
@@ -217,6 +491,8 @@ def default(obj):
         millis = int(calendar.timegm(obj.timetuple()) * 1000 +
                      obj.microsecond / 1000)
         return {"$date": millis}
+    if isinstance(obj, DatetimeMS):
+        return {"$date": int(obj)}
     if isinstance(obj, (RE_TYPE, Regex)):
         flags = ""
         if obj.flags & re.IGNORECASE:
@@ -252,6 +528,10 @@ def default(obj):
         return SON([
             ('$binary', base64.b64encode(obj).decode()),
             ('$type', "00")])
+    if HAVE_MEMORYVIEW and isinstance(obj, memoryview):
+        return SON([
+            ('$binary', base64.b64encode(obj.tobytes()).decode()),
+            ('$type', "00")])
     if isinstance(obj, uuid.UUID):
         return {"$uuid": obj.hex}
     raise TypeError("%r is not JSON serializable" % obj)
@@ -20,11 +20,11 @@ import binascii
 import calendar
 import datetime
 import hashlib
+import itertools
 import os
 import random
 import socket
 import struct
-import threading
 import time
 
 from bson.errors import InvalidId
@@ -46,6 +46,10 @@ def _machine_bytes():
     return machine_hash.digest()[0:3]
 
 
+_PACK_INT = struct.Struct(">i").pack
+_PACK_INC = struct.Struct(">I").pack
+
+
 def _raise_invalid_id(oid):
     raise InvalidId(
         "%r is not a valid ObjectId, it must be a 12-byte input"
@@ -56,11 +60,16 @@ class ObjectId(object):
     """A MongoDB ObjectId.
     """
 
-    _inc = random.randint(0, 0xFFFFFF)
-    _inc_lock = threading.Lock()
+    # next() on an itertools.count is atomic, so ObjectIds are generated
+    # without taking a lock.
+    _inc = itertools.count(random.randint(0, 0xFFFFFF))
 
     _machine_bytes = _machine_bytes()
 
+    # The machine bytes followed by the pid bytes, updated after a fork.
+    _pid = None
+    _machine_pid_bytes = None
+
     __slots__ = ('__id')
 
     _type_marker = 7
@@ -144,6 +153,30 @@ class ObjectId(object):
             ">i", int(timestamp)) + b"\x00\x00\x00\x00\x00\x00\x00\x00"
         return cls(oid)
 
+    @classmethod
+    def generate_many(cls, n):
+        """Generate a list of `n` new ObjectIds.
+
+        This is faster than calling ``ObjectId()`` `n` times. The ObjectIds
+        have the same generation time and increasing counters, which are
+        consecutive unless other threads generate ObjectIds at the same
+        time.
+
+        :Parameters:
+          - `n`: the number of ObjectIds to generate
+
+        .. versionadded:: 3.1
+        """
+        prefix = _PACK_INT(int(time.time())) + cls.__machine_pid_bytes()
+        oids = []
+        # Take every counter value before doing anything else, so that
+        # other threads are unlikely to take values in between.
+        for inc in list(itertools.islice(ObjectId._inc, n)):
+            oid = cls.__new__(cls)
+            oid.__id = prefix + _PACK_INC(inc % 0xFFFFFF)[1:4]
+            oids.append(oid)
+        return oids
+
     @classmethod
     def is_valid(cls, oid):
         """Checks if a `oid` string is valid or not.
@@ -162,25 +195,24 @@ class ObjectId(object):
         except (InvalidId, TypeError):
             return False
 
+    @staticmethod
+    def __machine_pid_bytes():
+        """The 3 machine bytes and 2 pid bytes of a new ObjectId.
+        """
+        pid = os.getpid()
+        if pid != ObjectId._pid:
+            ObjectId._machine_pid_bytes = (
+                ObjectId._machine_bytes + struct.pack(">H", pid % 0xFFFF))
+            ObjectId._pid = pid
+        return ObjectId._machine_pid_bytes
+
     def __generate(self):
         """Generate a new value for this ObjectId.
         """
-
-        # 4 bytes current time
-        oid = struct.pack(">i", int(time.time()))
-
-        # 3 bytes machine
-        oid += ObjectId._machine_bytes
-
-        # 2 bytes pid
-        oid += struct.pack(">H", os.getpid() % 0xFFFF)
-
-        # 3 bytes inc
-        with ObjectId._inc_lock:
-            oid += struct.pack(">i", ObjectId._inc)[1:4]
-            ObjectId._inc = (ObjectId._inc + 1) % 0xFFFFFF
-
-        self.__id = oid
+        # 4 bytes current time, 3 bytes machine, 2 bytes pid, 3 bytes inc
+        self.__id = (_PACK_INT(int(time.time())) +
+                     ObjectId.__machine_pid_bytes() +
+                     _PACK_INC(next(ObjectId._inc) % 0xFFFFFF)[1:4])
 
     def __validate(self, oid):
         """Validate and use the given id for this ObjectId.
@@ -18,6 +18,9 @@ import sys
 
 PY3 = sys.version_info[0] == 3
 
+# memoryview is new in python 2.7.
+HAVE_MEMORYVIEW = sys.version_info[:2] >= (2, 7)
+
 if PY3:
     import codecs
     import _thread as thread
@@ -41,6 +44,14 @@ if PY3:
     def bytes_from_hex(h):
         return bytes.fromhex(h)
 
+    def bytes_from_buffer(data):
+        # Copy any object supporting the buffer protocol (bytearray,
+        # memoryview, mmap...) to bytes. bytes(5) would return five NUL
+        # bytes, so go through memoryview to reject anything else.
+        if isinstance(data, bytes):
+            return data
+        return memoryview(data).tobytes()
+
     def iteritems(d):
         return iter(d.items())
 
@@ -78,6 +89,18 @@ else:
     def bytes_from_hex(h):
         return h.decode('hex')
 
+    def bytes_from_buffer(data):
+        # mmap doesn't support the new buffer protocol (memoryview) in
+        # python 2.x, but the old buffer protocol works for everything
+        # except unicode, which must not be treated as binary data.
+        if isinstance(data, str):
+            return data
+        if HAVE_MEMORYVIEW and isinstance(data, memoryview):
+            return data.tobytes()
+        if isinstance(data, unicode):
+            raise TypeError("cannot decode BSON from unicode")
+        return str(buffer(data))
+
     def iteritems(d):
         return d.iteritems()
 
@@ -94,3 +117,12 @@ else:
     string_type = basestring
     text_type = unicode
     integer_types = (int, long)
+
+
+def slice_buffer(data, start):
+    """Return `data` from `start` on, without copying it where memoryview
+    is available.
+    """
+    if HAVE_MEMORYVIEW:
+        return memoryview(data)[start:]
+    return data[start:]
@@ -0,0 +1,151 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tools for representing raw BSON documents.
+"""
+
+import collections
+import struct
+import sys
+
+from bson import _UNPACK_INT, _element_to_dict, _raw_element_index
+from bson.codec_options import (CodecOptions,
+                                _RAW_BSON_DOCUMENT_MARKER,
+                                _raw_document_class)
+from bson.errors import InvalidBSON
+from bson.py3compat import reraise
+
+
+class RawBSONDocument(collections.Mapping):
+    """Representation for a MongoDB document that provides access to the raw
+    BSON bytes that compose it.
+
+    A :class:`RawBSONDocument` decodes each of its fields separately, the
+    first time that field is accessed. Embedded documents are themselves
+    returned as :class:`RawBSONDocument` instances, so they are not decoded
+    until one of their fields is accessed.
+
+    To decode query results to :class:`RawBSONDocument`, use
+    :data:`DEFAULT_RAW_BSON_OPTIONS` or any
+    :class:`~bson.codec_options.CodecOptions` with
+    ``document_class=RawBSONDocument``::
+
+      >>> from bson.raw_bson import DEFAULT_RAW_BSON_OPTIONS
+      >>> coll = db.get_collection('test',
+      ...                          codec_options=DEFAULT_RAW_BSON_OPTIONS)
+      >>> doc = coll.find_one()
+      >>> doc['_id']
+      ObjectId('...')
+
+    .. versionadded:: 3.1
+    """
+
+    __slots__ = ('__raw', '__codec_options', '__keys', '__index', '__values')
+    _type_marker = _RAW_BSON_DOCUMENT_MARKER
+
+    def __init__(self, bson_bytes, codec_options=None):
+        """Create a new :class:`RawBSONDocument`.
+
+        :Parameters:
+          - `bson_bytes`: the BSON bytes that compose this document
+          - `codec_options` (optional): An instance of
+            :class:`~bson.codec_options.CodecOptions` whose `document_class`
+            is :class:`RawBSONDocument`, used to decode this document's
+            fields. Defaults to :data:`DEFAULT_RAW_BSON_OPTIONS`.
+        """
+        if not isinstance(bson_bytes, bytes):
+            raise TypeError("bson_bytes must be an instance of bytes")
+        if codec_options is None:
+            codec_options = DEFAULT_RAW_BSON_OPTIONS
+        elif not _raw_document_class(codec_options.document_class):
+            raise TypeError(
+                "RawBSONDocument cannot use CodecOptions with document "
+                "class %s" % (codec_options.document_class, ))
+        try:
+            obj_size = _UNPACK_INT(bson_bytes[:4])[0]
+        except struct.error as exc:
+            raise InvalidBSON(str(exc))
+        if obj_size != len(bson_bytes):
+            raise InvalidBSON("invalid object size")
+        if bson_bytes[obj_size - 1:obj_size] != b"\x00":
+            raise InvalidBSON("bad eoo")
+        self.__raw = bson_bytes
+        self.__codec_options = codec_options
+        self.__keys = None
+        self.__index = None
+        self.__values = {}
+
+    @property
+    def raw(self):
+        """The raw BSON bytes composing this document."""
+        return self.__raw
+
+    def __load_index(self):
+        """Find each field's element without decoding its value."""
+        self.__keys, self.__index = _raw_element_index(
+            self.__raw, 4, len(self.__raw) - 1, self.__codec_options)
+
+    def __getitem__(self, key):
+        try:
+            return self.__values[key]
+        except KeyError:
+            pass
+        if self.__index is None:
+            self.__load_index()
+        position = self.__index[key]
+        try:
+            _, value, _ = _element_to_dict(
+                self.__raw, position, len(self.__raw) - 1,
+                self.__codec_options)
+        except InvalidBSON:
+            raise
+        except Exception:
+            # Change exception type to InvalidBSON but preserve traceback.
+            _, exc_value, exc_tb = sys.exc_info()
+            reraise(InvalidBSON, exc_value, exc_tb)
+        self.__values[key] = value
+        return value
+
+    def __contains__(self, key):
+        if self.__index is None:
+            self.__load_index()
+        return key in self.__index
+
+    def __iter__(self):
+        if self.__keys is None:
+            self.__load_index()
+        return iter(self.__keys)
+
+    def __len__(self):
+        if self.__keys is None:
+            self.__load_index()
+        return len(self.__keys)
+
+    def __eq__(self, other):
+        if isinstance(other, RawBSONDocument):
+            return self.__raw == other.raw
+        return super(RawBSONDocument, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return ("RawBSONDocument(%r, codec_options=%r)"
+                % (self.raw, self.__codec_options))
+
+
+DEFAULT_RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+"""The default :class:`~bson.codec_options.CodecOptions` for
+:class:`RawBSONDocument`.
+"""
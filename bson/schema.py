@@ -0,0 +1,145 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compiled encoders and decoders for documents with a known shape.
+
+.. versionadded:: 3.1
+"""
+
+from bson import (_CODEC_OPTIONS_TYPE_ERROR,
+                  _ENCODERS,
+                  _USE_C,
+                  _bson_to_dict,
+                  _decode_schema,
+                  _encode_schema,
+                  _key_to_name,
+                  _raw_document_class)
+from bson.codec_options import CodecOptions, DEFAULT_CODEC_OPTIONS
+from bson.int64 import Int64
+from bson.py3compat import PY3, text_type
+
+# The BSON type code of each type the C extension writes without checking
+# for other types.
+_TYPE_CODES = {
+    float: 0x01,
+    text_type: 0x02,
+    bool: 0x08,
+    int: 0x10,
+    Int64: 0x12,
+}
+
+if not PY3:
+    _TYPE_CODES[long] = 0x12
+
+
+class Schema(object):
+    """A compiled encoder and decoder for documents that all have the same
+    fields, in the same order, with values of the same types::
+
+      >>> events = Schema([("_id", ObjectId), ("kind", str),
+      ...                  ("count", int), ("at", datetime.datetime)])
+      >>> data = events.encode({"_id": ObjectId(), "kind": "click",
+      ...                       "count": 1, "at": datetime.datetime.now()})
+      >>> events.decode(data)["kind"]
+      'click'
+
+    Each field's element name is encoded, and checked if `check_keys` is
+    ``True``, once when the schema is created. Values of a field's declared
+    type are then written with that type's encoder, without the lookup
+    :meth:`BSON.encode` does for every value. With the C extension this
+    applies to :class:`float`, :class:`str` (:class:`unicode` in python 2),
+    :class:`bool`, :class:`int` and :class:`~bson.int64.Int64`; values of
+    other types still skip the element name encoding. A value of some other
+    type than declared is encoded as usual, so declaring ``object`` accepts
+    any value.
+
+    Without the C extension, decoding reuses the schema's field names
+    instead of decoding the name of each element. Documents whose fields
+    don't match the schema are decoded as usual. The C extension already
+    caches decoded element names, so it decodes every document as usual.
+
+    :Parameters:
+      - `fields`: a sequence of ``(name, type)`` pairs, in the order the
+        fields are encoded, except that an ``_id`` field is always encoded
+        first, as by :meth:`BSON.encode`
+      - `check_keys` (optional): check if field names start with '$' or
+        contain '.', raising :class:`~bson.errors.InvalidDocument` in
+        either case. Embedded documents are checked as they are encoded.
+      - `codec_options` (optional): An instance of
+        :class:`~bson.codec_options.CodecOptions`.
+
+    .. versionadded:: 3.1
+    """
+
+    def __init__(self, fields, check_keys=False,
+                 codec_options=DEFAULT_CODEC_OPTIONS):
+        if not isinstance(codec_options, CodecOptions):
+            raise _CODEC_OPTIONS_TYPE_ERROR
+        plan = []
+        self.__fields = []
+        for key, field_type in fields:
+            name = _key_to_name(key, check_keys)
+            if not PY3 and isinstance(key, str):
+                key = key.decode('utf-8')
+            if key in [field[0] for field in plan]:
+                raise ValueError("duplicate field name %r" % (key,))
+            if not isinstance(field_type, type):
+                raise TypeError("the type of field %r must be a type, not %r"
+                                % (key, field_type))
+            encoder = _ENCODERS.get(field_type)
+            plan.append((key, name, _TYPE_CODES.get(field_type, 0),
+                         field_type if encoder else None, encoder))
+            self.__fields.append((key, field_type))
+        # Like BSON.encode, write _id first. The sort is stable.
+        plan.sort(key=lambda field: field[0] != "_id")
+        self.__plan = tuple(plan)
+        self.__check_keys = check_keys
+        self.__codec_options = codec_options
+        if (_USE_C or codec_options.decode_fields is not None or
+                _raw_document_class(codec_options.document_class)):
+            self.__decode_plan = None
+        else:
+            self.__decode_plan = self.__plan
+
+    @property
+    def fields(self):
+        """A list of the ``(name, type)`` pair of each field."""
+        return list(self.__fields)
+
+    @property
+    def codec_options(self):
+        """The :class:`~bson.codec_options.CodecOptions` documents are
+        encoded and decoded with."""
+        return self.__codec_options
+
+    def encode(self, document):
+        """Encode a document with the schema's fields to BSON.
+
+        Returns a string (:class:`bytes` in python 3). Raises
+        :class:`~bson.errors.InvalidDocument` if `document` doesn't have
+        exactly the schema's fields.
+        """
+        return _encode_schema(self.__plan, document, self.__check_keys,
+                              self.__codec_options)
+
+    def decode(self, data):
+        """Decode a BSON document, from a string or any other object
+        supporting the buffer protocol.
+        """
+        if self.__decode_plan is not None:
+            document = _decode_schema(data, self.__decode_plan,
+                                      self.__codec_options)
+            if document is not None:
+                return document
+        return _bson_to_dict(data, self.__codec_options)
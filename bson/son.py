@@ -29,6 +29,46 @@ from bson.py3compat import iteritems
 # This is essentially the same as re._pattern_type
 RE_TYPE = type(re.compile(""))
 
+try:
+    from collections import OrderedDict as _KeyOrder
+except ImportError:
+    # Python 2.6.
+    class _KeyOrder(object):
+        """The part of OrderedDict that SON uses, over a list of keys.
+
+        Adding and removing a key takes linear time, as it did before SON
+        used an OrderedDict.
+        """
+
+        def __init__(self):
+            self.__keys = []
+
+        @classmethod
+        def fromkeys(cls, keys):
+            order = cls()
+            for key in keys:
+                order[key] = None
+            return order
+
+        def __setitem__(self, key, value):
+            if key not in self.__keys:
+                self.__keys.append(key)
+
+        def __delitem__(self, key):
+            self.__keys.remove(key)
+
+        def __contains__(self, key):
+            return key in self.__keys
+
+        def __iter__(self):
+            return iter(self.__keys)
+
+        def __len__(self):
+            return len(self.__keys)
+
+        def clear(self):
+            self.__keys = []
+
 
 class SON(dict):
     """SON data.
@@ -86,17 +126,31 @@ class SON(dict):
        subtype 0.
     """
 
+    # The keys are stored in order in self.__keys, an OrderedDict whose
+    # values are all None, so that adding, finding and removing a key
+    # takes constant time. Python 2.6 has no OrderedDict: see _KeyOrder.
+
     def __init__(self, data=None, **kwargs):
-        self.__keys = []
+        self.__keys = _KeyOrder()
         dict.__init__(self)
         self.update(data)
         self.update(kwargs)
 
     def __new__(cls, *args, **kwargs):
         instance = super(SON, cls).__new__(cls, *args, **kwargs)
-        instance.__keys = []
+        instance.__keys = _KeyOrder()
         return instance
 
+    def __getstate__(self):
+        # Pickle the keys as a list, like earlier versions of SON.
+        state = self.__dict__.copy()
+        state["_SON__keys"] = list(self.__keys)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__keys = _KeyOrder.fromkeys(state["_SON__keys"])
+
     def __repr__(self):
         result = []
         for key in self.__keys:
@@ -104,13 +158,13 @@ class SON(dict):
         return "SON([%s])" % ", ".join(result)
 
     def __setitem__(self, key, value):
-        if key not in self.__keys:
-            self.__keys.append(key)
         dict.__setitem__(self, key, value)
+        # An existing key keeps its position.
+        self.__keys[key] = None
 
     def __delitem__(self, key):
-        self.__keys.remove(key)
         dict.__delitem__(self, key)
+        del self.__keys[key]
 
     def keys(self):
         return list(self.__keys)
@@ -124,8 +178,7 @@ class SON(dict):
     # efficient.
     # second level definitions support higher levels
     def __iter__(self):
-        for k in self.__keys:
-            yield k
+        return iter(self.__keys)
 
     def has_key(self, key):
         return key in self.__keys
@@ -150,7 +203,7 @@ class SON(dict):
         return [(key, self[key]) for key in self]
 
     def clear(self):
-        self.__keys = []
+        self.__keys.clear()
         super(SON, self).clear()
 
     def setdefault(self, key, default=None):
@@ -39,10 +39,16 @@ static struct module_state _state;
 
 #if PY_MAJOR_VERSION >= 3
 #define BYTES_FORMAT_STRING "y#"
+#define BYTES_FROM_STRING PyBytes_FromStringAndSize
 #else
 #define BYTES_FORMAT_STRING "s#"
+#define BYTES_FROM_STRING PyString_FromStringAndSize
 #endif
 
+/* A new bytes object with the contents of a buffer_t. */
+#define BYTES_FROM_BUFFER(buffer) \
+    BYTES_FROM_STRING(buffer_get_buffer(buffer), buffer_get_position(buffer))
+
 #define DOC_TOO_LARGE_FMT "BSON document too large (%d bytes)" \
                           " - the connected server supports" \
                           " BSON document sizes up to %ld bytes."
@@ -579,28 +585,103 @@ _set_document_too_large(int size, long max) {
     }
 }
 
+/* Call a method of sock_info with a request id and a message made of
+ * the start of the message in `head`, each bytes object in `segments`,
+ * then `tail` if it isn't NULL. The message is passed as a list of those
+ * buffers, so the encoded documents are never copied into one string.
+ * Steals the reference to `extra`. */
+static PyObject*
+_call_with_message(PyObject* sock_info, const char* method, int request_id,
+                   buffer_t head, PyObject* segments, PyObject* tail,
+                   PyObject* extra) {
+    PyObject* result;
+    PyObject* start;
+    Py_ssize_t count = PyList_GET_SIZE(segments);
+    Py_ssize_t i;
+    PyObject* message = PyList_New(count + (tail ? 2 : 1));
+    if (!message) {
+        Py_XDECREF(extra);
+        return NULL;
+    }
+    if (!(start = BYTES_FROM_BUFFER(head))) {
+        Py_DECREF(message);
+        Py_XDECREF(extra);
+        return NULL;
+    }
+    PyList_SET_ITEM(message, 0, start);
+    for (i = 0; i < count; i++) {
+        PyObject* segment = PyList_GET_ITEM(segments, i);
+        Py_INCREF(segment);
+        PyList_SET_ITEM(message, i + 1, segment);
+    }
+    if (tail) {
+        Py_INCREF(tail);
+        PyList_SET_ITEM(message, count + 1, tail);
+    }
+
+    if (extra) {
+        result = PyObject_CallMethod(sock_info, (char*)method, "iOiN",
+                                     request_id, message, 0, extra);
+    } else {
+        result = PyObject_CallMethod(sock_info, (char*)method, "iO",
+                                     request_id, message);
+    }
+    Py_DECREF(message);
+    return result;
+}
+
+/* Encode `doc` in `buffer`, which is emptied first so it can be reused
+ * for each document. Returns the encoded document as a new bytes object,
+ * or NULL on failure. */
+static PyObject*
+_encode_document(PyObject* cbson, buffer_t buffer, PyObject* doc,
+                 unsigned char check_keys, codec_options_t* options) {
+    buffer_update_position(buffer, 0);
+    if (!write_dict(cbson, buffer, doc, check_keys, options, 1)) {
+        return NULL;
+    }
+    return BYTES_FROM_BUFFER(buffer);
+}
+
+/* Send an insert of the encoded documents in `segments`, `length` bytes
+ * in all, after the start of the message in `head`. */
 static PyObject*
 _send_insert(PyObject* self, PyObject* sock_info,
-             PyObject* gle_args, buffer_t buffer,
-             char* coll_name, int coll_len, int request_id, int safe,
-             codec_options_t* options) {
+             PyObject* gle_args, buffer_t head, PyObject* segments,
+             int length, char* coll_name, int coll_len, int request_id,
+             int safe, codec_options_t* options) {
+
+    PyObject* last_error = NULL;
+    PyObject* result;
+    int message_length = buffer_get_position(head) + length;
+    memcpy(buffer_get_buffer(head), &message_length, 4);
+    memcpy(buffer_get_buffer(head) + 4, &request_id, 4);
 
     if (safe) {
+        buffer_t buffer = buffer_new();
+        if (!buffer) {
+            PyErr_NoMemory();
+            return NULL;
+        }
         if (!add_last_error(self, buffer, request_id,
                             coll_name, coll_len, options, gle_args)) {
+            buffer_free(buffer);
+            return NULL;
+        }
+        last_error = BYTES_FROM_BUFFER(buffer);
+        buffer_free(buffer);
+        if (!last_error) {
             return NULL;
         }
     }
 
     /* The max_doc_size parameter for legacy_write is the max size of any
-     * document in buffer. We enforced max size already, pass 0 here. */
-    return PyObject_CallMethod(sock_info, "legacy_write",
-                               "i" BYTES_FORMAT_STRING "iN",
-                               request_id,
-                               buffer_get_buffer(buffer),
-                               buffer_get_position(buffer),
-                               0,
-                               PyBool_FromLong((long)safe));
+     * document in the message. We enforced max size already, pass 0 here. */
+    result = _call_with_message(sock_info, "legacy_write", request_id,
+                                head, segments, last_error,
+                                PyBool_FromLong((long)safe));
+    Py_XDECREF(last_error);
+    return result;
 }
 
 static PyObject* _cbson_do_batched_insert(PyObject* self, PyObject* args) {
@@ -609,15 +690,17 @@ static PyObject* _cbson_do_batched_insert(PyObject* self, PyObject* args) {
     /* NOTE just using a random number as the request_id */
     int request_id = rand();
     int send_safe, flags = 0;
-    int length_location, message_length;
+    int batch_length = 0;
     int collection_name_length;
     char* collection_name = NULL;
     PyObject* docs;
     PyObject* doc;
+    PyObject* encoded;
+    PyObject* segments = NULL;
     PyObject* iterator;
     PyObject* sock_info;
     PyObject* last_error_args;
-    PyObject* result;
+    PyObject* result = NULL;
     PyObject* max_bson_size_obj;
     PyObject* max_message_size_obj;
     unsigned char check_keys;
@@ -628,6 +711,7 @@ static PyObject* _cbson_do_batched_insert(PyObject* self, PyObject* args) {
     long max_bson_size;
     long max_message_size;
     buffer_t buffer;
+    buffer_t doc_buffer = NULL;
     PyObject *exc_type = NULL, *exc_value = NULL, *exc_trace = NULL;
 
     if (!PyArg_ParseTuple(args, "et#ObbObO&O",
@@ -683,12 +767,19 @@ static PyObject* _cbson_do_batched_insert(PyObject* self, PyObject* args) {
         return NULL;
     }
 
-    length_location = init_insert_buffer(buffer,
-                                         request_id,
-                                         flags,
-                                         collection_name,
-                                         collection_name_length);
-    if (length_location == -1) {
+    /* The start of each message, up to the documents. The message length
+     * and request id are filled in when it's sent. */
+    if (init_insert_buffer(buffer, request_id, flags, collection_name,
+                           collection_name_length) == -1) {
+        goto insertfail;
+    }
+    /* Each document is encoded in doc_buffer, then copied to a bytes
+     * object of its own in segments. */
+    if (!(doc_buffer = buffer_new())) {
+        PyErr_NoMemory();
+        goto insertfail;
+    }
+    if (!(segments = PyList_New(0))) {
         goto insertfail;
     }
 
@@ -702,24 +793,22 @@ static PyObject* _cbson_do_batched_insert(PyObject* self, PyObject* args) {
         goto insertfail;
     }
     while ((doc = PyIter_Next(iterator)) != NULL) {
-        int before = buffer_get_position(buffer);
         int cur_size;
-        if (!write_dict(state->_cbson, buffer, doc, check_keys,
-                        &options, 1)) {
-            Py_DECREF(doc);
+        int sent = 0;
+        encoded = _encode_document(state->_cbson, doc_buffer, doc,
+                                   check_keys, &options);
+        Py_DECREF(doc);
+        if (!encoded) {
             goto iterfail;
         }
-        Py_DECREF(doc);
 
-        cur_size = buffer_get_position(buffer) - before;
+        cur_size = buffer_get_position(doc_buffer);
         if (cur_size > max_bson_size) {
+            Py_DECREF(encoded);
             /* If we've encoded anything send it before raising. */
             if (!empty) {
-                buffer_update_position(buffer, before);
-                message_length = buffer_get_position(buffer) - length_location;
-                memcpy(buffer_get_buffer(buffer) + length_location,
-                       &message_length, 4);
-                result = _send_insert(self, sock_info, last_error_args, buffer,
+                result = _send_insert(self, sock_info, last_error_args,
+                                      buffer, segments, batch_length,
                                       collection_name, collection_name_length,
                                       request_id, send_safe, &options);
                 if (!result)
@@ -732,45 +821,31 @@ static PyObject* _cbson_do_batched_insert(PyObject* self, PyObject* args) {
         empty = 0;
 
         /* We have enough data, send this batch. */
-        if (buffer_get_position(buffer) > max_message_size) {
-            int new_request_id = rand();
-            int message_start;
-            buffer_t new_buffer = buffer_new();
-            if (!new_buffer) {
-                PyErr_NoMemory();
-                goto iterfail;
-            }
-            message_start = init_insert_buffer(new_buffer,
-                                               new_request_id,
-                                               flags,
-                                               collection_name,
-                                               collection_name_length);
-            if (message_start == -1) {
-                buffer_free(new_buffer);
-                goto iterfail;
-            }
-
-            /* Copy the overflow encoded document into the new buffer. */
-            if (!buffer_write_bytes(new_buffer,
-                (const char*)buffer_get_buffer(buffer) + before, cur_size)) {
-                buffer_free(new_buffer);
-                goto iterfail;
-            }
-
-            /* Roll back to the beginning of this document. */
-            buffer_update_position(buffer, before);
-            message_length = buffer_get_position(buffer) - length_location;
-            memcpy(buffer_get_buffer(buffer) + length_location, &message_length, 4);
-
-            result = _send_insert(self, sock_info, last_error_args, buffer,
+        if (PyList_GET_SIZE(segments) && buffer_get_position(buffer) +
+                batch_length + cur_size > max_message_size) {
+            result = _send_insert(self, sock_info, last_error_args,
+                                  buffer, segments, batch_length,
                                   collection_name, collection_name_length,
                                   request_id, send_safe, &options);
+            sent = 1;
 
-            buffer_free(buffer);
-            buffer = new_buffer;
-            request_id = new_request_id;
-            length_location = message_start;
+            /* Start the next batch with this document. */
+            Py_DECREF(segments);
+            segments = PyList_New(0);
+            batch_length = 0;
+            request_id = rand();
+        }
+        if (!segments || PyList_Append(segments, encoded) < 0) {
+            Py_DECREF(encoded);
+            if (sent) {
+                Py_XDECREF(result);
+            }
+            goto iterfail;
+        }
+        Py_DECREF(encoded);
+        batch_length += cur_size;
 
+        if (sent) {
             if (!result) {
                 PyObject *etype = NULL, *evalue = NULL, *etrace = NULL;
                 PyObject* OperationFailure;
@@ -788,6 +863,8 @@ static PyObject* _cbson_do_batched_insert(PyObject* self, PyObject* args) {
                                 Py_XDECREF(etrace);
                                 Py_DECREF(iterator);
                                 buffer_free(buffer);
+                                buffer_free(doc_buffer);
+                                Py_DECREF(segments);
                                 PyMem_Free(collection_name);
                                 Py_RETURN_NONE;
                             }
@@ -829,16 +906,16 @@ static PyObject* _cbson_do_batched_insert(PyObject* self, PyObject* args) {
         goto insertfail;
     }
 
-    message_length = buffer_get_position(buffer) - length_location;
-    memcpy(buffer_get_buffer(buffer) + length_location, &message_length, 4);
-
     /* Send the last (or only) batch */
     result = _send_insert(self, sock_info, last_error_args, buffer,
+                          segments, batch_length,
                           collection_name, collection_name_length,
                           request_id, safe, &options);
 
     PyMem_Free(collection_name);
     buffer_free(buffer);
+    buffer_free(doc_buffer);
+    Py_DECREF(segments);
 
     if (!result) {
         Py_XDECREF(exc_type);
@@ -865,31 +942,41 @@ insertfail:
     Py_XDECREF(exc_value);
     Py_XDECREF(exc_trace);
     buffer_free(buffer);
+    buffer_free(doc_buffer);
+    Py_XDECREF(segments);
     PyMem_Free(collection_name);
     return NULL;
 }
 
+/* Send a write command with the elements of its list of documents in
+ * `segments`, `length` bytes in all, after the start of the message in
+ * `head`. */
 static PyObject*
-_send_write_command(PyObject* sock_info, buffer_t buffer,
-                    int lst_len_loc, int cmd_len_loc, unsigned char* errors) {
+_send_write_command(PyObject* sock_info, buffer_t head, PyObject* segments,
+                    int length, int lst_len_loc, int cmd_len_loc,
+                    unsigned char* errors) {
 
     PyObject* result;
+    PyObject* tail;
 
     int request_id = rand();
-    int position = buffer_get_position(buffer);
-    int length = position - lst_len_loc - 1;
-    memcpy(buffer_get_buffer(buffer) + lst_len_loc, &length, 4);
-    length = position - cmd_len_loc;
-    memcpy(buffer_get_buffer(buffer) + cmd_len_loc, &length, 4);
-    memcpy(buffer_get_buffer(buffer), &position, 4);
-    memcpy(buffer_get_buffer(buffer) + 4, &request_id, 4);
+    /* The list and the command are closed by the two NUL bytes in tail. */
+    int position = buffer_get_position(head) + length + 2;
+    int list_length = position - lst_len_loc - 1;
+    int cmd_length = position - cmd_len_loc;
+    memcpy(buffer_get_buffer(head) + lst_len_loc, &list_length, 4);
+    memcpy(buffer_get_buffer(head) + cmd_len_loc, &cmd_length, 4);
+    memcpy(buffer_get_buffer(head), &position, 4);
+    memcpy(buffer_get_buffer(head) + 4, &request_id, 4);
+
+    if (!(tail = BYTES_FROM_STRING("\x00\x00", 2))) {
+        return NULL;
+    }
 
     /* Send the current batch */
-    result = PyObject_CallMethod(sock_info, "write_command",
-                                 "i" BYTES_FORMAT_STRING,
-                                 request_id,
-                                 buffer_get_buffer(buffer),
-                                 buffer_get_position(buffer));
+    result = _call_with_message(sock_info, "write_command", request_id,
+                                head, segments, tail, NULL);
+    Py_DECREF(tail);
     if (result && PyDict_GetItemString(result, "writeErrors"))
         *errors = 1;
     return result;
@@ -938,6 +1025,7 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
     long max_write_batch_size;
     long idx_offset = 0;
     int idx = 0;
+    int batch_length = 0;
     int cmd_len_loc;
     int lst_len_loc;
     int ns_len;
@@ -948,6 +1036,8 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
     PyObject* command;
     PyObject* doc;
     PyObject* docs;
+    PyObject* encoded;
+    PyObject* segments = NULL;
     PyObject* sock_info;
     PyObject* iterator;
     PyObject* result;
@@ -958,6 +1048,7 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
     unsigned char empty = 1;
     unsigned char errors = 0;
     buffer_t buffer;
+    buffer_t doc_buffer = NULL;
 
     if (!PyArg_ParseTuple(args, "et#bOObO&O", "utf-8",
                           &ns, &ns_len, &op, &command, &docs, &check_keys,
@@ -1066,6 +1157,16 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
         goto cmdfail;
     }
 
+    /* Each document is encoded in doc_buffer, then copied to a bytes
+     * object of its own in segments, after one with its type and key. */
+    if (!(doc_buffer = buffer_new())) {
+        PyErr_NoMemory();
+        goto cmdfail;
+    }
+    if (!(segments = PyList_New(0))) {
+        goto cmdfail;
+    }
+
     iterator = PyObject_GetIter(docs);
     if (iterator == NULL) {
         PyObject* InvalidOperation = _error("InvalidOperation");
@@ -1076,36 +1177,32 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
         goto cmdfail;
     }
     while ((doc = PyIter_Next(iterator)) != NULL) {
-        int sub_doc_begin = buffer_get_position(buffer);
-        int cur_doc_begin;
         int cur_size;
+        int key_size;
         int enough_data = 0;
         int enough_documents = 0;
         char key[16];
+        char element_start[18];
+        PyObject* element;
         empty = 0;
-        INT2STRING(key, idx);
-        if (!buffer_write_bytes(buffer, "\x03", 1) ||
-            !buffer_write_bytes(buffer, key, (int)strlen(key) + 1)) {
-            Py_DECREF(doc);
-            goto cmditerfail;
-        }
-        cur_doc_begin = buffer_get_position(buffer);
-        if (!write_dict(state->_cbson, buffer, doc,
-                        check_keys, &options, 1)) {
-            Py_DECREF(doc);
+        encoded = _encode_document(state->_cbson, doc_buffer, doc,
+                                   check_keys, &options);
+        Py_DECREF(doc);
+        if (!encoded) {
             goto cmditerfail;
         }
-        Py_DECREF(doc);
+        cur_size = buffer_get_position(doc_buffer);
 
         /* We have enough data, maybe send this batch. */
-        enough_data = (buffer_get_position(buffer) > max_cmd_size);
+        INT2STRING(key, idx);
+        enough_data = (buffer_get_position(buffer) + batch_length +
+                       (int)strlen(key) + 2 + cur_size > max_cmd_size);
         enough_documents = (idx >= max_write_batch_size);
         if (enough_data || enough_documents) {
-            buffer_t new_buffer;
-            cur_size = buffer_get_position(buffer) - cur_doc_begin;
 
             /* This single document is too large for the command. */
             if (!idx) {
+                Py_DECREF(encoded);
                 if (op == _INSERT) {
                     _set_document_too_large(cur_size, max_bson_size);
                 } else {
@@ -1123,38 +1220,19 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
                 goto cmditerfail;
             }
 
-            if (!(new_buffer = buffer_new())) {
-                PyErr_NoMemory();
-                goto cmditerfail;
-            }
-            /* New buffer including the current overflow document */
-            if (!buffer_write_bytes(new_buffer,
-                (const char*)buffer_get_buffer(buffer), lst_len_loc + 5) ||
-                !buffer_write_bytes(new_buffer, "0\x00", 2) ||
-                !buffer_write_bytes(new_buffer,
-                (const char*)buffer_get_buffer(buffer) + cur_doc_begin, cur_size)) {
-                buffer_free(new_buffer);
-                goto cmditerfail;
-            }
-            /*
-             * Roll the existing buffer back to the beginning
-             * of the last document encoded.
-             */
-            buffer_update_position(buffer, sub_doc_begin);
-
-            if (!buffer_write_bytes(buffer, "\x00\x00", 2)) {
-                buffer_free(new_buffer);
-                goto cmditerfail;
-            }
+            result = _send_write_command(sock_info, buffer, segments,
+                                         batch_length, lst_len_loc,
+                                         cmd_len_loc, &errors);
 
-            result = _send_write_command(sock_info, buffer,
-                                         lst_len_loc, cmd_len_loc, &errors);
+            /* Start the next batch with this document. */
+            Py_DECREF(segments);
+            segments = PyList_New(0);
+            batch_length = 0;
 
-            buffer_free(buffer);
-            buffer = new_buffer;
-
-            if (!result)
+            if (!result) {
+                Py_DECREF(encoded);
                 goto cmditerfail;
+            }
 
 #if PY_MAJOR_VERSION >= 3
             result = Py_BuildValue("NN",
@@ -1163,21 +1241,46 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
             result = Py_BuildValue("NN",
                                    PyInt_FromLong(idx_offset), result);
 #endif
-            if (!result)
+            if (!result) {
+                Py_DECREF(encoded);
                 goto cmditerfail;
+            }
 
             PyList_Append(results, result);
             Py_DECREF(result);
 
             if (errors && ordered) {
+                Py_DECREF(encoded);
+                Py_XDECREF(segments);
                 destroy_codec_options(&options);
                 Py_DECREF(iterator);
                 buffer_free(buffer);
+                buffer_free(doc_buffer);
                 return results;
             }
             idx_offset += idx;
             idx = 0;
+            INT2STRING(key, idx);
+        }
+
+        /* The element's type and key, then the document. */
+        key_size = (int)strlen(key) + 1;
+        element_start[0] = 0x03;
+        memcpy(element_start + 1, key, key_size);
+        if (!segments ||
+            !(element = BYTES_FROM_STRING(element_start, key_size + 1))) {
+            Py_DECREF(encoded);
+            goto cmditerfail;
+        }
+        if (PyList_Append(segments, element) < 0 ||
+            PyList_Append(segments, encoded) < 0) {
+            Py_DECREF(element);
+            Py_DECREF(encoded);
+            goto cmditerfail;
         }
+        Py_DECREF(element);
+        Py_DECREF(encoded);
+        batch_length += key_size + 1 + cur_size;
         idx += 1;
     }
     Py_DECREF(iterator);
@@ -1195,10 +1298,7 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
         goto cmdfail;
     }
 
-    if (!buffer_write_bytes(buffer, "\x00\x00", 2))
-        goto cmdfail;
-
-    result = _send_write_command(sock_info, buffer,
+    result = _send_write_command(sock_info, buffer, segments, batch_length,
                                  lst_len_loc, cmd_len_loc, &errors);
     if (!result)
         goto cmdfail;
@@ -1212,6 +1312,8 @@ _cbson_do_batched_write_command(PyObject* self, PyObject* args) {
         goto cmdfail;
 
     buffer_free(buffer);
+    buffer_free(doc_buffer);
+    Py_DECREF(segments);
 
     PyList_Append(results, result);
     Py_DECREF(result);
@@ -1224,6 +1326,8 @@ cmdfail:
     destroy_codec_options(&options);
     Py_DECREF(results);
     buffer_free(buffer);
+    buffer_free(doc_buffer);
+    Py_XDECREF(segments);
     return NULL;
 }
 
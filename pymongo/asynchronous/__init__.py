@@ -0,0 +1,58 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""A client for asyncio applications.
+
+:class:`AsyncMongoClient` and the databases, collections, and cursors it
+returns do their network I/O with coroutines on an asyncio event loop,
+instead of blocking a thread for each operation:
+
+.. code-block:: python
+
+  import asyncio
+  from pymongo.asynchronous import AsyncMongoClient
+
+  @asyncio.coroutine
+  def main(loop):
+      client = AsyncMongoClient(loop=loop)
+      collection = client.test.test
+      yield from collection.insert_one({'x': 1})
+      cursor = collection.find({'x': {'$gt': 0}})
+      while (yield from cursor.fetch_next):
+          print(cursor.next_object())
+      client.close()
+
+  loop = asyncio.get_event_loop()
+  loop.run_until_complete(main(loop))
+
+Only the socket and connection pool layers are coroutines. Messages are
+built and replies parsed by the same code :class:`~pymongo.MongoClient`
+uses, and servers are discovered and selected by the same topology logic.
+
+Requires Python 3.4 or later. Writes are sent as write commands, so they
+require MongoDB 2.6 or later. Authentication and exhaust cursors are not
+supported.
+
+.. versionadded:: 3.1
+"""
+
+import sys
+
+if sys.version_info[:2] < (3, 4):
+    raise ImportError("pymongo.asynchronous requires Python 3.4 or later")
+
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.cursor import AsyncCursor
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.asynchronous.mongo_client import AsyncMongoClient
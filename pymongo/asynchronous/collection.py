@@ -0,0 +1,585 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Collection level operations, with coroutines."""
+
+import asyncio
+import collections
+
+from bson.objectid import ObjectId
+from bson.py3compat import string_type, _unicode, u
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+from pymongo import common, helpers
+from pymongo.asynchronous.cursor import AsyncCursor
+from pymongo.bulk import _Bulk, _COMMANDS, _merge_command
+from pymongo.errors import (BulkWriteError,
+                            ConfigurationError,
+                            InvalidName,
+                            InvalidOperation)
+from pymongo.helpers import _check_write_command_response
+from pymongo.message import _INSERT, _do_batched_write_command
+from pymongo.operations import _WriteOp
+from pymongo.results import (BulkWriteResult,
+                             DeleteResult,
+                             InsertOneResult,
+                             InsertManyResult,
+                             UpdateResult)
+
+_UJOIN = u("%s.%s")
+
+
+def _check_write_command_support(sock_info):
+    """Raise ConfigurationError if the server doesn't support write
+    commands, the only way an AsyncCollection sends writes."""
+    if sock_info.max_wire_version < 2:
+        raise ConfigurationError(
+            "pymongo.asynchronous requires MongoDB 2.6 or later for writes")
+
+
+class _StopBatching(Exception):
+    """Raised by a :class:`_BatchRecorder` once it has recorded a batch."""
+
+
+class _BatchRecorder(object):
+    """Stands in for a SocketInfo when splitting a write into batches
+    with :func:`~pymongo.message._do_batched_write_command`.
+
+    Instead of sending the first batch's message it records it and raises
+    :class:`_StopBatching`, so the batch can be sent with a coroutine
+    before the next one is encoded.
+    """
+    def __init__(self, sock_info):
+        self.max_bson_size = sock_info.max_bson_size
+        self.max_message_size = sock_info.max_message_size
+        self.max_write_batch_size = sock_info.max_write_batch_size
+        self.batch = None
+
+    def write_command(self, request_id, msg):
+        self.batch = (request_id, msg)
+        raise _StopBatching
+
+
+class _Documents(object):
+    """Iterates over the documents of a list from `start`, counting the
+    documents taken.
+    """
+    def __init__(self, docs, start):
+        self.docs = docs
+        self.start = start
+        self.taken = 0
+        self.exhausted = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        index = self.start + self.taken
+        if index >= len(self.docs):
+            self.exhausted = True
+            raise StopIteration
+        self.taken += 1
+        return self.docs[index]
+
+
+def _batched_write_command(namespace, operation, command,
+                           docs, opts, sock_info):
+    """Split a write command on the list `docs` into batches.
+
+    Yields (offset, request_id, msg) for each batch. A batch is only
+    encoded once the previous one has been consumed, so a single batch
+    is held in memory at a time and nothing more is encoded after the
+    caller stops iterating.
+    """
+    offset = 0
+    while True:
+        recorder = _BatchRecorder(sock_info)
+        source = _Documents(docs, offset)
+        try:
+            _do_batched_write_command(namespace, operation, command,
+                                      source, True, opts, recorder)
+        except _StopBatching:
+            pass
+        request_id, msg = recorder.batch
+        yield offset, request_id, msg
+        if source.exhausted:
+            return
+        # The batch was full: the last document taken didn't fit in it,
+        # and is encoded again at the start of the next batch.
+        offset += source.taken - 1
+
+
+class AsyncCollection(common.BaseObject):
+    """A Mongo collection, for use on an asyncio event loop.
+    """
+
+    def __init__(self, database, name, codec_options=None,
+                 read_preference=None, write_concern=None):
+        """Get a collection.
+
+        Raises :class:`TypeError` if `name` is not an instance of
+        :class:`str`. Raises :class:`~pymongo.errors.InvalidName` if `name`
+        is not a valid collection name. The collection is created
+        implicitly on first use.
+
+        :Parameters:
+          - `database`: the
+            :class:`~pymongo.asynchronous.database.AsyncDatabase` to get a
+            collection from
+          - `name`: the name of the collection to get
+          - `codec_options` (optional): An instance of
+            :class:`~bson.codec_options.CodecOptions`. If ``None`` (the
+            default) database.codec_options is used.
+          - `read_preference` (optional): The read preference to use. If
+            ``None`` (the default) database.read_preference is used.
+          - `write_concern` (optional): An instance of
+            :class:`~pymongo.write_concern.WriteConcern`. If ``None`` (the
+            default) database.write_concern is used.
+        """
+        super(AsyncCollection, self).__init__(
+            codec_options or database.codec_options,
+            read_preference or database.read_preference,
+            write_concern or database.write_concern)
+
+        if not isinstance(name, string_type):
+            raise TypeError("name must be an instance "
+                            "of %s" % (string_type.__name__,))
+
+        if not name or ".." in name:
+            raise InvalidName("collection names cannot be empty")
+        if "$" in name and not (name.startswith("oplog.$main") or
+                                name.startswith("$cmd")):
+            raise InvalidName("collection names must not "
+                              "contain '$': %r" % name)
+        if name[0] == "." or name[-1] == ".":
+            raise InvalidName("collection names must not start "
+                              "or end with '.': %r" % name)
+        if "\x00" in name:
+            raise InvalidName("collection names must not contain the "
+                              "null character")
+
+        self.__database = database
+        self.__name = _unicode(name)
+        self.__full_name = _UJOIN % (self.__database.name, self.__name)
+
+    def __getattr__(self, name):
+        """Get a sub-collection of this collection by name.
+
+        Raises InvalidName if an invalid collection name is used.
+
+        :Parameters:
+          - `name`: the name of the collection to get
+        """
+        if name.startswith('_'):
+            full_name = _UJOIN % (self.__name, name)
+            raise AttributeError(
+                "AsyncCollection has no attribute %r. To access the %s"
+                " collection, use database['%s']." % (
+                    name, full_name, full_name))
+        return self.__getitem__(name)
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.__database, _UJOIN % (self.__name, name))
+
+    def __repr__(self):
+        return "AsyncCollection(%r, %r)" % (self.__database, self.__name)
+
+    def __eq__(self, other):
+        if isinstance(other, AsyncCollection):
+            return (self.__database == other.database and
+                    self.__name == other.name)
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def full_name(self):
+        """The full name of this :class:`AsyncCollection`.
+
+        The full name is of the form `database_name.collection_name`.
+        """
+        return self.__full_name
+
+    @property
+    def name(self):
+        """The name of this :class:`AsyncCollection`."""
+        return self.__name
+
+    @property
+    def database(self):
+        """The :class:`~pymongo.asynchronous.database.AsyncDatabase` that
+        this :class:`AsyncCollection` is a part of.
+        """
+        return self.__database
+
+    @asyncio.coroutine
+    def _write(self, command, check_keys=False):
+        """Send a write command with one statement and return its result.
+
+        Adds this collection's write concern. Raises WriteError,
+        WriteConcernError, or DuplicateKeyError like
+        :meth:`pymongo.collection.Collection._insert_one`.
+        """
+        concern = self.write_concern.document
+        if concern:
+            command['writeConcern'] = concern
+        return (yield from self.__database.client._run_on_socket(
+            None, self.__write_on_socket, command, check_keys))
+
+    @asyncio.coroutine
+    def __write_on_socket(self, sock_info, slave_ok, command, check_keys):
+        _check_write_command_support(sock_info)
+        # The command result has to be published for APM unmodified
+        # so we make a shallow copy here.
+        result = (yield from sock_info.command(
+            self.__database.name, command, codec_options=self.codec_options,
+            check_keys=check_keys)).copy()
+        _check_write_command_response([(0, result)])
+        return result
+
+    @asyncio.coroutine
+    def _execute_bulk(self, blk):
+        """Execute a :class:`~pymongo.bulk._Bulk` with write commands.
+
+        A coroutine version of :meth:`~pymongo.bulk._Bulk.execute_command`.
+        Each run of operations is split into batches by
+        :func:`~pymongo.message._do_batched_write_command`, and each
+        batch is sent before the next one is encoded.
+        """
+        if not blk.ops:
+            raise InvalidOperation('No operations to execute')
+        if blk.executed:
+            raise InvalidOperation('Bulk operations can '
+                                   'only be executed once.')
+        blk.executed = True
+        return (yield from self.__database.client._run_on_socket(
+            None, self.__execute_bulk_on_socket, blk))
+
+    @asyncio.coroutine
+    def __execute_bulk_on_socket(self, sock_info, slave_ok, blk):
+        _check_write_command_support(sock_info)
+        if blk.ordered:
+            generator = blk.gen_ordered()
+        else:
+            generator = blk.gen_unordered()
+
+        # nModified is only reported for write commands, not legacy ops.
+        full_result = {
+            "writeErrors": [],
+            "writeConcernErrors": [],
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nRemoved": 0,
+            "upserted": [],
+        }
+        concern = self.write_concern.document
+        for run in generator:
+            cmd = SON([(_COMMANDS[run.op_type], self.__name),
+                       ('ordered', blk.ordered)])
+            if concern:
+                cmd['writeConcern'] = concern
+
+            results = []
+            for offset, request_id, msg in _batched_write_command(
+                    blk.namespace, run.op_type, cmd,
+                    run.ops, self.codec_options, sock_info):
+                result = yield from sock_info.write_command(request_id, msg)
+                results.append((offset, result))
+                if blk.ordered and "writeErrors" in result:
+                    break
+
+            _merge_command(run, full_result, results)
+            # We're supposed to continue if errors are
+            # at the write concern level (e.g. wtimeout)
+            if blk.ordered and full_result['writeErrors']:
+                break
+
+        if full_result["writeErrors"] or full_result["writeConcernErrors"]:
+            if full_result['writeErrors']:
+                full_result['writeErrors'].sort(
+                    key=lambda error: error['index'])
+            raise BulkWriteError(full_result)
+        return full_result
+
+    @asyncio.coroutine
+    def bulk_write(self, requests, ordered=True):
+        """Send a batch of write operations to the server.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.bulk_write`.
+
+        :Parameters:
+          - `requests`: A list of write operations, instances of the classes
+            in :mod:`pymongo.operations`.
+          - `ordered` (optional): If ``True`` (the default) requests will be
+            performed on the server serially, in the order provided. If an
+            error occurs all remaining operations are aborted. If ``False``
+            requests will be performed on the server in arbitrary order,
+            possibly in parallel, and all operations will be attempted.
+
+        :Returns:
+          An instance of :class:`~pymongo.results.BulkWriteResult`.
+        """
+        if not isinstance(requests, list):
+            raise TypeError("requests must be a list")
+
+        blk = _Bulk(self, ordered)
+        for request in requests:
+            if not isinstance(request, _WriteOp):
+                raise TypeError("%r is not a valid request" % (request,))
+            request._add_to_bulk(blk)
+
+        bulk_api_result = yield from self._execute_bulk(blk)
+        return BulkWriteResult(bulk_api_result,
+                               self.write_concern.acknowledged)
+
+    @asyncio.coroutine
+    def insert_one(self, document):
+        """Insert a single document.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.insert_one`::
+
+          result = yield from collection.insert_one({'x': 1})
+
+        :Parameters:
+          - `document`: The document to insert. If the document does not
+            have an _id field one will be added automatically.
+
+        :Returns:
+          - An instance of :class:`~pymongo.results.InsertOneResult`.
+        """
+        common.validate_is_document_type("document", document)
+        if not (isinstance(document, RawBSONDocument) or "_id" in document):
+            document["_id"] = ObjectId()
+        command = SON([('insert', self.__name),
+                       ('documents', [document]),
+                       ('ordered', True)])
+        yield from self._write(command, check_keys=True)
+        return InsertOneResult(document.get("_id"),
+                               self.write_concern.acknowledged)
+
+    @asyncio.coroutine
+    def insert_many(self, documents, ordered=True):
+        """Insert an iterable of documents.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.insert_many`.
+
+        :Parameters:
+          - `documents`: A iterable of documents to insert.
+          - `ordered` (optional): If ``True`` (the default) documents will be
+            inserted on the server serially, in the order provided. If an
+            error occurs all remaining inserts are aborted. If ``False``,
+            documents will be inserted on the server in arbitrary order,
+            possibly in parallel, and all document inserts will be
+            attempted.
+
+        :Returns:
+          An instance of :class:`~pymongo.results.InsertManyResult`.
+        """
+        if not isinstance(documents, collections.Iterable) or not documents:
+            raise TypeError("documents must be a non-empty list")
+        inserted_ids = []
+        def gen():
+            """A generator that validates documents and handles _ids."""
+            for document in documents:
+                common.validate_is_document_type("document", document)
+                if not (isinstance(document, RawBSONDocument) or
+                        "_id" in document):
+                    document["_id"] = ObjectId()
+                inserted_ids.append(document.get("_id"))
+                yield (_INSERT, document)
+
+        blk = _Bulk(self, ordered)
+        blk.ops = [doc for doc in gen()]
+        yield from self._execute_bulk(blk)
+        return InsertManyResult(inserted_ids, self.write_concern.acknowledged)
+
+    @asyncio.coroutine
+    def _update(self, criteria, document, upsert=False, multi=False):
+        """Internal update / replace helper."""
+        common.validate_boolean("upsert", upsert)
+        command = SON([('update', self.__name),
+                       ('updates', [SON([('q', criteria),
+                                         ('u', document),
+                                         ('multi', multi),
+                                         ('upsert', upsert)])]),
+                       ('ordered', True)])
+        result = yield from self._write(command)
+        # Add the updatedExisting field for compatibility.
+        if result.get('n') and 'upserted' not in result:
+            result['updatedExisting'] = True
+        else:
+            result['updatedExisting'] = False
+            # MongoDB >= 2.6.0 returns the upsert _id in an array
+            # element. Break it out for backward compatibility.
+            if 'upserted' in result:
+                result['upserted'] = result['upserted'][0]['_id']
+
+        return result
+
+    @asyncio.coroutine
+    def replace_one(self, filter, replacement, upsert=False):
+        """Replace a single document matching the filter.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.replace_one`.
+
+        :Parameters:
+          - `filter`: A query that matches the document to replace.
+          - `replacement`: The new document.
+          - `upsert` (optional): If ``True``, perform an insert if no
+            documents match the filter.
+
+        :Returns:
+          - An instance of :class:`~pymongo.results.UpdateResult`.
+        """
+        common.validate_is_mapping("filter", filter)
+        common.validate_ok_for_replace(replacement)
+        result = yield from self._update(filter, replacement, upsert)
+        return UpdateResult(result, self.write_concern.acknowledged)
+
+    @asyncio.coroutine
+    def update_one(self, filter, update, upsert=False):
+        """Update a single document matching the filter.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.update_one`.
+
+        :Parameters:
+          - `filter`: A query that matches the document to update.
+          - `update`: The modifications to apply.
+          - `upsert` (optional): If ``True``, perform an insert if no
+            documents match the filter.
+
+        :Returns:
+          - An instance of :class:`~pymongo.results.UpdateResult`.
+        """
+        common.validate_is_mapping("filter", filter)
+        common.validate_ok_for_update(update)
+        result = yield from self._update(filter, update, upsert)
+        return UpdateResult(result, self.write_concern.acknowledged)
+
+    @asyncio.coroutine
+    def update_many(self, filter, update, upsert=False):
+        """Update one or more documents that match the filter.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.update_many`.
+
+        :Parameters:
+          - `filter`: A query that matches the documents to update.
+          - `update`: The modifications to apply.
+          - `upsert` (optional): If ``True``, perform an insert if no
+            documents match the filter.
+
+        :Returns:
+          - An instance of :class:`~pymongo.results.UpdateResult`.
+        """
+        common.validate_is_mapping("filter", filter)
+        common.validate_ok_for_update(update)
+        result = yield from self._update(filter, update, upsert,
+                                         multi=True)
+        return UpdateResult(result, self.write_concern.acknowledged)
+
+    @asyncio.coroutine
+    def _delete(self, criteria, multi):
+        """Internal delete helper."""
+        common.validate_is_mapping("filter", criteria)
+        command = SON([('delete', self.__name),
+                       ('deletes', [SON([('q', criteria),
+                                         ('limit', int(not multi))])]),
+                       ('ordered', True)])
+        return (yield from self._write(command))
+
+    @asyncio.coroutine
+    def delete_one(self, filter):
+        """Delete a single document matching the filter.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.delete_one`.
+
+        :Parameters:
+          - `filter`: A query that matches the document to delete.
+        :Returns:
+          - An instance of :class:`~pymongo.results.DeleteResult`.
+        """
+        return DeleteResult((yield from self._delete(filter, False)),
+                            self.write_concern.acknowledged)
+
+    @asyncio.coroutine
+    def delete_many(self, filter):
+        """Delete one or more documents matching the filter.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.delete_many`.
+
+        :Parameters:
+          - `filter`: A query that matches the documents to delete.
+        :Returns:
+          - An instance of :class:`~pymongo.results.DeleteResult`.
+        """
+        return DeleteResult((yield from self._delete(filter, True)),
+                            self.write_concern.acknowledged)
+
+    @asyncio.coroutine
+    def drop(self):
+        """Drop this collection. A coroutine."""
+        yield from self.__database.command(
+            "drop", self.__name, allowable_errors=["ns not found"])
+
+    def find(self, *args, **kwargs):
+        """Query the database.
+
+        Takes the same arguments as :meth:`pymongo.collection.Collection.find`
+        and returns an :class:`~pymongo.asynchronous.cursor.AsyncCursor`.
+        No I/O is done until results are fetched from the cursor.
+        """
+        return AsyncCursor(self, *args, **kwargs)
+
+    @asyncio.coroutine
+    def find_one(self, filter=None, *args, **kwargs):
+        """Get a single document from the database.
+
+        A coroutine, like :meth:`pymongo.collection.Collection.find_one`.
+        Returns a single document, or ``None`` if no matching document is
+        found.
+        """
+        if (filter is not None and not
+                isinstance(filter, collections.Mapping)):
+            filter = {"_id": filter}
+
+        cursor = self.find(filter, *args, **kwargs).limit(-1)
+        for result in (yield from cursor.to_list()):
+            return result
+        return None
+
+    @asyncio.coroutine
+    def count(self, filter=None, **kwargs):
+        """Get the number of documents in this collection.
+
+        A coroutine, with the same parameters as
+        :meth:`pymongo.collection.Collection.count`. It obeys the
+        :attr:`read_preference` of this :class:`AsyncCollection`.
+        """
+        cmd = SON([("count", self.__name)])
+        if filter is not None:
+            if "query" in kwargs:
+                raise ConfigurationError("can't pass both filter and query")
+            kwargs["query"] = filter
+        if "hint" in kwargs and not isinstance(kwargs["hint"], string_type):
+            kwargs["hint"] = helpers._index_document(kwargs["hint"])
+        cmd.update(kwargs)
+        res = yield from self.__database.command(
+            cmd, allowable_errors=["ns missing"],
+            read_preference=self.read_preference)
+        if res.get("errmsg", "") == "ns missing":
+            return 0
+        return int(res["n"])
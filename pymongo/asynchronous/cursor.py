@@ -0,0 +1,342 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Cursor class to iterate over Mongo query results with coroutines."""
+
+import asyncio
+
+from collections import deque
+
+from bson.py3compat import integer_types
+from bson.son import SON
+from pymongo import helpers
+from pymongo.common import validate_is_mapping
+from pymongo.cursor import _QUERY_OPTIONS
+from pymongo.errors import (AutoReconnect,
+                            InvalidOperation,
+                            NotMasterError)
+from pymongo.message import _CursorAddress, _GetMore, _Query
+from pymongo.read_preferences import ReadPreference
+
+
+class AsyncCursor(object):
+    """A cursor over Mongo query results, for use on an asyncio event loop.
+
+    Iterate it with :attr:`fetch_next` and :meth:`next_object`::
+
+      cursor = collection.find({'x': {'$gt': 0}})
+      while (yield from cursor.fetch_next):
+          doc = cursor.next_object()
+
+    Or get all the results with :meth:`to_list`. On Python 3.5 and later an
+    AsyncCursor also supports ``async for``.
+    """
+
+    def __init__(self, collection, filter=None, projection=None, skip=0,
+                 limit=0, sort=None, batch_size=0):
+        """Create a new cursor.
+
+        Should not be called directly by application developers - see
+        :meth:`~pymongo.asynchronous.collection.AsyncCollection.find`
+        instead.
+        """
+        self.__id = None
+
+        spec = filter
+        if spec is None:
+            spec = {}
+
+        validate_is_mapping("filter", spec)
+        if not isinstance(skip, int):
+            raise TypeError("skip must be an instance of int")
+        if not isinstance(limit, int):
+            raise TypeError("limit must be an instance of int")
+        if not isinstance(batch_size, integer_types):
+            raise TypeError("batch_size must be an integer")
+        if batch_size < 0:
+            raise ValueError("batch_size must be >= 0")
+
+        if projection is not None:
+            if not projection:
+                projection = {"_id": 1}
+            projection = helpers._fields_list_to_dict(projection, "projection")
+
+        self.__collection = collection
+        self.__spec = spec
+        self.__projection = projection
+        self.__skip = skip
+        self.__limit = limit
+        self.__batch_size = batch_size
+        self.__ordering = sort and helpers._index_document(sort) or None
+
+        self.__data = deque()
+        self.__address = None
+        self.__retrieved = 0
+        self.__killed = False
+
+        self.__codec_options = collection.codec_options
+        self.__read_preference = collection.read_preference
+
+        self.__query_flags = 0
+        if self.__read_preference != ReadPreference.PRIMARY:
+            self.__query_flags |= _QUERY_OPTIONS["slave_okay"]
+
+    @property
+    def collection(self):
+        """The :class:`~pymongo.asynchronous.collection.AsyncCollection`
+        that this :class:`AsyncCursor` is iterating.
+        """
+        return self.__collection
+
+    @property
+    def alive(self):
+        """Does this cursor have the potential to return more data?
+
+        Like :attr:`pymongo.cursor.Cursor.alive`.
+        """
+        return bool(len(self.__data) or (not self.__killed))
+
+    @property
+    def cursor_id(self):
+        """Returns the id of the cursor, or ``None`` before it's used."""
+        return self.__id
+
+    @property
+    def address(self):
+        """The (host, port) of the server used, or None."""
+        return self.__address
+
+    def __del__(self):
+        if self.__id and not self.__killed:
+            self.__die()
+
+    def __die(self):
+        """Closes this cursor, killing it on the server soon."""
+        if self.__id and not self.__killed:
+            self.__collection.database.client.kill_cursors(
+                [self.__id],
+                _CursorAddress(self.__address, self.__collection.full_name))
+        self.__killed = True
+
+    @asyncio.coroutine
+    def close(self):
+        """Explicitly kill this cursor on the server. A coroutine."""
+        alive = self.__id and not self.__killed
+        self.__killed = True
+        if alive:
+            yield from self.__collection.database.client._kill_cursors(
+                [self.__id],
+                _CursorAddress(self.__address, self.__collection.full_name))
+
+    def __check_okay_to_chain(self):
+        """Check if it is okay to chain more options onto this cursor.
+        """
+        if self.__retrieved or self.__id is not None:
+            raise InvalidOperation("cannot set options after executing query")
+
+    def limit(self, limit):
+        """Limits the number of results to be returned by this cursor.
+
+        Like :meth:`pymongo.cursor.Cursor.limit`.
+        """
+        if not isinstance(limit, integer_types):
+            raise TypeError("limit must be an integer")
+        self.__check_okay_to_chain()
+
+        self.__limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        """Limits the number of documents returned in one batch.
+
+        Like :meth:`pymongo.cursor.Cursor.batch_size`.
+        """
+        if not isinstance(batch_size, integer_types):
+            raise TypeError("batch_size must be an integer")
+        if batch_size < 0:
+            raise ValueError("batch_size must be >= 0")
+        self.__check_okay_to_chain()
+
+        self.__batch_size = batch_size == 1 and 2 or batch_size
+        return self
+
+    def skip(self, skip):
+        """Skips the first `skip` results of this cursor.
+
+        Like :meth:`pymongo.cursor.Cursor.skip`.
+        """
+        if not isinstance(skip, integer_types):
+            raise TypeError("skip must be an integer")
+        if skip < 0:
+            raise ValueError("skip must be >= 0")
+        self.__check_okay_to_chain()
+
+        self.__skip = skip
+        return self
+
+    def sort(self, key_or_list, direction=None):
+        """Sorts this cursor's results.
+
+        Like :meth:`pymongo.cursor.Cursor.sort`.
+        """
+        self.__check_okay_to_chain()
+        keys = helpers._index_list(key_or_list, direction)
+        self.__ordering = helpers._index_document(keys)
+        return self
+
+    def __query_spec(self):
+        """Get the spec to use for a query.
+        """
+        if self.__ordering:
+            # $query has to come first.
+            spec = SON([("$query", self.__spec)])
+            spec["$orderby"] = self.__ordering
+            return spec
+        # See Cursor.__query_spec.
+        elif ("query" in self.__spec and
+              (len(self.__spec) == 1 or
+               next(iter(self.__spec)) == "query")):
+            return SON({"$query": self.__spec})
+
+        return self.__spec
+
+    def _initial_query(self):
+        """The _Query that begins this cursor's result set."""
+        ntoreturn = self.__batch_size
+        if self.__limit:
+            if self.__batch_size:
+                ntoreturn = min(self.__limit, self.__batch_size)
+            else:
+                ntoreturn = self.__limit
+        return _Query(self.__query_flags,
+                      self.__collection.full_name,
+                      self.__skip,
+                      ntoreturn,
+                      self.__query_spec(),
+                      self.__projection,
+                      self.__codec_options,
+                      self.__read_preference,
+                      self.__limit,
+                      self.__batch_size)
+
+    @asyncio.coroutine
+    def __send_message(self, operation):
+        """Send a query or getmore operation and handle the response.
+
+        Can raise ConnectionFailure.
+        """
+        client = self.__collection.database.client
+        try:
+            response = yield from client._send_message_with_response(
+                operation, read_preference=self.__read_preference,
+                address=self.__address)
+        except AutoReconnect:
+            # Don't try to send kill cursors on another socket
+            # or to another server.
+            self.__killed = True
+            raise
+
+        self.__address = response.address
+        try:
+            doc = helpers._unpack_response(response=response.data,
+                                           cursor_id=self.__id,
+                                           codec_options=self.__codec_options)
+        except NotMasterError:
+            # Don't send kill cursors to another server after a "not
+            # master" error. It's completely pointless.
+            self.__killed = True
+            client._topology.reset_server_and_request_check(self.__address)
+            raise
+        except Exception:
+            self.__killed = True
+            raise
+
+        self.__id = doc["cursor_id"]
+        if self.__id == 0:
+            self.__killed = True
+
+        self.__retrieved += doc["number_returned"]
+        self.__data = deque(doc["data"])
+
+        if self.__limit and self.__id and self.__limit <= self.__retrieved:
+            self.__die()
+
+    @asyncio.coroutine
+    def _refresh(self):
+        """Refreshes the cursor with more data from Mongo.
+
+        Returns the length of self.__data after refresh. Will exit early if
+        self.__data is already non-empty.
+        """
+        if len(self.__data) or self.__killed:
+            return len(self.__data)
+
+        if self.__id is None:  # Query
+            yield from self.__send_message(self._initial_query())
+            if not self.__id:
+                self.__killed = True
+        elif self.__id:  # Get More
+            if self.__limit:
+                limit = self.__limit - self.__retrieved
+                if self.__batch_size:
+                    limit = min(limit, self.__batch_size)
+            else:
+                limit = self.__batch_size
+
+            yield from self.__send_message(_GetMore(
+                self.__collection.full_name, limit, self.__id))
+
+        else:  # Cursor id is zero nothing else to return
+            self.__killed = True
+
+        return len(self.__data)
+
+    @property
+    @asyncio.coroutine
+    def fetch_next(self):
+        """A coroutine that returns True if there's another document to
+        get with :meth:`next_object`, fetching the next batch from the
+        server if needed, or False if the results are exhausted.
+        """
+        return bool((yield from self._refresh()))
+
+    def next_object(self):
+        """Get the next document fetched by :attr:`fetch_next`, or None."""
+        if not self.__data:
+            return None
+        return self.__data.popleft()
+
+    @asyncio.coroutine
+    def to_list(self, length=None):
+        """Get a list of up to `length` documents, or of all the remaining
+        documents if `length` is None. A coroutine.
+        """
+        if length is not None and length < 0:
+            raise ValueError("length must be non-negative")
+        result = []
+        while length is None or len(result) < length:
+            if not (yield from self._refresh()):
+                break
+            while self.__data and (length is None or len(result) < length):
+                result.append(self.__data.popleft())
+        return result
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        if (yield from self._refresh()):
+            return self.__data.popleft()
+        raise StopAsyncIteration()
@@ -0,0 +1,145 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Database level operations, with coroutines."""
+
+import asyncio
+
+from bson.codec_options import CodecOptions
+from bson.py3compat import string_type, _unicode
+from bson.son import SON
+from pymongo import common
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.database import _check_name
+from pymongo.read_preferences import ReadPreference
+
+
+class AsyncDatabase(common.BaseObject):
+    """A Mongo database, for use on an asyncio event loop.
+    """
+
+    def __init__(self, client, name, codec_options=None,
+                 read_preference=None, write_concern=None):
+        """Get a database by client and name.
+
+        Raises :class:`TypeError` if `name` is not an instance of
+        :class:`str`. Raises :class:`~pymongo.errors.InvalidName` if `name`
+        is not a valid database name.
+
+        :Parameters:
+          - `client`: An
+            :class:`~pymongo.asynchronous.mongo_client.AsyncMongoClient`
+            instance.
+          - `name`: The database name.
+          - `codec_options` (optional): An instance of
+            :class:`~bson.codec_options.CodecOptions`. If ``None`` (the
+            default) client.codec_options is used.
+          - `read_preference` (optional): The read preference to use. If
+            ``None`` (the default) client.read_preference is used.
+          - `write_concern` (optional): An instance of
+            :class:`~pymongo.write_concern.WriteConcern`. If ``None`` (the
+            default) client.write_concern is used.
+        """
+        super(AsyncDatabase, self).__init__(
+            codec_options or client.codec_options,
+            read_preference or client.read_preference,
+            write_concern or client.write_concern)
+
+        if not isinstance(name, string_type):
+            raise TypeError("name must be an instance "
+                            "of %s" % (string_type.__name__,))
+
+        if name != '$external':
+            _check_name(name)
+
+        self.__name = _unicode(name)
+        self.__client = client
+
+    @property
+    def client(self):
+        """The client instance for this :class:`AsyncDatabase`."""
+        return self.__client
+
+    @property
+    def name(self):
+        """The name of this :class:`AsyncDatabase`."""
+        return self.__name
+
+    def __eq__(self, other):
+        if isinstance(other, AsyncDatabase):
+            return (self.__client == other.client and
+                    self.__name == other.name)
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "AsyncDatabase(%r, %r)" % (self.__client, self.__name)
+
+    def __getattr__(self, name):
+        """Get a collection of this database by name.
+
+        Raises InvalidName if an invalid collection name is used.
+
+        :Parameters:
+          - `name`: the name of the collection to get
+        """
+        if name.startswith('_'):
+            raise AttributeError(
+                "AsyncDatabase has no attribute %r. To access the %s"
+                " collection, use database[%r]." % (name, name, name))
+        return self.__getitem__(name)
+
+    def __getitem__(self, name):
+        """Get a collection of this database by name.
+
+        Raises InvalidName if an invalid collection name is used.
+
+        :Parameters:
+          - `name`: the name of the collection to get
+        """
+        return AsyncCollection(self, name)
+
+    @asyncio.coroutine
+    def _command(self, sock_info, slave_ok, command, value=1, check=True,
+                 allowable_errors=None, read_preference=ReadPreference.PRIMARY,
+                 codec_options=CodecOptions(), **kwargs):
+        """Internal command helper, for AsyncMongoClient._run_on_socket."""
+        if isinstance(command, string_type):
+            command = SON([(command, value)])
+        command.update(kwargs)
+
+        return (yield from sock_info.command(self.__name,
+                                             command,
+                                             slave_ok,
+                                             read_preference,
+                                             codec_options,
+                                             check,
+                                             allowable_errors))
+
+    @asyncio.coroutine
+    def command(self, command, value=1, check=True,
+                allowable_errors=None, read_preference=ReadPreference.PRIMARY,
+                codec_options=CodecOptions(), **kwargs):
+        """Issue a MongoDB command.
+
+        A coroutine, with the same parameters as
+        :meth:`pymongo.database.Database.command`::
+
+          result = yield from db.command("buildinfo")
+        """
+        return (yield from self.__client._run_on_socket(
+            read_preference, self._command, command, value, check,
+            allowable_errors, read_preference, codec_options, **kwargs))
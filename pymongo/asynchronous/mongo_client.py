@@ -0,0 +1,312 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Tools for connecting to MongoDB from an asyncio event loop."""
+
+import asyncio
+import functools
+import warnings
+
+from bson.py3compat import string_type
+from pymongo import common, message, uri_parser
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.asynchronous.monitor import AsyncMonitor
+from pymongo.asynchronous.pool import AsyncPool
+from pymongo.asynchronous.server import AsyncServer
+from pymongo.asynchronous.topology import AsyncTopology, _AsyncCondition
+from pymongo.client_options import ClientOptions
+from pymongo.errors import (AutoReconnect,
+                            ConfigurationError,
+                            ConnectionFailure,
+                            InvalidURI,
+                            NetworkTimeout,
+                            NotMasterError)
+from pymongo.mongo_client import MongoClient
+from pymongo.read_preferences import ReadPreference
+from pymongo.server_selectors import writable_server_selector
+from pymongo.server_type import SERVER_TYPE
+from pymongo.settings import TopologySettings
+from pymongo.topology_description import TOPOLOGY_TYPE
+
+
+class AsyncMongoClient(common.BaseObject):
+    HOST = MongoClient.HOST
+    PORT = MongoClient.PORT
+
+    def __init__(
+            self,
+            host=None,
+            port=None,
+            document_class=dict,
+            tz_aware=False,
+            connect=True,
+            loop=None,
+            **kwargs):
+        """Client for a MongoDB instance, a replica set, or a set of mongoses,
+        for use on an asyncio event loop.
+
+        Takes the same arguments and options as
+        :class:`~pymongo.mongo_client.MongoClient`, and an event loop.
+        Operations are coroutines: they do their network I/O on the loop
+        instead of blocking the calling thread. Servers are monitored by
+        tasks on the loop rather than by background threads.
+
+        Raises :class:`~pymongo.errors.ConfigurationError` if credentials
+        are given: authentication isn't supported.
+
+        :Parameters:
+          - `host` (optional): hostname or IP address of the instance to
+            connect to, or a mongodb URI, or a list of hostnames / mongodb
+            URIs.
+          - `port` (optional): port number on which to connect
+          - `document_class` (optional): default class to use for
+            documents returned from queries on this client
+          - `tz_aware` (optional): if ``True``,
+            :class:`~datetime.datetime` instances returned as values
+            in a document by this :class:`AsyncMongoClient` will be timezone
+            aware (otherwise they will be naive)
+          - `connect` (optional): if ``True`` (the default), immediately
+            begin monitoring servers on the event loop, otherwise start
+            monitoring on the first operation.
+          - `loop` (optional): the event loop, or ``None`` (the default)
+            for the current event loop.
+
+        .. versionadded:: 3.1
+        """
+        if host is None:
+            host = self.HOST
+        if isinstance(host, string_type):
+            host = [host]
+        if port is None:
+            port = self.PORT
+        if not isinstance(port, int):
+            raise TypeError("port must be an instance of int")
+
+        seeds = set()
+        username = None
+        password = None
+        dbase = None
+        opts = {}
+        for entity in host:
+            if "://" in entity:
+                if entity.startswith("mongodb://"):
+                    res = uri_parser.parse_uri(entity, port, warn=True)
+                    seeds.update(res["nodelist"])
+                    username = res["username"] or username
+                    password = res["password"] or password
+                    dbase = res["database"] or dbase
+                    opts = res["options"]
+                else:
+                    idx = entity.find("://")
+                    raise InvalidURI("Invalid URI scheme: "
+                                     "%s" % (entity[:idx],))
+            else:
+                seeds.update(uri_parser.split_hosts(entity, port))
+        if not seeds:
+            raise ConfigurationError("need to specify at least one host")
+
+        keyword_opts = kwargs
+        keyword_opts['document_class'] = document_class
+        keyword_opts['tz_aware'] = tz_aware
+        keyword_opts['connect'] = connect
+        # Validate all keyword options.
+        keyword_opts = dict(common.validate(k, v)
+                            for k, v in keyword_opts.items())
+        opts.update(keyword_opts)
+        self.__options = options = ClientOptions(
+            username, password, dbase, opts)
+        if options.credentials:
+            raise ConfigurationError("authentication is not supported by "
+                                     "pymongo.asynchronous")
+
+        self.__default_database_name = dbase
+        self._loop = loop or asyncio.get_event_loop()
+
+        super(AsyncMongoClient, self).__init__(options.codec_options,
+                                               options.read_preference,
+                                               options.write_concern)
+
+        loop = self._loop
+        self._topology_settings = TopologySettings(
+            seeds=seeds,
+            replica_set_name=options.replica_set_name,
+            pool_class=functools.partial(AsyncPool, loop=loop),
+            pool_options=options.pool_options,
+            monitor_class=functools.partial(AsyncMonitor, loop=loop),
+            condition_class=functools.partial(_AsyncCondition, loop=loop),
+            server_class=AsyncServer,
+            local_threshold_ms=options.local_threshold_ms,
+            server_selection_timeout=options.server_selection_timeout)
+
+        self._topology = AsyncTopology(self._topology_settings)
+        if connect:
+            self._topology.open()
+
+    @property
+    def loop(self):
+        """The event loop this client does its network I/O on."""
+        return self._loop
+
+    def close(self):
+        """Disconnect from MongoDB.
+
+        Close all connections in the connection pools and stop the monitor
+        tasks. If this instance is used again it will be automatically
+        re-opened and the tasks restarted.
+        """
+        self._topology.close()
+
+    def _get_topology(self):
+        """Get the internal AsyncTopology, opening it if needed."""
+        self._topology.open()
+        return self._topology
+
+    @asyncio.coroutine
+    def _run_on_socket(self, read_preference, func, *args, **kwargs):
+        """Return the result of the coroutine ``func(sock_info, slave_ok,
+        *args, **kwargs)`` with a connection to a server.
+
+        Selects a server matching `read_preference`, or a writable server
+        if it's None. Resets the server on network error, like
+        :meth:`pymongo.mongo_client.MongoClient._get_socket`.
+        """
+        topology = self._get_topology()
+        server = yield from topology.select_server(
+            read_preference or writable_server_selector)
+        try:
+            sock_info = yield from server.pool.get_socket({})
+            try:
+                # Server Selection Spec: "slaveOK must be sent to mongods
+                # with topology type Single."
+                single = (topology.description.topology_type ==
+                          TOPOLOGY_TYPE.Single)
+                slave_ok = (single and not sock_info.is_mongos) or (
+                    read_preference not in (None, ReadPreference.PRIMARY))
+                return (yield from func(sock_info, slave_ok, *args, **kwargs))
+            finally:
+                server.pool.return_socket(sock_info)
+        except NetworkTimeout:
+            # The socket has been closed. Don't reset the server.
+            raise
+        except NotMasterError:
+            self._topology.reset_server_and_request_check(
+                server.description.address)
+            raise
+        except ConnectionFailure:
+            self._topology.reset_server(server.description.address)
+            raise
+
+    @asyncio.coroutine
+    def _send_message_with_response(self, operation, read_preference=None,
+                                    address=None):
+        """Send a message to MongoDB and return a Response.
+
+        :Parameters:
+          - `operation`: a _Query or _GetMore object.
+          - `read_preference` (optional): A ReadPreference.
+          - `address` (optional): Optional address when sending a message
+            to a specific server, used for getMore.
+        """
+        topology = self._get_topology()
+        if address:
+            server = yield from topology.select_server_by_address(address)
+            if not server:
+                raise AutoReconnect('server %s:%d no longer available'
+                                    % address)
+        else:
+            selector = read_preference or writable_server_selector
+            server = yield from topology.select_server(selector)
+
+        # See MongoClient.__select_server_for_message.
+        set_slave_ok = (
+            topology.description.topology_type == TOPOLOGY_TYPE.Single
+            and server.description.server_type != SERVER_TYPE.Mongos)
+        try:
+            return (yield from server.send_message_with_response(
+                operation, set_slave_ok, {}))
+        except NetworkTimeout:
+            raise
+        except ConnectionFailure:
+            self._topology.reset_server(server.description.address)
+            raise
+
+    @asyncio.coroutine
+    def _kill_cursors(self, cursor_ids, address):
+        """Send a kill cursors message with the given ids to `address`."""
+        try:
+            server = yield from self._get_topology().select_server_by_address(
+                tuple(address))
+            yield from server.send_message(message.kill_cursors(cursor_ids),
+                                           {})
+        except ConnectionFailure as exc:
+            warnings.warn("couldn't close cursor on %s: %s" % (address, exc))
+
+    def kill_cursors(self, cursor_ids, address):
+        """Send a kill cursors message soon with the given ids.
+
+        This method may be called from an
+        :class:`~pymongo.asynchronous.cursor.AsyncCursor` destructor, so it
+        schedules a task on the event loop rather than doing any I/O.
+
+        :Parameters:
+          - `cursor_ids`: list of cursor ids to kill
+          - `address`: (host, port) pair of the cursor's server
+        """
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.__schedule_kill_cursors,
+                                            cursor_ids, address)
+
+    def __schedule_kill_cursors(self, cursor_ids, address):
+        self._loop.create_task(self._kill_cursors(cursor_ids, address))
+
+    def __getattr__(self, name):
+        """Get a database by name.
+
+        Raises :class:`~pymongo.errors.InvalidName` if an invalid
+        database name is used.
+
+        :Parameters:
+          - `name`: the name of the database to get
+        """
+        if name.startswith('_'):
+            raise AttributeError(
+                "AsyncMongoClient has no attribute %r. To access the %s"
+                " database, use client[%r]." % (name, name, name))
+        return self.__getitem__(name)
+
+    def __getitem__(self, name):
+        """Get a database by name.
+
+        Raises :class:`~pymongo.errors.InvalidName` if an invalid
+        database name is used.
+
+        :Parameters:
+          - `name`: the name of the database to get
+        """
+        return AsyncDatabase(self, name)
+
+    def get_default_database(self):
+        """Get the database named in the MongoDB connection URI.
+
+        Raises :class:`~pymongo.errors.ConfigurationError` if no default
+        database was named.
+        """
+        if self.__default_database_name is None:
+            raise ConfigurationError('No default database defined')
+
+        return self[self.__default_database_name]
+
+    def __repr__(self):
+        return "AsyncMongoClient(%r)" % (
+            list(self._topology_settings.seeds),)
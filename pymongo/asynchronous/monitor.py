@@ -0,0 +1,174 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Class to monitor a MongoDB server in an asyncio task."""
+
+import asyncio
+import weakref
+
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from pymongo import common, helpers, message
+from pymongo.server_type import SERVER_TYPE
+from pymongo.ismaster import IsMaster
+from pymongo.monotonic import time as _time
+from pymongo.read_preferences import MovingAverage
+from pymongo.server_description import ServerDescription
+
+
+class AsyncMonitor(object):
+    def __init__(
+            self,
+            server_description,
+            topology,
+            pool,
+            topology_settings,
+            loop=None):
+        """Class to monitor a MongoDB server in an asyncio task.
+
+        Pass an initial ServerDescription, an AsyncTopology, an AsyncPool,
+        TopologySettings, and the event loop.
+
+        The Topology is weakly referenced. The Pool must be exclusive to this
+        Monitor.
+        """
+        self._server_description = server_description
+        self._pool = pool
+        self._settings = topology_settings
+        self._avg_round_trip_time = MovingAverage()
+        self._loop = loop or asyncio.get_event_loop()
+        self._task = None
+        self._wake = asyncio.Event(loop=self._loop)
+
+        # Avoid cycles. When the topology is freed, the task stops.
+        self._topology = weakref.proxy(topology)
+
+    def open(self):
+        """Start monitoring.
+
+        Multiple calls have no effect.
+        """
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._run())
+
+    def close(self):
+        """Close and stop monitoring.
+
+        open() restarts the monitor after closing.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # Increment the pool_id and maybe close the socket. If the task has
+        # the socket checked out, it will be closed when checked in.
+        self._pool.reset()
+
+    def request_check(self):
+        """If the monitor is sleeping, wake and check the server soon."""
+        self._wake.set()
+
+    @asyncio.coroutine
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                self._server_description = yield from self._check_with_retry()
+                self._topology.on_change(self._server_description)
+            except ReferenceError:
+                # Topology was garbage-collected.
+                self._pool.reset()
+                return
+
+            # Like PeriodicExecutor: check again after the heartbeat
+            # frequency, or when woken, but no sooner than the minimum
+            # heartbeat interval.
+            yield from asyncio.sleep(common.MIN_HEARTBEAT_INTERVAL,
+                                     loop=self._loop)
+            try:
+                yield from asyncio.wait_for(
+                    self._wake.wait(),
+                    common.HEARTBEAT_FREQUENCY - common.MIN_HEARTBEAT_INTERVAL,
+                    loop=self._loop)
+            except asyncio.TimeoutError:
+                pass
+
+    @asyncio.coroutine
+    def _check_with_retry(self):
+        """Call ismaster once or twice. Reset server's pool on error.
+
+        Returns a ServerDescription.
+        """
+        # According to the spec, if an ismaster call fails we reset the
+        # server's pool. If a server was once connected, change its type
+        # to Unknown only after retrying once.
+        address = self._server_description.address
+        retry = self._server_description.server_type != SERVER_TYPE.Unknown
+
+        try:
+            return (yield from self._check_once())
+        except (ReferenceError, asyncio.CancelledError):
+            # CancelledError is an Exception before Python 3.8: let close()
+            # stop the task.
+            raise
+        except Exception as error:
+            self._topology.reset_pool(address)
+            default = ServerDescription(address, error=error)
+            if not retry:
+                self._avg_round_trip_time.reset()
+                # Server type defaults to Unknown.
+                return default
+
+            # Try a second and final time. If it fails return original error.
+            try:
+                return (yield from self._check_once())
+            except (ReferenceError, asyncio.CancelledError):
+                raise
+            except Exception:
+                self._avg_round_trip_time.reset()
+                return default
+
+    @asyncio.coroutine
+    def _check_once(self):
+        """A single attempt to call ismaster.
+
+        Returns a ServerDescription, or raises an exception.
+        """
+        sock_info = yield from self._pool.get_socket({})
+        try:
+            response, round_trip_time = yield from self._check_with_socket(
+                sock_info)
+        finally:
+            self._pool.return_socket(sock_info)
+
+        self._avg_round_trip_time.add_sample(round_trip_time)
+        return ServerDescription(
+            address=self._server_description.address,
+            ismaster=response,
+            round_trip_time=self._avg_round_trip_time.get())
+
+    @asyncio.coroutine
+    def _check_with_socket(self, sock_info):
+        """Return (IsMaster, round_trip_time).
+
+        Can raise ConnectionFailure or OperationFailure.
+        """
+        start = _time()
+        request_id, msg, max_doc_size = message.query(
+            0, 'admin.$cmd', 0, -1, {'ismaster': 1},
+            None, DEFAULT_CODEC_OPTIONS)
+
+        yield from sock_info.send_message(msg, max_doc_size)
+        raw_response = yield from sock_info.receive_message(1, request_id)
+        result = helpers._unpack_response(raw_response)
+        return IsMaster(result['data'][0]), _time() - start
@@ -0,0 +1,156 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Internal network layer helper coroutines for asyncio streams.
+
+These mirror the functions in :mod:`pymongo.network`, reading and writing
+an :class:`asyncio.StreamReader` and :class:`asyncio.StreamWriter` instead
+of a socket.
+"""
+
+import asyncio
+import datetime
+import socket
+
+from pymongo import helpers, message, monitoring
+from pymongo.compression_support import decompress
+from pymongo.errors import AutoReconnect, NotMasterError, OperationFailure
+from pymongo.network import _UNPACK_COMPRESSION_HEADER, _UNPACK_HEADER
+
+
+@asyncio.coroutine
+def command(reader, writer, dbname, spec, slave_ok, is_mongos,
+            read_preference, codec_options, socket_timeout, loop,
+            check=True, allowable_errors=None, address=None, user=False,
+            check_keys=False, compression_ctx=None):
+    """Execute a command over a stream, or raise socket.error.
+
+    :Parameters:
+      - `reader`: an asyncio StreamReader
+      - `writer`: the asyncio StreamWriter for the same connection
+      - `dbname`: name of the database on which to run the command
+      - `spec`: a command document as a dict, SON, or mapping object
+      - `slave_ok`: whether to set the SlaveOkay wire protocol bit
+      - `is_mongos`: are we connected to a mongos?
+      - `read_preference`: a read preference
+      - `codec_options`: a CodecOptions instance
+      - `socket_timeout`: seconds to wait for the reply, or None
+      - `loop`: the event loop
+      - `check`: raise OperationFailure if there are errors
+      - `allowable_errors`: errors to ignore if `check` is True
+      - `address`: the (host, port) of the connection
+      - `user`: is this a user command or internal?
+      - `check_keys`: if True, check `spec` for invalid keys
+      - `compression_ctx`: the compression context to send `spec` with,
+        or None to send it uncompressed
+    """
+    name = next(iter(spec))
+    ns = dbname + '.$cmd'
+    flags = 4 if slave_ok else 0
+    if is_mongos:
+        spec = message._maybe_add_read_preference(spec, read_preference)
+
+    publish = user and monitoring.enabled()
+    if publish:
+        start = datetime.datetime.now()
+
+    request_id, msg, _ = message.query(flags, ns, 0, -1, spec,
+                                       None, codec_options, check_keys)
+
+    if publish:
+        encoding_duration = datetime.datetime.now() - start
+        monitoring.publish_command_start(spec, dbname, request_id, address)
+        start = datetime.datetime.now()
+
+    if compression_ctx is not None:
+        msg = message._compress(msg, compression_ctx)
+    yield from send_message(writer, msg)
+    response = yield from receive_message(
+        reader, 1, request_id, socket_timeout, loop)
+    try:
+        unpacked = helpers._unpack_response(
+            response, codec_options=codec_options)
+
+        response_doc = unpacked['data'][0]
+        if check:
+            msg = "command %s on namespace %s failed: %%s" % (
+                repr(spec).replace("%", "%%"), ns)
+            helpers._check_command_response(
+                response_doc, msg, allowable_errors)
+    except (NotMasterError, OperationFailure) as exc:
+        if publish:
+            duration = (datetime.datetime.now() - start) + encoding_duration
+            monitoring.publish_command_failure(
+                duration, exc.details, name, request_id, address)
+        raise
+    if publish:
+        duration = (datetime.datetime.now() - start) + encoding_duration
+        monitoring.publish_command_success(
+            duration, response_doc, name, request_id, address)
+    return response_doc
+
+
+@asyncio.coroutine
+def send_message(writer, message):
+    """Send a message or raise socket.error.
+
+    `message` is a string or any other buffer, or a list of the strings
+    that make up the message. The transport buffers the strings without
+    joining them together.
+    """
+    if isinstance(message, list):
+        writer.writelines(message)
+    else:
+        writer.write(message)
+    yield from writer.drain()
+
+
+@asyncio.coroutine
+def receive_message(reader, operation, request_id, timeout, loop):
+    """Receive a raw BSON message or raise socket.error.
+
+    Returns the message after its header. Raises socket.timeout if the
+    message doesn't arrive within `timeout` seconds.
+    """
+    header = yield from _receive_data(reader, 16, timeout, loop)
+    length, _, response_id, actual_op = _UNPACK_HEADER(header)
+    compressor_id = None
+    if actual_op == message._OP_COMPRESSED:
+        actual_op, _, compressor_id = _UNPACK_COMPRESSION_HEADER(
+            (yield from _receive_data(reader, 9, timeout, loop)))
+        length -= 9
+    assert operation == actual_op, ("wire protocol error: "
+                                    "unknown opcode %r" % (actual_op,))
+    assert request_id == response_id, (
+        "wire protocol error: got response id %r but expected %r"
+        % (response_id, request_id))
+    assert length > 16, ("wire protocol error: message length is shorter"
+                         " than standard message header: %r" % (length,))
+
+    data = yield from _receive_data(reader, length - 16, timeout, loop)
+    if compressor_id is not None:
+        return decompress(data, compressor_id)
+    return data
+
+
+@asyncio.coroutine
+def _receive_data(reader, length, timeout, loop):
+    """Read exactly `length` bytes."""
+    try:
+        return (yield from asyncio.wait_for(reader.readexactly(length),
+                                            timeout, loop=loop))
+    except asyncio.IncompleteReadError:
+        raise AutoReconnect("connection closed")
+    except asyncio.TimeoutError:
+        raise socket.timeout("timed out")
@@ -0,0 +1,337 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Connection pooling on asyncio streams."""
+
+import asyncio
+import socket
+
+from bson import DEFAULT_CODEC_OPTIONS
+from bson.son import SON
+from pymongo import helpers
+from pymongo.asynchronous import network
+from pymongo.compression_support import _NO_COMPRESSION
+from pymongo.errors import (ConnectionFailure,
+                            DocumentTooLarge,
+                            OperationFailure)
+from pymongo.ismaster import IsMaster
+from pymongo.message import _compress
+from pymongo.monotonic import time as _time
+from pymongo.pool import (_raise_connection_failure,
+                          match_hostname,
+                          CertificateError,
+                          SocketInfo)
+from pymongo.read_preferences import ReadPreference
+
+
+class AsyncSocketInfo(SocketInfo):
+    """Store a connection's streams with some metadata.
+
+    Writes are only sent as write commands: the legacy write opcodes
+    aren't supported.
+
+    :Parameters:
+      - `reader`: an asyncio StreamReader
+      - `writer`: the asyncio StreamWriter for the same connection
+      - `pool`: an AsyncPool instance
+      - `ismaster`: optional IsMaster instance, response to ismaster on the
+        connection
+      - `address`: the server's (host, port)
+    """
+    def __init__(self, reader, writer, pool, ismaster, address):
+        super(AsyncSocketInfo, self).__init__(writer, pool, ismaster, address)
+        self.reader = reader
+        self.socket_timeout = pool.opts.socket_timeout
+        self.loop = pool.loop
+
+    @asyncio.coroutine
+    def command(self, dbname, spec, slave_ok=False,
+                read_preference=ReadPreference.PRIMARY,
+                codec_options=DEFAULT_CODEC_OPTIONS, check=True,
+                allowable_errors=None, check_keys=False):
+        """Execute a command or raise ConnectionFailure or OperationFailure.
+
+        A coroutine, with the same parameters as
+        :meth:`pymongo.pool.SocketInfo.command`.
+        """
+        compression_ctx = self.compression_context
+        if next(iter(spec)).lower() in _NO_COMPRESSION:
+            compression_ctx = None
+        try:
+            return (yield from network.command(
+                self.reader, self.sock, dbname, spec, slave_ok,
+                self.is_mongos, read_preference, codec_options,
+                self.socket_timeout, self.loop, check, allowable_errors,
+                self.address, True, check_keys, compression_ctx))
+        except OperationFailure:
+            raise
+        # Catch socket.error, CancelledError, etc. and close ourselves.
+        except BaseException as error:
+            self._raise_connection_failure(error)
+
+    @asyncio.coroutine
+    def send_message(self, message, max_doc_size):
+        """Send a raw BSON message or raise ConnectionFailure.
+
+        If a network exception is raised, the connection is closed. The
+        message is compressed if the server supports one of the client's
+        compressors.
+        """
+        if (self.max_bson_size is not None
+                and max_doc_size > self.max_bson_size):
+            raise DocumentTooLarge(
+                "BSON document too large (%d bytes) - the connected server"
+                "supports BSON document sizes up to %d bytes." %
+                (max_doc_size, self.max_bson_size))
+
+        if self.compression_context is not None:
+            message = _compress(message, self.compression_context)
+        try:
+            yield from network.send_message(self.sock, message)
+        except BaseException as error:
+            self._raise_connection_failure(error)
+
+    @asyncio.coroutine
+    def receive_message(self, operation, request_id):
+        """Receive a raw BSON message or raise ConnectionFailure.
+
+        If any exception is raised, the connection is closed.
+        """
+        try:
+            return (yield from network.receive_message(
+                self.reader, operation, request_id, self.socket_timeout,
+                self.loop))
+        except BaseException as error:
+            self._raise_connection_failure(error)
+
+    @asyncio.coroutine
+    def write_command(self, request_id, msg):
+        """Send "insert" etc. command, returning response as a dict.
+
+        Can raise ConnectionFailure or OperationFailure.
+
+        :Parameters:
+          - `request_id`: an int.
+          - `msg`: bytes, or a list of buffers, the command message.
+        """
+        yield from self.send_message(msg, 0)
+        response = helpers._unpack_response(
+            (yield from self.receive_message(1, request_id)))
+        assert response['number_returned'] == 1
+        result = response['data'][0]
+
+        # Raises NotMasterError or OperationFailure.
+        helpers._check_command_response(result)
+        return result
+
+    def __repr__(self):
+        return "AsyncSocketInfo(%s)%s at %s" % (
+            repr(self.sock),
+            self.closed and " CLOSED" or "",
+            id(self)
+        )
+
+
+class AsyncPool(object):
+    def __init__(self, address, options, handshake=True, loop=None):
+        """
+        :Parameters:
+          - `address`: a (hostname, port) tuple
+          - `options`: a PoolOptions instance
+          - `handshake`: whether to call ismaster for each new
+            AsyncSocketInfo
+          - `loop`: the event loop, or None for the current event loop
+        """
+        self.sockets = set()
+
+        # Keep track of resets, so we notice connections created before the
+        # most recent reset and close them.
+        self.pool_id = 0
+        self.address = address
+        self.opts = options
+        self.handshake = handshake
+        self.loop = loop or asyncio.get_event_loop()
+
+        if self.opts.max_pool_size is None:
+            self._socket_semaphore = None
+        else:
+            self._socket_semaphore = asyncio.Semaphore(
+                self.opts.max_pool_size, loop=self.loop)
+
+    def reset(self):
+        self.pool_id += 1
+        sockets, self.sockets = self.sockets, set()
+        for sock_info in sockets:
+            sock_info.close()
+
+    @asyncio.coroutine
+    def connect(self):
+        """Connect to Mongo and return a new AsyncSocketInfo.
+
+        Can raise ConnectionFailure or CertificateError.
+
+        Note that the pool does not keep a reference to the connection --
+        you must call return_socket() when you're done with it.
+        """
+        writer = None
+        try:
+            reader, writer = yield from asyncio.wait_for(
+                self._open_connection(), self.opts.connect_timeout,
+                loop=self.loop)
+            if self.handshake:
+                cmd = SON([('ismaster', 1)])
+                settings = self.opts.compression_settings
+                if settings and settings.compressors:
+                    # Servers that don't support compression ignore this.
+                    cmd['compression'] = settings.compressors
+                ismaster = IsMaster((yield from network.command(
+                    reader, writer, 'admin', cmd, False, False,
+                    ReadPreference.PRIMARY, DEFAULT_CODEC_OPTIONS,
+                    self.opts.connect_timeout, self.loop)))
+            else:
+                ismaster = None
+            return AsyncSocketInfo(reader, writer, self, ismaster,
+                                   self.address)
+        except asyncio.TimeoutError:
+            if writer is not None:
+                writer.close()
+            _raise_connection_failure(self.address,
+                                      socket.timeout("timed out"))
+        except socket.error as error:
+            if writer is not None:
+                writer.close()
+            _raise_connection_failure(self.address, error)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            raise
+
+    @asyncio.coroutine
+    def _open_connection(self):
+        """Open a connection and return its (reader, writer) streams.
+
+        Can raise socket.error, ConnectionFailure, or CertificateError.
+        """
+        host, port = self.address
+        ssl_context = self.opts.ssl_context
+
+        # Check if dealing with a unix domain socket
+        if host.endswith('.sock'):
+            if not hasattr(socket, "AF_UNIX"):
+                raise ConnectionFailure("UNIX-sockets are not supported "
+                                        "on this system")
+            return (yield from asyncio.open_unix_connection(
+                host, loop=self.loop, ssl=ssl_context,
+                server_hostname=host if ssl_context else None))
+
+        # Don't try IPv6 if we don't support it. Also skip it if host
+        # is 'localhost' (::1 is fine). Avoids slow connect issues
+        # like PYTHON-356.
+        family = socket.AF_INET
+        if socket.has_ipv6 and host != 'localhost':
+            family = socket.AF_UNSPEC
+
+        reader, writer = yield from asyncio.open_connection(
+            host, port, loop=self.loop, family=family, ssl=ssl_context,
+            server_hostname=host if ssl_context else None)
+
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE,
+                        self.opts.socket_keepalive)
+        if (ssl_context is not None and ssl_context.verify_mode
+                and self.opts.ssl_match_hostname):
+            try:
+                match_hostname(writer.get_extra_info('peercert'),
+                               hostname=host)
+            except CertificateError:
+                writer.close()
+                raise
+        return reader, writer
+
+    @asyncio.coroutine
+    def get_socket(self, all_credentials):
+        """Get or create an AsyncSocketInfo. Can raise ConnectionFailure.
+
+        Unlike :meth:`pymongo.pool.Pool.get_socket` this is a coroutine,
+        not a context manager: pass the AsyncSocketInfo to
+        :meth:`return_socket` when you're done with it::
+
+            sock_info = yield from pool.get_socket({})
+            try:
+                yield from sock_info.send_message(msg, max_doc_size)
+            finally:
+                pool.return_socket(sock_info)
+
+        :Parameters:
+          - `all_credentials`: dict, maps auth source to MongoCredential.
+            Must be empty: authentication isn't supported.
+        """
+        if all_credentials:
+            raise ConnectionFailure("authentication is not supported by "
+                                    "pymongo.asynchronous")
+
+        if self._socket_semaphore is not None:
+            try:
+                yield from asyncio.wait_for(self._socket_semaphore.acquire(),
+                                            self.opts.wait_queue_timeout,
+                                            loop=self.loop)
+            except asyncio.TimeoutError:
+                self._raise_wait_queue_timeout()
+
+        # We've now acquired the semaphore and must release it on error.
+        try:
+            sock_info = None
+            while self.sockets and sock_info is None:
+                sock_info = self._check(self.sockets.pop())
+            if sock_info is None:
+                # Can raise ConnectionFailure or CertificateError.
+                sock_info = yield from self.connect()
+        except:
+            if self._socket_semaphore is not None:
+                self._socket_semaphore.release()
+            raise
+
+        sock_info.last_checkout = _time()
+        return sock_info
+
+    def return_socket(self, sock_info):
+        """Return the socket to the pool, or if it's closed discard it."""
+        if sock_info.pool_id != self.pool_id:
+            sock_info.close()
+        elif not sock_info.closed:
+            self.sockets.add(sock_info)
+
+        if self._socket_semaphore is not None:
+            self._socket_semaphore.release()
+
+    def _check(self, sock_info):
+        """Return `sock_info`, or None if the server closed it while it was
+        idle in the pool.
+        """
+        if sock_info.pool_id == self.pool_id and not sock_info.reader.at_eof():
+            return sock_info
+        sock_info.close()
+        return None
+
+    def _raise_wait_queue_timeout(self):
+        raise ConnectionFailure(
+            'Timed out waiting for socket from pool with max_size %r and'
+            ' wait_queue_timeout %r' % (
+                self.opts.max_pool_size, self.opts.wait_queue_timeout))
+
+    def __del__(self):
+        # Avoid ResourceWarnings.
+        for sock_info in self.sockets:
+            sock_info.close()
@@ -0,0 +1,92 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Communicate with one MongoDB server in a topology, with coroutines."""
+
+import asyncio
+
+from datetime import datetime
+
+from pymongo import monitoring
+from pymongo.response import Response
+from pymongo.server import Server
+
+
+class AsyncServer(Server):
+    """Represent one MongoDB server, with an AsyncPool and AsyncMonitor."""
+
+    @asyncio.coroutine
+    def send_message(self, message, all_credentials):
+        """Send an unacknowledged message to MongoDB.
+
+        Can raise ConnectionFailure.
+
+        :Parameters:
+          - `message`: (request_id, data).
+          - `all_credentials`: dict, maps auth source to MongoCredential.
+        """
+        _, data, max_doc_size = self._split_message(message)
+        sock_info = yield from self.pool.get_socket(all_credentials)
+        try:
+            yield from sock_info.send_message(data, max_doc_size)
+        finally:
+            self.pool.return_socket(sock_info)
+
+    @asyncio.coroutine
+    def send_message_with_response(
+            self,
+            operation,
+            set_slave_okay,
+            all_credentials):
+        """Send a message to MongoDB and return a Response object.
+
+        Can raise ConnectionFailure.
+
+        :Parameters:
+          - `operation`: A _Query or _GetMore object.
+          - `set_slave_okay`: Pass to operation.get_message.
+          - `all_credentials`: dict, maps auth source to MongoCredential.
+        """
+        sock_info = yield from self.pool.get_socket(all_credentials)
+        try:
+            duration = None
+            publish = monitoring.enabled()
+            if publish:
+                start = datetime.now()
+
+            message = operation.get_message(
+                set_slave_okay, sock_info.is_mongos)
+            request_id, data, max_doc_size = self._split_message(message)
+
+            if publish:
+                encoding_duration = datetime.now() - start
+                cmd, dbn = operation.as_command()
+                monitoring.publish_command_start(
+                    cmd, dbn, request_id, sock_info.address)
+                start = datetime.now()
+
+            yield from sock_info.send_message(data, max_doc_size)
+            response_data = yield from sock_info.receive_message(
+                1, request_id)
+
+            if publish:
+                duration = (datetime.now() - start) + encoding_duration
+
+            return Response(
+                data=response_data,
+                address=self._description.address,
+                duration=duration,
+                request_id=request_id)
+        finally:
+            self.pool.return_socket(sock_info)
@@ -0,0 +1,143 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Monitor a topology of one or more servers from an asyncio event loop."""
+
+import asyncio
+import random
+
+from pymongo import common
+from pymongo.errors import ServerSelectionTimeoutError
+from pymongo.monotonic import time as _time
+from pymongo.server_selectors import any_server_selector
+from pymongo.topology import Topology
+
+
+class _AsyncCondition(object):
+    """Stands in for the threading.Condition a Topology notifies when its
+    description changes, so coroutines can wait for the change.
+
+    Topology calls notify_all() holding its lock, which is never held
+    across a yield, so the lock isn't needed here.
+    """
+    def __init__(self, lock, loop):
+        self._loop = loop
+        self._waiters = []
+
+    def notify_all(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @asyncio.coroutine
+    def wait(self, timeout):
+        """Wait until notified, or for `timeout` seconds."""
+        waiter = asyncio.Future(loop=self._loop)
+        self._waiters.append(waiter)
+        try:
+            yield from asyncio.wait_for(waiter, timeout, loop=self._loop)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+
+class AsyncTopology(Topology):
+    """Monitor a topology of one or more servers with AsyncMonitors.
+
+    Server selection is a coroutine. Its settings' condition_class must be
+    :class:`_AsyncCondition`.
+    """
+
+    @asyncio.coroutine
+    def select_servers(self,
+                       selector,
+                       server_selection_timeout=None,
+                       address=None):
+        """Return a list of Servers matching selector, or time out.
+
+        A coroutine, with the same parameters as
+        :meth:`pymongo.topology.Topology.select_servers`.
+
+        Raises exc:`ServerSelectionTimeoutError` after
+        `server_selection_timeout` if no matching servers are found.
+        """
+        if server_selection_timeout is None:
+            server_timeout = self._settings.server_selection_timeout
+        else:
+            server_timeout = server_selection_timeout
+
+        with self._lock:
+            self._description.check_compatible()
+
+            now = _time()
+            end_time = now + server_timeout
+            server_descriptions = self._apply_selector(selector, address)
+
+        while not server_descriptions:
+            # No suitable servers.
+            if server_timeout == 0 or now > end_time:
+                with self._lock:
+                    raise ServerSelectionTimeoutError(
+                        self._error_message(selector))
+
+            with self._lock:
+                self._ensure_opened()
+                self._request_check_all()
+
+            # Wait for the topology description to change, or for a
+            # timeout. We won't miss any changes that came after our most
+            # recent _apply_selector call: nothing else runs until we
+            # yield.
+            yield from self._condition.wait(common.MIN_HEARTBEAT_INTERVAL)
+            with self._lock:
+                self._description.check_compatible()
+                now = _time()
+                server_descriptions = self._apply_selector(selector, address)
+
+        return [self.get_server_by_address(sd.address)
+                for sd in server_descriptions]
+
+    @asyncio.coroutine
+    def select_server(self,
+                      selector,
+                      server_selection_timeout=None,
+                      address=None):
+        """Like select_servers, but choose a random server if several match."""
+        return random.choice((yield from self.select_servers(
+            selector, server_selection_timeout, address)))
+
+    @asyncio.coroutine
+    def select_server_by_address(self, address,
+                                 server_selection_timeout=None):
+        """Return a Server for "address", reconnecting if necessary.
+
+        A coroutine, like
+        :meth:`pymongo.topology.Topology.select_server_by_address`.
+        """
+        return (yield from self.select_server(any_server_selector,
+                                              server_selection_timeout,
+                                              address))
+
+    @asyncio.coroutine
+    def request_check_all(self, wait_time=5):
+        """Wake all monitors, wait for at least one to check its server.
+
+        A coroutine, like :meth:`pymongo.topology.Topology.request_check_all`.
+        """
+        with self._lock:
+            self._request_check_all()
+        yield from self._condition.wait(wait_time)
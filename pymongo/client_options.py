@@ -19,6 +19,7 @@ from bson.py3compat import iteritems
 from pymongo.auth import _build_credentials_tuple
 from pymongo.common import validate, validate_boolean
 from pymongo import common
+from pymongo.compression_support import CompressionSettings
 from pymongo.errors import ConfigurationError
 from pymongo.pool import PoolOptions
 from pymongo.read_preferences import make_read_preference
@@ -94,10 +95,14 @@ def _parse_pool_options(options):
     wait_queue_timeout = options.get('waitqueuetimeoutms')
     wait_queue_multiple = options.get('waitqueuemultiple')
     ssl_context, ssl_match_hostname = _parse_ssl_options(options)
+    compression_settings = CompressionSettings(
+        options.get('compressors', []),
+        options.get('zlibcompressionlevel', -1))
     return PoolOptions(max_pool_size,
                        connect_timeout, socket_timeout,
                        wait_queue_timeout, wait_queue_multiple,
-                       ssl_context, ssl_match_hostname, socket_keepalive)
+                       ssl_context, ssl_match_hostname, socket_keepalive,
+                       compression_settings)
 
 
 class ClientOptions(object):
@@ -25,6 +25,7 @@ from bson.py3compat import (_unicode,
                             string_type,
                             u)
 from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from bson.son import SON
 from pymongo import (common,
                      helpers,
@@ -32,8 +33,11 @@ from pymongo import (common,
                      monitoring)
 from pymongo.bulk import BulkOperationBuilder, _Bulk
 from pymongo.command_cursor import CommandCursor
-from pymongo.cursor import Cursor
-from pymongo.errors import ConfigurationError, InvalidName, OperationFailure
+from pymongo.cursor import Cursor, CursorType
+from pymongo.errors import (ConfigurationError,
+                            InvalidName,
+                            InvalidOperation,
+                            OperationFailure)
 from pymongo.helpers import _check_write_command_response
 from pymongo.message import _INSERT
 from pymongo.operations import _WriteOp, IndexModel
@@ -426,7 +430,8 @@ class Collection(common.BaseObject):
     def _insert_one(
             self, sock_info, doc, check_keys, manipulate, write_concern):
         """Internal helper for inserting a single document."""
-        if manipulate:
+        # A RawBSONDocument can't be modified: send it as it is.
+        if manipulate and not isinstance(doc, RawBSONDocument):
             doc = self.__database._apply_incoming_manipulators(doc, self)
             if '_id' not in doc:
                 doc['_id'] = ObjectId()
@@ -458,7 +463,7 @@ class Collection(common.BaseObject):
     def _insert(self, sock_info, docs, ordered=True,
                 check_keys=True, manipulate=False, write_concern=None):
         """Internal insert helper."""
-        if isinstance(docs, collections.MutableMapping):
+        if isinstance(docs, (collections.MutableMapping, RawBSONDocument)):
             return self._insert_one(
                 sock_info, docs, check_keys, manipulate, write_concern)
 
@@ -471,6 +476,10 @@ class Collection(common.BaseObject):
                 """
                 _db = self.__database
                 for doc in docs:
+                    if isinstance(doc, RawBSONDocument):
+                        ids.append(doc.get('_id'))
+                        yield doc
+                        continue
                     # Apply user-configured SON manipulators. This order of
                     # operations is required for backwards compatibility,
                     # see PYTHON-709.
@@ -523,16 +532,22 @@ class Collection(common.BaseObject):
 
         :Parameters:
           - `document`: The document to insert. Must be a mutable mapping
-            type. If the document does not have an _id field one will be
-            added automatically.
+            type, or a :class:`~bson.raw_bson.RawBSONDocument`, which is
+            sent without being re-encoded. If the document does not have an
+            _id field one will be added automatically, except to a
+            :class:`~bson.raw_bson.RawBSONDocument`, which cannot be
+            modified.
 
         :Returns:
           - An instance of :class:`~pymongo.results.InsertOneResult`.
 
+        .. versionchanged:: 3.1
+           Accept :class:`~bson.raw_bson.RawBSONDocument`.
+
         .. versionadded:: 3.0
         """
-        common.validate_is_mutable_mapping("document", document)
-        if "_id" not in document:
+        common.validate_is_document_type("document", document)
+        if not (isinstance(document, RawBSONDocument) or "_id" in document):
             document["_id"] = ObjectId()
         with self._socket_for_writes() as sock_info:
             return InsertOneResult(self._insert(sock_info, document),
@@ -550,7 +565,9 @@ class Collection(common.BaseObject):
           2
 
         :Parameters:
-          - `documents`: A iterable of documents to insert.
+          - `documents`: A iterable of documents to insert. Like the
+            `document` passed to :meth:`insert_one`, each may be a
+            :class:`~bson.raw_bson.RawBSONDocument`.
           - `ordered` (optional): If ``True`` (the default) documents will be
             inserted on the server serially, in the order provided. If an error
             occurs all remaining inserts are aborted. If ``False``, documents
@@ -560,6 +577,9 @@ class Collection(common.BaseObject):
         :Returns:
           An instance of :class:`~pymongo.results.InsertManyResult`.
 
+        .. versionchanged:: 3.1
+           Accept :class:`~bson.raw_bson.RawBSONDocument`.
+
         .. versionadded:: 3.0
         """
         if not isinstance(documents, collections.Iterable) or not documents:
@@ -568,10 +588,11 @@ class Collection(common.BaseObject):
         def gen():
             """A generator that validates documents and handles _ids."""
             for document in documents:
-                common.validate_is_mutable_mapping("document", document)
-                if "_id" not in document:
+                common.validate_is_document_type("document", document)
+                if not (isinstance(document, RawBSONDocument) or
+                        "_id" in document):
                     document["_id"] = ObjectId()
-                inserted_ids.append(document["_id"])
+                inserted_ids.append(document.get("_id"))
                 yield (_INSERT, document)
 
         blk = _Bulk(self, ordered)
@@ -868,6 +889,69 @@ class Collection(common.BaseObject):
             return result
         return None
 
+    def find_one_many(self, filters, *args, **kwargs):
+        """Get a single document from the database for each filter.
+
+        Like calling :meth:`find_one` once for each filter, but all the
+        queries are sent to one server, on one connection, before any reply
+        is read, up to a limited number of bytes of queries at a time. The
+        replies are collected as they arrive, so the queries take about one
+        round trip between them instead of one each.
+
+        Returns a list with, for each filter in turn, the first matching
+        document or ``None`` if no document matches.
+
+        :Parameters:
+          - `filters`: a list of filters, each a dictionary specifying the
+            query to be performed OR any other type to be used as the value
+            for a query for ``"_id"``.
+
+          - `*args` (optional): any additional positional arguments
+            are the same as the arguments to :meth:`find`, and apply to
+            every query.
+
+          - `**kwargs` (optional): any additional keyword arguments
+            are the same as the arguments to :meth:`find_one`, and apply to
+            every query.
+
+        Raises :class:`~pymongo.errors.InvalidOperation` if `cursor_type` is
+        :attr:`~pymongo.cursor.CursorType.EXHAUST`.
+
+        .. versionadded:: 3.1
+        """
+        # cursor_type is find's fifth parameter after the filter.
+        cursor_type = args[4] if len(args) > 4 else kwargs.get("cursor_type")
+        if cursor_type == CursorType.EXHAUST:
+            raise InvalidOperation(
+                "find_one_many does not support exhaust cursors")
+        if not filters:
+            return []
+
+        max_time_ms = kwargs.pop("max_time_ms", None)
+        cursors = []
+        for filter in filters:
+            if (filter is not None and not
+                    isinstance(filter, collections.Mapping)):
+                filter = {"_id": filter}
+            cursor = self.find(filter,
+                               *args, **kwargs).max_time_ms(max_time_ms)
+            cursors.append(cursor.limit(-1))
+
+        operations = [cursor._initial_query() for cursor in cursors]
+        responses = self.__database.client._send_messages_with_response(
+            operations, read_preference=self.read_preference)
+
+        results = []
+        for cursor, operation, response in zip(cursors, operations,
+                                               responses):
+            cursor._refresh_with_response(operation, response)
+            for result in cursor:
+                results.append(result)
+                break
+            else:
+                results.append(None)
+        return results
+
     def find(self, *args, **kwargs):
         """Query the database.
 
@@ -1981,6 +2065,10 @@ class Collection(common.BaseObject):
 
         **DEPRECATED** - Use :meth:`insert_one` or :meth:`insert_many` instead.
 
+        .. versionchanged:: 3.1
+           A :class:`~bson.raw_bson.RawBSONDocument` is inserted without
+           manipulation, even if `manipulate` is ``True``.
+
         .. versionchanged:: 3.0
            Removed the `safe` parameter. Pass ``w=0`` for unacknowledged write
            operations.
@@ -21,8 +21,11 @@ import warnings
 from bson.binary import (STANDARD, PYTHON_LEGACY,
                          JAVA_LEGACY, CSHARP_LEGACY)
 from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from bson.py3compat import string_type, integer_types, iteritems
 from pymongo.auth import MECHANISMS
+from pymongo.compression_support import (validate_compressors,
+                                         validate_zlib_compression_level)
 from pymongo.errors import ConfigurationError
 from pymongo.read_preferences import (read_pref_mode_from_name,
                                       _ServerMode)
@@ -379,6 +382,15 @@ def validate_is_mutable_mapping(option, value):
                         "collections.MutableMapping" % (option,))
 
 
+def validate_is_document_type(option, value):
+    """Validate the type of method arguments that expect a MongoDB document."""
+    if not isinstance(value, (collections.MutableMapping, RawBSONDocument)):
+        raise TypeError("%s must be an instance of dict, bson.son.SON, "
+                        "bson.raw_bson.RawBSONDocument, or "
+                        "a type that inherits from "
+                        "collections.MutableMapping" % (option,))
+
+
 def validate_ok_for_replace(replacement):
     """Validate a replacement document."""
     validate_is_mapping("replacement", replacement)
@@ -433,7 +445,9 @@ VALIDATORS = {
     'document_class': validate_document_class,
     'tz_aware': validate_boolean_or_string,
     'uuidrepresentation': validate_uuid_representation,
-    'connect': validate_boolean
+    'connect': validate_boolean,
+    'compressors': validate_compressors,
+    'zlibcompressionlevel': validate_zlib_compression_level,
 }
 
 
@@ -0,0 +1,180 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Support for compressing messages with OP_COMPRESSED."""
+
+import warnings
+
+try:
+    import snappy
+    _HAVE_SNAPPY = True
+except ImportError:
+    # python-snappy isn't available.
+    _HAVE_SNAPPY = False
+
+try:
+    import zlib
+    _HAVE_ZLIB = True
+except ImportError:
+    # Python built without zlib support.
+    _HAVE_ZLIB = False
+
+from bson.py3compat import string_type
+from pymongo.errors import ConfigurationError
+
+_SUPPORTED_COMPRESSORS = set(["snappy", "zlib"])
+
+# Commands that are never compressed, so a server can always read them:
+# the handshake and the authentication commands.
+_NO_COMPRESSION = set(["ismaster"])
+_NO_COMPRESSION.update(["saslstart", "saslcontinue", "getnonce",
+                        "authenticate", "createuser", "updateuser",
+                        "copydbsaslstart", "copydbgetnonce", "copydb"])
+
+
+def validate_compressors(dummy, value):
+    """Validate a list of compressors, or a comma separated string of
+    compressors, in order of preference.
+
+    Compressors PyMongo doesn't support, or can't use because their module
+    isn't installed, are left out with a warning.
+    """
+    if isinstance(value, string_type):
+        value = [value]
+    elif not isinstance(value, (list, tuple)):
+        raise TypeError("compressors must be a string or a list of "
+                        "strings, not %r" % (value,))
+    compressors = []
+    for compressor in value:
+        if not isinstance(compressor, string_type):
+            raise TypeError("each compressor must be a string, not %r"
+                            % (compressor,))
+        compressors.extend(name.strip().lower()
+                           for name in compressor.split(","))
+    for compressor in compressors[:]:
+        if compressor not in _SUPPORTED_COMPRESSORS:
+            compressors.remove(compressor)
+            warnings.warn("Unsupported compressor: %s" % (compressor,))
+        elif compressor == "snappy" and not _HAVE_SNAPPY:
+            compressors.remove(compressor)
+            warnings.warn(
+                "Wire protocol compression with snappy is not available. "
+                "You must install the python-snappy module for snappy "
+                "support.")
+        elif compressor == "zlib" and not _HAVE_ZLIB:
+            compressors.remove(compressor)
+            warnings.warn(
+                "Wire protocol compression with zlib is not available. "
+                "The zlib module is not available.")
+    return compressors
+
+
+def validate_zlib_compression_level(option, value):
+    """Validate a zlib compression level, an integer from -1 to 9."""
+    try:
+        level = int(value)
+    except (TypeError, ValueError):
+        raise TypeError("%s must be an integer, not %r." % (option, value))
+    if level < -1 or level > 9:
+        raise ConfigurationError(
+            "%s must be between -1 and 9, not %d." % (option, level))
+    return level
+
+
+class CompressionSettings(object):
+    """The compressors a client offers, in order of preference.
+
+    :Parameters:
+      - `compressors`: a list of compressor names
+      - `zlib_compression_level`: the level zlib compresses at, -1 for
+        zlib's default
+    """
+
+    __slots__ = ('__compressors', '__zlib_compression_level')
+
+    def __init__(self, compressors, zlib_compression_level=-1):
+        self.__compressors = compressors
+        self.__zlib_compression_level = zlib_compression_level
+
+    @property
+    def compressors(self):
+        """The names of the compressors, in order of preference."""
+        return self.__compressors
+
+    @property
+    def zlib_compression_level(self):
+        """The level zlib compresses messages at."""
+        return self.__zlib_compression_level
+
+    def get_compression_context(self, server_compressors):
+        """A context for the first of our compressors the server supports.
+
+        Returns None if the server lists none of them.
+
+        :Parameters:
+          - `server_compressors`: the compressors from the server's
+            ismaster response
+        """
+        for compressor in self.__compressors:
+            if compressor in server_compressors:
+                if compressor == "snappy":
+                    return SnappyContext()
+                return ZlibContext(self.__zlib_compression_level)
+        return None
+
+
+class SnappyContext(object):
+    compressor_id = 1
+
+    @staticmethod
+    def compress(segments):
+        """Compress a message body, given as a list of strings.
+
+        Returns a list of strings. Snappy can only compress one string at a
+        time, so the segments are joined first.
+        """
+        return [snappy.compress(b"".join(segments))]
+
+
+class ZlibContext(object):
+    compressor_id = 2
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, segments):
+        """Compress a message body, given as a list of strings.
+
+        Returns a list of strings. Each segment is fed to the compressor in
+        turn, so they're never joined.
+        """
+        compressor = zlib.compressobj(self.level)
+        compressed = [compressor.compress(segment) for segment in segments]
+        compressed.append(compressor.flush())
+        return compressed
+
+
+def decompress(data, compressor_id):
+    """Decompress the body of an OP_COMPRESSED message.
+
+    Raises ValueError if PyMongo can't decompress it.
+    """
+    if compressor_id == 0:
+        # The "noop" compressor.
+        return data
+    elif compressor_id == SnappyContext.compressor_id and _HAVE_SNAPPY:
+        return snappy.uncompress(bytes(data))
+    elif compressor_id == ZlibContext.compressor_id and _HAVE_ZLIB:
+        return zlib.decompress(bytes(data))
+    raise ValueError("Unknown compressorId %d" % (compressor_id,))
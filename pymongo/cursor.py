@@ -793,12 +793,13 @@ class Cursor(object):
         self.__spec["$where"] = code
         return self
 
-    def __send_message(self, operation):
+    def __send_message(self, operation, response=None):
         """Send a query or getmore operation and handles the response.
 
         If operation is ``None`` this is an exhaust cursor, which reads
         the next result batch off the exhaust socket instead of
-        sending getMore messages to the server.
+        sending getMore messages to the server. If `response` is given,
+        `operation` has already been sent and this is its Response.
 
         Can raise ConnectionFailure.
         """
@@ -814,8 +815,9 @@ class Cursor(object):
                 kwargs["address"] = self.__address
 
             try:
-                response = client._send_message_with_response(operation,
-                                                              **kwargs)
+                if response is None:
+                    response = client._send_message_with_response(operation,
+                                                                  **kwargs)
                 self.__address = response.address
                 if self.__exhaust:
                     # 'response' is an ExhaustResponse.
@@ -927,6 +929,37 @@ class Cursor(object):
         if self.__exhaust and self.__id == 0:
             self.__exhaust_mgr.close()
 
+    def _initial_query(self):
+        """The _Query that begins this cursor's result set."""
+        ntoreturn = self.__batch_size
+        if self.__limit:
+            if self.__batch_size:
+                ntoreturn = min(self.__limit, self.__batch_size)
+            else:
+                ntoreturn = self.__limit
+        return _Query(self.__query_flags,
+                      self.__collection.full_name,
+                      self.__skip,
+                      ntoreturn,
+                      self.__query_spec(),
+                      self.__projection,
+                      self.__codec_options,
+                      self.__read_preference,
+                      self.__limit,
+                      self.__batch_size)
+
+    def _refresh_with_response(self, operation, response):
+        """Handle the Response to this cursor's initial query, which the
+        caller sent, as :meth:`_refresh` would if it had sent it.
+
+        :Parameters:
+          - `operation`: the _Query from :meth:`_initial_query`.
+          - `response`: the Response to `operation`.
+        """
+        self.__send_message(operation, response)
+        if not self.__id:
+            self.__killed = True
+
     def _refresh(self):
         """Refreshes the cursor with more data from Mongo.
 
@@ -938,22 +971,7 @@ class Cursor(object):
             return len(self.__data)
 
         if self.__id is None:  # Query
-            ntoreturn = self.__batch_size
-            if self.__limit:
-                if self.__batch_size:
-                    ntoreturn = min(self.__limit, self.__batch_size)
-                else:
-                    ntoreturn = self.__limit
-            self.__send_message(_Query(self.__query_flags,
-                                       self.__collection.full_name,
-                                       self.__skip,
-                                       ntoreturn,
-                                       self.__query_spec(),
-                                       self.__projection,
-                                       self.__codec_options,
-                                       self.__read_preference,
-                                       self.__limit,
-                                       self.__batch_size))
+            self.__send_message(self._initial_query())
             if not self.__id:
                 self.__killed = True
         elif self.__id:  # Get More
@@ -21,7 +21,8 @@ from pymongo.message import _Query
 import bson
 import pymongo
 from bson.codec_options import CodecOptions
-from bson.py3compat import itervalues, string_type, iteritems, u
+from bson.py3compat import (itervalues, string_type, iteritems, u,
+                            slice_buffer)
 from bson.son import SON
 from pymongo.errors import (CursorNotFound,
                             DuplicateKeyError,
@@ -129,7 +130,9 @@ def _unpack_response(response, cursor_id=None, codec_options=CodecOptions()):
     result["cursor_id"] = struct.unpack("<q", response[4:12])[0]
     result["starting_from"] = struct.unpack("<i", response[12:16])[0]
     result["number_returned"] = struct.unpack("<i", response[16:20])[0]
-    result["data"] = bson.decode_all(response[20:], codec_options)
+    # Decode the documents in place rather than copying the reply's body.
+    result["data"] = bson.decode_all(slice_buffer(response, 20),
+                                     codec_options)
     assert len(result["data"]) == result["number_returned"]
     return result
 
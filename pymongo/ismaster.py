@@ -111,6 +111,10 @@ class IsMaster(object):
     def max_wire_version(self):
         return self._doc.get('maxWireVersion', common.MAX_WIRE_VERSION)
 
+    @property
+    def compressors(self):
+        return self._doc.get('compression', [])
+
     @property
     def election_id(self):
         return self._doc.get('electionId')
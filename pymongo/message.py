@@ -25,7 +25,7 @@ import struct
 
 import bson
 from bson.codec_options import DEFAULT_CODEC_OPTIONS
-from bson.py3compat import b, StringIO
+from bson.py3compat import b
 from bson.son import SON
 try:
     from pymongo import _cmessage
@@ -57,6 +57,11 @@ _OP_MAP = {
 }
 
 
+_OP_COMPRESSED = 2012
+_UNPACK_HEADER = struct.Struct("<iiii").unpack_from
+_PACK_COMPRESSED_HEADER = struct.Struct("<iiiiiiB").pack
+
+
 def _maybe_add_read_preference(spec, read_preference):
     """Add $readPreference to spec when appropriate."""
     mode = read_preference.mode
@@ -270,6 +275,57 @@ def __pack_message(operation, data):
     return (request_id, message + data)
 
 
+def _compress(data, ctx):
+    """Wrap each message in `data` in an OP_COMPRESSED message.
+
+    Returns a list of strings (:class:`bytes` in python 3). The segments of
+    each message body are handed to the compressor without being joined.
+
+    :Parameters:
+      - `data`: one or more messages, as a string or any other buffer, or a
+        list of the strings that make them up
+      - `ctx`: the compression context of the socket they're sent on
+    """
+    if not isinstance(data, list):
+        data = [data if isinstance(data, bytes) else bytes(data)]
+    compressed = []
+    header = _EMPTY
+    body = []
+    remaining = 0
+    for segment in data:
+        position = 0
+        while position < len(segment):
+            if len(header) < 16:
+                # The header may be split across segments.
+                needed = 16 - len(header)
+                header += segment[position:position + needed]
+                position += needed
+                if len(header) < 16:
+                    continue
+                length, request_id, response_to, op_code = _UNPACK_HEADER(
+                    header)
+                remaining = length - 16
+            elif position == 0 and len(segment) <= remaining:
+                # Pass whole segments along without copying them.
+                body.append(segment)
+                position = len(segment)
+                remaining -= len(segment)
+            else:
+                body.append(segment[position:position + remaining])
+                position += len(body[-1])
+                remaining -= len(body[-1])
+            if not remaining:
+                chunks = ctx.compress(body)
+                compressed.append(_PACK_COMPRESSED_HEADER(
+                    25 + sum(len(chunk) for chunk in chunks), request_id,
+                    response_to, _OP_COMPRESSED, op_code, length - 16,
+                    ctx.compressor_id))
+                compressed.extend(chunks)
+                header = _EMPTY
+                body = []
+    return compressed
+
+
 def insert(collection_name, docs, check_keys,
            safe, last_error_args, continue_on_error, opts):
     """Get an **insert** message."""
@@ -278,11 +334,11 @@ def insert(collection_name, docs, check_keys,
         options += 1
     data = struct.pack("<i", options)
     data += bson._make_c_string(collection_name)
-    encoded = [bson.BSON.encode(doc, check_keys, opts) for doc in docs]
-    if not encoded:
+    encoded, offsets = bson._encode_many(docs, check_keys, opts)
+    if not offsets:
         raise InvalidOperation("cannot do an empty bulk insert")
-    max_bson_size = max(map(len, encoded))
-    data += _EMPTY.join(encoded)
+    max_bson_size = max(length for _, length in offsets)
+    data += encoded
     if safe:
         (_, insert_message) = __pack_message(2002, data)
         (request_id, error_message, _) = __last_error(collection_name,
@@ -395,23 +451,27 @@ def _do_batched_insert(collection_name, docs, check_keys,
                        sock_info):
     """Insert `docs` using multiple batches.
     """
-    def _insert_message(insert_message, send_safe):
-        """Build the insert message with header and GLE.
+    def _insert_message(batch, send_safe):
+        """Build the insert message with header and GLE, as a list of the
+        buffers that make it up.
         """
-        request_id, final_message = __pack_message(2002, insert_message)
+        length = 16 + len(prefix) + sum(len(encoded) for encoded in batch)
+        request_id = random.randint(MIN_INT32, MAX_INT32)
+        message = [struct.pack("<iiii", length, request_id, 0, 2002), prefix]
+        message.extend(batch)
         if send_safe:
             request_id, error_message, _ = __last_error(collection_name,
                                                         last_error_args)
-            final_message += error_message
-        return request_id, final_message
+            message.append(error_message)
+        return request_id, message
 
     send_safe = safe or not continue_on_error
     last_error = None
-    data = StringIO()
-    data.write(struct.pack("<i", int(continue_on_error)))
-    data.write(bson._make_c_string(collection_name))
-    message_length = begin_loc = data.tell()
-    has_docs = False
+    prefix = (struct.pack("<i", int(continue_on_error)) +
+              bson._make_c_string(collection_name))
+    message_length = begin_loc = len(prefix)
+    # The encoded documents are sent without joining them together.
+    batch = []
     for doc in docs:
         encoded = bson.BSON.encode(doc, check_keys, opts)
         encoded_length = len(encoded)
@@ -419,14 +479,13 @@ def _do_batched_insert(collection_name, docs, check_keys,
 
         message_length += encoded_length
         if message_length < sock_info.max_message_size and not too_large:
-            data.write(encoded)
-            has_docs = True
+            batch.append(encoded)
             continue
 
-        if has_docs:
+        if batch:
             # We have enough data, send this message.
             try:
-                request_id, msg = _insert_message(data.getvalue(), send_safe)
+                request_id, msg = _insert_message(batch, send_safe)
                 sock_info.legacy_write(request_id, msg, 0, send_safe)
             # Exception type could be OperationFailure or a subtype
             # (e.g. DuplicateKeyError)
@@ -450,14 +509,12 @@ def _do_batched_insert(collection_name, docs, check_keys,
                                    (encoded_length, sock_info.max_bson_size))
 
         message_length = begin_loc + encoded_length
-        data.seek(begin_loc)
-        data.truncate()
-        data.write(encoded)
+        batch = [encoded]
 
-    if not has_docs:
+    if not batch:
         raise InvalidOperation("cannot do an empty bulk insert")
 
-    request_id, msg = _insert_message(data.getvalue(), safe)
+    request_id, msg = _insert_message(batch, safe)
     sock_info.legacy_write(request_id, msg, 0, safe)
 
     # Re-raise any exception stored due to continue_on_error
@@ -479,29 +536,28 @@ def _do_batched_write_command(namespace, operation, command,
 
     ordered = command.get('ordered', True)
 
-    buf = StringIO()
+    # The message header and command, up to the list of documents.
+    buf = bytearray()
     # Save space for message length and request id
-    buf.write(_ZERO_64)
+    buf += _ZERO_64
     # responseTo, opCode
-    buf.write(b"\x00\x00\x00\x00\xd4\x07\x00\x00")
+    buf += b"\x00\x00\x00\x00\xd4\x07\x00\x00"
     # No options
-    buf.write(_ZERO_32)
+    buf += _ZERO_32
     # Namespace as C string
-    buf.write(b(namespace))
-    buf.write(_ZERO_8)
+    buf += b(namespace)
+    buf += _ZERO_8
     # Skip: 0, Limit: -1
-    buf.write(_SKIPLIM)
+    buf += _SKIPLIM
 
     # Where to write command document length
-    command_start = buf.tell()
-    buf.write(bson.BSON.encode(command))
+    command_start = len(buf)
+    buf += bson.BSON.encode(command)
 
     # Start of payload
-    buf.seek(-1, 2)
-    # Work around some Jython weirdness.
-    buf.truncate()
+    del buf[-1:]
     try:
-        buf.write(_OP_MAP[operation])
+        buf += _OP_MAP[operation]
     except KeyError:
         raise InvalidOperation('Unknown command')
 
@@ -509,26 +565,24 @@ def _do_batched_write_command(namespace, operation, command,
         check_keys = False
 
     # Where to write list document length
-    list_start = buf.tell() - 4
+    list_start = len(buf) - 4
+
+    # The list elements, sent after buf without joining them together.
+    segments = []
 
-    def send_message():
+    def send_message(length):
         """Finalize and send the current OP_QUERY message.
         """
         # Close list and command documents
-        buf.write(_ZERO_16)
+        length += 2
 
         # Write document lengths and request id
-        length = buf.tell()
-        buf.seek(list_start)
-        buf.write(struct.pack('<i', length - list_start - 1))
-        buf.seek(command_start)
-        buf.write(struct.pack('<i', length - command_start))
-        buf.seek(4)
         request_id = random.randint(MIN_INT32, MAX_INT32)
-        buf.write(struct.pack('<i', request_id))
-        buf.seek(0)
-        buf.write(struct.pack('<i', length))
-        return sock_info.write_command(request_id, buf.getvalue())
+        struct.pack_into('<i', buf, list_start, length - list_start - 1)
+        struct.pack_into('<i', buf, command_start, length - command_start)
+        struct.pack_into('<ii', buf, 0, length, request_id)
+        return sock_info.write_command(
+            request_id, [bytes(buf)] + segments + [_ZERO_16])
 
     # If there are multiple batches we'll
     # merge results in the caller.
@@ -536,6 +590,7 @@ def _do_batched_write_command(namespace, operation, command,
 
     idx = 0
     idx_offset = 0
+    length = len(buf)
     has_docs = False
     for doc in docs:
         has_docs = True
@@ -543,7 +598,7 @@ def _do_batched_write_command(namespace, operation, command,
         key = b(str(idx))
         value = bson.BSON.encode(doc, check_keys, opts)
         # Send a batch?
-        enough_data = (buf.tell() + len(key) + len(value) + 2) >= max_cmd_size
+        enough_data = (length + len(key) + len(value) + 2) >= max_cmd_size
         enough_documents = (idx >= max_write_batch_size)
         if enough_data or enough_documents:
             if not idx:
@@ -556,27 +611,26 @@ def _do_batched_write_command(namespace, operation, command,
                 # There's nothing intelligent we can say
                 # about size for update and remove
                 raise DocumentTooLarge("command document too large")
-            result = send_message()
+            result = send_message(length)
             results.append((idx_offset, result))
             if ordered and "writeErrors" in result:
                 return results
 
-            # Truncate back to the start of list elements
-            buf.seek(list_start + 4)
-            buf.truncate()
+            # Start again from the first list element
+            del segments[:]
+            length = len(buf)
             idx_offset += idx
             idx = 0
             key = b'0'
-        buf.write(_BSONOBJ)
-        buf.write(key)
-        buf.write(_ZERO_8)
-        buf.write(value)
+        segments.append(_BSONOBJ + key + _ZERO_8)
+        segments.append(value)
+        length += len(key) + len(value) + 2
         idx += 1
 
     if not has_docs:
         raise InvalidOperation("cannot do an empty bulk write")
 
-    results.append((idx_offset, send_message()))
+    results.append((idx_offset, send_message(length)))
     return results
 if _use_c:
     _do_batched_write_command = _cmessage._do_batched_write_command
@@ -149,6 +149,14 @@ class MongoClient(common.BaseObject):
           - `socketKeepAlive`: (boolean) Whether to send periodic keep-alive
             packets on connected sockets. Defaults to ``False`` (do not send
             keep-alive packets).
+          - `compressors`: (list or comma separated string) The compressors
+            to offer the server, in order of preference: "snappy" (requires
+            the python-snappy module) and "zlib". Messages are compressed
+            with the first one the server supports, or sent uncompressed if
+            it supports none. Defaults to ``[]`` (no compression).
+          - `zlibCompressionLevel`: (integer) The level zlib compresses
+            messages at, from 0 (no compression) to 9 (best compression).
+            Defaults to ``-1`` (zlib's default level).
 
           | **Write Concern options:**
           | (Only set if passed. No default values.)
@@ -226,6 +234,9 @@ class MongoClient(common.BaseObject):
 
         .. mongodoc:: connections
 
+        .. versionchanged:: 3.1
+           Added the ``compressors`` and ``zlibCompressionLevel`` options.
+
         .. versionchanged:: 3.0
            :class:`~pymongo.mongo_client.MongoClient` is now the one and only
            client class for a standalone server, mongos, or replica set.
@@ -727,6 +738,44 @@ class MongoClient(common.BaseObject):
           - `address` (optional): Optional address when sending a message
             to a specific server, used for getMore.
         """
+        server, set_slave_ok = self.__select_server_for_message(
+            read_preference, address)
+        return self._reset_on_error(
+            server,
+            server.send_message_with_response,
+            operation,
+            set_slave_ok,
+            self.__all_credentials,
+            exhaust)
+
+    def _send_messages_with_response(self, operations, read_preference=None,
+                                     address=None):
+        """Send several messages to one server and return a list of
+        Responses, one for each operation, in the same order.
+
+        The messages are pipelined on one socket: a window of them is sent
+        before its replies are read.
+
+        :Parameters:
+          - `operations`: a list of _Query or _GetMore objects.
+          - `read_preference` (optional): A ReadPreference.
+          - `address` (optional): Optional address when sending messages
+            to a specific server, used for getMore.
+        """
+        server, set_slave_ok = self.__select_server_for_message(
+            read_preference, address)
+        return self._reset_on_error(
+            server,
+            server.send_messages_with_response,
+            operations,
+            set_slave_ok,
+            self.__all_credentials)
+
+    def __select_server_for_message(self, read_preference, address):
+        """Select a server to send a _Query or _GetMore to.
+
+        Returns the Server and whether to set the slaveOk bit.
+        """
         with self.__lock:
             # If needed, restart kill-cursors thread after a fork.
             self._kill_cursors_executor.open()
@@ -748,14 +797,7 @@ class MongoClient(common.BaseObject):
         set_slave_ok = (
             topology.description.topology_type == TOPOLOGY_TYPE.Single
             and server.description.server_type != SERVER_TYPE.Mongos)
-
-        return self._reset_on_error(
-            server,
-            server.send_message_with_response,
-            operation,
-            set_slave_ok,
-            self.__all_credentials,
-            exhaust)
+        return server, set_slave_ok
 
     def _reset_on_error(self, server, func, *args, **kwargs):
         """Execute an operation. Reset the server on network error.
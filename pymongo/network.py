@@ -29,16 +29,22 @@ try:
 except ImportError:
     _HAS_POLL = False
 
+from bson.py3compat import HAVE_MEMORYVIEW
 from pymongo import helpers, message, monitoring
+from pymongo.compression_support import decompress
 from pymongo.errors import AutoReconnect, NotMasterError, OperationFailure
 
-_UNPACK_INT = struct.Struct("<i").unpack
+_UNPACK_HEADER = struct.Struct("<iiii").unpack
+_UNPACK_COMPRESSION_HEADER = struct.Struct("<iiB").unpack
+
+# The most buffers one sendmsg call can send: IOV_MAX on Linux and the BSDs.
+_MAX_SEGMENTS = 1024
 
 
 def command(sock, dbname, spec, slave_ok, is_mongos,
             read_preference, codec_options, check=True,
             allowable_errors=None, address=None, user=False,
-            check_keys=False):
+            check_keys=False, compression_ctx=None):
     """Execute a command over the socket, or raise socket.error.
 
     :Parameters:
@@ -54,6 +60,8 @@ def command(sock, dbname, spec, slave_ok, is_mongos,
       - `address`: the (host, port) of `sock`
       - `user`: is this a user command or internal?
       - `check_keys`: if True, check `spec` for invalid keys
+      - `compression_ctx`: the compression context to send `spec` with,
+        or None to send it uncompressed
     """
     name = next(iter(spec))
     ns = dbname + '.$cmd'
@@ -73,7 +81,9 @@ def command(sock, dbname, spec, slave_ok, is_mongos,
         monitoring.publish_command_start(spec, dbname, request_id, address)
         start = datetime.datetime.now()
 
-    sock.sendall(msg)
+    if compression_ctx is not None:
+        msg = message._compress(msg, compression_ctx)
+    send_message(sock, msg)
     response = receive_message(sock, 1, request_id)
     try:
         unpacked = helpers._unpack_response(
@@ -97,38 +107,115 @@ def command(sock, dbname, spec, slave_ok, is_mongos,
     return response_doc
 
 
+def send_message(sock, message):
+    """Send a message or raise socket.error.
+
+    `message` is a string or any other buffer, or a list of the strings
+    that make up the message. A list is sent with
+    :meth:`socket.socket.sendmsg` where it's available, without joining
+    the strings together.
+    """
+    if not isinstance(message, list):
+        sock.sendall(message)
+        return
+    sendmsg = getattr(sock, "sendmsg", None)
+    if sendmsg is not None:
+        try:
+            _sendmsg_all(sendmsg, message)
+            return
+        except NotImplementedError:
+            # SSL sockets can't send from several buffers.
+            pass
+    sock.sendall(b"".join(message))
+
+
+def _sendmsg_all(sendmsg, buffers):
+    """Send all of `buffers` with a socket's sendmsg method."""
+    views = [memoryview(buf) for buf in buffers]
+    start = 0
+    while start < len(views):
+        sent = sendmsg(views[start:start + _MAX_SEGMENTS])
+        # Skip the buffers sent in full, then the start of a partly sent one.
+        while start < len(views) and sent >= len(views[start]):
+            sent -= len(views[start])
+            start += 1
+        if sent:
+            views[start] = views[start][sent:]
+
+
 def receive_message(sock, operation, request_id):
-    """Receive a raw BSON message or raise socket.error."""
-    header = _receive_data_on_socket(sock, 16)
-    length = _UNPACK_INT(header[:4])[0]
+    """Receive a raw BSON message or raise socket.error.
 
-    actual_op = _UNPACK_INT(header[12:])[0]
-    assert operation == actual_op, ("wire protocol error: "
-                                    "unknown opcode %r" % (actual_op,))
+    Returns the message after its header, like :func:`receive_reply`.
+    """
+    response_id, data = receive_reply(sock, operation)
     # No request_id for exhaust cursor "getMore".
     if request_id is not None:
-        response_id = _UNPACK_INT(header[8:12])[0]
         assert request_id == response_id, (
             "wire protocol error: got response id %r but expected %r"
             % (response_id, request_id))
+    return data
+
+
+def receive_reply(sock, operation):
+    """Receive the next raw BSON message, whichever request it responds
+    to, or raise socket.error.
 
+    Returns ``(response_to, data)``: the request id from the message's
+    header, and the message after its header, in a :class:`bytearray`
+    that is read into directly and can be decoded without copying it (a
+    string on python 2.6). A message sent with OP_COMPRESSED is returned
+    decompressed, as a string.
+    """
+    header = _receive_data_on_socket(sock, 16)
+    length, _, response_id, actual_op = _UNPACK_HEADER(header)
+    compressor_id = None
+    if actual_op == message._OP_COMPRESSED:
+        actual_op, _, compressor_id = _UNPACK_COMPRESSION_HEADER(
+            _receive_data_on_socket(sock, 9))
+        length -= 9
+    assert operation == actual_op, ("wire protocol error: "
+                                    "unknown opcode %r" % (actual_op,))
     assert length > 16, ("wire protocol error: message length is shorter"
                          " than standard message header: %r" % (length,))
 
-    return _receive_data_on_socket(sock, length - 16)
+    data = _receive_data_on_socket(sock, length - 16)
+    if compressor_id is not None:
+        return response_id, decompress(data, compressor_id)
+    return response_id, data
 
 
 def _receive_data_on_socket(sock, length):
-    msg = b""
+    """Read exactly `length` bytes into a new bytearray."""
+    if not HAVE_MEMORYVIEW:
+        return _recv_data_on_socket(sock, length)
+    buf = bytearray(length)
+    view = memoryview(buf)
+    bytes_read = 0
+    while bytes_read < length:
+        chunk_length = sock.recv_into(view[bytes_read:])
+        if chunk_length == 0:
+            raise AutoReconnect("connection closed")
+        bytes_read += chunk_length
+
+    return buf
+
+
+def _recv_data_on_socket(sock, length):
+    """Read exactly `length` bytes into a new string, with recv.
+
+    For python 2.6, which can't recv_into part of a bytearray.
+    """
+    chunks = []
     while length:
         chunk = sock.recv(length)
         if chunk == b"":
             raise AutoReconnect("connection closed")
 
         length -= len(chunk)
-        msg += chunk
+        chunks.append(chunk)
 
-    return msg
+    return b"".join(chunks)
 
 
 def socket_closed(sock):
@@ -19,7 +19,9 @@ import threading
 
 from bson import DEFAULT_CODEC_OPTIONS
 from bson.py3compat import u, itervalues
+from bson.son import SON
 from pymongo import auth, helpers, thread_util
+from pymongo.compression_support import _NO_COMPRESSION
 from pymongo.errors import (AutoReconnect,
                             ConnectionFailure,
                             DocumentTooLarge,
@@ -27,9 +29,12 @@ from pymongo.errors import (AutoReconnect,
                             NotMasterError,
                             OperationFailure)
 from pymongo.ismaster import IsMaster
+from pymongo.message import _compress
 from pymongo.monotonic import time as _time
 from pymongo.network import (command,
                              receive_message,
+                             receive_reply,
+                             send_message,
                              socket_closed)
 from pymongo.read_preferences import ReadPreference
 from pymongo.server_type import SERVER_TYPE
@@ -66,12 +71,14 @@ class PoolOptions(object):
 
     __slots__ = ('__max_pool_size', '__connect_timeout', '__socket_timeout',
                  '__wait_queue_timeout', '__wait_queue_multiple',
-                 '__ssl_context', '__ssl_match_hostname', '__socket_keepalive')
+                 '__ssl_context', '__ssl_match_hostname', '__socket_keepalive',
+                 '__compression_settings')
 
     def __init__(self, max_pool_size=100, connect_timeout=None,
                  socket_timeout=None, wait_queue_timeout=None,
                  wait_queue_multiple=None, ssl_context=None,
-                 ssl_match_hostname=True, socket_keepalive=False):
+                 ssl_match_hostname=True, socket_keepalive=False,
+                 compression_settings=None):
 
         self.__max_pool_size = max_pool_size
         self.__connect_timeout = connect_timeout
@@ -81,6 +88,7 @@ class PoolOptions(object):
         self.__ssl_context = ssl_context
         self.__ssl_match_hostname = ssl_match_hostname
         self.__socket_keepalive = socket_keepalive
+        self.__compression_settings = compression_settings
 
     @property
     def max_pool_size(self):
@@ -135,6 +143,13 @@ class PoolOptions(object):
         """
         return self.__socket_keepalive
 
+    @property
+    def compression_settings(self):
+        """A :class:`~pymongo.compression_support.CompressionSettings`
+        instance or None.
+        """
+        return self.__compression_settings
+
 
 class SocketInfo(object):
     """Store a socket with some metadata.
@@ -163,6 +178,15 @@ class SocketInfo(object):
         else:
             self.is_mongos = None
 
+        # Messages are compressed with the first of the client's compressors
+        # the server listed in its ismaster response, if any.
+        settings = pool.opts.compression_settings
+        if ismaster and settings:
+            self.compression_context = settings.get_compression_context(
+                ismaster.compressors)
+        else:
+            self.compression_context = None
+
         # The pool's pool_id changes with each reset() so we can close sockets
         # created before the last reset.
         self.pool_id = pool.pool_id
@@ -183,11 +207,14 @@ class SocketInfo(object):
           - `allowable_errors`: errors to ignore if `check` is True
           - `check_keys`: if True, check `spec` for invalid keys
         """
+        compression_ctx = self.compression_context
+        if next(iter(spec)).lower() in _NO_COMPRESSION:
+            compression_ctx = None
         try:
             return command(self.sock, dbname, spec, slave_ok,
                            self.is_mongos, read_preference, codec_options,
                            check, allowable_errors, self.address, True,
-                           check_keys)
+                           check_keys, compression_ctx)
         except OperationFailure:
             raise
         # Catch socket.error, KeyboardInterrupt, etc. and close ourselves.
@@ -197,7 +224,9 @@ class SocketInfo(object):
     def send_message(self, message, max_doc_size):
         """Send a raw BSON message or raise ConnectionFailure.
 
-        If a network exception is raised, the socket is closed.
+        If a network exception is raised, the socket is closed. The message
+        is compressed if the server supports one of the client's
+        compressors.
         """
         if (self.max_bson_size is not None
                 and max_doc_size > self.max_bson_size):
@@ -206,8 +235,10 @@ class SocketInfo(object):
                 "supports BSON document sizes up to %d bytes." %
                 (max_doc_size, self.max_bson_size))
 
+        if self.compression_context is not None:
+            message = _compress(message, self.compression_context)
         try:
-            self.sock.sendall(message)
+            send_message(self.sock, message)
         except BaseException as error:
             self._raise_connection_failure(error)
 
@@ -221,6 +252,28 @@ class SocketInfo(object):
         except BaseException as error:
             self._raise_connection_failure(error)
 
+    def receive_replies(self, operation, request_ids):
+        """Receive a reply to each of several requests sent on this socket,
+        without waiting for one reply before sending the next request.
+
+        Yields ``(request_id, data)`` for each reply, in the order the
+        replies arrive. If any exception is raised, including when a reply
+        doesn't respond to one of `request_ids`, the socket is closed.
+        Read every reply, or close the socket: replies left unread would be
+        taken for the replies to later requests.
+        """
+        pending = set(request_ids)
+        while pending:
+            try:
+                response_id, data = receive_reply(self.sock, operation)
+                assert response_id in pending, (
+                    "wire protocol error: got response id %r but expected "
+                    "one of %r" % (response_id, sorted(pending)))
+            except BaseException as error:
+                self._raise_connection_failure(error)
+            pending.remove(response_id)
+            yield response_id, data
+
     def legacy_write(self, request_id, msg, max_doc_size, with_last_error):
         """Send OP_INSERT, etc., optionally returning response as a dict.
 
@@ -228,8 +281,8 @@ class SocketInfo(object):
 
         :Parameters:
           - `request_id`: an int.
-          - `msg`: bytes, an OP_INSERT, OP_UPDATE, or OP_DELETE message,
-            perhaps with a getlasterror command appended.
+          - `msg`: bytes, or a list of buffers, an OP_INSERT, OP_UPDATE, or
+            OP_DELETE message, perhaps with a getlasterror command appended.
           - `max_doc_size`: size in bytes of the largest document in `msg`.
           - `with_last_error`: True if a getlasterror command is appended.
         """
@@ -249,7 +302,7 @@ class SocketInfo(object):
 
         :Parameters:
           - `request_id`: an int.
-          - `msg`: bytes, the command message.
+          - `msg`: bytes, or a list of buffers, the command message.
         """
         self.send_message(msg, 0)
         response = helpers._unpack_response(self.receive_message(1, request_id))
@@ -475,7 +528,12 @@ class Pool:
         try:
             sock = _configured_socket(self.address, self.opts)
             if self.handshake:
-                ismaster = IsMaster(command(sock, 'admin', {'ismaster': 1},
+                cmd = SON([('ismaster', 1)])
+                settings = self.opts.compression_settings
+                if settings and settings.compressors:
+                    # Servers that don't support compression ignore this.
+                    cmd['compression'] = settings.compressors
+                ismaster = IsMaster(command(sock, 'admin', cmd,
                                             False, False,
                                             ReadPreference.PRIMARY,
                                             DEFAULT_CODEC_OPTIONS))
@@ -22,6 +22,36 @@ from pymongo import monitoring
 from pymongo.response import Response, ExhaustResponse
 from pymongo.server_type import SERVER_TYPE
 
+# The most bytes of requests send_messages_with_response sends before
+# reading their replies. The server stops reading requests while its
+# replies aren't read, so the requests in flight must fit in the sockets'
+# buffers.
+_MAX_PIPELINED_BYTES = 32 * 1024
+
+
+def _pipeline_windows(messages):
+    """Group (request_id, data, max_doc_size) messages into windows that
+    can be sent before their replies are read.
+
+    Yields (request_ids, data, max_doc_size) for each window, where data is
+    a list of buffers. A message larger than _MAX_PIPELINED_BYTES is sent
+    on its own.
+    """
+    request_ids, data, max_doc_size, size = [], [], 0, 0
+    for request_id, msg, doc_size in messages:
+        if not isinstance(msg, list):
+            msg = [msg]
+        length = sum(len(segment) for segment in msg)
+        if request_ids and size + length > _MAX_PIPELINED_BYTES:
+            yield request_ids, data, max_doc_size
+            request_ids, data, max_doc_size, size = [], [], 0, 0
+        request_ids.append(request_id)
+        data.extend(msg)
+        max_doc_size = max(max_doc_size, doc_size)
+        size += length
+    if request_ids:
+        yield request_ids, data, max_doc_size
+
 
 class Server(object):
     def __init__(self, server_description, pool, monitor):
@@ -122,6 +152,67 @@ class Server(object):
                     duration=duration,
                     request_id=request_id)
 
+    def send_messages_with_response(
+            self,
+            operations,
+            set_slave_okay,
+            all_credentials):
+        """Send several messages to MongoDB on one socket and return a list
+        of Response objects, one for each operation, in the same order.
+
+        The messages are sent in windows of up to _MAX_PIPELINED_BYTES, and
+        each window's replies are read before the next window is sent. The
+        replies are matched to the requests by their request ids as they
+        arrive, so each window takes about one round trip.
+
+        Can raise ConnectionFailure.
+
+        :Parameters:
+          - `operations`: A list of _Query or _GetMore objects.
+          - `set_slave_okay`: Pass to operation.get_message.
+          - `all_credentials`: dict, maps auth source to MongoCredential.
+        """
+        if not operations:
+            return []
+
+        with self.get_socket(all_credentials) as sock_info:
+
+            publish = monitoring.enabled()
+            if publish:
+                start = datetime.now()
+
+            messages = []
+            for operation in operations:
+                message = operation.get_message(
+                    set_slave_okay, sock_info.is_mongos)
+                messages.append(self._split_message(message))
+            request_ids = [message[0] for message in messages]
+
+            if publish:
+                encoding_duration = datetime.now() - start
+                for operation, request_id in zip(operations, request_ids):
+                    cmd, dbn = operation.as_command()
+                    monitoring.publish_command_start(
+                        cmd, dbn, request_id, sock_info.address)
+                start = datetime.now()
+
+            responses = {}
+            for window_ids, data, max_doc_size in _pipeline_windows(messages):
+                sock_info.send_message(data, max_doc_size)
+                for request_id, response_data in sock_info.receive_replies(
+                        1, window_ids):
+                    duration = None
+                    if publish:
+                        duration = ((datetime.now() - start) +
+                                    encoding_duration)
+                    responses[request_id] = Response(
+                        data=response_data,
+                        address=self._description.address,
+                        duration=duration,
+                        request_id=request_id)
+
+            return [responses[request_id] for request_id in request_ids]
+
     @contextlib.contextmanager
     def get_socket(self, all_credentials, checkout=False):
         with self.pool.get_socket(all_credentials, checkout) as sock_info:
@@ -16,7 +16,7 @@
 
 import threading
 
-from pymongo import monitor, pool
+from pymongo import monitor, pool, server
 from pymongo.common import LOCAL_THRESHOLD_MS, SERVER_SELECTION_TIMEOUT
 from pymongo.topology_description import TOPOLOGY_TYPE
 from pymongo.pool import PoolOptions
@@ -31,6 +31,7 @@ class TopologySettings(object):
                  pool_options=None,
                  monitor_class=None,
                  condition_class=None,
+                 server_class=None,
                  local_threshold_ms=LOCAL_THRESHOLD_MS,
                  server_selection_timeout=SERVER_SELECTION_TIMEOUT):
         """Represent MongoClient's configuration.
@@ -43,6 +44,7 @@ class TopologySettings(object):
         self._pool_options = pool_options or PoolOptions()
         self._monitor_class = monitor_class or monitor.Monitor
         self._condition_class = condition_class or threading.Condition
+        self._server_class = server_class or server.Server
         self._local_threshold_ms = local_threshold_ms
         self._server_selection_timeout = server_selection_timeout
         self._direct = (len(self._seeds) == 1 and not replica_set_name)
@@ -72,6 +74,10 @@ class TopologySettings(object):
     def condition_class(self):
         return self._condition_class
 
+    @property
+    def server_class(self):
+        return self._server_class
+
     @property
     def local_threshold_ms(self):
         return self._local_threshold_ms
@@ -27,7 +27,6 @@ from pymongo.topology_description import (updated_topology_description,
                                           TopologyDescription)
 from pymongo.errors import ServerSelectionTimeoutError, InvalidOperation
 from pymongo.monotonic import time as _time
-from pymongo.server import Server
 from pymongo.server_selectors import (any_server_selector,
                                       apply_local_threshold,
                                       arbiter_server_selector,
@@ -352,7 +351,7 @@ class Topology(object):
                     pool=self._create_pool_for_monitor(address),
                     topology_settings=self._settings)
 
-                server = Server(
+                server = self._settings.server_class(
                     server_description=sd,
                     pool=self._create_pool_for_server(address),
                     monitor=monitor)
@@ -247,6 +247,8 @@ ext_modules = [Extension('bson._cbson',
 extra_opts = {
     "packages": ["bson", "pymongo", "gridfs"]
 }
+if sys.version_info[:2] >= (3, 4):
+    extra_opts['packages'].append("pymongo.asynchronous")
 if sys.version_info[:2] == (2, 6):
     extra_opts['tests_require'] = "unittest2"
 
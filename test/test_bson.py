@@ -18,27 +18,37 @@
 
 import collections
 import datetime
+import os
 import re
 import sys
+import tempfile
 import uuid
 
 sys.path[0:0] = [""]
 
 import bson
 from bson import (BSON,
+                  BSONWriter,
                   decode_all,
                   decode_file_iter,
                   decode_iter,
+                  encode_many,
+                  encode_to,
+                  encoded_size,
                   EPOCH_AWARE,
                   is_valid,
-                  Regex)
+                  Regex,
+                  validate)
 from bson.binary import Binary, UUIDLegacy
 from bson.code import Code
 from bson.codec_options import CodecOptions
+from bson.datetime_ms import DatetimeMS
 from bson.int64 import Int64
 from bson.objectid import ObjectId
 from bson.dbref import DBRef
-from bson.py3compat import PY3, u, text_type, iteritems, StringIO
+from bson.py3compat import (PY3, u, text_type, iteritems, StringIO,
+                            HAVE_MEMORYVIEW)
+from bson.raw_bson import RawBSONDocument
 from bson.son import SON
 from bson.timestamp import Timestamp
 from bson.tz_util import FixedOffset
@@ -115,6 +125,8 @@ class DSTAwareTimezone(datetime.tzinfo):
 class TestBSON(unittest.TestCase):
     def assertInvalid(self, data):
         self.assertRaises(InvalidBSON, bson.BSON(data).decode)
+        self.assertFalse(is_valid(data))
+        self.assertTrue(validate(data))
 
     def check_encode_then_decode(self, doc_class=dict):
 
@@ -256,6 +268,72 @@ class TestBSON(unittest.TestCase):
             b"\x00\x02\x00\xff\xff\xff"
             b"\xff\x00\x00\x00")
 
+    def test_validate(self):
+        docs = [SON([("a", [1, {"b": Code("x", {"y": 2})}]),
+                     ("c", Binary(b"abcd", 2)),
+                     ("d", uuid.uuid4()), ("e", Regex("a.b", "im")),
+                     ("f", datetime.datetime(2015, 1, 1)),
+                     ("g", DBRef("c", 1)), ("h", Timestamp(1, 2))]),
+                {}, {"x": u("\u1234")}]
+        encoded = [BSON.encode(doc) for doc in docs]
+        data = b"".join(encoded)
+        buffers = [data, bytearray(data)]
+        if HAVE_MEMORYVIEW:
+            buffers.append(memoryview(data))
+        for buf in buffers:
+            self.assertEqual([], validate(buf))
+        for doc in encoded:
+            self.assertTrue(is_valid(doc))
+        self.assertEqual([], validate(b""))
+
+        # The offset of each invalid document is returned.
+        bad = encoded[0][:4] + b"\x13" + encoded[0][5:]
+        self.assertEqual([0, len(bad) + len(encoded[1])],
+                         validate(bad + encoded[1] + bad + encoded[2]))
+        # Documents after one with an invalid size can't be found.
+        self.assertEqual([len(encoded[1])],
+                         validate(encoded[1] + b"\xff\xff\xff\x7f" +
+                                  data[4:]))
+        self.assertEqual([len(data)], validate(data + b"\x05\x00\x00"))
+
+        # Structurally invalid values.
+        self.assertFalse(is_valid(BSON.encode({"b": Binary(b"abcd", 2)})
+                                  .replace(b"\x04\x00\x00\x00ab",
+                                           b"\x03\x00\x00\x00ab")))
+        # A 3 byte UUID.
+        self.assertFalse(is_valid(b"\x10\x00\x00\x00\x05u\x00\x03\x00"
+                                  b"\x00\x00\x04abc\x00"))
+        # Invalid UTF-8 in a regex and in a key.
+        self.assertFalse(is_valid(b"\x0d\x00\x00\x00\x0br\x00a\xff\x00"
+                                  b"i\x00\x00"))
+        self.assertFalse(is_valid(b"\x0c\x00\x00\x00\x10\xff\x00\x01"
+                                  b"\x00\x00\x00\x00"))
+        # Valid BSON, even though the datetime is out of range for
+        # datetime.datetime.
+        self.assertTrue(is_valid(b"\x10\x00\x00\x00\x09d\x00\xff\xff"
+                                 b"\xff\xff\xff\xff\xff\x7f\x00"))
+
+    def test_validate_max_depth(self):
+        nested = {}
+        for _ in range(3):
+            nested = {"a": [nested]}
+        data = BSON.encode(nested)
+        self.assertEqual([], validate(data))
+        self.assertEqual([], validate(data, max_depth=6))
+        self.assertEqual([0], validate(data, max_depth=5))
+        self.assertEqual([0], validate(BSON.encode({"c": Code("x", {"y": 1})}),
+                                       max_depth=0))
+        self.assertEqual([], validate(BSON.encode({"a": 1}), max_depth=0))
+        self.assertRaises(ValueError, validate, data, max_depth=-1)
+
+        # Checking very deeply nested documents doesn't recurse.
+        deep = b"\x05\x00\x00\x00\x00"
+        for _ in range(10000):
+            deep = (bson._PACK_INT(len(deep) + 8) + b"\x03a\x00" + deep +
+                    b"\x00")
+        self.assertTrue(is_valid(deep))
+        self.assertEqual([0], validate(deep, max_depth=9999))
+
     def test_random_data_is_not_bson(self):
         qcheck.check_unittest(self, qcheck.isnt(is_valid),
                               qcheck.gen_string(qcheck.gen_range(0, 40)))
@@ -283,6 +361,204 @@ class TestBSON(unittest.TestCase):
                             b"\x6f\x20\x77\x6F\x72\x6C\x64\x00\x00"
                             b"\x05\x00\x00\x00\x00"))))
 
+    def test_decode_buffer_protocol(self):
+        doc = {"test": u("hello world")}
+        data = (b"\x1B\x00\x00\x00\x0E\x74\x65\x73\x74"
+                b"\x00\x0C\x00\x00\x00\x68\x65\x6C\x6C"
+                b"\x6f\x20\x77\x6F\x72\x6C\x64\x00\x00"
+                b"\x05\x00\x00\x00\x00")
+        self.assertEqual([doc, {}], decode_all(bytearray(data)))
+        self.assertEqual([doc, {}], list(decode_iter(bytearray(data))))
+        if HAVE_MEMORYVIEW:
+            view = memoryview(data)
+            self.assertEqual([doc, {}], decode_all(view))
+            self.assertEqual([doc, {}], list(decode_iter(view)))
+            # A memoryview slice that doesn't start at the beginning of the
+            # underlying buffer.
+            view = memoryview(b"\x00" * 20 + data)[20:]
+            self.assertEqual([doc, {}], decode_all(view))
+            self.assertEqual([doc, {}], list(decode_iter(view)))
+            self.assertEqual(
+                [doc, {}], decode_all(view, CodecOptions(document_class=SON)))
+
+        self.assertRaises(InvalidBSON, decode_all, bytearray(data[:-1]))
+        self.assertRaises(TypeError, decode_all, u("not bson"))
+        self.assertRaises(TypeError, decode_all, 5)
+
+    def test_encode_many(self):
+        docs = [SON([("_id", 1), ("a", u("x"))]), {}, {"b": [1.5]}]
+        data, offsets = encode_many(iter(docs))
+        self.assertEqual(b"".join(BSON.encode(doc) for doc in docs), data)
+        self.assertEqual([(0, 23), (23, 5), (28, 24)], offsets)
+        for (offset, length), doc in zip(offsets, docs):
+            self.assertEqual(doc, BSON(data[offset:offset + length]).decode())
+        self.assertEqual([1.5], decode_all(data)[2]["b"])
+
+        self.assertEqual((b"", []), encode_many([]))
+        raw = RawBSONDocument(BSON.encode({"$a": 1}))
+        self.assertEqual((raw.raw, [(0, 13)]),
+                         encode_many([raw], check_keys=True))
+        self.assertRaises(InvalidDocument, encode_many,
+                          [{}, {"$a": 1}], check_keys=True)
+        self.assertRaises(TypeError, encode_many, [{}, 1])
+        self.assertRaises(TypeError, encode_many, 1)
+        self.assertRaises(TypeError, encode_many, [{}], codec_options={})
+
+    def test_encoded_size(self):
+        doc = SON([
+            ("a", 1), ("_id", ObjectId()), ("big", 2 ** 40), ("f", 1.5),
+            ("t", True), ("n", None), ("s", u("ascii")),
+            ("u", u("\u00e9\u4e2d")), ("b", Binary(b"xyz", 2)),
+            ("bytes", b"abc"), ("l", [1, (2, u("x")), {"c": []}]),
+            ("d", datetime.datetime(2015, 1, 1)), ("dms", DatetimeMS(5)),
+            ("i64", Int64(1)), ("ts", Timestamp(1, 2)),
+            ("uuid", uuid.uuid4()), ("re", re.compile("a", re.I)),
+            ("code", Code("x", {"y": 1})), ("ref", DBRef("c", 1, "db")),
+            ("min", MinKey()), ("max", MaxKey()),
+            ("raw", RawBSONDocument(BSON.encode({"r": 1}))),
+            ("bson", BSON.encode({"q": 1})),
+            ("son", SON([("_id", 2)])),
+        ])
+        self.assertEqual(len(BSON.encode(doc)), encoded_size(doc))
+        self.assertEqual(5, encoded_size({}))
+        raw = RawBSONDocument(BSON.encode({"$a": 1}))
+        self.assertEqual(len(raw.raw), encoded_size(raw, check_keys=True))
+
+        self.assertRaises(InvalidDocument, encoded_size,
+                          {"a": {"$b": 1}}, check_keys=True)
+        self.assertRaises(InvalidDocument, encoded_size, {1: 1})
+        self.assertRaises(InvalidDocument, encoded_size, {"a": object()})
+        self.assertRaises(OverflowError, encoded_size, {"a": 2 ** 64})
+        self.assertRaises(TypeError, encoded_size, 1)
+        self.assertRaises(TypeError, encoded_size, {}, codec_options={})
+
+    def test_encode_to(self):
+        big = b"x" * (bson._WRITE_CHUNK_SIZE + 1)
+        docs = [
+            SON([("a", 1), ("_id", 2), ("b", [u("y")] * 20000)]),
+            {"bin": Binary(big, 128), "bytes": big, "f": 1.5},
+            {"raw": RawBSONDocument(BSON.encode({"r": big})),
+             "bson": BSON.encode({"q": big})},
+            RawBSONDocument(BSON.encode({"$r": 1})),
+            {},
+        ]
+        expected = b"".join(BSON.encode(doc) for doc in docs)
+
+        class Unseekable(object):
+            def __init__(self):
+                self.data = bytearray()
+
+            def write(self, data):
+                self.data += data
+
+            def getvalue(self):
+                return bytes(self.data)
+
+        def getvalue(stream):
+            if isinstance(stream, bytearray):
+                return bytes(stream)
+            return stream.getvalue()
+
+        for stream in (StringIO(), bytearray(), Unseekable()):
+            writer = BSONWriter(stream)
+            self.assertEqual(len(expected), writer.write_many(iter(docs)))
+            self.assertEqual(expected, getvalue(stream))
+
+        stream = StringIO()
+        self.assertEqual(len(BSON.encode(docs[0])),
+                         encode_to(stream, docs[0], check_keys=True))
+        self.assertEqual(
+            [docs[0]], list(decode_file_iter(StringIO(stream.getvalue()))))
+
+        # Nothing is left behind by a document that can't be encoded.
+        bad = SON([("a", big), ("b", object())])
+        for stream in (StringIO(), bytearray(), Unseekable()):
+            encode_to(stream, {})
+            self.assertRaises(InvalidDocument, encode_to, stream, bad)
+            self.assertEqual(BSON.encode({}), getvalue(stream))
+        self.assertRaises(InvalidDocument, encode_to,
+                          StringIO(), {"$a": 1}, check_keys=True)
+
+        # Or by a document the stream failed to write.
+        class FailsOnce(Unseekable):
+            failed = False
+
+            def write(self, data):
+                if not self.failed:
+                    self.failed = True
+                    raise IOError("failed")
+                Unseekable.write(self, data)
+
+        stream = FailsOnce()
+        writer = BSONWriter(stream)
+        self.assertRaises(IOError, writer.write, {"a": 1})
+        writer.write({"b": 2})
+        self.assertEqual(BSON.encode({"b": 2}), stream.getvalue())
+
+        self.assertRaises(TypeError, encode_to, StringIO(), 1)
+        self.assertRaises(TypeError, BSONWriter, StringIO(), codec_options={})
+
+    def test_encode_to_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        docs = [{"_id": i, "s": "x" * i} for i in range(3)]
+
+        # Appending to a dump, as a backup tool does.
+        for doc in docs:
+            with open(path, "ab") as stream:
+                encode_to(stream, doc)
+        with open(path, "rb") as stream:
+            self.assertEqual(docs, list(decode_file_iter(stream)))
+
+        # A document that fails when written before the end of the file
+        # leaves what follows it alone.
+        bad = SON([("a", 1), ("b", object())])
+        with open(path, "r+b") as stream:
+            self.assertRaises(InvalidDocument, encode_to, stream, bad)
+            self.assertEqual(0, stream.tell())
+            encode_to(stream, {"_id": 5, "s": ""})
+        with open(path, "rb") as stream:
+            self.assertEqual([{"_id": 5, "s": ""}] + docs[1:],
+                             list(decode_file_iter(stream)))
+
+    def test_decode_all_large(self):
+        # Enough data to be checked without holding the GIL.
+        doc = {"s": u("x") * 1024}
+        data = BSON.encode(doc) * 2048
+        self.assertEqual([doc] * 2048, decode_all(data))
+        self.assertRaises(InvalidBSON, decode_all, data + b"\x05\x00\x00")
+        self.assertRaises(InvalidBSON, decode_all, data[:-1] + b"\x01")
+
+        big = {"s": u("x") * (2 * 1024 * 1024)}
+        raw = RawBSONDocument(BSON.encode(big))
+        self.assertEqual(big, decode_all(BSON.encode({"raw": raw}))[0]["raw"])
+
+    def test_decode_all_buffer_changed(self):
+        data = bytearray(BSON.encode({"a": 1}) * 2)
+
+        class Corrupting(dict):
+            """Makes the next document claim to be larger than the buffer,
+            while the first is being decoded."""
+            def __init__(self, *args, **kwargs):
+                data[12:16] = b"\xff\xff\x00\x00"
+                super(Corrupting, self).__init__(*args, **kwargs)
+
+        opts = CodecOptions(document_class=Corrupting)
+        if bson.has_c():
+            self.assertRaises(InvalidBSON, decode_all, data, opts)
+        else:
+            # The pure Python decoder copies the buffer first.
+            self.assertEqual([{"a": 1}] * 2, decode_all(data, opts))
+
+    def test_decoded_keys_are_shared(self):
+        if not bson.has_c():
+            raise SkipTest("C extension not available")
+        data = BSON.encode(SON([("timestamp", 1), (u("caf\xe9"), 2)]))
+        first, second = decode_all(data * 2)
+        self.assertIs(list(first)[0], list(second)[0])
+        self.assertEqual(list(first), list(second))
+
     def test_invalid_decodes(self):
         # Invalid object size (not enough bytes in document for even
         # an object size of first object.
@@ -326,6 +602,13 @@ class TestBSON(unittest.TestCase):
         self.assertRaises(InvalidBSON, list, decode_iter(data))
         self.assertRaises(InvalidBSON, list, decode_file_iter(StringIO(data)))
 
+        # An embedded document and an array with negative sizes.
+        for element_type in (b"\x03", b"\x04"):
+            data = (b"\x10\x00\x00\x00" + element_type +
+                    b"a\x00\xF0\xFF\xFF\xFF\x00\x00\x00\x00\x00")
+            self.assertRaises(InvalidBSON, decode_all, data)
+            self.assertRaises(InvalidBSON, BSON(data).decode)
+
     def test_data_timestamp(self):
         self.assertEqual({"test": Timestamp(4, 20)},
                          BSON(b"\x13\x00\x00\x00\x11\x74\x65\x73\x74\x00\x14"
@@ -514,6 +797,73 @@ class TestBSON(unittest.TestCase):
                 epoch,
                 BSON.encode(doc).decode(codec_options=local_co)['epoch'])
 
+    def test_datetime_ms(self):
+        dt = datetime.datetime(1993, 4, 4, 2, 3, 4, 5000)
+        opts = CodecOptions(datetime_ms=True)
+        decoded = BSON.encode({"date": dt}).decode(opts)["date"]
+        self.assertIsInstance(decoded, DatetimeMS)
+        self.assertEqual(733888984005, decoded)
+        self.assertEqual(dt, decoded.as_datetime())
+        self.assertEqual(dt.replace(tzinfo=utc),
+                         decoded.as_datetime(CodecOptions(tz_aware=True)))
+
+        # Round-trips as a BSON datetime.
+        self.assertEqual(dt, BSON.encode({"date": decoded}).decode()["date"])
+        self.assertEqual({"date": decoded},
+                         BSON.encode({"date": decoded}).decode(opts))
+
+        # Dates outside the range of datetime.datetime.
+        for millis in (-2 ** 63, 2 ** 63 - 1):
+            doc = {"date": DatetimeMS(millis)}
+            self.assertEqual(doc, BSON.encode(doc).decode(opts))
+        self.assertRaises(OverflowError, BSON.encode,
+                          {"date": DatetimeMS(2 ** 63)})
+
+        # Arithmetic returns plain integers.
+        self.assertEqual(733888985005, decoded + 1000)
+
+    def test_binary_memoryview(self):
+        if not HAVE_MEMORYVIEW:
+            raise SkipTest("memoryview requires python 2.7")
+        opts = CodecOptions(binary_memoryview=True)
+        data = b"\x00\x01binary\xff" * 10
+        encoded = BSON.encode({"a": Binary(data, 0), "b": Binary(data, 5),
+                               "c": {"d": [Binary(b"", 0)]}})
+        # Python 2 can't make read-only views of a bytearray.
+        for buf in (encoded, bytearray(encoded)) if PY3 else (encoded,):
+            decoded = decode_all(buf, opts)[0]
+            view = decoded["a"]
+            self.assertIsInstance(view, memoryview)
+            self.assertTrue(view.readonly)
+            self.assertEqual(data, view.tobytes())
+            self.assertEqual(Binary(data, 5), decoded["b"])
+            self.assertEqual(b"", decoded["c"]["d"][0].tobytes())
+
+        # Encoded as binary subtype 0.
+        decoded = encoded.decode(opts)
+        self.assertEqual(encoded, BSON.encode(decoded))
+        if PY3:
+            self.assertEqual(data, BSON.encode(decoded).decode()["a"])
+        self.assertEqual(len(encoded), encoded_size(decoded))
+
+        docs = decode_all(encoded * 2, opts)
+        self.assertEqual(data, docs[1]["a"].tobytes())
+        raw = encoded.decode(CodecOptions(document_class=RawBSONDocument,
+                                          binary_memoryview=True))
+        self.assertEqual(data, raw["a"].tobytes())
+
+    def test_binary_memoryview_shares_buffer(self):
+        if not (PY3 and bson.has_c()):
+            raise SkipTest("requires python 3 and the C extension")
+        data = bytearray(BSON.encode({"a": Binary(b"1234", 0)}))
+        view = decode_all(data, CodecOptions(binary_memoryview=True))[0]["a"]
+        data[-3] = ord(b"x")
+        self.assertEqual(b"12x4", view.tobytes())
+        # The view keeps the buffer exported.
+        self.assertRaises(BufferError, data.extend, b"resize")
+        view.release()
+        data.extend(b"resize")
+
     def test_naive_decode(self):
         aware = datetime.datetime(1993, 4, 4, 2,
                                   tzinfo=FixedOffset(555, "SomeZone"))
@@ -879,9 +1229,75 @@ class TestCodecOptions(unittest.TestCase):
         r = ("CodecOptions(document_class=dict, tz_aware=False, "
              "uuid_representation=PYTHON_LEGACY, "
              "unicode_decode_error_handler='strict', "
-             "tzinfo=None)")
+             "tzinfo=None, decode_fields=None, datetime_ms=False, "
+             "binary_memoryview=False)")
         self.assertEqual(r, repr(CodecOptions()))
 
+    def test_datetime_ms(self):
+        self.assertRaises(TypeError, CodecOptions, datetime_ms=1)
+        self.assertFalse(CodecOptions().datetime_ms)
+        self.assertTrue(CodecOptions(datetime_ms=True).datetime_ms)
+
+    def test_binary_memoryview(self):
+        self.assertRaises(TypeError, CodecOptions, binary_memoryview=1)
+        self.assertFalse(CodecOptions().binary_memoryview)
+        if HAVE_MEMORYVIEW:
+            self.assertTrue(
+                CodecOptions(binary_memoryview=True).binary_memoryview)
+        else:
+            self.assertRaises(ValueError, CodecOptions,
+                              binary_memoryview=True)
+
+    def test_decode_fields(self):
+        self.assertRaises(TypeError, CodecOptions, decode_fields="a")
+        self.assertRaises(TypeError, CodecOptions, decode_fields=1)
+        self.assertRaises(TypeError, CodecOptions, decode_fields=[1])
+        self.assertRaises(ValueError, CodecOptions, decode_fields=["a..b"])
+        self.assertRaises(ValueError, CodecOptions, decode_fields=[""])
+        self.assertRaises(ValueError, CodecOptions,
+                          document_class=RawBSONDocument, decode_fields=["a"])
+        opts = CodecOptions(decode_fields=["b", "a.c", "a.c"])
+        self.assertEqual(frozenset([u("a.c"), u("b")]), opts.decode_fields)
+        self.assertEqual(opts, CodecOptions(decode_fields=("a.c", "b")))
+        self.assertIn("decode_fields=[%r, %r]" % (u("a.c"), u("b")),
+                      repr(opts))
+
+        doc = SON([
+            ("_id", 1),
+            ("skipped", {"big": ["x" * 100], "b": Binary(b"\x00" * 10)}),
+            ("a", SON([("b", 1), ("c", 2), ("d", {"e": 3, "f": 4})])),
+            ("list", [{"x": 1, "y": 2}, 3, {"y": 4}]),
+            ("code", Code("f", {"x": 1, "y": 2})),
+            ("re", Regex("a.*b", "i")),
+            ("oid", ObjectId()),
+            ("n", None)])
+        data = BSON.encode(doc)
+
+        def decode(*fields):
+            return BSON(data).decode(CodecOptions(decode_fields=fields))
+
+        self.assertEqual({"_id": 1}, decode("_id"))
+        self.assertEqual({}, decode("missing"))
+        self.assertEqual({"a": {"c": 2, "d": {"f": 4}}},
+                         decode("a.c", "a.d.f"))
+        # Selecting a field selects all of its fields.
+        self.assertEqual({"a": doc["a"]}, decode("a.c", "a"))
+        self.assertEqual({"a": doc["a"]}, decode("a", "a.c"))
+        # Dotted names apply to documents in arrays.
+        self.assertEqual({"list": [{"y": 2}, 3, {"y": 4}]}, decode("list.y"))
+        # Code scopes are not affected.
+        self.assertEqual({"code": doc["code"]}, decode("code.x"))
+        self.assertEqual({"n": None, "oid": doc["oid"]}, decode("n", "oid"))
+        self.assertEqual(
+            [{"n": None}, {"n": None}],
+            decode_all(data + data, CodecOptions(decode_fields=["n"])))
+
+        # Skipped elements are still checked.
+        bad = (b"\x17\x00\x00\x00\x02a\x00\x20\x00\x00\x00abc\x00"
+               b"\x10b\x00\x01\x00\x00\x00\x00")
+        self.assertRaises(InvalidBSON, BSON(bad).decode,
+                          CodecOptions(decode_fields=["b"]))
+
     def test_decode_all_defaults(self):
         # Test decode_all()'s default document_class is dict and tz_aware is
         # False. The default uuid_representation is PYTHON_LEGACY but this
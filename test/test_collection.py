@@ -24,10 +24,12 @@ from collections import defaultdict
 
 sys.path[0:0] = [""]
 
+from bson import BSON
 from bson.regex import Regex
 from bson.code import Code
 from bson.objectid import ObjectId
 from bson.py3compat import u, itervalues
+from bson.raw_bson import RawBSONDocument
 from bson.son import SON
 from pymongo import (ASCENDING, DESCENDING, GEO2D,
                      GEOHAYSTACK, GEOSPHERE, HASHED, TEXT)
@@ -101,6 +103,14 @@ class TestCollectionNoConnect(unittest.TestCase):
     def test_iteration(self):
         self.assertRaises(TypeError, next, self.db)
 
+    def test_find_one_many(self):
+        # Neither selects a server.
+        self.assertEqual([], self.db.test.find_one_many([]))
+        self.assertRaises(InvalidOperation, self.db.test.find_one_many,
+                          [{}], cursor_type=CursorType.EXHAUST)
+        self.assertRaises(InvalidOperation, self.db.test.find_one_many,
+                          [{}], None, 0, 0, False, CursorType.EXHAUST)
+
 
 class TestCollection(IntegrationTest):
 
@@ -610,6 +620,24 @@ class TestCollection(IntegrationTest):
         self.assertFalse(result.acknowledged)
         self.assertEqual(15, db.test.count())
 
+    def test_insert_raw_bson_document(self):
+        db = self.db
+        db.test.drop()
+
+        doc = RawBSONDocument(BSON.encode({"_id": 1, "x": [1, 2]}))
+        result = db.test.insert_one(doc)
+        self.assertEqual(1, result.inserted_id)
+        self.assertEqual({"_id": 1, "x": [1, 2]}, db.test.find_one())
+
+        docs = [RawBSONDocument(BSON.encode({"_id": i})) for i in (2, 3)]
+        docs.append(RawBSONDocument(BSON.encode({"y": 1})))
+        result = db.test.insert_many(docs)
+        self.assertEqual([2, 3, None], result.inserted_ids)
+        self.assertEqual(4, db.test.count())
+        # The server adds an _id to documents that don't have one.
+        self.assertTrue(isinstance(db.test.find_one({"y": 1})["_id"],
+                                   ObjectId))
+
     def test_delete_one(self):
         self.db.test.drop()
 
@@ -1353,6 +1381,27 @@ class TestCollection(IntegrationTest):
         self.assertEqual(1, db.test.find_one()["x"])
         self.assertEqual(2, db.test.find_one(skip=1, limit=2)["x"])
 
+    def test_find_one_many(self):
+        db = self.db
+        db.drop_collection("test")
+
+        ids = db.test.insert_many([{"x": i} for i in range(10)]).inserted_ids
+
+        self.assertEqual([], db.test.find_one_many([]))
+        docs = db.test.find_one_many([{"x": i} for i in range(9, -1, -1)])
+        self.assertEqual(list(range(9, -1, -1)), [doc["x"] for doc in docs])
+        self.assertEqual(ids, [doc["_id"] for doc in
+                               db.test.find_one_many(ids)])
+        self.assertEqual([None, 1, None],
+                         [doc and doc["x"] for doc in db.test.find_one_many(
+                             [{"x": 10}, {"x": 1}, ObjectId()])])
+        self.assertEqual([["_id"], ["_id"]],
+                         [list(doc) for doc in db.test.find_one_many(
+                             [{"x": 1}, {"x": 2}], projection=[])])
+        self.assertEqual([1, 1],
+                         [doc["x"] for doc in db.test.find_one_many(
+                             [{}, {}], skip=1, sort=[("x", 1)])])
+
     def test_find_with_sort(self):
         db = self.db
         db.drop_collection("test")
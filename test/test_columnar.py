@@ -0,0 +1,152 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the columnar module."""
+
+import datetime
+import sys
+
+sys.path[0:0] = [""]
+
+HAVE_NUMPY = True
+try:
+    import numpy
+except ImportError:
+    HAVE_NUMPY = False
+
+from bson import BSON, _decode_columns
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidBSON
+from bson.int64 import Int64
+from bson.objectid import ObjectId
+from bson.py3compat import u
+from bson.son import SON
+from bson.tz_util import utc
+from test import SkipTest, unittest
+
+if HAVE_NUMPY:
+    from bson.columnar import decode_columns
+
+
+def encode_all(docs):
+    return b"".join(BSON.encode(doc) for doc in docs)
+
+
+class TestDecodeColumns(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not HAVE_NUMPY:
+            raise SkipTest('NumPy not available.')
+
+    def test_numeric_columns(self):
+        dt = datetime.datetime(2015, 6, 1, 12, 30, 15, 123000)
+        data = encode_all([
+            SON([("i", 1), ("l", Int64(2)), ("d", 1.5), ("b", True),
+                 ("dt", dt), ("n", 1)]),
+            SON([("i", -1), ("l", 3), ("d", 2.5), ("b", False),
+                 ("dt", dt), ("n", 0.5)])])
+        columns = decode_columns(data)
+        self.assertEqual(["i", "l", "d", "b", "dt", "n"], list(columns))
+
+        self.assertEqual(numpy.int32, columns["i"].values.dtype)
+        self.assertEqual([1, -1], columns["i"].values.tolist())
+        self.assertEqual(numpy.int64, columns["l"].values.dtype)
+        self.assertEqual([2, 3], columns["l"].values.tolist())
+        self.assertEqual(numpy.float64, columns["d"].values.dtype)
+        self.assertEqual([1.5, 2.5], columns["d"].values.tolist())
+        self.assertEqual(numpy.bool_, columns["b"].values.dtype)
+        self.assertEqual([True, False], columns["b"].values.tolist())
+        self.assertEqual(numpy.dtype('datetime64[ms]'),
+                         columns["dt"].values.dtype)
+        self.assertEqual([dt, dt], columns["dt"].values.tolist())
+        # Integers and doubles are promoted to float64.
+        self.assertEqual(numpy.float64, columns["n"].values.dtype)
+        self.assertEqual([1.0, 0.5], columns["n"].values.tolist())
+        for column in columns.values():
+            self.assertEqual([True, True], column.mask.tolist())
+
+    def test_missing_values(self):
+        data = encode_all([{"a": 1}, {"b": u("x")}, {"a": None, "b": None},
+                           {"a": 2}])
+        columns = decode_columns(data)
+        self.assertEqual([1, 0, 0, 2], columns["a"].values.tolist())
+        self.assertEqual([True, False, False, True],
+                         columns["a"].mask.tolist())
+        self.assertEqual(object, columns["b"].values.dtype)
+        self.assertEqual([None, "x", None, None],
+                         columns["b"].values.tolist())
+        self.assertEqual([False, True, False, False],
+                         columns["b"].mask.tolist())
+
+    def test_object_columns(self):
+        oid = ObjectId()
+        dt = datetime.datetime(2015, 6, 1, tzinfo=utc)
+        data = encode_all([
+            {"a": oid}, {"a": {"x": [1, 2]}}, {"a": [3, 4]}, {"a": 5},
+            {"a": Int64(6)}, {"a": 1.5}, {"a": True}, {"a": dt}])
+        values = decode_columns(
+            data, codec_options=CodecOptions(tz_aware=True))["a"].values
+        self.assertEqual(object, values.dtype)
+        self.assertEqual(
+            [oid, {"x": [1, 2]}, [3, 4], 5, 6, 1.5, True, dt],
+            values.tolist())
+        self.assertIsInstance(values[4], Int64)
+        self.assertIsInstance(values[6], bool)
+
+    def test_fields(self):
+        data = encode_all([SON([("a", 1), ("b", 2), ("c", u("x"))])] * 3)
+        columns = decode_columns(data, ["c", "missing", "a", "c"])
+        self.assertEqual(["c", "missing", "a"], list(columns))
+        self.assertEqual(["x"] * 3, columns["c"].values.tolist())
+        self.assertEqual([False] * 3, columns["missing"].mask.tolist())
+        self.assertEqual([1] * 3, columns["a"].values.tolist())
+
+    def test_duplicate_keys(self):
+        # {"a": 1, "a": 2}
+        data = (b"\x13\x00\x00\x00\x10a\x00\x01\x00\x00\x00"
+                b"\x10a\x00\x02\x00\x00\x00\x00")
+        self.assertEqual([2], decode_columns(data)["a"].values.tolist())
+
+    def test_buffers(self):
+        data = encode_all([{"a": 1}, {"a": 2}])
+        for buf in (bytearray(data), memoryview(data)):
+            self.assertEqual([1, 2], decode_columns(buf)["a"].values.tolist())
+        self.assertEqual(SON(), decode_columns(b""))
+
+    def test_invalid(self):
+        data = encode_all([{"a": 1}, {"a": 2}])
+        self.assertRaises(InvalidBSON, decode_columns, data[:-1])
+        self.assertRaises(InvalidBSON, decode_columns, data[:-1] + b"\x01")
+        self.assertRaises(TypeError, decode_columns, data, codec_options={})
+
+
+class TestDecodeColumnsInternal(unittest.TestCase):
+    # _decode_columns doesn't need NumPy.
+
+    def test_decode_columns(self):
+        data = encode_all([SON([("a", 1), ("b", u("x"))]), {"a": 2.5}])
+        names, columns = _decode_columns(data, None, CodecOptions())
+        self.assertEqual(["a", "b"], names)
+        types, values, objects = columns[0]
+        self.assertEqual(bytearray(b"\x10\x01"), types)
+        self.assertEqual(16, len(values))
+        self.assertEqual([None, None], objects)
+        types, values, objects = columns[1]
+        self.assertEqual(bytearray(b"\x02\x00"), types)
+        self.assertEqual([u("x"), None], objects)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test wire protocol compression against a stub server."""
+
+import struct
+import sys
+import warnings
+import zlib
+
+sys.path[0:0] = [""]
+
+from bson import BSON, decode_all
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from bson.son import SON
+from pymongo import MongoClient, message
+from pymongo.compression_support import (CompressionSettings,
+                                         _HAVE_SNAPPY,
+                                         validate_compressors)
+from pymongo.errors import ConfigurationError
+from pymongo.pool import Pool, PoolOptions
+from pymongo.uri_parser import parse_uri
+from test import unittest, SkipTest
+from test.utils import StubServer, recv_message, reply_bytes, send_reply
+
+_OP_QUERY = 2004
+_OP_INSERT = 2002
+
+
+class CompressionServer(StubServer):
+    """Replies to each OP_QUERY with {"ok": 1} or an ismaster response,
+    compressed with zlib if the query was compressed.
+
+    Records (op_code, compressor_id, body) for each message it receives,
+    where compressor_id is None if the message wasn't compressed.
+    """
+
+    def __init__(self, compressors):
+        super(CompressionServer, self).__init__()
+        self.compressors = compressors
+        self.received = []
+
+    def handle(self, sock):
+        request_id, op_code, body = recv_message(sock)
+        compressor_id = None
+        if op_code == message._OP_COMPRESSED:
+            op_code, _, compressor_id = struct.unpack("<iiB", body[:9])
+            body = zlib.decompress(body[9:])
+        self.received.append((op_code, compressor_id, body))
+        if op_code != _OP_QUERY:
+            return
+
+        # Flags, the namespace, skip and limit come before the command.
+        cmd = decode_all(body[body.index(b"\x00", 4) + 9:])[0]
+        reply = {"ok": 1}
+        if "ismaster" in cmd:
+            reply.update(ismaster=True, maxWireVersion=3)
+            if self.compressors is not None:
+                reply["compression"] = self.compressors
+        elif "getlasterror" in cmd:
+            reply["err"] = None
+        if compressor_id is None:
+            send_reply(sock, request_id, [reply])
+        else:
+            reply = reply_bytes([reply])
+            compressed = zlib.compress(reply)
+            sock.sendall(struct.pack("<iiiiiiB", 25 + len(compressed), 1,
+                                     request_id, message._OP_COMPRESSED, 1,
+                                     len(reply), compressor_id) + compressed)
+
+
+class TestCompression(unittest.TestCase):
+
+    def connect(self, server_compressors, compressors=("zlib",)):
+        server = CompressionServer(server_compressors)
+        server.start()
+        settings = CompressionSettings(list(compressors))
+        pool = Pool(server.address,
+                    PoolOptions(connect_timeout=10, socket_timeout=10,
+                                compression_settings=settings))
+        sock_info = pool.connect()
+        self.addCleanup(server.join, 10)
+        self.addCleanup(sock_info.close)
+        return server, sock_info
+
+    def test_compressed_command(self):
+        server, sock_info = self.connect(["snappy", "zlib"])
+        self.assertEqual(2, sock_info.compression_context.compressor_id)
+
+        self.assertEqual({"ok": 1},
+                         sock_info.command("admin", SON([("ping", 1)])))
+        # The handshake isn't compressed, and offers our compressors.
+        op_code, compressor_id, body = server.received[0]
+        self.assertEqual((_OP_QUERY, None), (op_code, compressor_id))
+        self.assertIn(BSON.encode(SON([("ismaster", 1),
+                                       ("compression", ["zlib"])])), body)
+        op_code, compressor_id, body = server.received[1]
+        self.assertEqual((_OP_QUERY, 2), (op_code, compressor_id))
+        self.assertIn(BSON.encode({"ping": 1}), body)
+
+        # Authentication commands aren't compressed.
+        sock_info.command("admin", SON([("saslStart", 1)]))
+        self.assertEqual(None, server.received[2][1])
+
+    def test_compressed_messages(self):
+        server, sock_info = self.connect(["zlib"])
+        docs = [{"_id": i, "x": "y" * 100} for i in range(10)]
+        # An insert followed by a getlasterror command, each compressed on
+        # its own.
+        message._do_batched_insert("db.coll", docs, True, True, {}, False,
+                                   DEFAULT_CODEC_OPTIONS, sock_info)
+        (insert_op, insert_id, insert), (gle_op, gle_id, gle) = (
+            server.received[1:])
+        self.assertEqual((_OP_INSERT, 2), (insert_op, insert_id))
+        self.assertEqual(docs, decode_all(insert[12:]))
+        self.assertEqual((_OP_QUERY, 2), (gle_op, gle_id))
+
+    def test_compress_segments(self):
+        ctx = CompressionSettings(["zlib"]).get_compression_context(["zlib"])
+        _, first, _ = message.query(0, "db.$cmd", 0, -1, {"ping": 1},
+                                    None, DEFAULT_CODEC_OPTIONS)
+        _, second, _ = message.insert(
+            "db.coll", [{"x": "y" * 100}], False, False, {}, False,
+            DEFAULT_CODEC_OPTIONS)
+        data = first + second
+        expected = b""
+        for msg in (first, second):
+            length, request_id, _, op_code = struct.unpack("<iiii", msg[:16])
+            body = zlib.compress(msg[16:])
+            expected += struct.pack("<iiiiiiB", 25 + len(body), request_id,
+                                    0, 2012, op_code, length - 16, 2) + body
+        self.assertEqual(expected, b"".join(message._compress(data, ctx)))
+        # However the messages are split into segments, even through a
+        # header, the same compressed messages come out.
+        for split in (1, 10, 16, 20, len(first), len(first) + 5):
+            compressed = message._compress([data[:split], data[split:]], ctx)
+            self.assertEqual(expected, b"".join(compressed))
+        single_bytes = [data[i:i + 1] for i in range(len(data))]
+        self.assertEqual(
+            expected, b"".join(message._compress(single_bytes, ctx)))
+
+        # Segments inside a message body are compressed without being
+        # joined or copied.
+        class Recording(object):
+            compressor_id = 2
+
+            def __init__(self):
+                self.bodies = []
+
+            def compress(self, segments):
+                self.bodies.append(segments)
+                return ctx.compress(segments)
+
+        recording = Recording()
+        segments = [first[:20], first[20:], second[:16], second[16:30],
+                    second[30:]]
+        compressed = message._compress(segments, recording)
+        self.assertEqual(expected, b"".join(compressed))
+        self.assertEqual(2, len(recording.bodies))
+        self.assertEqual(segments[3:], recording.bodies[1])
+        self.assertIs(segments[3], recording.bodies[1][0])
+        self.assertIs(segments[4], recording.bodies[1][1])
+
+    def test_server_without_compression(self):
+        for server_compressors in (None, [], ["snappy"]):
+            server, sock_info = self.connect(server_compressors)
+            self.assertIsNone(sock_info.compression_context)
+            sock_info.command("admin", SON([("ping", 1)]))
+            self.assertEqual(None, server.received[1][1])
+
+    def test_snappy(self):
+        if not _HAVE_SNAPPY:
+            raise SkipTest("python-snappy isn't installed")
+        server, sock_info = self.connect(["snappy", "zlib"],
+                                         ["snappy", "zlib"])
+        self.assertEqual(1, sock_info.compression_context.compressor_id)
+
+
+class TestCompressionOptions(unittest.TestCase):
+
+    def test_validate_compressors(self):
+        self.assertEqual(["zlib"], validate_compressors("compressors",
+                                                        "zlib"))
+        self.assertEqual(["zlib"], validate_compressors("compressors",
+                                                        ["zlib"]))
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            self.assertEqual(["zlib"], validate_compressors(
+                "compressors", "foo, ZLIB"))
+            self.assertTrue(w)
+        self.assertRaises(TypeError, validate_compressors, "compressors", 1)
+
+    def test_client_options(self):
+        client = MongoClient(connect=False, compressors="zlib",
+                             zlibCompressionLevel=4)
+        settings = client._MongoClient__options.pool_options
+        settings = settings.compression_settings
+        self.assertEqual(["zlib"], settings.compressors)
+        self.assertEqual(4, settings.zlib_compression_level)
+
+        client = MongoClient(connect=False)
+        settings = client._MongoClient__options.pool_options
+        self.assertEqual([], settings.compression_settings.compressors)
+
+        self.assertRaises(ConfigurationError, MongoClient, connect=False,
+                          zlibCompressionLevel=10)
+
+    def test_uri(self):
+        options = parse_uri("mongodb://localhost/?compressors=zlib"
+                            "&zlibCompressionLevel=9")["options"]
+        self.assertEqual(["zlib"], options["compressors"])
+        self.assertEqual(9, options["zlibcompressionlevel"])
+
+
+if __name__ == "__main__":
+    unittest.main()
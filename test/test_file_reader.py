@@ -0,0 +1,163 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the file_reader module."""
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path[0:0] = [""]
+
+try:
+    from concurrent import futures
+    HAVE_FUTURES = True
+except ImportError:
+    HAVE_FUTURES = False
+
+from bson import BSON, decode_file_iter
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidBSON
+from bson.file_reader import BSONFileReader
+from bson.py3compat import u
+from bson.raw_bson import RawBSONDocument
+from test import SkipTest, unittest
+
+
+class TestBSONFileReader(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.docs = [{"_id": i, "s": u("x") * (i % 7)} for i in range(100)]
+        self.path = self.write_file(
+            "coll.bson", b"".join(BSON.encode(doc) for doc in self.docs))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as file_obj:
+            file_obj.write(data)
+        return path
+
+    def test_index(self):
+        with BSONFileReader(self.path) as reader:
+            self.assertEqual(self.path, reader.name)
+            self.assertEqual(100, len(reader))
+            self.assertEqual(101, len(reader.offsets))
+            self.assertEqual(0, reader.offsets[0])
+            self.assertEqual(os.path.getsize(self.path), reader.offsets[-1])
+            self.assertEqual(self.docs, list(reader))
+            with open(self.path, "rb") as file_obj:
+                self.assertEqual(list(decode_file_iter(file_obj)),
+                                 list(reader))
+
+        with open(self.path, "rb") as file_obj:
+            with BSONFileReader(file_obj) as reader:
+                self.assertEqual(self.path, reader.name)
+                self.assertEqual(self.docs, list(reader))
+
+        with BSONFileReader(self.write_file("empty.bson", b"")) as reader:
+            self.assertEqual(0, len(reader))
+            self.assertEqual([], list(reader))
+            self.assertEqual([], reader[:])
+
+    def test_random_access(self):
+        with BSONFileReader(self.path) as reader:
+            self.assertEqual(self.docs[0], reader[0])
+            self.assertEqual(self.docs[42], reader[42])
+            self.assertEqual(self.docs[-1], reader[-1])
+            self.assertRaises(IndexError, reader.__getitem__, 100)
+            self.assertRaises(IndexError, reader.__getitem__, -101)
+
+            self.assertEqual(self.docs[10:20], reader[10:20])
+            self.assertEqual(self.docs[-5:], reader[-5:])
+            self.assertEqual(self.docs[::7], reader[::7])
+            self.assertEqual(self.docs[50:10:-3], reader[50:10:-3])
+            self.assertEqual([], reader[20:10])
+            self.assertEqual(self.docs[90:], reader.decode_range(90, 200))
+
+        opts = CodecOptions(document_class=RawBSONDocument)
+        with BSONFileReader(self.path, opts) as reader:
+            self.assertEqual(BSON.encode(self.docs[3]), reader[3].raw)
+
+    def test_split(self):
+        with BSONFileReader(self.path) as reader:
+            for parts in (1, 3, 8, 100, 1000):
+                ranges = reader.split(parts)
+                self.assertTrue(len(ranges) <= parts)
+                self.assertEqual(0, ranges[0][0])
+                self.assertEqual(100, ranges[-1][1])
+                for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(stop, start)
+                docs = []
+                for start, stop in ranges:
+                    self.assertTrue(start < stop)
+                    docs.extend(reader.decode_range(start, stop))
+                self.assertEqual(self.docs, docs)
+            self.assertRaises(ValueError, reader.split, 0)
+
+    def test_decode_parallel(self):
+        if not HAVE_FUTURES:
+            raise SkipTest("concurrent.futures is not available")
+        with BSONFileReader(self.path) as reader:
+            with futures.ThreadPoolExecutor(2) as executor:
+                self.assertEqual(self.docs,
+                                 list(reader.decode_parallel(executor)))
+                self.assertEqual(self.docs,
+                                 list(reader.decode_parallel(executor, 3)))
+            with futures.ProcessPoolExecutor(2) as executor:
+                self.assertEqual(self.docs,
+                                 list(reader.decode_parallel(executor, 5)))
+
+    def test_close(self):
+        reader = BSONFileReader(self.path)
+        self.assertFalse(reader.closed)
+        # A live iterator keeps the file mapped until it's freed.
+        it = iter(reader)
+        self.assertEqual(self.docs[0], next(it))
+        reader.close()
+        self.assertTrue(reader.closed)
+        self.assertEqual(self.docs[1:], list(it))
+        reader.close()
+
+        for operation in (len, iter, lambda r: r[0], lambda r: r[:2],
+                          lambda r: r.decode_range(0, 2),
+                          lambda r: r.split(2)):
+            self.assertRaises(ValueError, operation, reader)
+
+        with BSONFileReader(self.path) as reader:
+            it = iter(reader)
+            next(it)
+        self.assertTrue(reader.closed)
+        self.assertEqual(self.docs[1:], list(it))
+
+        with BSONFileReader(self.write_file("empty.bson", b"")) as reader:
+            pass
+        self.assertRaises(ValueError, len, reader)
+
+    def test_invalid(self):
+        data = BSON.encode({"a": 1})
+        for bad in (data + b"\x05\x00", data + b"\x05\x00\x00\x00",
+                    data[:-1] + b"\x01", b"\x04\x00\x00\x00\x00"):
+            self.assertRaises(InvalidBSON, BSONFileReader,
+                              self.write_file("bad.bson", bad))
+        self.assertRaises(TypeError, BSONFileReader, self.path,
+                          codec_options={})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,15 +22,20 @@ import uuid
 
 sys.path[0:0] = [""]
 
-from bson import json_util, EPOCH_AWARE
-from bson.binary import Binary, MD5_SUBTYPE, USER_DEFINED_SUBTYPE
+from bson import json_util, BSON, EPOCH_AWARE
+from bson.binary import (Binary, MD5_SUBTYPE, USER_DEFINED_SUBTYPE,
+                         CSHARP_LEGACY, JAVA_LEGACY)
 from bson.code import Code
+from bson.codec_options import CodecOptions
 from bson.dbref import DBRef
+from bson.errors import InvalidBSON
 from bson.int64 import Int64
 from bson.max_key import MaxKey
 from bson.min_key import MinKey
 from bson.objectid import ObjectId
+from bson.py3compat import u, HAVE_MEMORYVIEW
 from bson.regex import Regex
+from bson.son import SON
 from bson.timestamp import Timestamp
 from bson.tz_util import utc
 
@@ -38,6 +43,11 @@ from test import unittest, IntegrationTest
 
 PY3 = sys.version_info[0] == 3
 
+if PY3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
 
 class TestJsonUtil(unittest.TestCase):
     def round_tripped(self, doc):
@@ -216,6 +226,118 @@ class TestJsonUtil(unittest.TestCase):
         self.assertEqual(json_util.loads(json)['weight'],
                          Int64(65535))
 
+    def test_dump_bson(self):
+        doc = SON([
+            ("str", u("a\u00e9\"\\\n\x01\x7f\U0001f600")),
+            ("int", -5), ("long", Int64(-2 ** 63)),
+            ("doubles", [1e100, 0.1, -0.0, float("inf")]),
+            ("bools", [True, False]), ("null", None),
+            ("date", datetime.datetime(1960, 1, 1, 0, 0, 0, 5000)),
+            ("oid", ObjectId()), ("regex", Regex("a.b", "xmsi")),
+            ("bin", Binary(b"\x00\x01\xff")),
+            ("old", Binary(b"abcd", 2)),
+            ("uuid", uuid.uuid4()),
+            ("code", Code("f()")), ("scope", Code("g()", {"x": [1, {}]})),
+            ("ts", Timestamp(5, 7)), ("min", MinKey()), ("max", MaxKey()),
+            ("sub", SON([("a", []), ("b", {"c": u("\u1234")})]))])
+        for uuid_rep in (3, CSHARP_LEGACY, JAVA_LEGACY):
+            opts = CodecOptions(document_class=SON,
+                                uuid_representation=uuid_rep)
+            data = BSON.encode(doc, codec_options=opts)
+            out = StringIO()
+            json_util.dump_bson(data, out, opts)
+            self.assertEqual(
+                json_util.dumps(BSON(data).decode(opts)) + "\n",
+                out.getvalue())
+
+    def test_dump_bson_batch(self):
+        docs = [{"a": i} for i in range(3)]
+        data = b"".join(BSON.encode(doc) for doc in docs)
+        buffers = [data, bytearray(data)]
+        if HAVE_MEMORYVIEW:
+            buffers.append(memoryview(data))
+        for buf in buffers:
+            out = StringIO()
+            json_util.dump_bson(buf, out)
+            self.assertEqual('{"a": 0}\n{"a": 1}\n{"a": 2}\n',
+                             out.getvalue())
+
+        out = StringIO()
+        json_util.dump_bson(b"", out)
+        self.assertEqual("", out.getvalue())
+
+        # Embedded DBRef documents aren't reordered.
+        out = StringIO()
+        json_util.dump_bson(
+            BSON.encode({"ref": SON([("$id", 1), ("$ref", "c")])}), out)
+        self.assertEqual('{"ref": {"$id": 1, "$ref": "c"}}\n',
+                         out.getvalue())
+
+        # Code in a scope keeps its own scope, unlike with dumps.
+        doc = {"c": Code("f", {"g": Code("h", {"x": 1}), "i": Code("j")})}
+        out = StringIO()
+        json_util.dump_bson(BSON.encode(doc), out)
+        self.assertEqual(doc, json_util.loads(out.getvalue()))
+        self.assertEqual({"c": Code("f", {"g": "h", "i": "j"})},
+                         json_util.loads(json_util.dumps(doc)))
+
+    def test_dump_bson_invalid(self):
+        data = BSON.encode({"a": [1, {"b": u("x")}]})
+        self.assertRaises(InvalidBSON, json_util.dump_bson,
+                          data[:-1], StringIO())
+        self.assertRaises(InvalidBSON, json_util.dump_bson,
+                          data[:-1] + b"\x01", StringIO())
+        self.assertRaises(InvalidBSON, json_util.dump_bson,
+                          data + b"\x00\x00\x00\x00", StringIO())
+        self.assertRaises(InvalidBSON, json_util.dump_bson,
+                          data.replace(b"\x02b", b"\x06b"), StringIO())
+        self.assertRaises(TypeError, json_util.dump_bson,
+                          data, StringIO(), codec_options={})
+
+    def test_object_hook(self):
+        # Dicts with more than one Extended JSON key are converted like
+        # before, whatever the order of their keys.
+        oid = ObjectId()
+        self.assertEqual(oid, json_util.object_hook(
+            SON([("$ref", "c"), ("$oid", str(oid))])))
+        self.assertEqual(Regex("a", re.I), json_util.object_hook(
+            SON([("$options", "i"), ("$regex", "a")])))
+        self.assertEqual(Binary(b"x", 5), json_util.object_hook(
+            SON([("$type", "05"), ("$binary", "eA==")])))
+        self.assertEqual({"$options": "i"},
+                         json_util.object_hook({"$options": "i"}))
+        self.assertEqual({"a": 1, "$b": 2},
+                         json_util.object_hook({"a": 1, "$b": 2}))
+
+    def test_iter_loads(self):
+        docs = [{"_id": ObjectId(), "n": i, "t": Timestamp(i, 1)}
+                for i in range(5)]
+        text = "\n\n".join(json_util.dumps(doc) for doc in docs) + "\n"
+        self.assertEqual(docs, list(json_util.iter_loads(StringIO(text))))
+        self.assertEqual(
+            [docs[:2], docs[2:4], docs[4:]],
+            list(json_util.iter_loads(StringIO(text), batch_size=2)))
+        self.assertEqual(
+            docs, list(json_util.iter_loads(text.encode().splitlines())))
+        self.assertEqual([], list(json_util.iter_loads(StringIO(""))))
+        self.assertRaises(ValueError, list,
+                          json_util.iter_loads(StringIO(text), batch_size=0))
+        self.assertRaises(ValueError, list,
+                          json_util.iter_loads(StringIO("{\n}\n")))
+
+        # Other arguments are passed to the JSONDecoder.
+        doc, = json_util.iter_loads(StringIO('{"x": 1.5}'),
+                                    parse_float=str)
+        self.assertEqual({"x": "1.5"}, doc)
+
+    def test_dump_bson_iter_loads(self):
+        docs = [SON([("_id", ObjectId()), ("code", Code("f", {"y": 1})),
+                     ("a", [Int64(2 ** 40), Timestamp(5, 7)])])] * 3
+        out = StringIO()
+        json_util.dump_bson(b"".join(BSON.encode(doc) for doc in docs), out)
+        out.seek(0)
+        self.assertEqual(docs, list(json_util.iter_loads(out)))
+
 
 class TestJsonUtilRoundtrip(IntegrationTest):
     def test_cursor(self):
@@ -22,10 +22,12 @@ import warnings
 
 sys.path[0:0] = [""]
 
+from bson import BSON
 from bson.codec_options import CodecOptions
 from bson.dbref import DBRef
 from bson.objectid import ObjectId
 from bson.py3compat import u
+from bson.raw_bson import RawBSONDocument
 from bson.son import SON
 from pymongo import ASCENDING, DESCENDING
 from pymongo.errors import (ConfigurationError,
@@ -142,6 +144,25 @@ class TestLegacy(IntegrationTest):
         qcheck.check_unittest(self, remove_insert_find_one,
                               qcheck.gen_mongo_dict(3))
 
+    def test_insert_raw_bson_document(self):
+        # Raw documents are inserted without manipulation.
+        db = self.db
+        db.test.drop()
+        self.assertEqual(None, db.test.insert(
+            RawBSONDocument(BSON.encode({"x": 1}))))
+        self.assertEqual(1, db.test.insert(
+            RawBSONDocument(BSON.encode({"_id": 1, "x": 2}))))
+        ids = db.test.insert([RawBSONDocument(BSON.encode({"_id": 2})),
+                              RawBSONDocument(BSON.encode({"y": 1})),
+                              {"z": 1}])
+        self.assertEqual(2, ids[0])
+        self.assertEqual(None, ids[1])
+        self.assertTrue(isinstance(ids[2], ObjectId))
+        self.assertEqual(5, db.test.count())
+        # The server adds an _id to documents that don't have one.
+        self.assertTrue(isinstance(db.test.find_one({"x": 1})["_id"],
+                                   ObjectId))
+
     def test_generator_insert(self):
         # Only legacy insert currently supports insert from a generator.
         db = self.db
@@ -0,0 +1,221 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test building batched write messages without a server."""
+
+import socket
+import struct
+import sys
+
+sys.path[0:0] = [""]
+
+from bson import BSON, decode_all
+from bson.codec_options import CodecOptions, DEFAULT_CODEC_OPTIONS
+from bson.son import SON
+from pymongo import message
+from pymongo.errors import DocumentTooLarge, InvalidOperation
+from pymongo.network import send_message
+from test import unittest
+
+
+def _join(msg):
+    """The bytes of a message passed to legacy_write or write_command."""
+    if isinstance(msg, list):
+        return b"".join(bytes(segment) for segment in msg)
+    return bytes(msg)
+
+
+class MockSocketInfo(object):
+    """Records the messages sent by the batched write helpers."""
+
+    def __init__(self, max_message_size=48000000, max_write_batch_size=1000):
+        self.max_bson_size = 16 * 1024 * 1024
+        self.max_message_size = max_message_size
+        self.max_write_batch_size = max_write_batch_size
+        self.sent = []
+
+    def legacy_write(self, request_id, msg, max_doc_size, with_last_error):
+        self.sent.append((request_id, _join(msg)))
+
+    def write_command(self, request_id, msg):
+        self.sent.append((request_id, _join(msg)))
+        return {"ok": 1}
+
+
+def _parse(request_id, data, op_code):
+    """Check a message's header and return its body."""
+    length, header_request_id, response_to, header_op_code = struct.unpack(
+        "<iiii", data[:16])
+    assert length == len(data)
+    assert header_request_id == request_id
+    assert response_to == 0
+    assert header_op_code == op_code
+    return data[16:]
+
+
+class TestBatchedWrites(unittest.TestCase):
+
+    def test_batched_write_command(self):
+        docs = [{"_id": i, "x": "y" * 100} for i in range(25)]
+        sock_info = MockSocketInfo(max_write_batch_size=10)
+        command = SON([("insert", "coll"), ("ordered", True)])
+        results = message._do_batched_write_command(
+            "db.$cmd", message._INSERT, command, docs, True,
+            DEFAULT_CODEC_OPTIONS, sock_info)
+        self.assertEqual([0, 10, 20], [offset for offset, _ in results])
+
+        sent = []
+        for request_id, data in sock_info.sent:
+            body = _parse(request_id, data, 2004)
+            # Flags, namespace, skip and limit.
+            self.assertEqual(b"\x00\x00\x00\x00db.$cmd\x00", body[:12])
+            self.assertEqual(struct.pack("<ii", 0, -1), body[12:20])
+            cmd, = decode_all(body[20:], CodecOptions(document_class=SON))
+            self.assertEqual(["insert", "ordered", "documents"], list(cmd))
+            sent.extend(cmd["documents"])
+        self.assertEqual(docs, sent)
+
+        self.assertRaises(InvalidOperation,
+                          message._do_batched_write_command,
+                          "db.$cmd", message._INSERT, command, [], True,
+                          DEFAULT_CODEC_OPTIONS, sock_info)
+        big = {"x": "y" * (sock_info.max_bson_size + 16382)}
+        self.assertRaises(DocumentTooLarge,
+                          message._do_batched_write_command,
+                          "db.$cmd", message._INSERT, command, [big], True,
+                          DEFAULT_CODEC_OPTIONS, sock_info)
+
+    def test_batched_insert(self):
+        docs = [{"_id": i, "x": "y" * 100} for i in range(50)]
+        size = len(BSON.encode(docs[0]))
+        sock_info = MockSocketInfo(max_message_size=size * 20)
+        message._do_batched_insert("db.coll", docs, True, True, {}, False,
+                                   DEFAULT_CODEC_OPTIONS, sock_info)
+
+        sent = []
+        for _, data in sock_info.sent:
+            length, request_id = struct.unpack("<ii", data[:8])
+            insert = data[:length]
+            body = _parse(request_id, insert, 2002)
+            self.assertEqual(b"\x00\x00\x00\x00db.coll\x00", body[:12])
+            sent.extend(decode_all(body[12:]))
+            # Followed by a getlasterror command.
+            gle = data[length:]
+            _, gle_request_id = struct.unpack("<ii", gle[:8])
+            self.assertEqual(b"db.$cmd\x00", _parse(gle_request_id, gle,
+                                                    2004)[4:12])
+        self.assertTrue(len(sock_info.sent) > 1)
+        self.assertEqual(docs, sent)
+
+        self.assertRaises(InvalidOperation, message._do_batched_insert,
+                          "db.coll", [], True, True, {}, False,
+                          DEFAULT_CODEC_OPTIONS, sock_info)
+
+    def test_messages_outlive_the_call(self):
+        # A socket may keep the message it is given, e.g. to send it later.
+        class KeepingSocketInfo(MockSocketInfo):
+            def write_command(self, request_id, msg):
+                self.sent.append((request_id, msg))
+                return {"ok": 1}
+
+        docs = [{"_id": i, "x": "y" * 100} for i in range(25)]
+        sock_info = KeepingSocketInfo(max_write_batch_size=10)
+        command = SON([("insert", "coll"), ("ordered", True)])
+        message._do_batched_write_command(
+            "db.$cmd", message._INSERT, command, docs, True,
+            DEFAULT_CODEC_OPTIONS, sock_info)
+
+        sent = []
+        for request_id, msg in sock_info.sent:
+            body = _parse(request_id, _join(msg), 2004)
+            sent.extend(decode_all(body[20:])[0]["documents"])
+        self.assertEqual(docs, sent)
+
+    def test_documents_are_not_joined(self):
+        class SegmentsSocketInfo(MockSocketInfo):
+            def legacy_write(self, request_id, msg, max_doc_size,
+                             with_last_error):
+                self.sent.append(msg)
+
+            def write_command(self, request_id, msg):
+                self.sent.append(msg)
+                return {"ok": 1}
+
+        docs = [{"_id": i, "x": "y" * 100} for i in range(5)]
+        encoded = [BSON.encode(doc) for doc in docs]
+        sock_info = SegmentsSocketInfo()
+        command = SON([("insert", "coll"), ("ordered", True)])
+        message._do_batched_write_command(
+            "db.$cmd", message._INSERT, command, docs, True,
+            DEFAULT_CODEC_OPTIONS, sock_info)
+        message._do_batched_insert("db.coll", docs, True, True, {}, False,
+                                   DEFAULT_CODEC_OPTIONS, sock_info)
+        for msg in sock_info.sent:
+            self.assertIsInstance(msg, list)
+            segments = [bytes(segment) for segment in msg]
+            for data in encoded:
+                self.assertIn(data, segments)
+
+
+class TestSendMessage(unittest.TestCase):
+
+    def test_send_message(self):
+        sock, peer = socket.socketpair()
+        try:
+            segments = [b"abc", b"def", b"", b"g" * 1000]
+            send_message(sock, segments)
+            send_message(sock, b"hij")
+            expected = b"abcdef" + b"g" * 1000 + b"hij"
+            received = b""
+            while len(received) < len(expected):
+                received += peer.recv(4096)
+            self.assertEqual(expected, received)
+        finally:
+            sock.close()
+            peer.close()
+
+    def test_partial_sends(self):
+        class PartialSocket(object):
+            """Sends at most 3 bytes from at most 2 buffers at a time."""
+            def __init__(self):
+                self.data = b""
+
+            def sendmsg(self, buffers):
+                data = b"".join(buf.tobytes() for buf in buffers[:2])[:3]
+                self.data += data
+                return len(data)
+
+        sock = PartialSocket()
+        segments = [b"abcd", b"", b"e", b"fghijklm", b"n" * 5000]
+        send_message(sock, segments)
+        self.assertEqual(b"".join(segments), sock.data)
+
+    def test_no_sendmsg(self):
+        class SSLLikeSocket(object):
+            def __init__(self):
+                self.data = b""
+
+            def sendmsg(self, buffers):
+                raise NotImplementedError
+
+            def sendall(self, data):
+                self.data += data
+
+        sock = SSLLikeSocket()
+        send_message(sock, [b"ab", b"cd"])
+        self.assertEqual(b"abcd", sock.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
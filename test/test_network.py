@@ -0,0 +1,102 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the network module without a server."""
+
+import struct
+import sys
+
+sys.path[0:0] = [""]
+
+from bson import BSON
+from bson.py3compat import HAVE_MEMORYVIEW
+from pymongo import helpers, network
+from pymongo.errors import AutoReconnect
+from pymongo.network import receive_message, receive_reply
+from test import unittest
+
+
+def _reply(request_id, docs):
+    """An OP_REPLY message responding to `request_id`."""
+    body = (struct.pack("<iqii", 0, 0, 0, len(docs)) +
+            b"".join(BSON.encode(doc) for doc in docs))
+    return struct.pack("<iiii", 16 + len(body), 1, request_id, 1) + body
+
+
+class ChunkedSocket(object):
+    """Returns the data it's given in chunks of at most `chunk_size` bytes."""
+
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.position = 0
+        self.chunk_size = chunk_size
+
+    def recv_into(self, buf):
+        chunk = self.data[self.position:self.position + self.chunk_size]
+        chunk = chunk[:len(buf)]
+        buf[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def recv(self, length):
+        chunk = self.data[self.position:self.position + self.chunk_size]
+        chunk = chunk[:length]
+        self.position += len(chunk)
+        return chunk
+
+
+class TestReceiveMessage(unittest.TestCase):
+
+    def test_receive_message(self):
+        docs = [{"_id": i, "x": "y" * i} for i in range(100)]
+        message = _reply(42, docs)
+        for chunk_size in (1, 7, 4096, len(message)):
+            sock = ChunkedSocket(message, chunk_size)
+            data = receive_message(sock, 1, 42)
+            if HAVE_MEMORYVIEW:
+                self.assertIsInstance(data, bytearray)
+            self.assertEqual(message[16:], data)
+            self.assertEqual(len(message), sock.position)
+            self.assertEqual(docs, helpers._unpack_response(data)["data"])
+
+        # Exhaust cursors don't check the response id.
+        self.assertEqual(message[16:],
+                         receive_message(ChunkedSocket(message, 100), 1, None))
+        self.assertEqual((42, message[16:]),
+                         receive_reply(ChunkedSocket(message, 100), 1))
+
+    def test_receive_message_errors(self):
+        message = _reply(42, [{}])
+        self.assertRaises(AssertionError, receive_message,
+                          ChunkedSocket(message, 100), 1, 43)
+        self.assertRaises(AssertionError, receive_message,
+                          ChunkedSocket(message, 100), 2004, 42)
+        for end in (0, 10, 16, len(message) - 1):
+            self.assertRaises(AutoReconnect, receive_message,
+                              ChunkedSocket(message[:end], 100), 1, 42)
+
+    def test_recv_data_on_socket(self):
+        # Python 2.6 reads with recv instead of recv_into.
+        message = _reply(42, [{"x": "y" * 1000}])
+        for chunk_size in (1, 7, len(message)):
+            sock = ChunkedSocket(message, chunk_size)
+            self.assertEqual(message[:100],
+                             network._recv_data_on_socket(sock, 100))
+            self.assertEqual(100, sock.position)
+        self.assertRaises(AutoReconnect, network._recv_data_on_socket,
+                          ChunkedSocket(message[:50], 7), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
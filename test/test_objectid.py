@@ -92,6 +92,19 @@ class TestObjectId(unittest.TestCase):
     def test_pid(self):
         self.assertTrue(oid_generated_on_client(ObjectId()))
 
+    def test_generate_many(self):
+        oids = ObjectId.generate_many(3)
+        self.assertEqual(3, len(oids))
+        self.assertEqual(3, len(set(oids)))
+        for oid in oids:
+            self.assertIsInstance(oid, ObjectId)
+            self.assertTrue(oid_generated_on_client(oid))
+            self.assertEqual(oids[0].binary[:9], oid.binary[:9])
+        counters = [int(str(oid)[18:], 16) for oid in oids]
+        self.assertEqual((counters[0] + 1) % 0xFFFFFF, counters[1])
+        self.assertEqual((counters[1] + 1) % 0xFFFFFF, counters[2])
+        self.assertEqual([], ObjectId.generate_many(0))
+
     def test_generation_time(self):
         d1 = datetime.datetime.utcnow()
         d2 = ObjectId().generation_time
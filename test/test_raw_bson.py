@@ -0,0 +1,150 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the raw_bson module."""
+
+import sys
+
+sys.path[0:0] = [""]
+
+import bson
+from bson import BSON, decode_all, decode_iter
+from bson.code import Code
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidBSON, InvalidDocument
+from bson.objectid import ObjectId
+from bson.py3compat import b, u
+from bson.raw_bson import RawBSONDocument, DEFAULT_RAW_BSON_OPTIONS
+from bson.son import SON
+from test import unittest
+
+
+class TestRawBSONDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.oid = ObjectId()
+        self.document = SON([('_id', self.oid),
+                             ('name', u('Sherlock')),
+                             ('address', SON([('street', u('Baker St')),
+                                              ('number', 221)])),
+                             ('tags', [1, SON([('a', 2)])])])
+        self.bson_bytes = BSON.encode(self.document)
+
+    def test_decode(self):
+        raw = BSON(self.bson_bytes).decode(DEFAULT_RAW_BSON_OPTIONS)
+        self.assertIsInstance(raw, RawBSONDocument)
+        self.assertEqual(self.bson_bytes, raw.raw)
+        self.assertEqual(self.oid, raw['_id'])
+        self.assertEqual('Sherlock', raw['name'])
+        self.assertEqual(['_id', 'name', 'address', 'tags'], list(raw))
+        self.assertEqual(4, len(raw))
+        self.assertTrue('name' in raw)
+        self.assertFalse('foo' in raw)
+        self.assertRaises(KeyError, raw.__getitem__, 'foo')
+        self.assertEqual(None, raw.get('foo'))
+        self.assertEqual(BSON(self.bson_bytes).decode(), raw)
+
+    def test_decode_all(self):
+        docs = decode_all(self.bson_bytes * 2, DEFAULT_RAW_BSON_OPTIONS)
+        self.assertEqual(2, len(docs))
+        for doc in docs:
+            self.assertIsInstance(doc, RawBSONDocument)
+            self.assertEqual(self.bson_bytes, doc.raw)
+        docs = list(decode_iter(self.bson_bytes * 2, DEFAULT_RAW_BSON_OPTIONS))
+        self.assertEqual(docs[0], docs[1])
+
+    def test_embedded_documents_stay_raw(self):
+        raw = RawBSONDocument(self.bson_bytes)
+        address = raw['address']
+        self.assertIsInstance(address, RawBSONDocument)
+        self.assertEqual(BSON.encode(self.document['address']), address.raw)
+        self.assertEqual(221, address['number'])
+        self.assertIsInstance(raw['tags'][1], RawBSONDocument)
+        self.assertEqual(2, raw['tags'][1]['a'])
+
+    def test_code_with_scope(self):
+        data = BSON.encode({'code': Code('return a', {'a': 1})})
+        code = RawBSONDocument(data)['code']
+        self.assertEqual(Code('return a', {'a': 1}), code)
+
+    def test_fields_decoded_on_access(self):
+        data = BSON.encode(SON([('good', 1), ('bad', u('abc'))]))
+        raw = RawBSONDocument(data.replace(b('abc'), b('\xff\xfe\xfd')))
+        # Only the invalid field fails to decode.
+        self.assertEqual(1, raw['good'])
+        self.assertRaises(InvalidBSON, raw.__getitem__, 'bad')
+
+    def test_duplicate_keys(self):
+        data = (BSON.encode(SON([('a', 1), ('b', 2)]))[:-1] +
+                BSON.encode({'a': 3})[4:])
+        data = BSON(b('\x1a\x00\x00\x00') + data[4:])
+        raw = RawBSONDocument(data)
+        self.assertEqual(['a', 'b'], list(raw))
+        self.assertEqual(3, raw['a'])
+        self.assertEqual(data.decode(), raw)
+
+    def test_invalid_bson(self):
+        self.assertRaises(TypeError, RawBSONDocument, u('not bytes'))
+        self.assertRaises(InvalidBSON, RawBSONDocument, b('\x05\x00'))
+        self.assertRaises(InvalidBSON, RawBSONDocument, self.bson_bytes[:-1])
+        self.assertRaises(InvalidBSON, RawBSONDocument,
+                          self.bson_bytes[:-1] + b('\x01'))
+        # A double element that runs past the end of the document.
+        bad_length = b('\x0c\x00\x00\x00\x01a\x00\x01\x00\x00\x00\x00')
+        raw = RawBSONDocument(bad_length)
+        self.assertRaises(InvalidBSON, len, raw)
+        self.assertRaises(InvalidBSON, raw.__getitem__, 'a')
+
+    def test_codec_options(self):
+        self.assertRaises(TypeError, RawBSONDocument, self.bson_bytes,
+                          CodecOptions())
+        options = CodecOptions(document_class=RawBSONDocument, tz_aware=True)
+        raw = RawBSONDocument(self.bson_bytes, options)
+        self.assertEqual(options,
+                         BSON(self.bson_bytes).decode(options)['address']
+                         ._RawBSONDocument__codec_options)
+        self.assertEqual(self.oid.generation_time, raw['_id'].generation_time)
+
+    def test_equality(self):
+        raw = RawBSONDocument(self.bson_bytes)
+        self.assertEqual(RawBSONDocument(self.bson_bytes), raw)
+        self.assertNotEqual(RawBSONDocument(BSON.encode({})), raw)
+        self.assertEqual(self.document.to_dict(), raw)
+
+    def test_encode(self):
+        raw = RawBSONDocument(self.bson_bytes)
+        # Encoded by copying, even with check_keys.
+        self.assertEqual(self.bson_bytes,
+                         bson._dict_to_bson(raw, True, CodecOptions()))
+        self.assertEqual(self.bson_bytes, BSON.encode(raw, check_keys=True))
+
+    def test_embed(self):
+        inner = SON([("a", 1), ("$b", [1, 2])])
+        expected = BSON.encode(SON([("x", 1), ("doc", inner), ("y", 2)]))
+        for value in (BSON.encode(inner),
+                      RawBSONDocument(BSON.encode(inner))):
+            envelope = BSON.encode(SON([("x", 1), ("doc", value), ("y", 2)]))
+            self.assertEqual(expected, envelope)
+            self.assertEqual([inner],
+                             BSON.encode({"list": [value]}).decode()["list"])
+
+        self.assertRaises(InvalidDocument, BSON.encode, {"a": BSON(b"")})
+        self.assertRaises(InvalidDocument, BSON.encode,
+                          {"a": BSON(b"\x07\x00\x00\x00\x00\x00")})
+        self.assertRaises(InvalidDocument, BSON.encode,
+                          {"a": BSON(b"\x05\x00\x00\x00\x01")})
+
+
+if __name__ == "__main__":
+    unittest.main()
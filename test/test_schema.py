@@ -0,0 +1,150 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the schema module."""
+
+import datetime
+import sys
+
+sys.path[0:0] = [""]
+
+from bson import BSON
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidBSON, InvalidDocument
+from bson.int64 import Int64
+from bson.objectid import ObjectId
+from bson.py3compat import text_type, u
+from bson.raw_bson import RawBSONDocument
+from bson.schema import Schema
+from bson.son import SON
+from test import unittest
+
+
+class TestSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = Schema([("_id", ObjectId),
+                              ("kind", text_type),
+                              ("count", int),
+                              ("total", Int64),
+                              ("ratio", float),
+                              ("ok", bool),
+                              ("at", datetime.datetime),
+                              ("tags", object)])
+        self.doc = SON([("_id", ObjectId()),
+                        ("kind", u("click")),
+                        ("count", 42),
+                        ("total", Int64(7)),
+                        ("ratio", 0.5),
+                        ("ok", True),
+                        ("at", datetime.datetime(2015, 1, 2, 3, 4, 5)),
+                        ("tags", [u("a"), {"b": None}])])
+
+    def test_encode(self):
+        # Encoded like BSON.encode, in the schema's field order.
+        self.assertEqual(BSON.encode(self.doc), self.schema.encode(self.doc))
+        self.assertEqual(BSON.encode(self.doc),
+                         self.schema.encode(dict(self.doc)))
+
+        # Values of other types are encoded as usual.
+        doc = SON(self.doc)
+        doc["count"] = 2 ** 40
+        doc["total"] = 7
+        doc["ratio"] = 1
+        doc["ok"] = None
+        doc["kind"] = Int64(3)
+        self.assertEqual(BSON.encode(doc), self.schema.encode(doc))
+
+    def test_encode_id_first(self):
+        # Like BSON.encode, _id is encoded first wherever it's declared.
+        fields = self.schema.fields
+        schema = Schema(fields[1:] + fields[:1])
+        doc = SON(list(self.doc.items())[1:] + list(self.doc.items())[:1])
+        data = schema.encode(doc)
+        self.assertEqual(BSON.encode(doc), data)
+        self.assertEqual(BSON.encode(self.doc), data)
+        self.assertEqual(dict(self.doc), schema.decode(data))
+        self.assertEqual(fields[1:] + fields[:1], schema.fields)
+
+    def test_encode_mismatch(self):
+        doc = dict(self.doc)
+        del doc["kind"]
+        self.assertRaises(InvalidDocument, self.schema.encode, doc)
+        doc["other"] = 1
+        self.assertRaises(InvalidDocument, self.schema.encode, doc)
+        doc = dict(self.doc, extra=1)
+        self.assertRaises(InvalidDocument, self.schema.encode, doc)
+        doc = dict(self.doc, count=2 ** 64)
+        self.assertRaises(OverflowError, self.schema.encode, doc)
+        self.assertRaises(TypeError, self.schema.encode, 1)
+
+    def test_check_keys(self):
+        self.assertRaises(InvalidDocument, Schema, [("$a", int)],
+                          check_keys=True)
+        self.assertRaises(InvalidDocument, Schema, [("a.b", int)],
+                          check_keys=True)
+        Schema([("$a", int)])
+        schema = Schema([("a", object)], check_keys=True)
+        self.assertRaises(InvalidDocument, schema.encode, {"a": {"$b": 1}})
+        schema = Schema([("a", object)])
+        self.assertEqual(BSON.encode({"a": {"$b": 1}}),
+                         schema.encode({"a": {"$b": 1}}))
+
+    def test_invalid_fields(self):
+        self.assertRaises(ValueError, Schema, [("a", int), ("a", float)])
+        self.assertRaises(TypeError, Schema, [("a", 1)])
+        self.assertRaises(InvalidDocument, Schema, [(1, int)])
+        self.assertRaises(TypeError, Schema, [("a", int)], codec_options={})
+
+    def test_decode(self):
+        data = BSON.encode(self.doc)
+        self.assertEqual(dict(self.doc), self.schema.decode(data))
+        self.assertEqual(dict(self.doc), self.schema.decode(bytearray(data)))
+        schema = Schema(self.schema.fields,
+                        codec_options=CodecOptions(document_class=SON))
+        self.assertEqual(list(self.doc), list(schema.decode(data)))
+
+        # Documents that don't match the schema are decoded as usual.
+        for doc in ({}, {"_id": 1}, dict(self.doc, extra=1),
+                    SON(list(self.doc.items())[::-1])):
+            self.assertEqual(doc, self.schema.decode(BSON.encode(doc)))
+
+        self.assertRaises(InvalidBSON, self.schema.decode, data[:-1])
+        self.assertRaises(InvalidBSON, self.schema.decode, data + b"\x00")
+
+    def test_codec_options(self):
+        opts = CodecOptions(document_class=SON, tz_aware=True)
+        schema = Schema([("at", datetime.datetime)], codec_options=opts)
+        self.assertEqual(opts, schema.codec_options)
+        decoded = schema.decode(BSON.encode({"at": datetime.datetime.now()}))
+        self.assertIsInstance(decoded, SON)
+        self.assertIsNotNone(decoded["at"].tzinfo)
+
+        data = BSON.encode(self.doc)
+        opts = CodecOptions(document_class=RawBSONDocument)
+        schema = Schema(self.schema.fields, codec_options=opts)
+        self.assertEqual(data, schema.decode(data).raw)
+        opts = CodecOptions(decode_fields=["kind"])
+        schema = Schema(self.schema.fields, codec_options=opts)
+        self.assertEqual({"kind": "click"}, schema.decode(data))
+
+    def test_fields(self):
+        self.assertEqual([u("_id"), u("kind"), u("count"), u("total"),
+                          u("ratio"), u("ok"), u("at"), u("tags")],
+                         [name for name, _ in self.schema.fields])
+        self.assertEqual(int, self.schema.fields[2][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
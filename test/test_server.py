@@ -14,14 +14,73 @@
 
 """Test the server module."""
 
+import socket
 import sys
 
 sys.path[0:0] = [""]
 
+from bson import decode_all
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
 from pymongo.ismaster import IsMaster
+from pymongo.message import _Query
+from pymongo.pool import Pool, PoolOptions
+from pymongo.read_preferences import ReadPreference
 from pymongo.server import Server
 from pymongo.server_description import ServerDescription
 from test import unittest
+from test.utils import StubServer, recv_message, send_reply
+
+
+class PipeliningServer(StubServer):
+    """Reads `count` queries, then replies to each with the document it
+    queried for, in reverse order.
+
+    If `response_to` is given, the replies respond to it instead.
+    """
+
+    def __init__(self, count, response_to=None):
+        super(PipeliningServer, self).__init__()
+        self.count = count
+        self.response_to = response_to
+
+    def serve(self, sock):
+        queries = []
+        for _ in range(self.count):
+            request_id, _, body = recv_message(sock)
+            spec = decode_all(body[body.index(b"\x00", 4) + 9:])[0]
+            queries.append((request_id, spec))
+        for request_id, spec in reversed(queries):
+            if self.response_to is not None:
+                request_id = self.response_to
+            send_reply(sock, request_id, [spec])
+        # Wait for the client to close the socket.
+        sock.recv(1)
+
+
+class ReplyingServer(StubServer):
+    """Replies to each query as soon as it's read, with `padding` bytes of
+    padding added to the document it queried for.
+    """
+
+    def __init__(self, padding):
+        super(ReplyingServer, self).__init__()
+        self.padding = padding
+
+    def serve(self, sock):
+        # Like mongod, send each reply without waiting to coalesce them.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super(ReplyingServer, self).serve(sock)
+
+    def handle(self, sock):
+        request_id, _, body = recv_message(sock)
+        spec = decode_all(body[body.index(b"\x00", 4) + 9:])[0]
+        spec["padding"] = b"x" * self.padding
+        send_reply(sock, request_id, [spec])
+
+
+def _query(spec):
+    return _Query(0, "db.coll", 0, -1, spec, None, DEFAULT_CODEC_OPTIONS,
+                  ReadPreference.PRIMARY, 0, 0)
 
 
 class TestServer(unittest.TestCase):
@@ -31,6 +90,48 @@ class TestServer(unittest.TestCase):
         server = Server(sd, pool=object(), monitor=object())
         self.assertTrue('Standalone' in str(server))
 
+    def pipelining_server(self, stub):
+        stub.start()
+        self.addCleanup(stub.join, 10)
+        pool = Pool(stub.address,
+                    PoolOptions(connect_timeout=10, socket_timeout=10),
+                    handshake=False)
+        self.addCleanup(pool.reset)
+        sd = ServerDescription(stub.address, IsMaster({'ok': 1}))
+        return Server(sd, pool=pool, monitor=object())
+
+    def test_send_messages_with_response(self):
+        specs = [{"x": i} for i in range(50)]
+        server = self.pipelining_server(PipeliningServer(len(specs)))
+        responses = server.send_messages_with_response(
+            [_query(spec) for spec in specs], False, {})
+        self.assertEqual(specs, [decode_all(bytes(response.data[20:]))[0]
+                                 for response in responses])
+        request_ids = [response.request_id for response in responses]
+        self.assertEqual(len(specs), len(set(request_ids)))
+
+        # The socket was returned to the pool and can be reused.
+        self.assertEqual(1, len(server.pool.sockets))
+        self.assertEqual([], server.send_messages_with_response([], False, {}))
+
+    def test_large_pipelines(self):
+        # More requests and replies than fit in the sockets' buffers: the
+        # server stops reading until its replies are read.
+        specs = [{"x": i, "s": "y" * 10000} for i in range(1000)]
+        server = self.pipelining_server(ReplyingServer(10000))
+        responses = server.send_messages_with_response(
+            [_query(spec) for spec in specs], False, {})
+        self.assertEqual(list(range(1000)),
+                         [decode_all(bytes(response.data[20:]))[0]["x"]
+                          for response in responses])
+
+    def test_unexpected_response(self):
+        server = self.pipelining_server(PipeliningServer(2, response_to=-1))
+        self.assertRaises(AssertionError, server.send_messages_with_response,
+                          [_query({"x": 1}), _query({"x": 2})], False, {})
+        # The socket was closed rather than returned to the pool.
+        self.assertEqual(0, len(server.pool.sockets))
+
 
 if __name__ == "__main__":
     unittest.main()
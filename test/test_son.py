@@ -40,6 +40,20 @@ class TestSON(unittest.TestCase):
         self.assertEqual(b2["hello"], "world")
         self.assertRaises(KeyError, lambda: b2["goodbye"])
 
+    def test_set_and_delete_order(self):
+        son = SON([(i, i) for i in range(5)])
+        son[2] = "two"
+        del son[0]
+        son[0] = "zero"
+        self.assertEqual([1, 2, 3, 4, 0], list(son))
+        self.assertEqual([1, 2, 3, 4, 0], son.keys())
+        self.assertEqual((1, 1), son.popitem())
+        self.assertRaises(KeyError, son.__delitem__, 1)
+        self.assertRaises(TypeError, son.__setitem__, [], 1)
+        self.assertEqual(4, len(son))
+        self.assertEqual([(2, "two"), (3, 3), (4, 4), (0, "zero")],
+                         son.items())
+
     def test_equality(self):
         a1 = SON({"hello": "world"})
         b2 = SON((('hello', 'world'), ('mike', 'awesome'), ('hello_', 'mike')))
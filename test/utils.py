@@ -17,6 +17,7 @@
 
 import contextlib
 import os
+import socket
 import struct
 import sys
 import threading
@@ -24,6 +25,7 @@ import time
 import warnings
 from functools import partial
 
+from bson import BSON
 from pymongo import MongoClient
 from pymongo.errors import AutoReconnect, OperationFailure
 from pymongo.server_selectors import (any_server_selector,
@@ -429,3 +431,99 @@ def lazy_client_trial(reset, target, test, get_client):
             lazy_collection = lazy_client.pymongo_test.test
             run_threads(lazy_collection, target)
             test(lazy_collection)
+
+
+def recv_exactly(sock, length):
+    """Receive `length` bytes from `sock`, or raise EOFError."""
+    data = b""
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def recv_message(sock):
+    """Receive a wire protocol message from `sock`.
+
+    Returns (request_id, op_code, body), where body follows the header.
+    """
+    length, request_id, _, op_code = struct.unpack(
+        "<iiii", recv_exactly(sock, 16))
+    return request_id, op_code, recv_exactly(sock, length - 16)
+
+
+def reply_bytes(docs, cursor_id=0):
+    """The body of an OP_REPLY returning `docs`."""
+    return (struct.pack("<iqii", 0, cursor_id, 0, len(docs)) +
+            b"".join(BSON.encode(doc) for doc in docs))
+
+
+def send_reply(sock, response_to, docs, cursor_id=0):
+    """Send an OP_REPLY with `docs`, responding to `response_to`."""
+    reply = reply_bytes(docs, cursor_id)
+    sock.sendall(struct.pack("<iiii", 16 + len(reply), 1, response_to,
+                             1) + reply)
+
+
+class StubServer(threading.Thread):
+    """A daemon thread accepting connections on a port on localhost.
+
+    Each connection is passed to serve(), which by default calls the
+    subclass's handle(sock) until the client disconnects. If `concurrent`
+    is False only the first connection is served, on this thread.
+    Otherwise each connection is served on its own thread until stop() is
+    called.
+    """
+
+    def __init__(self, concurrent=False):
+        super(StubServer, self).__init__()
+        self.daemon = True
+        self.concurrent = concurrent
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.listener = socket.socket()
+        self.listener.bind(("localhost", 0))
+        self.listener.listen(128 if concurrent else 1)
+        self.address = self.listener.getsockname()
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+        self.listener.close()
+
+    def run(self):
+        if not self.concurrent:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error:
+                return
+            finally:
+                self.listener.close()
+            self.connections = 1
+            self._serve(sock)
+            return
+
+        while not self.stopped:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error:
+                return
+            with self.lock:
+                self.connections += 1
+            thread = threading.Thread(target=self._serve, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, sock):
+        try:
+            self.serve(sock)
+        except (EOFError, socket.error):
+            pass
+        finally:
+            sock.close()
+
+    def serve(self, sock):
+        while True:
+            self.handle(sock)